@@ -9,7 +9,13 @@
 #   Aaron Ponti - initial API and implementation
 # ******************************************************************************
 
+from ._epoch import DatasetEpochCallback
+from ._profiling import TransformProfilingCallback
 from ._unfreeze import ProgressiveUnfreezeCallback
 
 __doc__ = "Custom PyTorch-Lightning callbacks."
-__all__ = ["ProgressiveUnfreezeCallback"]
+__all__ = [
+    "DatasetEpochCallback",
+    "ProgressiveUnfreezeCallback",
+    "TransformProfilingCallback",
+]
@@ -0,0 +1,26 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import pytorch_lightning as pl
+
+
+class DatasetEpochCallback(pl.Callback):
+    """Passes the current epoch to the training dataset at the start of every epoch.
+
+    This is needed by the datasets that shuffle their samples themselves (e.g., the
+    `qute.data.patch_queue.PatchQueueDataset`): the DataLoader only sets the epoch of
+    its sampler. Datasets without a `set_epoch()` method are ignored.
+    """
+
+    def on_train_epoch_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        dataset = getattr(trainer.train_dataloader, "dataset", None)
+        if hasattr(dataset, "set_epoch"):
+            dataset.set_epoch(trainer.current_epoch)
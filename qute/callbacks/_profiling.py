@@ -0,0 +1,81 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import json
+from pathlib import Path
+from typing import Union
+
+import pytorch_lightning as pl
+
+from qute.transforms.profiling import aggregate_transform_stats, flush_transform_stats
+
+
+class TransformProfilingCallback(pl.Callback):
+    """Aggregates the per-transform statistics recorded by the `InstrumentedCompose`
+    pipelines of all processes, logs them and saves them to a JSON summary.
+
+    The statistics are collected at the end of every training epoch and at the end of
+    the fit and test stages. Since the DataLoader workers write their statistics at most
+    every `flush_interval` seconds, the latest calls may only appear in the next report.
+    """
+
+    def __init__(
+        self,
+        stats_dir: Union[Path, str],
+        summary_file: Union[Path, str],
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        stats_dir: Union[Path, str]
+            Folder where the instrumented pipelines save their statistics.
+
+        summary_file: Union[Path, str]
+            Full path of the JSON summary to write.
+        """
+        super().__init__()
+        self.stats_dir = Path(stats_dir).resolve()
+        self.summary_file = Path(summary_file)
+
+    def report(self, trainer: pl.Trainer) -> dict:
+        """Aggregate the statistics, log them and write the summary."""
+        flush_transform_stats(self.stats_dir)
+        stats = aggregate_transform_stats(self.stats_dir)
+        if len(stats) == 0:
+            return stats
+
+        # Log the mean time (ms) and output size (MB) per transform
+        if trainer.logger is not None:
+            metrics = {}
+            for pipeline, transforms in stats.items():
+                for transform, entry in transforms.items():
+                    prefix = f"transforms/{pipeline}/{transform}"
+                    metrics[f"{prefix}/mean_time_ms"] = 1000.0 * entry["mean_time"]
+                    metrics[f"{prefix}/mean_output_mb"] = entry["mean_bytes"] / 2**20
+                    metrics[f"{prefix}/calls"] = entry["calls"]
+            trainer.logger.log_metrics(metrics, step=trainer.global_step)
+
+        # Write the summary
+        self.summary_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.summary_file, "w") as f:
+            json.dump(stats, f, indent=2)
+        return stats
+
+    def on_train_epoch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        self.report(trainer)
+
+    def on_fit_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        self.report(trainer)
+
+    def on_test_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        self.report(trainer)
@@ -18,10 +18,12 @@ from ._campaigns import (
     SegmentationCampaignTransformsIDT3D,
     SelfSupervisedRestorationCampaignTransforms,
 )
+from ._instrumented import InstrumentedCampaignTransforms
 
 __doc__ = "Full training campaign definitions."
 __all__ = [
     "CampaignTransforms",
+    "InstrumentedCampaignTransforms",
     "RestorationCampaignTransforms",
     "SegmentationCampaignTransforms2D",
     "SegmentationCampaignTransforms3D",
@@ -9,6 +9,7 @@
 #   Aaron Ponti - initial API and implementation
 # ******************************************************************************
 from abc import ABC, abstractmethod
+from typing import Optional
 
 import numpy as np
 import torch
@@ -26,9 +27,19 @@ from monai.transforms import (
 )
 
 from qute.transforms import ToPyTorchLightningOutputd
+from qute.transforms.augment import (
+    ComposeBatch,
+    RandFlipBatch,
+    RandGaussianNoiseBatch,
+    RandGaussianSmoothBatch,
+)
 
 # from qute.transforms.debug import DebugExtractChannel
-from qute.transforms.geom import CustomResampler, CustomResamplerd
+from qute.transforms.geom import (
+    CustomResampler,
+    CustomResamplerd,
+    IndexedRandCropByPosNegLabeld,
+)
 from qute.transforms.io import CustomTIFFReader, CustomTIFFReaderd
 from qute.transforms.norm import (
     MinMaxNormalize,
@@ -41,10 +52,19 @@ from qute.transforms.objects import (
     LabelToTwoClassMaskd,
     NormalizedDistanceTransformd,
     OneHotToMaskBatch,
+    ProcessPoolBackend,
     WatershedAndLabelTransform,
 )
 
 
+def _rand_crop_by_pos_neg_labeld(use_sampling_index: bool, **kwargs):
+    """Return a `RandCropByPosNegLabeld` transform, or the version that draws the centers from
+    a precomputed sampling index if `use_sampling_index` is True."""
+    if use_sampling_index:
+        return IndexedRandCropByPosNegLabeld(**kwargs)
+    return RandCropByPosNegLabeld(**kwargs)
+
+
 class CampaignTransforms(ABC):
     """Abstract base class that defines all transforms needed for a full training campaign."""
 
@@ -60,6 +80,16 @@ class CampaignTransforms(ABC):
         """
         pass
 
+    def get_on_device_train_transforms(self):
+        """Return the batched augmentations to apply to the training batches on the device, or None.
+
+        These transforms are applied by the model to the whole collated (image, label) batch
+        after it has been transferred to the training device (see `qute.transforms.augment`).
+        They replace the per-sample augmentations that would otherwise run on the CPU in the
+        data loader workers. Return None (default) to skip this stage.
+        """
+        return None
+
     @abstractmethod
     def get_valid_transforms(self):
         """Return a composition of Transforms needed to validate on a patch.
@@ -133,21 +163,49 @@ class SegmentationCampaignTransforms2D(CampaignTransforms):
     """Example segmentation campaign transforms."""
 
     def __init__(
-        self, num_classes: int = 3, patch_size: tuple = (640, 640), num_patches: int = 1
+        self,
+        num_classes: int = 3,
+        patch_size: tuple = (640, 640),
+        num_patches: int = 1,
+        on_device_augmentation: bool = False,
+        use_sampling_index: bool = False,
     ):
         """Constructor.
 
         By default, these transforms apply to a single-channel input image to
         predict three output classes.
+
+        Set `on_device_augmentation` to True to run the random flips, noise and smoothing
+        on the training device on whole batches instead of in the data loader workers.
+
+        Set `use_sampling_index` to True to draw the centers of the training and validation
+        patches from the precomputed sampling indices of the data module (if available).
         """
         super().__init__()
 
         self.num_classes = num_classes
         self.patch_size = patch_size
         self.num_patches = num_patches
+        self.on_device_augmentation = on_device_augmentation
+        self.use_sampling_index = use_sampling_index
 
     def get_train_transforms(self):
         """Return a composition of Transforms needed to train (patch)."""
+
+        # Augmentations (skipped if they run on the training device)
+        augmentations = []
+        if not self.on_device_augmentation:
+            augmentations = [
+                RandFlipd(
+                    keys=("image", "label"), prob=0.5, spatial_axis=[0], lazy=False
+                ),
+                RandFlipd(
+                    keys=("image", "label"), prob=0.5, spatial_axis=[1], lazy=False
+                ),
+                RandGaussianNoised(keys=("image",), prob=0.2),
+                RandGaussianSmoothd(keys=("image",), prob=0.2),
+            ]
+
         train_transforms = Compose(
             [
                 CustomTIFFReaderd(
@@ -156,7 +214,8 @@ class SegmentationCampaignTransforms2D(CampaignTransforms):
                     dtype=torch.float32,
                 ),
                 ZNormalized(keys=("image",)),
-                RandCropByPosNegLabeld(
+                _rand_crop_by_pos_neg_labeld(
+                    use_sampling_index=self.use_sampling_index,
                     keys=("image", "label"),
                     label_key="label",
                     spatial_size=self.patch_size,
@@ -168,20 +227,26 @@ class SegmentationCampaignTransforms2D(CampaignTransforms):
                     allow_smaller=False,
                     lazy=False,
                 ),
-                RandFlipd(
-                    keys=("image", "label"), prob=0.5, spatial_axis=[0], lazy=False
-                ),
-                RandFlipd(
-                    keys=("image", "label"), prob=0.5, spatial_axis=[1], lazy=False
-                ),
-                RandGaussianNoised(keys=("image",), prob=0.2),
-                RandGaussianSmoothd(keys=("image",), prob=0.2),
+                *augmentations,
                 AsDiscreted(keys=["label"], to_onehot=self.num_classes),
                 ToPyTorchLightningOutputd(),
             ]
         )
         return train_transforms
 
+    def get_on_device_train_transforms(self):
+        """Return the batched augmentations to apply on the training device (or None)."""
+        if not self.on_device_augmentation:
+            return None
+        return ComposeBatch(
+            [
+                RandFlipBatch(prob=0.5, spatial_axis=0),
+                RandFlipBatch(prob=0.5, spatial_axis=1),
+                RandGaussianNoiseBatch(prob=0.2),
+                RandGaussianSmoothBatch(prob=0.2),
+            ]
+        )
+
     def get_valid_transforms(self):
         """Return a composition of Transforms needed to validate (patch)."""
         val_transforms = Compose(
@@ -192,7 +257,8 @@ class SegmentationCampaignTransforms2D(CampaignTransforms):
                     dtype=torch.float32,
                 ),
                 ZNormalized(keys=("image",)),
-                RandCropByPosNegLabeld(
+                _rand_crop_by_pos_neg_labeld(
+                    use_sampling_index=self.use_sampling_index,
                     keys=("image", "label"),
                     label_key="label",
                     spatial_size=self.patch_size,
@@ -251,19 +317,53 @@ class SegmentationCampaignTransforms2D(CampaignTransforms):
 class SegmentationCampaignTransformsIDT2D(CampaignTransforms):
     """Example 2D segmentation campaign transforms using regression to Inverse Distance Transform."""
 
-    def __init__(self, patch_size: tuple = (640, 640), num_patches: int = 1):
+    def __init__(
+        self,
+        patch_size: tuple = (640, 640),
+        num_patches: int = 1,
+        on_device_augmentation: bool = False,
+        use_sampling_index: bool = False,
+        post_processing_backend: Optional[ProcessPoolBackend] = None,
+    ):
         """Constructor.
 
         By default, these transforms apply to a single-channel input image to
         predict three output classes.
+
+        Set `on_device_augmentation` to True to run the random flips, noise and smoothing
+        on the training device on whole batches instead of in the data loader workers.
+
+        Set `use_sampling_index` to True to draw the centers of the training and validation
+        patches from the precomputed sampling indices of the data module (if available).
+
+        Set `post_processing_backend` to run the watershed of the items of the inference
+        batches in a pool of processes.
         """
         super().__init__()
 
         self.patch_size = patch_size
         self.num_patches = num_patches
+        self.on_device_augmentation = on_device_augmentation
+        self.use_sampling_index = use_sampling_index
+        self.post_processing_backend = post_processing_backend
 
     def get_train_transforms(self):
         """Return a composition of Transforms needed to train (patch)."""
+
+        # Augmentations (skipped if they run on the training device)
+        augmentations = []
+        if not self.on_device_augmentation:
+            augmentations = [
+                RandFlipd(
+                    keys=("image", "label"), prob=0.5, spatial_axis=[0], lazy=False
+                ),
+                RandFlipd(
+                    keys=("image", "label"), prob=0.5, spatial_axis=[1], lazy=False
+                ),
+                RandGaussianNoised(keys=("image",), prob=0.2),
+                RandGaussianSmoothd(keys=("image",), prob=0.2),
+            ]
+
         train_transforms = Compose(
             [
                 CustomTIFFReaderd(
@@ -272,7 +372,8 @@ class SegmentationCampaignTransformsIDT2D(CampaignTransforms):
                     dtype=torch.float32,
                 ),
                 ZNormalized(keys=("image",)),
-                RandCropByPosNegLabeld(
+                _rand_crop_by_pos_neg_labeld(
+                    use_sampling_index=self.use_sampling_index,
                     keys=("image", "label"),
                     label_key="label",
                     spatial_size=self.patch_size,
@@ -284,14 +385,7 @@ class SegmentationCampaignTransformsIDT2D(CampaignTransforms):
                     allow_smaller=False,
                     lazy=False,
                 ),
-                RandFlipd(
-                    keys=("image", "label"), prob=0.5, spatial_axis=[0], lazy=False
-                ),
-                RandFlipd(
-                    keys=("image", "label"), prob=0.5, spatial_axis=[1], lazy=False
-                ),
-                RandGaussianNoised(keys=("image",), prob=0.2),
-                RandGaussianSmoothd(keys=("image",), prob=0.2),
+                *augmentations,
                 NormalizedDistanceTransformd(
                     keys=("label",),
                     reverse=True,
@@ -304,6 +398,19 @@ class SegmentationCampaignTransformsIDT2D(CampaignTransforms):
         )
         return train_transforms
 
+    def get_on_device_train_transforms(self):
+        """Return the batched augmentations to apply on the training device (or None)."""
+        if not self.on_device_augmentation:
+            return None
+        return ComposeBatch(
+            [
+                RandFlipBatch(prob=0.5, spatial_axis=0),
+                RandFlipBatch(prob=0.5, spatial_axis=1),
+                RandGaussianNoiseBatch(prob=0.2),
+                RandGaussianSmoothBatch(prob=0.2),
+            ]
+        )
+
     def get_valid_transforms(self):
         """Return a composition of Transforms needed to validate (patch)."""
         val_transforms = Compose(
@@ -314,7 +421,8 @@ class SegmentationCampaignTransformsIDT2D(CampaignTransforms):
                     dtype=torch.float32,
                 ),
                 ZNormalized(keys=("image",)),
-                RandCropByPosNegLabeld(
+                _rand_crop_by_pos_neg_labeld(
+                    use_sampling_index=self.use_sampling_index,
                     keys=("image", "label"),
                     label_key="label",
                     spatial_size=self.patch_size,
@@ -360,7 +468,10 @@ class SegmentationCampaignTransformsIDT2D(CampaignTransforms):
         post_inference_transforms = Compose(
             [
                 WatershedAndLabelTransform(
-                    use_seed_channel=True, dt_threshold=0.02, with_batch_dim=True
+                    use_seed_channel=True,
+                    dt_threshold=0.02,
+                    with_batch_dim=True,
+                    backend=self.post_processing_backend,
                 )
             ]
         )
@@ -390,6 +501,9 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
         voxel_size: tuple[float, float, float] = (1.0, 1.0, 1.0),
         to_isotropic: bool = False,
         upscale_z: bool = True,
+        on_device_augmentation: bool = False,
+        use_sampling_index: bool = False,
+        post_processing_backend: Optional[ProcessPoolBackend] = None,
     ):
         """Constructor.
 
@@ -420,6 +534,18 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
 
             If False, sub-sample x and y to reach the resolution of z. Please notice that it is assumed
             that the z resolution is worse than the x and y resolution.
+
+        on_device_augmentation: bool = False
+            Set to True to run the random noise and smoothing on the training device on whole
+            batches instead of in the data loader workers.
+
+        use_sampling_index: bool = False
+            Set to True to draw the centers of the training and validation patches from the
+            precomputed sampling indices of the data module (if available).
+
+        post_processing_backend: Optional[ProcessPoolBackend] = None
+            Backend that runs the watershed of the items (or blocks of large volumes) of the
+            inference batches in a pool of processes. Omit to run it serially.
         """
         super().__init__()
 
@@ -429,6 +555,9 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
         self.target_voxel_size = self.voxel_size.copy()
         self.to_isotropic = to_isotropic
         self.upscale_z = upscale_z
+        self.on_device_augmentation = on_device_augmentation
+        self.use_sampling_index = use_sampling_index
+        self.post_processing_backend = post_processing_backend
 
         if self.to_isotropic:
             # Should we upscale the image to keep the higher resolution, or downscale it
@@ -445,6 +574,15 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
 
     def get_train_transforms(self):
         """Return a composition of Transforms needed to train (patch)."""
+
+        # Augmentations (skipped if they run on the training device)
+        augmentations = []
+        if not self.on_device_augmentation:
+            augmentations = [
+                RandGaussianNoised(keys=("image",), prob=0.2),
+                RandGaussianSmoothd(keys=("image",), prob=0.2),
+            ]
+
         train_transforms = Compose(
             [
                 CustomTIFFReaderd(
@@ -461,7 +599,8 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
                     mode=("trilinear", "nearest"),
                 ),
                 ZNormalized(keys=("image",)),
-                RandCropByPosNegLabeld(
+                _rand_crop_by_pos_neg_labeld(
+                    use_sampling_index=self.use_sampling_index,
                     keys=("image", "label"),
                     label_key="label",
                     spatial_size=self.patch_size,
@@ -473,8 +612,7 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
                     allow_smaller=False,
                     lazy=False,
                 ),
-                RandGaussianNoised(keys=("image",), prob=0.2),
-                RandGaussianSmoothd(keys=("image",), prob=0.2),
+                *augmentations,
                 NormalizedDistanceTransformd(
                     keys=("label",),
                     reverse=True,
@@ -487,6 +625,17 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
         )
         return train_transforms
 
+    def get_on_device_train_transforms(self):
+        """Return the batched augmentations to apply on the training device (or None)."""
+        if not self.on_device_augmentation:
+            return None
+        return ComposeBatch(
+            [
+                RandGaussianNoiseBatch(prob=0.2),
+                RandGaussianSmoothBatch(prob=0.2),
+            ]
+        )
+
     def get_valid_transforms(self):
         """Return a composition of Transforms needed to validate (patch)."""
         val_transforms = Compose(
@@ -505,7 +654,8 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
                     mode=("trilinear", "nearest"),
                 ),
                 ZNormalized(keys=("image",)),
-                RandCropByPosNegLabeld(
+                _rand_crop_by_pos_neg_labeld(
+                    use_sampling_index=self.use_sampling_index,
                     keys=("image", "label"),
                     label_key="label",
                     spatial_size=self.patch_size,
@@ -558,7 +708,10 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
         post_inference_transforms = Compose(
             [
                 WatershedAndLabelTransform(
-                    use_seed_channel=True, dt_threshold=0.05, with_batch_dim=True
+                    use_seed_channel=True,
+                    dt_threshold=0.05,
+                    with_batch_dim=True,
+                    backend=self.post_processing_backend,
                 ),
             ]
         )
@@ -575,7 +728,10 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
                     #     to_binary=False
                     # ),
                     WatershedAndLabelTransform(
-                        use_seed_channel=True, dt_threshold=0.02, with_batch_dim=True
+                        use_seed_channel=True,
+                        dt_threshold=0.02,
+                        with_batch_dim=True,
+                        backend=self.post_processing_backend,
                     ),
                     CustomResampler(
                         target_voxel_size=self.voxel_size,
@@ -589,7 +745,10 @@ class SegmentationCampaignTransformsIDT3D(CampaignTransforms):
             post_full_inference_transforms = Compose(
                 [
                     WatershedAndLabelTransform(
-                        use_seed_channel=True, dt_threshold=0.02, with_batch_dim=True
+                        use_seed_channel=True,
+                        dt_threshold=0.02,
+                        with_batch_dim=True,
+                        backend=self.post_processing_backend,
                     )
                 ]
             )
@@ -616,6 +775,8 @@ class SegmentationCampaignTransforms3D(CampaignTransforms):
         voxel_size: tuple[float, float, float] = (1.0, 1.0, 1.0),
         to_isotropic: bool = False,
         upscale_z: bool = True,
+        on_device_augmentation: bool = False,
+        use_sampling_index: bool = False,
     ):
         """Constructor.
 
@@ -649,6 +810,14 @@ class SegmentationCampaignTransforms3D(CampaignTransforms):
 
             If False, sub-sample x and y to reach the resolution of z. Please notice that it is assumed
             that the z resolution is worse than the x and y resolution.
+
+        on_device_augmentation: bool = False
+            Set to True to run the random noise and smoothing on the training device on whole
+            batches instead of in the data loader workers.
+
+        use_sampling_index: bool = False
+            Set to True to draw the centers of the training and validation patches from the
+            precomputed sampling indices of the data module (if available).
         """
         super().__init__()
 
@@ -659,6 +828,8 @@ class SegmentationCampaignTransforms3D(CampaignTransforms):
         self.target_voxel_size = self.voxel_size.copy()
         self.to_isotropic = to_isotropic
         self.upscale_z = upscale_z
+        self.on_device_augmentation = on_device_augmentation
+        self.use_sampling_index = use_sampling_index
 
         if self.to_isotropic:
             # Should we upscale the image to keep the higher resolution, or downscale it
@@ -675,6 +846,15 @@ class SegmentationCampaignTransforms3D(CampaignTransforms):
 
     def get_train_transforms(self):
         """Return a composition of Transforms needed to train (patch)."""
+
+        # Augmentations (skipped if they run on the training device)
+        augmentations = []
+        if not self.on_device_augmentation:
+            augmentations = [
+                RandGaussianNoised(keys=("image",), prob=0.2),
+                RandGaussianSmoothd(keys=("image",), prob=0.2),
+            ]
+
         train_transforms = Compose(
             [
                 CustomTIFFReaderd(
@@ -691,7 +871,8 @@ class SegmentationCampaignTransforms3D(CampaignTransforms):
                     mode=("trilinear", "nearest"),
                 ),
                 ZNormalized(keys=("image",)),
-                RandCropByPosNegLabeld(
+                _rand_crop_by_pos_neg_labeld(
+                    use_sampling_index=self.use_sampling_index,
                     keys=("image", "label"),
                     label_key="label",
                     spatial_size=self.patch_size,
@@ -704,14 +885,24 @@ class SegmentationCampaignTransforms3D(CampaignTransforms):
                     lazy=False,
                 ),
                 LabelToTwoClassMaskd(keys=("label",), border_thickness=1),
-                RandGaussianNoised(keys=("image",), prob=0.2),
-                RandGaussianSmoothd(keys=("image",), prob=0.2),
+                *augmentations,
                 AsDiscreted(keys=["label"], to_onehot=self.num_classes),
                 ToPyTorchLightningOutputd(),
             ]
         )
         return train_transforms
 
+    def get_on_device_train_transforms(self):
+        """Return the batched augmentations to apply on the training device (or None)."""
+        if not self.on_device_augmentation:
+            return None
+        return ComposeBatch(
+            [
+                RandGaussianNoiseBatch(prob=0.2),
+                RandGaussianSmoothBatch(prob=0.2),
+            ]
+        )
+
     def get_valid_transforms(self):
         """Return a composition of Transforms needed to validate (patch)."""
         val_transforms = Compose(
@@ -730,7 +921,8 @@ class SegmentationCampaignTransforms3D(CampaignTransforms):
                     mode=("trilinear", "nearest"),
                 ),
                 ZNormalized(keys=("image",)),
-                RandCropByPosNegLabeld(
+                _rand_crop_by_pos_neg_labeld(
+                    use_sampling_index=self.use_sampling_index,
                     keys=("image", "label"),
                     label_key="label",
                     spatial_size=self.patch_size,
@@ -0,0 +1,120 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+from pathlib import Path
+from typing import Union
+
+from monai.transforms import Compose
+
+from qute.campaigns._campaigns import CampaignTransforms
+from qute.transforms.profiling import InstrumentedCompose
+
+
+class InstrumentedCampaignTransforms(CampaignTransforms):
+    """Wraps a CampaignTransforms object to record per-transform statistics of its pipelines.
+
+    Every pipeline returned by the wrapped campaign is replaced by an `InstrumentedCompose`
+    that records the wall time, the output size and the number of calls of each transform
+    in each process (see `qute.transforms.profiling`). All other attributes are forwarded
+    to the wrapped campaign. Campaigns that are not wrapped are not affected at all.
+    """
+
+    def __init__(
+        self,
+        campaign_transforms: CampaignTransforms,
+        stats_dir: Union[Path, str],
+        flush_interval: float = 2.0,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        campaign_transforms: CampaignTransforms
+            Campaign to instrument.
+
+        stats_dir: Union[Path, str]
+            Folder where each process saves its statistics.
+
+        flush_interval: float = 2.0
+            Minimum interval in seconds between two writes of the statistics of a process.
+        """
+        super().__init__()
+        self.campaign_transforms = campaign_transforms
+        self.stats_dir = Path(stats_dir).resolve()
+        self.flush_interval = flush_interval
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not found on the wrapper
+        if name == "campaign_transforms":
+            raise AttributeError(name)
+        return getattr(self.campaign_transforms, name)
+
+    def _instrument(self, transforms, name: str):
+        """Wrap the pipeline (if it is one) into an InstrumentedCompose."""
+        if isinstance(transforms, Compose):
+            return InstrumentedCompose(
+                transforms,
+                stats_dir=self.stats_dir,
+                name=name,
+                flush_interval=self.flush_interval,
+            )
+        return transforms
+
+    def get_train_transforms(self):
+        """Return the instrumented training transforms."""
+        return self._instrument(
+            self.campaign_transforms.get_train_transforms(), "train"
+        )
+
+    def get_on_device_train_transforms(self):
+        """Return the on-device training transforms of the wrapped campaign."""
+        return self.campaign_transforms.get_on_device_train_transforms()
+
+    def get_valid_transforms(self):
+        """Return the instrumented validation transforms."""
+        return self._instrument(
+            self.campaign_transforms.get_valid_transforms(), "valid"
+        )
+
+    def get_test_transforms(self):
+        """Return the instrumented test transforms."""
+        return self._instrument(self.campaign_transforms.get_test_transforms(), "test")
+
+    def get_inference_transforms(self):
+        """Return the instrumented inference transforms."""
+        return self._instrument(
+            self.campaign_transforms.get_inference_transforms(), "inference"
+        )
+
+    def get_post_inference_transforms(self):
+        """Return the instrumented post-inference transforms."""
+        return self._instrument(
+            self.campaign_transforms.get_post_inference_transforms(), "post_inference"
+        )
+
+    def get_post_full_inference_transforms(self):
+        """Return the instrumented post-full-inference transforms."""
+        return self._instrument(
+            self.campaign_transforms.get_post_full_inference_transforms(),
+            "post_full_inference",
+        )
+
+    def get_val_metrics_transforms(self):
+        """Return the instrumented validation metrics transforms."""
+        return self._instrument(
+            self.campaign_transforms.get_val_metrics_transforms(), "val_metrics"
+        )
+
+    def get_test_metrics_transforms(self):
+        """Return the instrumented test metrics transforms."""
+        return self._instrument(
+            self.campaign_transforms.get_test_metrics_transforms(), "test_metrics"
+        )
@@ -151,6 +151,131 @@ def version(
         typer.echo(__version__)
 
 
+@app.command()
+def serve(
+    config: str = typer.Option(
+        ...,
+        "--config",
+        "-c",
+        help="Full path to the configuration file the models were trained with.",
+        show_default=False,
+    ),
+    models: Optional[list[str]] = typer.Option(
+        None,
+        "--model",
+        "-m",
+        help="Model to serve as name=path (checkpoint or exported model); can be repeated. Defaults to `source_model_path`.",
+        show_default=False,
+    ),
+    host: str = typer.Option(
+        "127.0.0.1",
+        "--host",
+        help="Address to listen on.",
+        show_default=True,
+    ),
+    port: int = typer.Option(
+        8000,
+        "--port",
+        "-p",
+        help="Port to listen on.",
+        show_default=True,
+    ),
+    socket_path: Optional[str] = typer.Option(
+        None,
+        "--socket",
+        "-s",
+        help="Listen on this Unix socket instead of a TCP port.",
+        show_default=False,
+    ),
+    max_batch_size: Optional[int] = typer.Option(
+        None,
+        "--max_batch_size",
+        help="Maximum number of windows (of one or more requests) per batch. Defaults to `inference_batch_size`.",
+        show_default=False,
+    ),
+    max_wait_ms: float = typer.Option(
+        5.0,
+        "--max_wait_ms",
+        help="Maximum time in milliseconds to wait for the windows of other requests.",
+        show_default=True,
+    ),
+):
+    """Keep models warm and serve predictions over HTTP or a Unix socket."""
+    from qute.data.precision import InferencePrecision
+    from qute.data.writers import TIFFPredictionWriter
+    from qute.export import load_backend, read_export_metadata
+    from qute.models.factory import ModelFactory
+    from qute.serve import InferenceServer
+
+    # Check input argument config
+    config_file = Path(config).resolve()
+    if not config_file.is_file():
+        raise ValueError(f"The specified config file {config_file} does not exist.")
+    config = ConfigFactory.get_config(config_file)
+    if not config.parse():
+        raise ValueError(f"Could not parse the config file {config_file}.")
+
+    # Models by name
+    if not models:
+        if config.source_model_path is None:
+            raise ValueError("No model specified.")
+        models = [f"{Path(config.source_model_path).stem}={config.source_model_path}"]
+    model_class = ModelFactory.get_model_class(config)
+
+    def load_checkpoint(checkpoint):
+        return model_class.load_from_checkpoint(
+            checkpoint,
+            map_location="cpu",
+            weights_only=False,
+            criterion=None,
+            metrics=None,
+            class_names=config.class_names if hasattr(config, "class_names") else [],
+        )
+
+    served_models, campaign_transforms = {}, None
+    for model in models:
+        name, _, model_path = model.rpartition("=")
+        model_path = Path(model_path)
+        name = name if name != "" else model_path.stem
+        if model_path.suffix == ".ckpt":
+            served_models[name] = load_checkpoint(model_path)
+        else:
+            # Exported models use the campaign transforms of their checkpoint
+            served_models[name] = load_backend(model_path)
+            if campaign_transforms is None:
+                campaign_transforms = load_checkpoint(
+                    read_export_metadata(model_path)["checkpoint"]
+                ).campaign_transforms
+        typer.echo(f"Loaded model '{name}' from {model_path}.")
+
+    server = InferenceServer(
+        served_models,
+        roi_size=config.patch_size,
+        campaign_transforms=campaign_transforms,
+        max_batch_size=(
+            max_batch_size
+            if max_batch_size is not None
+            else config.inference_batch_size
+        ),
+        max_wait=max_wait_ms / 1000.0,
+        output_dtype=config.output_dtype,
+        writer=TIFFPredictionWriter(
+            compression=config.output_compression,
+            level=config.output_compression_level,
+            tile=config.output_tile_size,
+            num_threads=config.output_writer_threads,
+            label_dtype=config.output_label_dtype,
+        ),
+        precision=InferencePrecision(
+            config.inference_precision,
+            channels_last=config.inference_channels_last,
+            inference_mode=config.inference_mode,
+        ),
+        in_channels=config.in_channels,
+    )
+    server.serve(host=host, port=port, socket_path=socket_path)
+
+
 # Instantiate Typer
 config_app = typer.Typer(name="config", help="Manage configuration options.")
 
@@ -238,3 +363,173 @@ Available configuration categories:
 
 
 app.add_typer(config_app, name="config")
+
+# Instantiate Typer
+data_app = typer.Typer(name="data", help="Manage datasets.")
+
+
+@data_app.command()
+def convert(
+    input_dir: str = typer.Option(
+        ...,
+        "--input",
+        "-i",
+        help="Full path to the dataset folder (containing the images and labels sub-folders).",
+        show_default=False,
+    ),
+    output_dir: str = typer.Option(
+        ...,
+        "--output",
+        "-o",
+        help="Full path to the folder of the memory-mapped store to create.",
+        show_default=False,
+    ),
+    sub_folders: str = typer.Option(
+        "images,labels",
+        "--sub_folders",
+        "-s",
+        help="Comma-separated list of sub-folders to convert.",
+        show_default=True,
+    ),
+    keep_dtype: bool = typer.Option(
+        False,
+        "--keep_dtype",
+        help="Keep the original data type instead of converting to float32.",
+        show_default=True,
+    ),
+    num_workers: int = typer.Option(
+        1,
+        "-n",
+        "--num_workers",
+        help="Number of processes to use for the conversion.",
+        show_default=True,
+    ),
+    overwrite: bool = typer.Option(
+        False,
+        "--overwrite",
+        help="Convert again the files that are already in the store.",
+        show_default=True,
+    ),
+):
+    """Convert a dataset of TIFF files into a memory-mapped store for training."""
+    from qute.data.store import convert_to_store
+
+    metadata = convert_to_store(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        sub_folders=tuple(s.strip() for s in sub_folders.split(",") if s.strip()),
+        dtype=None if keep_dtype else "float32",
+        num_workers=num_workers,
+        overwrite=overwrite,
+    )
+    typer.echo(
+        f"Successfully converted {len(metadata['files'])} files into {Path(output_dir).resolve()}."
+    )
+
+
+app.add_typer(data_app, name="data")
+
+# Instantiate Typer
+model_app = typer.Typer(name="model", help="Manage trained models.")
+
+
+@model_app.command()
+def export(
+    config: str = typer.Option(
+        ...,
+        "--config",
+        "-c",
+        help="Full path to the configuration file the models were trained with.",
+        show_default=False,
+    ),
+    output_dir: str = typer.Option(
+        ...,
+        "--output",
+        "-o",
+        help="Full path to the folder where to write the exported models.",
+        show_default=False,
+    ),
+    checkpoint: Optional[str] = typer.Option(
+        None,
+        "--checkpoint",
+        "-m",
+        help="Checkpoint file, or folder with checkpoints (e.g., the models folder of a run). Defaults to `source_model_path`.",
+        show_default=False,
+    ),
+    export_format: str = typer.Option(
+        "torchscript",
+        "--format",
+        "-f",
+        help="Export format: one of 'torchscript' or 'onnx'.",
+        show_default=True,
+    ),
+    dynamic: bool = typer.Option(
+        False,
+        "--dynamic",
+        help="Export models that accept windows of any size (instead of `patch_size` only).",
+        show_default=True,
+    ),
+    benchmark: bool = typer.Option(
+        False,
+        "--benchmark",
+        "-b",
+        help="Compare startup time and throughput of the exported model with the eager model.",
+        show_default=True,
+    ),
+    batch_size: int = typer.Option(
+        4,
+        "--batch_size",
+        help="Number of windows per batch for the benchmark.",
+        show_default=True,
+    ),
+):
+    """Export trained models to TorchScript or ONNX for inference without Lightning."""
+    from qute.export import (
+        EagerBackend,
+        benchmark_backends,
+        export_checkpoints,
+        load_backend,
+        read_export_metadata,
+    )
+    from qute.models.factory import ModelFactory
+
+    # Check input argument config
+    config_file = Path(config).resolve()
+    if not config_file.is_file():
+        raise ValueError(f"The specified config file {config_file} does not exist.")
+    config = ConfigFactory.get_config(config_file)
+    if not config.parse():
+        raise ValueError(f"Could not parse the config file {config_file}.")
+
+    exported = export_checkpoints(
+        config,
+        checkpoint=checkpoint,
+        output_dir=output_dir,
+        export_format=export_format,
+        dynamic=dynamic,
+    )
+    typer.echo(f"Successfully exported {len(exported)} model(s) to {output_dir}.")
+
+    if benchmark:
+        # Compare the first exported model with its checkpoint
+        exported_file = exported[0]
+        model_class = ModelFactory.get_model_class(config)
+        source = read_export_metadata(exported_file)["checkpoint"]
+        benchmark_backends(
+            {
+                "eager": lambda: EagerBackend(
+                    model_class.load_from_checkpoint(
+                        source,
+                        map_location="cpu",
+                        weights_only=False,
+                        criterion=None,
+                        metrics=None,
+                    ).net
+                ),
+                export_format: lambda: load_backend(exported_file),
+            },
+            input_shape=(batch_size, config.in_channels) + config.patch_size,
+        )
+
+
+app.add_typer(model_app, name="model")
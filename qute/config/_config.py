@@ -407,6 +407,346 @@ class Config(ABC):
             voxel_size[i] = float(element)
         return tuple(voxel_size)
 
+    @property
+    def cache_mode(self):
+        if "cache_mode" in self._config["settings"]:
+            cache_mode = self._config["settings"]["cache_mode"].lower()
+            if cache_mode not in ["", "none"]:
+                return cache_mode
+        return None
+
+    @property
+    def cache_dir(self):
+        if "cache_dir" in self._config["settings"]:
+            cache_dir = self._config["settings"]["cache_dir"]
+            if cache_dir != "":
+                return Config.process_path(Path(cache_dir))
+        return None
+
+    @property
+    def cache_max_bytes(self):
+        if "cache_max_gb" in self._config["settings"]:
+            cache_max_gb = self._config["settings"]["cache_max_gb"]
+            if cache_max_gb != "":
+                return int(float(cache_max_gb) * 1024**3)
+        return None
+
+    @property
+    def use_sampling_index(self):
+        if "use_sampling_index" in self._config["settings"]:
+            use_sampling_index = self._config["settings"]["use_sampling_index"]
+            return use_sampling_index.lower() == "true"
+        return False
+
+    @property
+    def prefetch_factor(self):
+        if "prefetch_factor" in self._config["settings"]:
+            prefetch_factor = self._config["settings"]["prefetch_factor"]
+            if prefetch_factor != "":
+                return int(prefetch_factor)
+        return None
+
+    @property
+    def tune_data_loader(self):
+        if "tune_data_loader" in self._config["settings"]:
+            tune_data_loader = self._config["settings"]["tune_data_loader"]
+            return tune_data_loader.lower() == "true"
+        return False
+
+    @property
+    def profile_transforms(self):
+        if "profile_transforms" in self._config["settings"]:
+            profile_transforms = self._config["settings"]["profile_transforms"]
+            return profile_transforms.lower() == "true"
+        return False
+
+    @property
+    def on_device_augmentation(self):
+        if "on_device_augmentation" in self._config["settings"]:
+            on_device_augmentation = self._config["settings"]["on_device_augmentation"]
+            return on_device_augmentation.lower() == "true"
+        return False
+
+    @property
+    def patch_queue_pool_size(self):
+        if "patch_queue_pool_size" in self._config["settings"]:
+            pool_size = self._config["settings"]["patch_queue_pool_size"]
+            if pool_size != "":
+                return int(pool_size)
+        return None
+
+    @property
+    def patch_queue_samples_per_volume(self):
+        if "patch_queue_samples_per_volume" in self._config["settings"]:
+            samples_per_volume = self._config["settings"][
+                "patch_queue_samples_per_volume"
+            ]
+            if samples_per_volume != "":
+                return int(samples_per_volume)
+        return 8
+
+    @property
+    def patch_queue_shuffle_buffer_size(self):
+        if "patch_queue_shuffle_buffer_size" in self._config["settings"]:
+            shuffle_buffer_size = self._config["settings"][
+                "patch_queue_shuffle_buffer_size"
+            ]
+            if shuffle_buffer_size != "":
+                return int(shuffle_buffer_size)
+        return 16
+
+    @property
+    def output_compression(self):
+        if "output_compression" in self._config["settings"]:
+            output_compression = self._config["settings"]["output_compression"]
+            if output_compression != "":
+                return output_compression.lower()
+        return "zlib"
+
+    @property
+    def output_compression_level(self):
+        if "output_compression_level" in self._config["settings"]:
+            output_compression_level = self._config["settings"][
+                "output_compression_level"
+            ]
+            if output_compression_level == "":
+                return None
+            return int(output_compression_level)
+        return 9
+
+    @property
+    def output_tile_size(self):
+        if "output_tile_size" in self._config["settings"]:
+            output_tile_size_str = self._config["settings"]["output_tile_size"]
+            if output_tile_size_str != "":
+                output_tile_size = re.sub(r"\s+", "", output_tile_size_str).split(",")
+                return tuple(int(element) for element in output_tile_size)
+        return None
+
+    @property
+    def output_writer_threads(self):
+        if "output_writer_threads" in self._config["settings"]:
+            output_writer_threads = self._config["settings"]["output_writer_threads"]
+            if output_writer_threads != "":
+                return int(output_writer_threads)
+        return 1
+
+    @property
+    def post_processing_workers(self):
+        if "post_processing_workers" in self._config["settings"]:
+            post_processing_workers = self._config["settings"][
+                "post_processing_workers"
+            ]
+            if post_processing_workers != "":
+                return int(post_processing_workers)
+        return None
+
+    @property
+    def post_processing_block_size(self):
+        if "post_processing_block_size" in self._config["settings"]:
+            block_size_str = self._config["settings"]["post_processing_block_size"]
+            if block_size_str != "":
+                block_size = re.sub(r"\s+", "", block_size_str).split(",")
+                return tuple(int(element) for element in block_size)
+        return None
+
+    @property
+    def post_processing_halo(self):
+        if "post_processing_halo" in self._config["settings"]:
+            post_processing_halo = self._config["settings"]["post_processing_halo"]
+            if post_processing_halo != "":
+                return int(post_processing_halo)
+        return 16
+
+    @property
+    def output_label_dtype(self):
+        if "output_label_dtype" in self._config["settings"]:
+            output_label_dtype = self._config["settings"]["output_label_dtype"]
+            if output_label_dtype != "":
+                try:
+                    return np.dtype(output_label_dtype)
+                except (TypeError, ValueError):
+                    print(f"{output_label_dtype} is not a valid output label dtype.")
+        return None
+
+    @property
+    def tiled_inference(self):
+        if "tiled_inference" in self._config["settings"]:
+            tiled_inference = self._config["settings"]["tiled_inference"]
+            return tiled_inference.lower() == "true"
+        return False
+
+    @property
+    def inference_tile_size(self):
+        if "inference_tile_size" in self._config["settings"]:
+            inference_tile_size_str = self._config["settings"]["inference_tile_size"]
+            if inference_tile_size_str != "":
+                inference_tile_size = re.sub(r"\s+", "", inference_tile_size_str).split(
+                    ","
+                )
+                return tuple(int(element) for element in inference_tile_size)
+        return None
+
+    @property
+    def ensemble_voting_mechanism(self):
+        if "ensemble_voting_mechanism" in self._config["settings"]:
+            voting_mechanism = self._config["settings"]["ensemble_voting_mechanism"]
+            if voting_mechanism != "":
+                return voting_mechanism.lower()
+        return "mode"
+
+    @property
+    def ensemble_vote_chunk_size(self):
+        if "ensemble_vote_chunk_size" in self._config["settings"]:
+            vote_chunk_size = self._config["settings"]["ensemble_vote_chunk_size"]
+            if vote_chunk_size != "":
+                return int(vote_chunk_size)
+        return None
+
+    @property
+    def tta_variants(self):
+        if "tta_variants" in self._config["settings"]:
+            tta_variants = self._config["settings"]["tta_variants"]
+            if tta_variants.lower() not in ["", "none"]:
+                return tta_variants
+        return None
+
+    @property
+    def tta_adaptive(self):
+        if "tta_adaptive" in self._config["settings"]:
+            tta_adaptive = self._config["settings"]["tta_adaptive"]
+            return tta_adaptive.lower() == "true"
+        return False
+
+    @property
+    def inference_precision(self):
+        if "inference_precision" in self._config["settings"]:
+            inference_precision = self._config["settings"]["inference_precision"]
+            if inference_precision != "":
+                return inference_precision.lower()
+        return "32"
+
+    @property
+    def inference_channels_last(self):
+        if "inference_channels_last" in self._config["settings"]:
+            channels_last = self._config["settings"]["inference_channels_last"]
+            return channels_last.lower() == "true"
+        return False
+
+    @property
+    def inference_mode(self):
+        if "inference_mode" in self._config["settings"]:
+            inference_mode = self._config["settings"]["inference_mode"]
+            return inference_mode.lower() == "true"
+        return True
+
+    @property
+    def inference_precision_check(self):
+        if "inference_precision_check" in self._config["settings"]:
+            precision_check = self._config["settings"]["inference_precision_check"]
+            return precision_check.lower() == "true"
+        return True
+
+    @property
+    def inference_precision_check_images(self):
+        if "inference_precision_check_images" in self._config["settings"]:
+            check_images = self._config["settings"]["inference_precision_check_images"]
+            if check_images != "":
+                return int(check_images)
+        return 2
+
+    @property
+    def inference_precision_tolerance(self):
+        if "inference_precision_tolerance" in self._config["settings"]:
+            tolerance = self._config["settings"]["inference_precision_tolerance"]
+            if tolerance != "":
+                return float(tolerance)
+        return 0.01
+
+    @property
+    def inference_quantization(self):
+        if "inference_quantization" in self._config["settings"]:
+            quantization = self._config["settings"]["inference_quantization"]
+            if quantization.lower() not in ["", "none"]:
+                return quantization.lower()
+        return None
+
+    @property
+    def quantization_calibration_batches(self):
+        if "quantization_calibration_batches" in self._config["settings"]:
+            calibration_batches = self._config["settings"][
+                "quantization_calibration_batches"
+            ]
+            if calibration_batches != "":
+                return int(calibration_batches)
+        return 8
+
+    @property
+    def quantization_max_metric_drift(self):
+        if "quantization_max_metric_drift" in self._config["settings"]:
+            max_metric_drift = self._config["settings"]["quantization_max_metric_drift"]
+            if max_metric_drift != "":
+                return float(max_metric_drift)
+        return None
+
+    @property
+    def resume_prediction(self):
+        if "resume_prediction" in self._config["settings"]:
+            resume_prediction = self._config["settings"]["resume_prediction"]
+            return resume_prediction.lower() == "true"
+        return False
+
+    @property
+    def watch_for_prediction(self):
+        if "watch_for_prediction" in self._config["settings"]:
+            watch_for_prediction = self._config["settings"]["watch_for_prediction"]
+            return watch_for_prediction.lower() == "true"
+        return False
+
+    @property
+    def watch_settle_time(self):
+        if "watch_settle_time" in self._config["settings"]:
+            watch_settle_time = self._config["settings"]["watch_settle_time"]
+            if watch_settle_time != "":
+                return float(watch_settle_time)
+        return 2.0
+
+    @property
+    def watch_poll_interval(self):
+        if "watch_poll_interval" in self._config["settings"]:
+            watch_poll_interval = self._config["settings"]["watch_poll_interval"]
+            if watch_poll_interval != "":
+                return float(watch_poll_interval)
+        return 1.0
+
+    @property
+    def watch_idle_timeout(self):
+        if "watch_idle_timeout" in self._config["settings"]:
+            watch_idle_timeout = self._config["settings"]["watch_idle_timeout"]
+            if watch_idle_timeout != "":
+                return float(watch_idle_timeout)
+        return None
+
+    @property
+    def watch_max_retries(self):
+        if "watch_max_retries" in self._config["settings"]:
+            watch_max_retries = self._config["settings"]["watch_max_retries"]
+            if watch_max_retries != "":
+                return int(watch_max_retries)
+        return 3
+
+    @property
+    def inference_window_batch_size(self):
+        if "inference_window_batch_size" in self._config["settings"]:
+            inference_window_batch_size = self._config["settings"][
+                "inference_window_batch_size"
+            ]
+            if inference_window_batch_size.lower() == "auto":
+                return "auto"
+            if inference_window_batch_size != "":
+                return int(inference_window_batch_size)
+        return self.inference_batch_size
+
     def _validate(self):
         """Validate configuration."""
 
@@ -455,6 +795,85 @@ class Config(ABC):
                 print("`early_stopping_patience` must be greater than 0.")
                 return False
 
+        # Validate the cache mode
+        if self.cache_mode not in [None, "disk", "shared"]:
+            print("`cache_mode` must be one of 'none', 'disk' or 'shared'.")
+            return False
+
+        # Validate the ensemble voting mechanism
+        if self.ensemble_voting_mechanism not in ["mode", "mean", "soft"]:
+            print(
+                "`ensemble_voting_mechanism` must be one of 'mode', 'mean' or 'soft'."
+            )
+            return False
+
+        # Validate the output compression
+        if self.output_compression not in ["none", "lzw", "zlib", "zstd"]:
+            print(
+                "`output_compression` must be one of 'none', 'lzw', 'zlib' or 'zstd'."
+            )
+            return False
+
+        # Validate the inference precision
+        if self.inference_precision not in ["32", "bf16", "16"]:
+            print("`inference_precision` must be one of '32', 'bf16' or '16'.")
+            return False
+
+        # Validate the inference quantization
+        if self.inference_quantization not in [None, "dynamic", "static"]:
+            print(
+                "`inference_quantization` must be one of 'none', 'dynamic' or 'static'."
+            )
+            return False
+        if self.inference_quantization == "dynamic" and self.model_class in [
+            "unet",
+            "attention_unet",
+        ]:
+            print(
+                "Dynamic quantization does not change the convolutions of "
+                f"'{self.model_class}' models: use `inference_quantization = static`."
+            )
+            return False
+
+        # Validate the post-processing pool
+        if (
+            self.post_processing_workers is not None
+            and self.post_processing_workers < 1
+        ):
+            print("`post_processing_workers` must be at least 1.")
+            return False
+        if self.post_processing_block_size is not None and (
+            any(s < 1 for s in self.post_processing_block_size)
+            or self.post_processing_halo < 1
+        ):
+            print(
+                "`post_processing_block_size` must be positive and "
+                "`post_processing_halo` at least 1."
+            )
+            return False
+
+        # Validate the watch mode
+        if self.watch_settle_time < 0 or self.watch_poll_interval <= 0:
+            print(
+                "`watch_settle_time` must be non-negative and `watch_poll_interval` positive."
+            )
+            return False
+        if self.watch_max_retries < 0:
+            print("`watch_max_retries` must be non-negative.")
+            return False
+
+        # Validate the sliding-window batch size
+        if self.inference_window_batch_size != "auto" and (
+            self.inference_window_batch_size < 1
+        ):
+            print("`inference_window_batch_size` must be a positive number or 'auto'.")
+            return False
+        if self.tiled_inference and self.inference_window_batch_size == "auto":
+            print(
+                "`inference_window_batch_size` cannot be 'auto' with tiled inference."
+            )
+            return False
+
         # @TODO Complete the checks.
 
         # Return success
@@ -0,0 +1,506 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import hashlib
+import io
+import json
+import multiprocessing
+import shutil
+import sys
+import uuid
+import weakref
+from copy import deepcopy
+from enum import Enum
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import numpy as np
+import torch
+from monai.data import Dataset, PersistentDataset
+from monai.transforms import Compose, RandomizableTrait, Transform
+
+from qute.hash import calculate_file_hash
+
+__doc__ = "Caching of the deterministic part of the transform pipelines."
+__all__ = [
+    "CACHE_VERSION",
+    "FileContentHasher",
+    "DiskCacheDataset",
+    "SharedMemoryCache",
+    "SharedMemoryCacheDataset",
+    "get_deterministic_prefix_length",
+    "hash_transform_parameters",
+]
+
+# Version of the on-disk cache layout: bump it whenever the cached content changes
+# in a way that is not captured by the file content and the transform parameters.
+CACHE_VERSION = 1
+
+
+def get_deterministic_prefix_length(transforms: Compose) -> int:
+    """Return the number of transforms at the beginning of the pipeline that are
+    deterministic and can therefore be cached.
+
+    The prefix ends at the first transform that is randomizable (or that is not
+    a MONAI `Transform` at all, since nothing can be assumed about it). This is the
+    same criterion used by `monai.data.PersistentDataset`.
+
+    Parameters
+    ----------
+
+    transforms: Compose
+        Transform pipeline as returned by one of the `CampaignTransforms.get_*_transforms()`
+        methods.
+
+    Returns
+    -------
+
+    n: int
+        Number of deterministic transforms at the beginning of the pipeline.
+    """
+    if not isinstance(transforms, Compose):
+        transforms = Compose(transforms)
+    first_random = transforms.get_index_of_first(
+        lambda t: isinstance(t, RandomizableTrait) or not isinstance(t, Transform)
+    )
+    if first_random is None:
+        return len(transforms.transforms)
+    return first_random
+
+
+def _describe(obj, depth: int = 0):
+    """Return a JSON-serializable, run-independent description of an object."""
+    if depth > 8:
+        return type(obj).__qualname__
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, Enum):
+        return str(obj.value)
+    if isinstance(obj, Path):
+        return str(obj)
+    if isinstance(obj, (np.dtype, torch.dtype)) or (
+        isinstance(obj, type) and issubclass(obj, np.generic)
+    ):
+        return str(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, torch.Tensor):
+        obj = obj.detach().cpu().numpy()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist() if obj.size < 1024 else str(obj.shape)
+    if isinstance(obj, (list, tuple)):
+        return [_describe(o, depth + 1) for o in obj]
+    if isinstance(obj, dict):
+        return {str(k): _describe(v, depth + 1) for k, v in obj.items()}
+    if isinstance(obj, (np.random.RandomState, np.random.Generator)):
+        # The state of the random generators is not a parameter
+        return None
+    if callable(obj) and not hasattr(obj, "__dict__"):
+        return f"{getattr(obj, '__module__', '')}.{getattr(obj, '__qualname__', '')}"
+    if hasattr(obj, "__dict__"):
+        return {
+            "class": f"{type(obj).__module__}.{type(obj).__qualname__}",
+            "params": {
+                k: _describe(v, depth + 1)
+                for k, v in sorted(vars(obj).items())
+                if k not in ("R", "lazy", "_lazy")
+            },
+        }
+    return f"{type(obj).__module__}.{type(obj).__qualname__}"
+
+
+def hash_transform_parameters(
+    transforms: Union[Compose, Sequence], end: Optional[int] = None
+) -> str:
+    """Calculate a hash of the classes and parameters of the transforms in a pipeline.
+
+    Parameters
+    ----------
+
+    transforms: Union[Compose, Sequence]
+        Transform pipeline, or sequence of transforms.
+
+    end: Optional[int] = None
+        Only consider the transforms with index lower than `end`. If omitted,
+        the whole pipeline is considered.
+
+    Returns
+    -------
+
+    hash: str
+        The hexadecimal hash of the transform parameters.
+    """
+    if isinstance(transforms, Compose):
+        transforms = transforms.transforms
+    description = [_describe(t) for t in list(transforms)[:end]]
+    text = json.dumps(description, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _hash_deterministic_transforms(transforms: Sequence) -> bytes:
+    """Hash the deterministic transforms as passed by `monai.data.PersistentDataset`."""
+    return hash_transform_parameters(transforms).encode("utf-8")
+
+
+class FileContentHasher:
+    """Hash a data dictionary by the content of the files it points to.
+
+    The hashes are memoized by path, file size and modification time, so that each
+    file is only read once per process. The memo is pickled with the object, and
+    can therefore be pre-filled in the main process before the DataLoader workers
+    are spawned.
+    """
+
+    def __init__(self, hash_function: str = "sha256"):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        hash_function: str = "sha256"
+            The name of the hash function to use (see `qute.hash.calculate_file_hash`).
+        """
+        self.hash_function = hash_function
+        self._memo: dict = {}
+
+    def hash_file(self, file_path: Union[Path, str]) -> str:
+        """Return the (memoized) content hash of a file."""
+        file_path = Path(file_path)
+        stat = file_path.stat()
+        key = (str(file_path.resolve()), stat.st_size, stat.st_mtime_ns)
+        if key not in self._memo:
+            self._memo[key] = calculate_file_hash(
+                file_path, hash_function=self.hash_function, chunk_size=1 << 20
+            )
+        return self._memo[key]
+
+    def __call__(self, item) -> bytes:
+        """Return the hash of a data item (dictionary of file paths, or single path)."""
+        if not isinstance(item, dict):
+            item = {"": item}
+        hash_obj = hashlib.new(self.hash_function)
+        for key in sorted(item.keys(), key=str):
+            value = item[key]
+            hash_obj.update(str(key).encode("utf-8"))
+            if isinstance(value, (str, Path)) and Path(value).is_file():
+                hash_obj.update(self.hash_file(value).encode("utf-8"))
+            else:
+                hash_obj.update(repr(value).encode("utf-8"))
+        return hash_obj.hexdigest().encode("utf-8")
+
+
+class DiskCacheDataset(PersistentDataset):
+    """Dataset that caches the output of the deterministic prefix of the transform
+    pipeline to disk.
+
+    The cache entries are keyed by the content of the input files and by the
+    parameters of the cached transforms, and are stored in a versioned sub-folder
+    of `cache_dir`. Changing the random tail of the pipeline (e.g., the augmentations)
+    does not invalidate the cache.
+    """
+
+    def __init__(
+        self,
+        data,
+        transform: Compose,
+        cache_dir: Union[Path, str],
+        hasher: Optional[FileContentHasher] = None,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        data: list
+            List of data dictionaries (e.g., {"image": path, "label": path}).
+
+        transform: Compose
+            Full transform pipeline. Only its deterministic prefix will be cached.
+
+        cache_dir: Union[Path, str]
+            Root folder of the cache. The cache entries are stored in the
+            `v{CACHE_VERSION}` sub-folder.
+
+        hasher: Optional[FileContentHasher] = None
+            Hasher for the data items. Pass the same object to all datasets to share
+            the memoized file hashes. If omitted, a new one is created.
+        """
+        if not isinstance(transform, Compose):
+            transform = Compose(transform)
+        if hasher is None:
+            hasher = FileContentHasher()
+
+        # Number of transforms whose output is cached
+        self.num_cached_transforms = get_deterministic_prefix_length(transform)
+
+        # Make sure the versioned cache folder exists
+        cache_dir = Path(cache_dir) / f"v{CACHE_VERSION}"
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        super().__init__(
+            data=data,
+            transform=transform,
+            cache_dir=cache_dir,
+            hash_func=hasher,
+            hash_transform=_hash_deterministic_transforms,
+        )
+
+        # Pre-compute the file hashes once in the calling process, so that
+        # they are inherited by the DataLoader workers
+        for item in data:
+            hasher(item)
+
+
+def _open_shared_memory(
+    name: Optional[str] = None, create: bool = False, size: int = 0
+) -> shared_memory.SharedMemory:
+    """Create or attach a shared memory segment that is not tracked by the resource
+    tracker of the current process.
+
+    The segments are owned by the `SharedMemoryCache`, not by the (worker) process
+    that creates or attaches them: without this, the resource tracker would unlink
+    them when the worker exits.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(
+            name=name, create=create, size=size, track=False
+        )
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _unlink_shared_memory(name: str):
+    """Unlink a shared memory segment, ignoring segments that are already gone."""
+    try:
+        shm = _open_shared_memory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    if sys.version_info < (3, 13):
+        # `unlink()` unregisters the segment from the resource tracker
+        resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+
+
+def _release_shared_memory_cache(index, manager):
+    """Unlink all segments of a cache and shut down its manager."""
+    try:
+        for name, _, _ in index.values():
+            _unlink_shared_memory(name)
+    except (EOFError, ConnectionError, BrokenPipeError):
+        pass
+    manager.shutdown()
+
+
+class SharedMemoryCache:
+    """Least-recently-used cache of samples in POSIX shared memory.
+
+    Each sample is serialized into its own shared memory segment, and a small index
+    (segment name, size and last access time per key) is kept by a manager process.
+    Since the object only holds proxies to the index, it can be passed to the
+    DataLoader workers: all workers of all DataLoaders see the same entries. When
+    storing a new sample would exceed the byte budget, the least recently used
+    entries are evicted.
+
+    The segments are released when the cache is closed or garbage-collected in the
+    process that created it.
+    """
+
+    def __init__(self, max_bytes: int, name_prefix: str = "qute"):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        max_bytes: int
+            Maximum number of bytes that the cached samples can occupy. The budget
+            is further limited by the free space in `/dev/shm`, if it exists.
+
+        name_prefix: str = "qute"
+            Prefix for the names of the shared memory segments.
+        """
+        # Make sure not to exceed the size of the shared memory file system
+        if Path("/dev/shm").is_dir():
+            max_bytes = min(max_bytes, int(0.9 * shutil.disk_usage("/dev/shm").free))
+        if max_bytes <= 0:
+            raise ValueError("`max_bytes` must be larger than 0.")
+        self.max_bytes = int(max_bytes)
+        self.name_prefix = f"{name_prefix}_{uuid.uuid4().hex[:8]}"
+
+        # The index and the statistics live in a manager process
+        self._manager = multiprocessing.Manager()
+        self._index = self._manager.dict()
+        self._stats = self._manager.dict(
+            {"clock": 0, "bytes": 0, "hits": 0, "misses": 0, "evictions": 0}
+        )
+        self._lock = self._manager.Lock()
+
+        # Release the shared memory when the cache goes away
+        self._finalizer = weakref.finalize(
+            self, _release_shared_memory_cache, self._index, self._manager
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Only the creating process owns the manager and the segments
+        state["_manager"] = None
+        state["_finalizer"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def get(self, key: str):
+        """Return a copy of the cached sample for `key`, or None if not cached."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            name, nbytes, _ = entry
+            clock = self._stats["clock"] + 1
+            self._stats["clock"] = clock
+            self._stats["hits"] += 1
+            self._index[key] = (name, nbytes, clock)
+
+        # The entry may have been evicted in the meanwhile
+        try:
+            shm = _open_shared_memory(name=name)
+        except FileNotFoundError:
+            return None
+        try:
+            buffer = io.BytesIO(shm.buf[:nbytes])
+        finally:
+            shm.close()
+        return torch.load(buffer, weights_only=False)
+
+    def put(self, key: str, value) -> bool:
+        """Store a sample in the cache, evicting the least recently used entries if
+        needed. Return False if the sample is larger than the whole budget."""
+        buffer = io.BytesIO()
+        torch.save(value, buffer)
+        data = buffer.getbuffer()
+        nbytes = len(data)
+        if nbytes > self.max_bytes:
+            return False
+
+        with self._lock:
+            if key in self._index:
+                return True
+
+            # Evict the least recently used entries
+            total = self._stats["bytes"]
+            if total + nbytes > self.max_bytes:
+                entries = sorted(self._index.items(), key=lambda e: e[1][2])
+                for old_key, (old_name, old_nbytes, _) in entries:
+                    if total + nbytes <= self.max_bytes:
+                        break
+                    del self._index[old_key]
+                    _unlink_shared_memory(old_name)
+                    total -= old_nbytes
+                    self._stats["evictions"] += 1
+
+            # Store the new entry
+            name = f"{self.name_prefix}_{uuid.uuid4().hex[:16]}"
+            shm = _open_shared_memory(name=name, create=True, size=nbytes)
+            try:
+                shm.buf[:nbytes] = data
+            finally:
+                shm.close()
+            clock = self._stats["clock"] + 1
+            self._stats["clock"] = clock
+            self._stats["bytes"] = total + nbytes
+            self._index[key] = (name, nbytes, clock)
+
+        return True
+
+    def stats(self) -> dict:
+        """Return the number of entries, bytes in use, hits, misses and evictions."""
+        stats = dict(self._stats)
+        stats.pop("clock")
+        stats["entries"] = len(self._index)
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+    def close(self):
+        """Release all shared memory segments (only in the creating process)."""
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+class SharedMemoryCacheDataset(Dataset):
+    """Dataset that caches the output of the deterministic prefix of the transform
+    pipeline in a `SharedMemoryCache`.
+
+    The cache can be shared by several datasets (e.g., training and validation): the
+    entries are keyed by the content of the input files and the parameters of the
+    cached transforms.
+    """
+
+    def __init__(
+        self,
+        data,
+        transform: Compose,
+        cache: SharedMemoryCache,
+        hasher: Optional[FileContentHasher] = None,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        data: list
+            List of data dictionaries (e.g., {"image": path, "label": path}).
+
+        transform: Compose
+            Full transform pipeline. Only its deterministic prefix will be cached.
+
+        cache: SharedMemoryCache
+            Shared memory cache to use.
+
+        hasher: Optional[FileContentHasher] = None
+            Hasher for the data items. Pass the same object to all datasets to share
+            the memoized file hashes. If omitted, a new one is created.
+        """
+        super().__init__(data=data, transform=transform)
+        if hasher is None:
+            hasher = FileContentHasher()
+        self.cache = cache
+        self.hasher = hasher
+
+        # Hash the parameters of the deterministic prefix only
+        self.num_cached_transforms = get_deterministic_prefix_length(self.transform)
+        self.transform_hash = hash_transform_parameters(
+            self.transform, end=self.num_cached_transforms
+        )
+
+        # Pre-compute the file hashes once in the calling process, so that
+        # they are inherited by the DataLoader workers
+        for item in data:
+            hasher(item)
+
+    def _transform(self, index: int):
+        """Fetch the sample from the cache (or run and cache the deterministic
+        transforms), then apply the random tail of the pipeline."""
+        item = self.data[index]
+        key = f"{self.hasher(item).decode('utf-8')}_{self.transform_hash}"
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = self.transform(
+                deepcopy(item), end=self.num_cached_transforms, threading=True
+            )
+            self.cache.put(key, cached)
+        return self.transform(cached, start=self.num_cached_transforms)
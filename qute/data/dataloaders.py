@@ -18,12 +18,22 @@ from typing import Optional, Union
 
 import numpy as np
 import pytorch_lightning as pl
+import torch
 from monai.data import ArrayDataset, DataLoader, Dataset, list_data_collate
 from natsort import natsorted
 from numpy.random import default_rng
 from sklearn.model_selection import KFold
 
 from qute.campaigns import CampaignTransforms
+from qute.data.cache import (
+    DiskCacheDataset,
+    FileContentHasher,
+    SharedMemoryCache,
+    SharedMemoryCacheDataset,
+)
+from qute.data.patch_queue import PatchQueueDataset
+from qute.data.sampling import build_sampling_indices, find_indexed_crop
+from qute.data.store import is_store
 
 __doc__ = "Dataloaders."
 __all__ = [
@@ -44,6 +54,14 @@ def open_with_fallback(filename=None):
             file.close()
 
 
+def _get_default_cache_max_bytes() -> int:
+    """Return a quarter of the physical memory, or 4 GB if it cannot be queried."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 4
+    except (AttributeError, ValueError, OSError):
+        return 4 * 1024**3
+
+
 class DataModuleLocalFolder(pl.LightningDataModule):
     """DataLoader for local folder containing source and target image sub-folders."""
 
@@ -67,6 +85,15 @@ class DataModuleLocalFolder(pl.LightningDataModule):
         num_workers: Optional[int] = os.cpu_count() - 1,
         num_inference_workers: Optional[int] = os.cpu_count() - 1,
         pin_memory: bool = True,
+        prefetch_factor: Optional[int] = None,
+        cache_mode: Optional[str] = None,
+        cache_dir: Union[None, Path, str] = None,
+        cache_max_bytes: Optional[int] = None,
+        use_sampling_index: bool = False,
+        sampling_index_dir: Union[None, Path, str] = None,
+        patch_queue_pool_size: Optional[int] = None,
+        patch_queue_samples_per_volume: int = 8,
+        patch_queue_shuffle_buffer_size: int = 16,
     ):
         """
         Constructor.
@@ -80,7 +107,8 @@ class DataModuleLocalFolder(pl.LightningDataModule):
 
         data_dir: Path | str = Path()
             Data directory, containing two source and target image sub-folders. The subfolder names
-            and labels can be overwritten.
+            and labels can be overwritten. If the directory is a memory-mapped store (see
+            `qute.data.store.convert_to_store()`), the `.npy` files are used instead of the TIFF files.
 
         num_folds: int = 1
             Set to a number larger than one to set up k-fold cross-validation. All images
@@ -135,7 +163,57 @@ class DataModuleLocalFolder(pl.LightningDataModule):
             Number of workers to be used in the inference data loader.
 
         pin_memory: bool = True
-            Whether to pin the GPU memory.
+            Whether to pin the memory of the batches for faster transfer to the GPU.
+            It is ignored if CUDA is not available.
+
+        prefetch_factor: Optional[int] = None
+            Number of batches loaded in advance by each worker. If omitted, the PyTorch
+            default is used. Ignored if there are no workers.
+            @see `qute.data.tuning.tune_data_loader()` to tune the data loader settings.
+
+        cache_mode: Optional[str] = None
+            Set to "disk" to cache the output of the deterministic part of the transform
+            pipelines (everything before the first random transform) to disk. The cache
+            is keyed by file content and transform parameters, and is reused across
+            epochs, folds and runs. Set to "shared" to cache it in shared memory instead:
+            the cache is shared by all workers of the training, validation and test
+            data loaders, and lives as long as the data module. Omit (or set to None)
+            to disable caching.
+
+        cache_dir: Union[None, Path, str] = None
+            Root folder of the cache. If omitted, `{data_dir}/.qute_cache` is used.
+            Only used if `cache_mode` is "disk".
+
+        cache_max_bytes: Optional[int] = None
+            Maximum size in bytes of the shared memory cache: when full, the least
+            recently used samples are evicted. If omitted, a quarter of the physical
+            memory is used (4 GB if it cannot be queried, e.g., on Windows). Only used if
+            `cache_mode` is "shared".
+
+        use_sampling_index: bool = False
+            Set to True to precompute (once, in parallel) an index of the foreground and
+            background voxels of the labels, so that the `IndexedRandCropByPosNegLabeld`
+            transform of the campaign does not need to scan the whole label image to
+            pick the centers of the patches.
+            @see `qute.data.sampling.build_sampling_indices()`.
+
+        sampling_index_dir: Union[None, Path, str] = None
+            Root folder of the sampling indices. If omitted, `{data_dir}/.qute_index` is used.
+            Only used if `use_sampling_index` is True.
+
+        patch_queue_pool_size: Optional[int] = None
+            Set to use a patch queue for training: each DataLoader worker keeps a pool of
+            `patch_queue_pool_size` preprocessed volumes in memory and draws many patches
+            from them, while the next volume is loaded in the background. Memory use grows
+            with the pool size. Omit (or set to None) to load one volume per sample.
+            @see `qute.data.patch_queue.PatchQueueDataset`.
+
+        patch_queue_samples_per_volume: int = 8
+            Number of samples drawn from each volume in the pool before it is replaced.
+            One epoch contains `patch_queue_samples_per_volume` samples per training image.
+
+        patch_queue_shuffle_buffer_size: int = 16
+            Number of samples mixed in the patch queue before being batched.
         """
 
         super().__init__()
@@ -148,7 +226,32 @@ class DataModuleLocalFolder(pl.LightningDataModule):
 
         self.num_workers = num_workers
         self.num_inference_workers = num_inference_workers
-        self.pin_memory = pin_memory
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.prefetch_factor = prefetch_factor
+
+        # Set the caching options
+        if cache_mode is not None and cache_mode not in ["disk", "shared"]:
+            raise ValueError("`cache_mode` must be one of None, 'disk' or 'shared'.")
+        self.cache_mode = cache_mode
+        if cache_dir is None:
+            cache_dir = self.data_dir / ".qute_cache"
+        self.cache_dir = Path(cache_dir).resolve()
+        if cache_max_bytes is None and cache_mode == "shared":
+            cache_max_bytes = _get_default_cache_max_bytes()
+        self.cache_max_bytes = cache_max_bytes
+        self._hasher = FileContentHasher()
+        self._shared_cache = None
+
+        # Set the sampling index options
+        self.use_sampling_index = use_sampling_index
+        if sampling_index_dir is None:
+            sampling_index_dir = self.data_dir / ".qute_index"
+        self.sampling_index_dir = Path(sampling_index_dir).resolve()
+
+        # Set the patch queue options
+        self.patch_queue_pool_size = patch_queue_pool_size
+        self.patch_queue_samples_per_volume = patch_queue_samples_per_volume
+        self.patch_queue_shuffle_buffer_size = patch_queue_shuffle_buffer_size
 
         # Set the sub-folder names and labels
         self.source_images_sub_folder = source_images_sub_folder
@@ -233,15 +336,18 @@ class DataModuleLocalFolder(pl.LightningDataModule):
             # Data is already prepared
             return
 
+        # Read from the memory-mapped store if the data folder contains one
+        fmt_filter = "*.npy" if is_store(self.data_dir) else "*.tif"
+
         # Scan the "images" and "labels" folders and clean them
         image_candidates = list(
-            (self.data_dir / self.source_images_sub_folder).glob("*.tif")
+            (self.data_dir / self.source_images_sub_folder).glob(fmt_filter)
         )
         image_candidates = [
             image for image in image_candidates if not str(image).startswith("._")
         ]
         label_candidates = list(
-            (self.data_dir / self.target_images_sub_folder).glob("*.tif")
+            (self.data_dir / self.target_images_sub_folder).glob(fmt_filter)
         )
         label_candidates = [
             label for label in label_candidates if not str(label).startswith("._")
@@ -329,6 +435,51 @@ class DataModuleLocalFolder(pl.LightningDataModule):
                 # Recreate the datasets
                 self._create_datasets()
 
+    def _create_dataset(self, files: list, transform, training: bool = False):
+        """Create a dataset for the passed files, honoring the caching and sampling options."""
+        if self.use_sampling_index:
+            index_files = build_sampling_indices(
+                files,
+                transform,
+                index_dir=self.sampling_index_dir,
+                num_workers=max(1, self.num_workers),
+                hasher=self._hasher,
+            )
+            if index_files is not None:
+                index_key = find_indexed_crop(transform).index_key
+                files = [
+                    {**item, index_key: str(index_file)}
+                    for item, index_file in zip(files, index_files)
+                ]
+        if training and self.patch_queue_pool_size is not None:
+            return PatchQueueDataset(
+                data=files,
+                transform=transform,
+                samples_per_volume=self.patch_queue_samples_per_volume,
+                pool_size=self.patch_queue_pool_size,
+                shuffle_buffer_size=self.patch_queue_shuffle_buffer_size,
+                batch_size=self.batch_size,
+                seed=self.seed,
+            )
+        if self.cache_mode == "disk":
+            return DiskCacheDataset(
+                data=files,
+                transform=transform,
+                cache_dir=self.cache_dir,
+                hasher=self._hasher,
+            )
+        if self.cache_mode == "shared":
+            # One cache for all datasets (and all folds)
+            if self._shared_cache is None:
+                self._shared_cache = SharedMemoryCache(max_bytes=self.cache_max_bytes)
+            return SharedMemoryCacheDataset(
+                data=files,
+                transform=transform,
+                cache=self._shared_cache,
+                hasher=self._hasher,
+            )
+        return Dataset(data=files, transform=transform)
+
     def _create_datasets(self):
         """Create datasets based on current splits."""
         # Create the training dataset
@@ -339,8 +490,8 @@ class DataModuleLocalFolder(pl.LightningDataModule):
                 self._all_labels[self._train_indices],
             )
         ]
-        self.train_dataset = Dataset(
-            data=train_files, transform=self.campaign_transforms.get_train_transforms()
+        self.train_dataset = self._create_dataset(
+            train_files, self.campaign_transforms.get_train_transforms(), training=True
         )
 
         # Create the validation dataset
@@ -350,8 +501,8 @@ class DataModuleLocalFolder(pl.LightningDataModule):
                 self._all_images[self._val_indices], self._all_labels[self._val_indices]
             )
         ]
-        self.val_dataset = Dataset(
-            data=val_files, transform=self.campaign_transforms.get_valid_transforms()
+        self.val_dataset = self._create_dataset(
+            val_files, self.campaign_transforms.get_valid_transforms()
         )
 
         # Create the testing dataset
@@ -362,8 +513,8 @@ class DataModuleLocalFolder(pl.LightningDataModule):
                 self._all_labels[self._test_indices],
             )
         ]
-        self.test_dataset = Dataset(
-            data=test_files, transform=self.campaign_transforms.get_test_transforms()
+        self.test_dataset = self._create_dataset(
+            test_files, self.campaign_transforms.get_test_transforms()
         )
 
         # Inform
@@ -383,6 +534,12 @@ class DataModuleLocalFolder(pl.LightningDataModule):
 
     def train_dataloader(self):
         """Return DataLoader for Training data."""
+        if isinstance(self.train_dataset, PatchQueueDataset):
+            # The batch size may have changed (e.g., by tuning), and the first epoch may
+            # not be 0 (e.g., when resuming training)
+            self.train_dataset.batch_size = self.batch_size
+            if self.trainer is not None:
+                self.train_dataset.set_epoch(self.trainer.current_epoch)
         return DataLoader(
             self.train_dataset,
             shuffle=False,  # Already shuffled
@@ -391,6 +548,7 @@ class DataModuleLocalFolder(pl.LightningDataModule):
             collate_fn=list_data_collate,
             pin_memory=self.pin_memory,
             persistent_workers=True if self.num_workers > 0 else False,
+            prefetch_factor=self.prefetch_factor if self.num_workers > 0 else None,
         )
 
     def val_dataloader(self):
@@ -403,6 +561,7 @@ class DataModuleLocalFolder(pl.LightningDataModule):
             collate_fn=list_data_collate,
             pin_memory=self.pin_memory,
             persistent_workers=True if self.num_workers > 0 else False,
+            prefetch_factor=self.prefetch_factor if self.num_workers > 0 else None,
         )
 
     def test_dataloader(self):
@@ -415,6 +574,7 @@ class DataModuleLocalFolder(pl.LightningDataModule):
             collate_fn=list_data_collate,
             pin_memory=self.pin_memory,
             persistent_workers=True if self.num_workers > 0 else False,
+            prefetch_factor=self.prefetch_factor if self.num_workers > 0 else None,
         )
 
     def inference_dataloader(
@@ -456,4 +616,7 @@ class DataModuleLocalFolder(pl.LightningDataModule):
             collate_fn=list_data_collate,
             pin_memory=pin_memory,
             persistent_workers=persistent_workers,
+            prefetch_factor=(
+                self.prefetch_factor if num_inference_workers > 0 else None
+            ),
         )
@@ -51,6 +51,9 @@ class CellSegmentationDemo(DataModuleLocalFolder):
         num_workers: Optional[int] = os.cpu_count() - 1,
         num_inference_workers: Optional[int] = os.cpu_count() - 1,
         pin_memory: bool = True,
+        cache_mode: Optional[str] = None,
+        cache_dir: Union[None, Path, str] = None,
+        cache_max_bytes: Optional[int] = None,
     ):
         """
         Constructor.
@@ -107,6 +110,18 @@ class CellSegmentationDemo(DataModuleLocalFolder):
 
         pin_memory: bool = True
             Whether to pin the GPU memory.
+
+        cache_mode: Optional[str] = None
+            Set to "disk" or "shared" to cache the output of the deterministic part of the
+            transform pipelines to disk or shared memory, respectively.
+            @see `qute.data.dataloaders.DataModuleLocalFolder`.
+
+        cache_dir: Union[None, Path, str] = None
+            Root folder of the cache. Only used if `cache_mode` is "disk".
+
+        cache_max_bytes: Optional[int] = None
+            Maximum size in bytes of the shared memory cache. Only used if `cache_mode`
+            is "shared".
         """
 
         # Check that download_dir is set
@@ -144,6 +159,9 @@ class CellSegmentationDemo(DataModuleLocalFolder):
             num_workers=num_workers,
             num_inference_workers=num_inference_workers,
             pin_memory=pin_memory,
+            cache_mode=cache_mode,
+            cache_dir=cache_dir,
+            cache_max_bytes=cache_max_bytes,
         )
 
     def prepare_data(self):
@@ -179,6 +197,9 @@ class CellSegmentationDemoIDT(DataModuleLocalFolder):
         num_workers: Optional[int] = os.cpu_count() - 1,
         num_inference_workers: Optional[int] = os.cpu_count() - 1,
         pin_memory: bool = True,
+        cache_mode: Optional[str] = None,
+        cache_dir: Union[None, Path, str] = None,
+        cache_max_bytes: Optional[int] = None,
     ):
         """
         Constructor.
@@ -232,6 +253,18 @@ class CellSegmentationDemoIDT(DataModuleLocalFolder):
 
         pin_memory: bool = True
             Whether to pin the GPU memory.
+
+        cache_mode: Optional[str] = None
+            Set to "disk" or "shared" to cache the output of the deterministic part of the
+            transform pipelines to disk or shared memory, respectively.
+            @see `qute.data.dataloaders.DataModuleLocalFolder`.
+
+        cache_dir: Union[None, Path, str] = None
+            Root folder of the cache. Only used if `cache_mode` is "disk".
+
+        cache_max_bytes: Optional[int] = None
+            Maximum size in bytes of the shared memory cache. Only used if `cache_mode`
+            is "shared".
         """
 
         # Check that download_dir is set
@@ -262,6 +295,9 @@ class CellSegmentationDemoIDT(DataModuleLocalFolder):
             num_workers=num_workers,
             num_inference_workers=num_inference_workers,
             pin_memory=pin_memory,
+            cache_mode=cache_mode,
+            cache_dir=cache_dir,
+            cache_max_bytes=cache_max_bytes,
         )
 
     def prepare_data(self):
@@ -295,6 +331,9 @@ class CellRestorationDemo(DataModuleLocalFolder):
         num_workers: Optional[int] = os.cpu_count() - 1,
         num_inference_workers: Optional[int] = os.cpu_count() - 1,
         pin_memory: bool = True,
+        cache_mode: Optional[str] = None,
+        cache_dir: Union[None, Path, str] = None,
+        cache_max_bytes: Optional[int] = None,
     ):
         """
         Constructor.
@@ -348,6 +387,18 @@ class CellRestorationDemo(DataModuleLocalFolder):
 
         pin_memory: bool = True
             Whether to pin the GPU memory.
+
+        cache_mode: Optional[str] = None
+            Set to "disk" or "shared" to cache the output of the deterministic part of the
+            transform pipelines to disk or shared memory, respectively.
+            @see `qute.data.dataloaders.DataModuleLocalFolder`.
+
+        cache_dir: Union[None, Path, str] = None
+            Root folder of the cache. Only used if `cache_mode` is "disk".
+
+        cache_max_bytes: Optional[int] = None
+            Maximum size in bytes of the shared memory cache. Only used if `cache_mode`
+            is "shared".
         """
 
         # Check that download_dir is set
@@ -380,6 +431,9 @@ class CellRestorationDemo(DataModuleLocalFolder):
             num_workers=num_workers,
             num_inference_workers=num_inference_workers,
             pin_memory=pin_memory,
+            cache_mode=cache_mode,
+            cache_dir=cache_dir,
+            cache_max_bytes=cache_max_bytes,
         )
 
     def prepare_data(self):
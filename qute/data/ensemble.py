@@ -0,0 +1,269 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import copy
+from typing import Optional, Sequence
+
+import torch
+from torch.func import functional_call, stack_module_state
+
+__doc__ = "Device-resident evaluation and voting of ensembles of models."
+__all__ = [
+    "EnsembleNetwork",
+    "average_predictions",
+    "to_compact_int",
+    "vote",
+]
+
+# Maximum number of classes for which the mode is computed by counting votes
+_MAX_COUNTED_CLASSES = 256
+
+
+def _have_same_architecture(networks: Sequence[torch.nn.Module]) -> bool:
+    """Return True if all networks have the same type and parameter/buffer shapes."""
+    reference = networks[0]
+    shapes = {k: v.shape for k, v in reference.state_dict().items()}
+    for network in networks[1:]:
+        if type(network) is not type(reference):
+            return False
+        state_dict = network.state_dict()
+        if state_dict.keys() != shapes.keys():
+            return False
+        if any(state_dict[k].shape != shape for k, shape in shapes.items()):
+            return False
+    return True
+
+
+class EnsembleNetwork:
+    """Evaluates all networks of an ensemble in a single forward pass.
+
+    The networks are moved to the device (and switched to evaluation mode) once. If all
+    networks share the same architecture, their weights are stacked and the ensemble is
+    evaluated as one vectorized (`torch.vmap`) forward pass; otherwise, the networks are
+    evaluated one after the other on the same input.
+
+    The outputs of the networks are concatenated along the channel dimension: for an input
+    of shape (B, C_in, ...), the output has shape (B, M * C, ...), where M is the number
+    of networks. This way, the ensemble can be passed as a single network to MONAI's
+    `SlidingWindowInferer`. Use `split()` to recover the output of each network.
+    """
+
+    def __init__(
+        self,
+        networks: Sequence[torch.nn.Module],
+        device: Optional[torch.device] = None,
+        stack: bool = True,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        networks: Sequence[torch.nn.Module]
+            Networks of the ensemble.
+
+        device: Optional[torch.device] = None
+            Device where to keep the networks. Omit to leave them where they are.
+
+        stack: bool = True
+            Set to True to evaluate networks with the same architecture as one vectorized
+            forward pass; set to False to always evaluate them one after the other.
+        """
+        if len(networks) == 0:
+            raise ValueError("The ensemble must contain at least one network.")
+        self.networks = list(networks)
+        for network in self.networks:
+            if device is not None:
+                network.to(device)
+            network.eval()
+        self.num_networks = len(networks)
+
+        # Stack the weights of the networks
+        self.stacked = stack and len(networks) > 1 and _have_same_architecture(networks)
+        if self.stacked:
+            self._params, self._buffers = stack_module_state(self.networks)
+            self._base = copy.deepcopy(self.networks[0]).to("meta")
+
+    def _forward_one(self, params, buffers, x):
+        return functional_call(self._base, (params, buffers), (x,))
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if self.stacked:
+            try:
+                outputs = torch.vmap(self._forward_one, in_dims=(0, 0, None))(
+                    self._params, self._buffers, x
+                )
+            except RuntimeError as e:
+                # Some operations cannot be vectorized: fall back to a loop
+                print(
+                    f"Cannot vectorize the ensemble ({e}): evaluating the models in turn."
+                )
+                self.stacked = False
+                self._params, self._buffers, self._base = None, None, None
+                return self(x)
+        else:
+            outputs = torch.stack([network(x) for network in self.networks])
+
+        # (M, B, C, ...) -> (B, M * C, ...)
+        return outputs.transpose(0, 1).flatten(1, 2)
+
+    def split(self, outputs: torch.Tensor) -> torch.Tensor:
+        """Reshape the (B, M * C, ...) output of the ensemble into (B, M, C, ...)."""
+        return outputs.unflatten(1, (self.num_networks, -1))
+
+
+def to_compact_int(labels: torch.Tensor) -> torch.Tensor:
+    """Cast an integer-valued tensor to the smallest of uint8, int16 and int32 that can hold it."""
+    if labels.numel() == 0:
+        return labels.to(torch.uint8)
+    min_value, max_value = int(labels.min()), int(labels.max())
+    if min_value >= 0 and max_value <= 255:
+        return labels.to(torch.uint8)
+    if min_value >= -(2**15) and max_value < 2**15:
+        return labels.to(torch.int16)
+    return labels.to(torch.int32)
+
+
+def _normalized_weights(
+    weights: Optional[Sequence[float]], num_models: int, device: torch.device
+) -> torch.Tensor:
+    """Return the weights as a tensor that sums to one (uniform if omitted)."""
+    if weights is None:
+        weights = [1.0] * num_models
+    if len(weights) != num_models:
+        raise ValueError("The number of weights must match the number of models.")
+    weights = torch.as_tensor(weights, dtype=torch.float32, device=device)
+    return weights / weights.sum()
+
+
+def vote(
+    predictions: torch.Tensor,
+    mechanism: str = "mode",
+    weights: Optional[Sequence[float]] = None,
+    chunk_size: Optional[int] = None,
+) -> torch.Tensor:
+    """Combine the label predictions of an ensemble on their device.
+
+    Parameters
+    ----------
+
+    predictions: torch.Tensor
+        Label predictions of the M models, stacked along the first dimension: (M, ...). Any
+        number of dimensions (batch, channel, 2D or 3D) may follow.
+
+    mechanism: str = "mode"
+        "mode": pick the most common label among the predictions for each pixel (in case of
+                a tie, the smallest label). If `weights` are given, each model votes with
+                its weight.
+        "mean": (rounded) weighted mean of the predicted labels per pixel.
+
+    weights: Optional[Sequence[float]] = None
+        Relative contributions of the models. Omit to weigh all models equally.
+
+    chunk_size: Optional[int] = None
+        Number of pixels to vote on at once. Set it to bound the temporary memory for large
+        3D volumes. Omit to vote on all pixels at once.
+
+    Returns
+    -------
+
+    labels: torch.Tensor
+        Voted labels, with the shape of a single prediction and the smallest of the uint8,
+        int16 and int32 types that can hold them.
+    """
+    if mechanism not in ["mode", "mean"]:
+        raise ValueError("`mechanism` must be one of 'mode' or 'mean'.")
+    num_models = predictions.shape[0]
+    shape = predictions.shape[1:]
+    flat = predictions.reshape(num_models, -1)
+    num_pixels = flat.shape[1]
+    if chunk_size is None or chunk_size <= 0:
+        chunk_size = max(1, num_pixels)
+
+    uniform = weights is None
+    weights = _normalized_weights(weights, num_models, predictions.device)
+
+    # Count the votes if the labels are few and non-negative
+    if mechanism == "mode" and num_pixels > 0:
+        min_label, max_label = int(flat.min()), int(flat.max())
+        count_votes = min_label >= 0 and max_label < _MAX_COUNTED_CLASSES
+    else:
+        count_votes = False
+
+    out = torch.empty(num_pixels, dtype=torch.int32, device=predictions.device)
+    for start in range(0, num_pixels, chunk_size):
+        stop = min(start + chunk_size, num_pixels)
+        if mechanism == "mean":
+            chunk = flat[:, start:stop].to(torch.float32)
+            mean = (weights[:, None] * chunk).sum(dim=0)
+            out[start:stop] = torch.round(mean).to(torch.int32)
+        elif count_votes:
+            chunk = flat[:, start:stop].to(torch.int64)
+            counts = torch.zeros(
+                (max_label + 1, stop - start),
+                dtype=torch.float32,
+                device=predictions.device,
+            )
+            counts.scatter_add_(
+                0, chunk, weights[:, None].expand(num_models, stop - start)
+            )
+            # argmax returns the first (smallest) label in case of a tie
+            out[start:stop] = counts.argmax(dim=0).to(torch.int32)
+        else:
+            if not uniform:
+                raise ValueError(
+                    f"Weighted mode is only supported for labels in [0, {_MAX_COUNTED_CLASSES})."
+                )
+            values, _ = torch.mode(flat[:, start:stop].to(torch.int64), dim=0)
+            out[start:stop] = values.to(torch.int32)
+    return to_compact_int(out.reshape(shape))
+
+
+def average_predictions(
+    outputs: torch.Tensor,
+    weights: Optional[Sequence[float]] = None,
+    activation: Optional[str] = "softmax",
+) -> torch.Tensor:
+    """Average the (soft) outputs of an ensemble on their device.
+
+    Parameters
+    ----------
+
+    outputs: torch.Tensor
+        Outputs of the M models, with shape (B, M, C, ...) (see `EnsembleNetwork.split()`).
+
+    weights: Optional[Sequence[float]] = None
+        Relative contributions of the models. Omit to weigh all models equally.
+
+    activation: Optional[str] = "softmax"
+        Activation to apply to the outputs before averaging: one of "softmax" (over the
+        channels), "sigmoid" or None (average the raw outputs).
+
+    Returns
+    -------
+
+    average: torch.Tensor
+        Weighted average with shape (B, C, ...).
+    """
+    if activation not in ["softmax", "sigmoid", None]:
+        raise ValueError("`activation` must be one of 'softmax', 'sigmoid' or None.")
+    weights = _normalized_weights(weights, outputs.shape[1], outputs.device)
+    average = None
+    for m in range(outputs.shape[1]):
+        output = outputs[:, m]
+        if activation == "softmax":
+            output = torch.softmax(output, dim=1)
+        elif activation == "sigmoid":
+            output = torch.sigmoid(output)
+        average = (
+            weights[m] * output if average is None else average + weights[m] * output
+        )
+    return average
@@ -9,41 +9,390 @@
 #    Aaron Ponti - initial API and implementation
 #  ******************************************************************************
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from multiprocessing import get_context
 from pathlib import Path
-from typing import Optional, Tuple, Union
+from typing import TYPE_CHECKING, Callable, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch
-from monai.data import DataLoader
+from monai.data import ArrayDataset, DataLoader
+from monai.data.utils import compute_importance_map, dense_patch_slices
 from monai.inferers import SlidingWindowInferer
-from monai.transforms import Transform
+from monai.transforms import Compose, Transform
 from monai.utils import BlendMode
-from tifffile import TiffWriter
 
 from qute.campaigns import CampaignTransforms
-from qute.device import get_device
-from qute.models.base_model import BaseModel
+from qute.data.ensemble import (
+    EnsembleNetwork,
+    average_predictions,
+    to_compact_int,
+    vote,
+)
+from qute.data.manifest import PredictionManifest, hash_model
+from qute.data.precision import InferencePrecision
+from qute.data.tiles import (
+    compute_image_statistics,
+    iterate_tiles,
+    open_region_reader,
+    open_tile_writer,
+)
+from qute.data.tta import TTANetwork
+from qute.data.writers import PredictionWriter, TIFFPredictionWriter
+from qute.device import get_available_memory, get_device
+from qute.export import InferenceBackend
+from qute.models.quantization import is_quantized
+from qute.transforms.geom import CustomResampler
+from qute.transforms.io import CustomTIFFReader
+from qute.transforms.norm import ZNormalize
+
+# BaseModel pulls in PyTorch Lightning, which is not needed to run exported models
+if TYPE_CHECKING:
+    from qute.models.base_model import BaseModel
+
+
+def _cast(pred: np.ndarray, output_dtype: Optional[Union[str, np.dtype]]) -> np.ndarray:
+    """Type-cast the prediction if needed, without wrapping around for integer types."""
+    if output_dtype is None:
+        return pred
+    if np.issubdtype(output_dtype, np.integer):
+        info = np.iinfo(output_dtype)
+        pred = np.clip(pred, info.min, info.max)
+    return pred.astype(output_dtype)
+
+
+def _get_device_and_precision(
+    networks: list, precision: Optional[InferencePrecision]
+) -> Tuple[torch.device, InferencePrecision]:
+    """Return the device to run the networks on and the precision policy to use."""
+    device = get_device()
+    if precision is None:
+        precision = InferencePrecision(inference_mode=False)
+
+    # Quantized kernels only run on the CPU (and are int8 internally)
+    if any(is_quantized(network) for network in networks):
+        device = torch.device("cpu")
+        if precision.dtype is not None or precision.channels_last:
+            print("Quantized models are run without autocast and channels-last.")
+            precision = InferencePrecision(inference_mode=precision.inference_mode)
+
+    return device, precision.for_device(device)
+
+
+def _subset_data_loader(data_loader: DataLoader, indices: Sequence[int]) -> DataLoader:
+    """Return a copy of an inference DataLoader that only loads the images at `indices`."""
+    image_dataset = data_loader.dataset.dataset
+    subset = ArrayDataset(
+        [image_dataset.data[i] for i in indices],
+        img_transform=image_dataset.transform,
+    )
+    num_workers = min(data_loader.num_workers, len(indices))
+    return DataLoader(
+        subset,
+        batch_size=min(data_loader.batch_size, len(indices)),
+        num_workers=num_workers,
+        collate_fn=data_loader.collate_fn,
+        pin_memory=data_loader.pin_memory,
+        prefetch_factor=data_loader.prefetch_factor if num_workers > 0 else None,
+    )
+
+
+def _resume_from_manifest(
+    data_loader: DataLoader,
+    target_folder: Union[Path, str],
+    output_names: Sequence[Sequence[Path]],
+    parameters: dict,
+) -> Tuple[PredictionManifest, Optional[DataLoader]]:
+    """Open the manifest of the target folder and skip the images with valid predictions.
+
+    Returns the manifest and a DataLoader for the images that must be predicted (None if
+    all predictions are valid).
+    """
+    manifest = PredictionManifest(target_folder, parameters=parameters)
+    input_file_names = data_loader.dataset.dataset.data
+    pending = manifest.pending(input_file_names, output_names)
+    if len(pending) == 0:
+        return manifest, None
+    if len(pending) < len(input_file_names):
+        data_loader = _subset_data_loader(data_loader, pending)
+    return manifest, data_loader
+
+
+def _post_process_and_save(
+    outputs: torch.Tensor,
+    post_full_inference_transforms: Optional[Transform],
+    output_names: list[Path],
+    transpose: bool,
+    output_dtype: Optional[Union[str, np.dtype]],
+    writer: PredictionWriter,
+) -> list[Path]:
+    """Apply the post-transforms to a batch of predictions and save them."""
+
+    # Apply post-transforms? (tensors created in inference mode can only be modified in
+    # place in inference mode, and grad mode is not inherited by the writer threads)
+    if post_full_inference_transforms is not None:
+        with torch.inference_mode(outputs.is_inference()):
+            outputs = post_full_inference_transforms(outputs)
+
+    # Retrieve the image from the GPU (if needed)
+    preds = outputs.cpu().numpy()
+
+    # Process one image at a time
+    for pred, output_name in zip(preds, output_names):
+        # Drop the channel singleton dimension
+        if pred.shape[0] == 1:
+            pred = pred.squeeze(0)
+
+        if transpose:
+            # Transpose to undo the effect of monai.transform.LoadImage(d)
+            pred = pred.T
+
+        # Type-cast if needed and save
+        writer.write(_cast(pred, output_dtype), output_name)
+
+    return output_names
+
+
+class _OrderedWriterPool:
+    """Pool of writers that process the predictions in the background, in submission order.
+
+    At most `max_pending` tasks are queued or running: `submit()` blocks until the oldest
+    one is done when the queue is full. The results are returned in submission order, and
+    exceptions raised by the writers are re-raised in the calling thread.
+    """
+
+    def __init__(self, num_writers: int = 2, max_pending: int = 2, use_processes=False):
+        if num_writers < 1 or max_pending < 1:
+            raise ValueError("`num_writers` and `max_pending` must be at least 1.")
+        self.use_processes = use_processes
+        if use_processes:
+            self._executor = ProcessPoolExecutor(
+                max_workers=num_writers, mp_context=get_context("spawn")
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=num_writers, thread_name_prefix="qute_writer"
+            )
+        self.max_pending = max_pending
+        self._pending = deque()
+
+    def submit(self, fn, *args) -> list:
+        """Submit a task; return the results of the tasks that had to be waited for."""
+        done = []
+        while len(self._pending) >= self.max_pending:
+            done.append(self._pending.popleft().result())
+        self._pending.append(self._executor.submit(fn, *args))
+        return done
+
+    def drain(self):
+        """Yield the results of all pending tasks, in submission order."""
+        while len(self._pending) > 0:
+            yield self._pending.popleft().result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # Do not start the tasks that are still queued
+            for future in self._pending:
+                future.cancel()
+        self._executor.shutdown(wait=True)
+        return False
+
+
+def _get_probe_modules(models: Sequence) -> list[torch.nn.Module]:
+    """Return the (eager) modules of models and backends, to measure their activations."""
+    modules = []
+    for model in models:
+        module = getattr(model, "module", model)
+        if isinstance(module, torch.nn.Module) and not isinstance(
+            module, torch.jit.ScriptModule
+        ):
+            modules.append(module)
+    return modules
+
+
+class _SlidingWindowPlanner:
+    """Chooses the sliding-window batch size and the stitching device for each image.
+
+    The memory needed per window is measured once with a probe forward pass: the peak of
+    allocated memory on CUDA devices, or the size of the activations of the modules
+    elsewhere. For each batch of images, the output buffers of the stitching stay on the
+    device if they fit in a fraction of the available memory, and are moved to the host
+    otherwise. The windows are then predicted in the largest batches that fit in the
+    remaining memory.
+    """
+
+    def __init__(
+        self,
+        network: Callable,
+        modules: Sequence[torch.nn.Module],
+        roi_size: Tuple[int, ...],
+        overlap: float,
+        device: torch.device,
+        max_batch_size: int = 256,
+        memory_fraction: float = 0.7,
+    ):
+        self.network = network
+        self.modules = list(modules)
+        self.roi_size = tuple(roi_size)
+        self.overlap = overlap
+        self.device = torch.device(device)
+        self.max_batch_size = max_batch_size
+        self.memory_fraction = memory_fraction
+        self.window_bytes = None
+        self.out_channels = None
+        self._inferers = {}
+        self._last_plan = None
+
+    def _activation_bytes(self, window: torch.Tensor) -> int:
+        """Return the size of the outputs of all (leaf) modules for one window."""
+        total = 0
+
+        def hook(module, inputs, output):
+            nonlocal total
+            if isinstance(output, torch.Tensor):
+                total += output.numel() * output.element_size()
+
+        handles = [
+            m.register_forward_hook(hook)
+            for module in self.modules
+            for m in module.modules()
+            if next(m.children(), None) is None
+        ]
+        try:
+            for module in self.modules:
+                module(window)
+        finally:
+            for handle in handles:
+                handle.remove()
+        return total
+
+    def _probe(self, in_channels: int):
+        """Measure the memory needed per window and the number of output channels."""
+        windows = torch.zeros((2, in_channels) + self.roi_size, device=self.device)
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+            base = torch.cuda.memory_allocated(self.device)
+            output = self.network(windows)
+            torch.cuda.synchronize(self.device)
+            peak = torch.cuda.max_memory_allocated(self.device) - base
+            self.window_bytes = max(peak // 2, 1)
+        else:
+            output = self.network(windows[:1])
+            window_bytes = self._activation_bytes(windows[:1])
+            if window_bytes == 0:
+                # No modules to measure (e.g., exported models): rough estimate
+                window_bytes = 32 * (
+                    windows[:1].numel() * windows.element_size()
+                    + output.numel() * output.element_size()
+                )
+            if isinstance(self.network, TTANetwork):
+                window_bytes *= len(self.network.variants)
+            self.window_bytes = window_bytes
+        self.out_channels = output.shape[1]
+
+    def _num_windows(self, image_size: Tuple[int, ...]) -> int:
+        padded_size = tuple(max(i, r) for i, r in zip(image_size, self.roi_size))
+        scan_interval = _get_scan_interval(padded_size, self.roi_size, self.overlap)
+        return len(dense_patch_slices(padded_size, self.roi_size, scan_interval))
+
+    def plan(self, images: torch.Tensor) -> Tuple[int, torch.device]:
+        """Return the sliding-window batch size and the stitching device for a batch."""
+        if self.window_bytes is None:
+            self._probe(images.shape[1])
+
+        # Windows of the batch, and size of the output and count buffers of the stitching
+        spatial_size = tuple(images.shape[2:])
+        num_windows = images.shape[0] * self._num_windows(spatial_size)
+        num_voxels = images.shape[0] * int(
+            np.prod([max(i, r) for i, r in zip(spatial_size, self.roi_size)])
+        )
+        stitch_bytes = (self.out_channels + 1) * num_voxels * 4
+        input_bytes = images.numel() * 4
+
+        available_memory = get_available_memory(self.device)
+        if available_memory is None:
+            return 1, self.device
+        budget = available_memory * self.memory_fraction
+
+        # Stitch on the host if the buffers would take more than half of the budget
+        stitch_device = self.device
+        if self.device.type != "cpu" and stitch_bytes + input_bytes > budget / 2:
+            stitch_device = torch.device("cpu")
+        else:
+            budget -= stitch_bytes + input_bytes
+
+        sw_batch_size = int(
+            np.clip(
+                budget // self.window_bytes,
+                1,
+                max(min(self.max_batch_size, num_windows), 1),
+            )
+        )
+        return sw_batch_size, stitch_device
+
+    def get_inferer(self, images: torch.Tensor) -> SlidingWindowInferer:
+        """Return the inferer planned for a batch of images."""
+        plan = self.plan(images)
+        if plan != self._last_plan:
+            print(
+                f"Sliding window: {plan[0]} window(s) per batch, stitching on {plan[1]}."
+            )
+            self._last_plan = plan
+        if plan not in self._inferers:
+            self._inferers[plan] = SlidingWindowInferer(
+                roi_size=self.roi_size,
+                sw_batch_size=plan[0],
+                overlap=self.overlap,
+                mode=BlendMode.GAUSSIAN,
+                sigma_scale=0.125,
+                sw_device=self.device,
+                device=plan[1],
+            )
+        return self._inferers[plan]
 
 
 def full_inference(
-    model: BaseModel,
+    model: Union["BaseModel", InferenceBackend],
     campaign_transforms: CampaignTransforms,
     data_loader: DataLoader,
     target_folder: Union[Path, str],
     roi_size: Tuple[int, ...],
-    batch_size: int,
+    batch_size: Union[int, str],
     overlap: float = 0.25,
     transpose: bool = True,
     output_dtype: Optional[Union[str, np.dtype]] = None,
     prefix: str = "pred_",
+    num_writers: int = 2,
+    max_pending: int = 2,
+    writer_type: str = "thread",
+    writer: Optional[PredictionWriter] = None,
+    tta_variants: Optional[Union[str, Sequence[str]]] = None,
+    tta_adaptive: bool = False,
+    precision: Optional[InferencePrecision] = None,
+    resume: bool = False,
+    model_hash: Optional[str] = None,
 ):
     """Run inference on full images using given model.
 
+    The inference is pipelined: the post-processing (post full-inference transforms, type
+    casting) and the saving of each batch of predictions run in a pool of writers, while
+    the next batch is inferred.
+
     Parameters
     ----------
 
-    model: BaselModel
-        MoOdel to be used for prediction.
+    model: Union[BaseModel, InferenceBackend]
+        Model to be used for prediction, or a backend that runs an exported model (see
+        `qute.export.load_backend()`). The sliding windows, blending and post-processing are
+        the same for all backends.
+        Quantized models (see `qute.models.quantization.quantize_model()`) always run on
+        the CPU.
 
     campaign_transforms: CampaignTransforms
         Campaign transforms to be applied (specifically, get_post_full_inference_transforms())
@@ -57,8 +406,11 @@ def full_inference(
     roi_size: Tuple[int, int]
         Size of the patch for the sliding window prediction. It must match the patch size during training.
 
-    batch_size: int
-        Number of parallel batches to run.
+    batch_size: Union[int, str]
+        Number of windows predicted in parallel by the sliding window. Set to "auto" to
+        choose, for each batch of images, the largest number of windows that fits in the
+        memory of the device (measured with a probe forward pass), and to stitch the
+        windows in host memory if the output of the image would not fit on the device.
 
     overlap: float
         Fraction of overlap between rois.
@@ -72,6 +424,48 @@ def full_inference(
     prefix: str = "pred_"
         Prefix to append to the file name. Set to "" to keep the original file name.
 
+    num_writers: int = 2
+        Number of writers that post-process and save the predictions in the background.
+
+    max_pending: int = 2
+        Maximum number of batches waiting to be post-processed and saved. Inference pauses
+        when the queue is full. Since the pending batches are kept on the device, this also
+        bounds the extra memory used by the pipeline.
+
+    writer_type: str = "thread"
+        One of "thread" or "process". With "process", the predictions are moved to the
+        CPU before being handed over to the writers, and the post full-inference transforms
+        must be picklable.
+
+    writer: Optional[PredictionWriter] = None
+        Writer used to save the predictions (codec, compression level, tiling, ...). Omit
+        to save zlib-compressed (level 9) TIFF files.
+
+    tta_variants: Optional[Union[str, Sequence[str]]] = None
+        Test-time augmentation: flip and rotation variants of each window to predict in the
+        same forward pass and average before the post full-inference transforms (e.g.,
+        "flips", "all", or "flip_x, rot90"; see `qute.data.tta.parse_tta_variants()`).
+        Omit to disable test-time augmentation.
+
+    tta_adaptive: bool = False
+        Set to True to stop adding test-time augmentation variants once the averaged
+        prediction of a window stops changing (see `qute.data.tta.TTANetwork`).
+
+    precision: Optional[InferencePrecision] = None
+        Precision policy (autocast type, memory format, inference mode; see
+        `qute.data.precision.InferencePrecision`). Policies that the device does not
+        support fall back to float32. Omit to run in float32 with `torch.no_grad()`.
+
+    resume: bool = False
+        Set to True to keep a manifest of the predictions in the target folder (see
+        `qute.data.manifest.PredictionManifest`) and skip the images whose predictions are
+        still valid for the same model, input and parameters. Predictions that are missing,
+        outdated or were only partially written (e.g., by an interrupted run) are redone.
+
+    model_hash: Optional[str] = None
+        Hash that identifies the model in the manifest (e.g., the hash of its checkpoint
+        file). Omit to hash the weights of the model. Only used if `resume` is True.
+
     Returns
     -------
 
@@ -79,6 +473,16 @@ def full_inference(
         True if the inference was successful, False otherwise.
     """
 
+    if writer_type not in ["thread", "process"]:
+        raise ValueError("`writer_type` must be one of 'thread' or 'process'.")
+
+    if isinstance(batch_size, str) and batch_size != "auto":
+        raise ValueError("`batch_size` must be a number or 'auto'.")
+
+    # Default writer
+    if writer is None:
+        writer = TIFFPredictionWriter()
+
     # Make sure the target folder exists
     Path(target_folder).mkdir(parents=True, exist_ok=True)
 
@@ -92,8 +496,37 @@ def full_inference(
         print("No input files provided to process. Quitting.")
         return
 
-    # Device
-    device = get_device()
+    # Skip the images whose predictions are still valid
+    manifest = None
+    if resume:
+        manifest, data_loader = _resume_from_manifest(
+            data_loader,
+            target_folder,
+            output_names=[
+                [Path(target_folder) / f"{prefix}{f.stem}{writer.extension}"]
+                for f in input_file_names
+            ],
+            parameters={
+                "model": model_hash if model_hash is not None else hash_model(model),
+                "inference_transforms": data_loader.dataset.dataset.transform,
+                "post_full_inference_transforms": campaign_transforms.get_post_full_inference_transforms(),
+                "roi_size": roi_size,
+                "overlap": overlap,
+                "transpose": transpose,
+                "output_dtype": output_dtype,
+                "writer": writer,
+                "tta_variants": tta_variants,
+                "tta_adaptive": tta_adaptive,
+                "precision": precision,
+            },
+        )
+        if data_loader is None:
+            print("All predictions are up to date.")
+            return True
+        input_file_names = data_loader.dataset.dataset.data
+
+    # Device and precision policy
+    device, precision = _get_device_and_precision([model], precision)
 
     # Make sure the model is on the device
     model.to(device)
@@ -101,61 +534,104 @@ def full_inference(
     # Switch to evaluation mode
     model.eval()
 
-    # Instantiate the inferer
-    sliding_window_inferer = SlidingWindowInferer(
-        roi_size=roi_size,
-        sw_batch_size=batch_size,
-        overlap=overlap,
-        mode=BlendMode.GAUSSIAN,
-        sigma_scale=0.125,
-        device=device,
+    # Use the memory format of the precision policy
+    precision.prepare(model, len(roi_size))
+
+    # Optional test-time augmentation
+    network = precision.wrap(model, len(roi_size))
+    if tta_variants is not None:
+        network = TTANetwork(
+            network,
+            variants=tta_variants,
+            spatial_dims=len(roi_size),
+            adaptive=tta_adaptive,
+        )
+
+    # Instantiate the inferer (or plan it for each batch of images)
+    planner = None
+    if batch_size == "auto":
+        planner = _SlidingWindowPlanner(
+            network, _get_probe_modules([model]), roi_size, overlap, device
+        )
+    else:
+        sliding_window_inferer = SlidingWindowInferer(
+            roi_size=roi_size,
+            sw_batch_size=batch_size,
+            overlap=overlap,
+            mode=BlendMode.GAUSSIAN,
+            sigma_scale=0.125,
+            device=device,
+        )
+
+    # Post-transforms are retrieved once and shared by all writers
+    post_full_inference_transforms = (
+        campaign_transforms.get_post_full_inference_transforms()
     )
 
+    # Record the predictions in the manifest as soon as they are saved
+    input_file_by_output_name = {}
+
+    def on_saved(saved_names):
+        for output_name in saved_names:
+            print(f"Saved {output_name}.")
+            if manifest is not None:
+                manifest.record(
+                    input_file_by_output_name.pop(output_name), [output_name]
+                )
+
     # Process all images
     c = 0
-    with torch.no_grad():
-        for images in data_loader:
-            # Apply sliding inference over ROI size
-            outputs = sliding_window_inferer(
-                inputs=images.to(device),
-                network=model,
-            )
-
-            # Apply post-transforms?
-            outputs = campaign_transforms.get_post_full_inference_transforms()(outputs)
-
-            # Retrieve the image from the GPU (if needed)
-            preds = outputs.cpu().numpy()
-
-            # Process one batch at a time
-            for pred in preds:
-                # Drop the channel singleton dimension
-                if pred.shape[0] == 1:
-                    pred = pred.squeeze(0)
-
-                if transpose:
-                    # Transpose to undo the effect of monai.transform.LoadImage(d)
-                    pred = pred.T
-
-                # Type-cast if needed
-                if output_dtype is not None:
-                    # Make sure not to wrap around
-                    if np.issubdtype(output_dtype, np.integer):
-                        info = np.iinfo(output_dtype)
-                        pred[pred < info.min] = info.min
-                        pred[pred > info.max] = info.max
-                    pred = pred.astype(output_dtype)
-
-                # Save prediction image as tiff file
-                output_name = (
-                    Path(target_folder) / f"{prefix}{input_file_names[c].stem}.tif"
+    with _OrderedWriterPool(
+        num_writers=num_writers,
+        max_pending=max_pending,
+        use_processes=writer_type == "process",
+    ) as writers:
+        with precision.grad_context():
+            for images in data_loader:
+                # Apply sliding inference over ROI size
+                if planner is not None:
+                    sliding_window_inferer = planner.get_inferer(images)
+                outputs = sliding_window_inferer(
+                    inputs=images.to(sliding_window_inferer.device),
+                    network=network,
                 )
-                c += 1
-                with TiffWriter(output_name) as tif:
-                    tif.write(pred, compression="zlib", compressionargs={"level": 9})
+                if writers.use_processes:
+                    outputs = outputs.cpu()
 
-                # Inform
-                print(f"Saved {output_name}.")
+                # Map the predictions to the input file names
+                output_names = [
+                    Path(target_folder)
+                    / f"{prefix}{input_file_names[c + i].stem}{writer.extension}"
+                    for i in range(outputs.shape[0])
+                ]
+                for i, output_name in enumerate(output_names):
+                    input_file_by_output_name[output_name] = input_file_names[c + i]
+                c += len(output_names)
+
+                # Post-process and save in the background (and inform about the
+                # predictions that were saved in the meanwhile)
+                for saved_names in writers.submit(
+                    _post_process_and_save,
+                    outputs,
+                    post_full_inference_transforms,
+                    output_names,
+                    transpose,
+                    output_dtype,
+                    writer,
+                ):
+                    on_saved(saved_names)
+
+        # Wait for the last predictions to be saved
+        for saved_names in writers.drain():
+            on_saved(saved_names)
+
+    # Restore the memory format of the model
+    precision.restore(model)
+
+    if isinstance(network, TTANetwork):
+        print(
+            f"Test-time augmentation: {network.mean_variants:.2f} variants per window on average."
+        )
 
     print("Prediction completed.")
 
@@ -168,9 +644,9 @@ def full_inference_ensemble(
     models: list,
     data_loader: DataLoader,
     target_folder: Union[Path, str],
-    post_full_inference_transforms: Transform,
+    post_full_inference_transforms: Optional[Transform],
     roi_size: Tuple[int, ...],
-    batch_size: int,
+    batch_size: Union[int, str],
     voting_mechanism: str = "mode",
     weights: Optional[list] = None,
     overlap: float = 0.25,
@@ -179,14 +655,30 @@ def full_inference_ensemble(
     output_dtype: Optional[Union[str, np.dtype]] = None,
     prefix: str = "pred_",
     ensemble_prefix: str = "ensemble_",
+    writer: Optional[PredictionWriter] = None,
+    stack_models: bool = True,
+    soft_activation: Optional[str] = "softmax",
+    vote_chunk_size: Optional[int] = None,
+    tta_variants: Optional[Union[str, Sequence[str]]] = None,
+    tta_adaptive: bool = False,
+    precision: Optional[InferencePrecision] = None,
+    resume: bool = False,
+    model_hash: Optional[str] = None,
 ):
     """Run inference on full images using an ensemble of models.
 
+    All models are moved to the device once and evaluated together on each sliding window
+    (as a single vectorized forward pass if they share the same architecture, see
+    `qute.data.ensemble.EnsembleNetwork`). The voting also happens on the device: only the
+    final (and, optionally, the individual) predictions are copied to the CPU.
+
     Parameters
     ----------
 
     models: list
         List of trained models inheriting from BaseModel to use for ensemble prediction.
+        Quantized models (see `qute.models.quantization.quantize_model()`) always run on
+        the CPU.
 
     data_loader: DataLoader
         DataLoader for the image files names to be predicted on.
@@ -194,24 +686,28 @@ def full_inference_ensemble(
     target_folder: Union[Path|str]
         Path to the folder where to store the predicted images.
 
-    post_full_inference_transforms: Transform
+    post_full_inference_transforms: Optional[Transform]
         Composition of transforms to be applied to the result of the sliding window inference (whole image).
 
     roi_size: Tuple[int, int]
         Size of the patch for the sliding window prediction. It must match the patch size during training.
 
-    batch_size: int
-        Number of parallel batches to run.
+    batch_size: Union[int, str]
+        Number of windows predicted in parallel by the sliding window, or "auto" (see
+        `full_inference()`).
 
     voting_mechanism: str = "mode"
         Voting mechanism to assign the final class among the predictions from the ensemble of models.
-        One of "mode" (default) and "mean".
-        "mode": pick the most common class among the predictions for each pixel.
+        One of "mode" (default), "mean" and "soft".
+        "mode": pick the most common class among the predictions for each pixel (the smallest class in
+        case of a tie). If `weights` are given, each model votes with its weight.
         "mean": (rounded) weighted mean of the predicted classes per pixel. The `weights` argument defines
         the relative contribution of the models.
+        "soft": weighted mean of the (activated, see `soft_activation`) outputs of the models; the
+        post full-inference transforms are applied to the mean.
 
     weights: Optional[list]
-        List of weights for each of the contributions. Only used if `voting_mechanism` is "mean".
+        List of weights for each of the contributions. Omit to weigh all models equally.
 
     overlap: float
         Fraction of overlap between rois.
@@ -224,7 +720,8 @@ def full_inference_ensemble(
         Whether to save the individual predictions of each model.
 
     output_dtype: Optional[np.dtype]
-        Optional NumPy dtype for the output image. Omit to save the output of inference without casting.
+        Optional NumPy dtype for the output image. Omit to save the output of inference without casting
+        (the integer ensemble predictions are saved as int32).
 
     prefix: str = "pred_"
         Prefix to append to the file name. Set to "" to keep the original file name.
@@ -232,6 +729,46 @@ def full_inference_ensemble(
     ensemble_prefix: str = "ensemble_pred_"
         Prefix to append to the ensemble prediction file name. Set to "" to keep the original file name.
 
+    writer: Optional[PredictionWriter] = None
+        Writer used to save the predictions (codec, compression level, tiling, ...). Omit
+        to save zlib-compressed (level 9) TIFF files.
+
+    stack_models: bool = True
+        Set to True to evaluate models with the same architecture as one vectorized forward
+        pass; set to False to evaluate them one after the other.
+
+    soft_activation: Optional[str] = "softmax"
+        Activation applied to the outputs before averaging them with the "soft" voting
+        mechanism. One of "softmax", "sigmoid" or None.
+
+    vote_chunk_size: Optional[int] = None
+        Number of pixels to vote on at once (see `qute.data.ensemble.vote()`). Set it to
+        bound the temporary memory for large 3D volumes.
+
+    tta_variants: Optional[Union[str, Sequence[str]]] = None
+        Test-time augmentation: flip and rotation variants of each window to predict in the
+        same forward pass and average before the post full-inference transforms (e.g.,
+        "flips", "all", or "flip_x, rot90"; see `qute.data.tta.parse_tta_variants()`).
+        Omit to disable test-time augmentation.
+
+    tta_adaptive: bool = False
+        Set to True to stop adding test-time augmentation variants once the averaged
+        prediction of a window stops changing (see `qute.data.tta.TTANetwork`).
+
+    precision: Optional[InferencePrecision] = None
+        Precision policy (autocast type, memory format, inference mode; see
+        `qute.data.precision.InferencePrecision`). Policies that the device does not
+        support fall back to float32. Omit to run in float32 with `torch.no_grad()`.
+
+    resume: bool = False
+        Set to True to keep a manifest of the predictions in the target folder and skip
+        the images whose (ensemble and individual) predictions are still valid (see
+        `full_inference()`).
+
+    model_hash: Optional[str] = None
+        Hash that identifies the models in the manifest (e.g., a hash of their checkpoint
+        files). Omit to hash the weights of the models. Only used if `resume` is True.
+
     Returns
     -------
 
@@ -239,18 +776,22 @@ def full_inference_ensemble(
         True if the inference was successful, False otherwise.
     """
 
-    if voting_mechanism not in ["mode", "mean"]:
-        raise ValueError("`voting mechanism` must be one of 'mode' or 'mean'.")
+    if voting_mechanism not in ["mode", "mean", "soft"]:
+        raise ValueError("`voting mechanism` must be one of 'mode', 'mean' or 'soft'.")
+
+    if weights is not None and len(models) != len(weights):
+        raise ValueError("The number of weights must match the number of models.")
 
-    if voting_mechanism == "mean":
-        if len(models) != len(weights):
-            raise ValueError("The number of weights must match the number of models.")
+    if isinstance(batch_size, str) and batch_size != "auto":
+        raise ValueError("`batch_size` must be a number or 'auto'.")
 
-        # Turn the weights into a NumPy array of float 32 bit
-        weights = np.array(weights, dtype=np.float32)
-        weights = weights / weights.sum()
+    # Default writer
+    if writer is None:
+        writer = TIFFPredictionWriter()
 
     # Check if models are instances of BaseModel
+    from qute.models.base_model import BaseModel
+
     if not isinstance(models[0], BaseModel) or not hasattr(models[0], "net"):
         raise ValueError(
             "The models must inherit from `BaseModel` and have a `net` attribute."
@@ -269,163 +810,507 @@ def full_inference_ensemble(
         print("No input files provided to process. Quitting.")
         return False
 
+    def get_output_names(input_file_name):
+        output_names = [
+            Path(target_folder)
+            / f"{ensemble_prefix}{input_file_name.stem}{writer.extension}"
+        ]
+        if save_individual_preds:
+            output_names += [
+                Path(target_folder)
+                / f"fold_{p}"
+                / f"{prefix}{input_file_name.stem}{writer.extension}"
+                for p in range(len(models))
+            ]
+        return output_names
+
+    # Skip the images whose predictions are still valid
+    manifest = None
+    if resume:
+        manifest, data_loader = _resume_from_manifest(
+            data_loader,
+            target_folder,
+            output_names=[get_output_names(f) for f in input_file_names],
+            parameters={
+                "models": (
+                    model_hash
+                    if model_hash is not None
+                    else [hash_model(model) for model in models]
+                ),
+                "inference_transforms": data_loader.dataset.dataset.transform,
+                "post_full_inference_transforms": post_full_inference_transforms,
+                "roi_size": roi_size,
+                "voting_mechanism": voting_mechanism,
+                "weights": weights,
+                "overlap": overlap,
+                "transpose": transpose,
+                "output_dtype": output_dtype,
+                "writer": writer,
+                "soft_activation": soft_activation,
+                "tta_variants": tta_variants,
+                "tta_adaptive": tta_adaptive,
+                "precision": precision,
+            },
+        )
+        if data_loader is None:
+            print("All predictions are up to date.")
+            return True
+        input_file_names = data_loader.dataset.dataset.data
+
     # If needed, create the sub-folders for the individual predictions
     if save_individual_preds:
         for f in range(len(models)):
             fold_subfolder = Path(target_folder) / f"fold_{f}"
             Path(fold_subfolder).mkdir(parents=True, exist_ok=True)
 
-    # Device
-    device = get_device()
-
-    # Switch to evaluation mode on all models
+    # Device and precision policy
+    device, precision = _get_device_and_precision(
+        [model.net for model in models], precision
+    )
     for model in models:
-        model.net.eval()
-
-    # Instantiate the inferer
-    sliding_window_inferer = SlidingWindowInferer(
-        roi_size=roi_size,
-        sw_batch_size=batch_size,
-        overlap=overlap,
-        mode=BlendMode.GAUSSIAN,
-        sigma_scale=0.125,
+        precision.prepare(model.net, len(roi_size))
+
+    # Move all models to the device (once) and switch them to evaluation mode
+    # (quantized networks cannot be vectorized)
+    ensemble = EnsembleNetwork(
+        [model.net for model in models],
         device=device,
+        stack=stack_models and not any(is_quantized(model.net) for model in models),
     )
 
-    c = 0
-    with torch.no_grad():
-        for images in data_loader:
-            predictions = [[] for _ in range(len(models))]
-
-            # Not process all models
-            for n, model in enumerate(models):
-                # Make sure the model is on the device
-                model.to(device)
+    # Optional test-time augmentation (the classes are compared per model)
+    network = precision.wrap(ensemble, len(roi_size))
+    if tta_variants is not None:
+        network = TTANetwork(
+            network,
+            variants=tta_variants,
+            spatial_dims=len(roi_size),
+            adaptive=tta_adaptive,
+            channel_groups=len(models),
+        )
 
-                # Apply sliding inference over ROI size
-                outputs = sliding_window_inferer(
-                    inputs=images.to(device),
-                    network=model.net,
-                )
+    # Instantiate the inferer (or plan it for each batch of images)
+    planner = None
+    if batch_size == "auto":
+        planner = _SlidingWindowPlanner(
+            network,
+            _get_probe_modules([model.net for model in models]),
+            roi_size,
+            overlap,
+            device,
+        )
+    else:
+        sliding_window_inferer = SlidingWindowInferer(
+            roi_size=roi_size,
+            sw_batch_size=batch_size,
+            overlap=overlap,
+            mode=BlendMode.GAUSSIAN,
+            sigma_scale=0.125,
+            device=device,
+        )
 
-                # Apply post-transforms?
-                outputs = post_full_inference_transforms(outputs)
+    def post_process(outputs):
+        if post_full_inference_transforms is None:
+            return outputs
+        return post_full_inference_transforms(outputs)
+
+    def to_numpy(pred):
+        pred = pred.cpu().numpy()
+        # Drop the channel singleton dimension
+        if pred.shape[0] == 1:
+            pred = pred.squeeze(0)
+        if transpose:
+            # Transpose to undo the effect of monai.transform.LoadImage(d)
+            pred = pred.T
+        return pred
 
-                # Retrieve the image from the GPU (if needed)
-                preds = outputs.cpu().numpy()
+    c = 0
+    with precision.grad_context():
+        for images in data_loader:
+            # Apply sliding inference over ROI size with all models at once: (B, M, C, ...)
+            if planner is not None:
+                sliding_window_inferer = planner.get_inferer(images)
+            outputs = ensemble.split(
+                sliding_window_inferer(
+                    inputs=images.to(sliding_window_inferer.device), network=network
+                )
+            )
 
-                stored_preds = []
-                for pred in preds:
-                    # Drop the channel singleton dimension
-                    if pred.shape[0] == 1:
-                        pred = pred.squeeze(0)
+            # Individual predictions (only needed for voting or saving)
+            individual_preds = None
+            if voting_mechanism != "soft" or save_individual_preds:
+                individual_preds = torch.stack(
+                    [post_process(outputs[:, m]) for m in range(len(models))]
+                )
 
-                    if transpose:
-                        # Transpose to undo the effect of monai.transform.LoadImage(d)
-                        pred = pred.T
-                    stored_preds.append(pred)
+            # Apply selected voting mechanism on the device
+            if voting_mechanism == "soft":
+                ensemble_preds = post_process(
+                    average_predictions(outputs, weights, activation=soft_activation)
+                )
+                if not torch.is_floating_point(ensemble_preds):
+                    ensemble_preds = to_compact_int(ensemble_preds)
+            else:
+                ensemble_preds = vote(
+                    individual_preds,
+                    mechanism=voting_mechanism,
+                    weights=weights,
+                    chunk_size=vote_chunk_size,
+                )
 
-                # Store predictions for each model
-                predictions[n] = stored_preds
+            # The labels are voted on in the most compact type for the batch, but are
+            # saved as int32 (unless requested otherwise) for all images
+            ensemble_dtype = output_dtype
+            if ensemble_dtype is None and not torch.is_floating_point(ensemble_preds):
+                ensemble_dtype = np.int32
 
             # Iterate over all images in the batch
-            pred_dim = len(models)
-            batch_dim = len(predictions[0])
-
-            for b in range(batch_dim):
-                # Apply selected voting mechanism
-                if voting_mechanism == "mean":
-                    # Apply weighted mean (and rounding) of the predictions per pixel
-
-                    # Iterate over all predictions from the models
-                    for p in range(pred_dim):
-                        if p == 0:
-                            ensemble_pred = weights[p] * predictions[p][b]
-                        else:
-                            ensemble_pred += weights[p] * predictions[p][b]
-                    ensemble_pred = np.round(ensemble_pred).astype(np.int32)
-
-                elif voting_mechanism == "mode":
-                    # Select the mode of the predictions per pixel
-
-                    # Store predictions in a stack
-                    target = np.zeros(
-                        (
-                            pred_dim,
-                            predictions[0][0].shape[0],
-                            predictions[0][0].shape[1],
-                        )
-                    )
-
-                    # Iterate over all predictions from the models
-                    for p in range(pred_dim):
-                        target[p, :, :] = predictions[p][b]
-                    values, _ = torch.mode(torch.tensor(target), dim=0)
-                    ensemble_pred = values.numpy().astype(np.int32)
-                else:
-                    raise ValueError(
-                        "`voting mechanism` must be one of 'mode' or 'mean'."
-                    )
-
-                # Type-cast if needed
-                if output_dtype is not None:
-                    # Make sure not to wrap around
-                    if np.issubdtype(output_dtype, np.integer):
-                        info = np.iinfo(output_dtype)
-                        ensemble_pred[ensemble_pred < info.min] = info.min
-                        ensemble_pred[ensemble_pred > info.max] = info.max
-                    ensemble_pred = ensemble_pred.astype(output_dtype)
-
-                # Save ensemble prediction image as tiff file
-                output_name = (
-                    Path(target_folder)
-                    / f"{ensemble_prefix}{input_file_names[c].stem}.tif"
+            for b in range(ensemble_preds.shape[0]):
+                # Type-cast if needed and save the ensemble prediction
+                output_names = get_output_names(input_file_names[c])
+                writer.write(
+                    _cast(to_numpy(ensemble_preds[b]), ensemble_dtype), output_names[0]
                 )
-                with TiffWriter(output_name) as tif:
-                    tif.write(
-                        ensemble_pred,
-                        compression="zlib",
-                        compressionargs={"level": 9},
-                    )
 
                 # Inform
-                print(f"Saved {output_name}.")
+                print(f"Saved {output_names[0]}.")
 
                 # Save individual predictions?
                 if save_individual_preds:
                     # Iterate over all predictions from the models
-                    for p in range(len(predictions)):
-                        # Save prediction image as tiff file
-                        output_name = (
-                            Path(target_folder)
-                            / f"fold_{p}"
-                            / f"{prefix}{input_file_names[c].stem}.tif"
+                    for p in range(len(models)):
+                        # Type-cast if needed and save
+                        writer.write(
+                            _cast(to_numpy(individual_preds[p, b]), output_dtype),
+                            output_names[p + 1],
                         )
 
-                        # Get current prediction
-                        current_pred = predictions[p][b]
-
-                        # Type-cast if needed
-                        if output_dtype is not None:
-                            # Make sure not to wrap around
-                            if np.issubdtype(output_dtype, np.integer):
-                                info = np.iinfo(output_dtype)
-                                current_pred[current_pred < info.min] = info.min
-                                current_pred[current_pred > info.max] = info.max
-                            current_pred = current_pred.astype(output_dtype)
-
-                        # Save
-                        with TiffWriter(output_name) as tif:
-                            tif.write(
-                                current_pred,
-                                compression="zlib",
-                                compressionargs={"level": 9},
-                            )
+                # Record the predictions of the image
+                if manifest is not None:
+                    manifest.record(input_file_names[c], output_names)
 
                 # Update global file counter c
                 c += 1
 
+    # Restore the memory format of the models
+    for model in models:
+        precision.restore(model.net)
+
+    if isinstance(network, TTANetwork):
+        print(
+            f"Test-time augmentation: {network.mean_variants:.2f} variants per window on average."
+        )
+
     print("Ensemble prediction completed.")
 
     # Return success
     return True
+
+
+def get_tiled_input_transforms(
+    campaign_transforms: CampaignTransforms,
+) -> Tuple[Optional[Callable], bool]:
+    """Map the inference transforms of a campaign to region-wise transforms.
+
+    The reader is replaced by the region reader, and the z-normalization by a normalization
+    with the statistics of the whole image. All remaining transforms are applied to each
+    region separately and must therefore act pixel-wise.
+
+    Returns
+    -------
+
+    input_transforms, z_normalize: Tuple[Optional[Callable], bool]
+        Transforms to apply to each region (or None), and whether the image must be
+        z-normalized after them.
+    """
+    inference_transforms = campaign_transforms.get_inference_transforms()
+    transforms = (
+        inference_transforms.transforms
+        if isinstance(inference_transforms, Compose)
+        else [inference_transforms]
+    )
+
+    region_transforms = []
+    z_normalize = False
+    for transform in transforms:
+        if isinstance(transform, CustomTIFFReader):
+            continue
+        if isinstance(transform, CustomResampler):
+            if transform.input_voxel_size is not None and np.allclose(
+                transform.input_voxel_size, transform.target_voxel_size
+            ):
+                continue
+            raise ValueError("Tiled inference does not support resampling.")
+        if z_normalize:
+            raise ValueError(
+                "Tiled inference only supports transforms before `ZNormalize`."
+            )
+        if isinstance(transform, ZNormalize):
+            z_normalize = True
+            continue
+        region_transforms.append(transform)
+    input_transforms = (
+        Compose(region_transforms) if len(region_transforms) > 0 else None
+    )
+    return input_transforms, z_normalize
+
+
+def _get_scan_interval(
+    image_size: Tuple[int, ...], roi_size: Tuple[int, ...], overlap: float
+) -> Tuple[int, ...]:
+    """Return the distance between the windows (as monai.inferers.sliding_window_inference)."""
+    scan_interval = []
+    for i, r in zip(image_size, roi_size):
+        if r == i:
+            scan_interval.append(r)
+        else:
+            scan_interval.append(max(int(r * (1 - overlap)), 1))
+    return tuple(scan_interval)
+
+
+def full_inference_tiled(
+    model: "BaseModel",
+    input_file: Union[Path, str],
+    output_file: Union[Path, str],
+    roi_size: Tuple[int, ...],
+    tile_size: Optional[Tuple[int, ...]] = None,
+    batch_size: int = 1,
+    overlap: float = 0.25,
+    input_transforms: Optional[Callable] = None,
+    z_normalize: bool = True,
+    post_full_inference_transforms: Optional[Transform] = None,
+    output_dtype: Optional[Union[str, np.dtype]] = None,
+    compression: str = "zlib",
+    level: Optional[int] = None,
+    precision: Optional[InferencePrecision] = None,
+):
+    """Run out-of-core inference on an image that may be larger than memory.
+
+    The input image is read region by region (memory-mapped, or decoded one TIFF tile or
+    strip at a time), and the output is computed and written one tile at a time. Each
+    output tile is the Gaussian-weighted blend of all sliding windows that overlap it, with
+    the same windows and weights as `SlidingWindowInferer` on the whole image: the result is
+    therefore the same as the one of `full_inference()`. Peak memory is bounded by the size
+    of the output tile plus a halo of one window on each side, independently of the size of
+    the image. Windows that overlap more than one tile are evaluated for each tile.
+
+    Parameters
+    ----------
+
+    model: BaseModel
+        Model to be used for prediction.
+
+    input_file: Union[Path, str]
+        Single-channel 2D or 3D image to predict on (see `qute.data.tiles.open_region_reader()`).
+
+    output_file: Union[Path, str]
+        Output image: a tiled TIFF (.tif), a memory-mapped NumPy (.npy) or a zarr (.zarr) file
+        (see `qute.data.tiles.open_tile_writer()`). TIFF files must be single-channel.
+
+    roi_size: Tuple[int, ...]
+        Size of the patch for the sliding window prediction. It must match the patch size during training.
+
+    tile_size: Optional[Tuple[int, ...]] = None
+        Size of the output tiles. Larger tiles evaluate fewer windows twice, but need more
+        memory. Omit to use (1024, 1024) for 2D and (64, 256, 256) for 3D images.
+
+    batch_size: int = 1
+        Number of windows to predict in parallel.
+
+    overlap: float = 0.25
+        Fraction of overlap between rois.
+
+    input_transforms: Optional[Callable] = None
+        Optional pixel-wise transforms to apply to each region of the input image (e.g., a
+        `MinMaxNormalize` with fixed intensities).
+
+    z_normalize: bool = True
+        Whether to z-normalize the input with the mean and standard deviation of the whole
+        image (computed block by block), as `ZNormalize` does in `full_inference()`.
+
+    post_full_inference_transforms: Optional[Transform] = None
+        Transforms to apply to each output tile (with batch dimension). They must act
+        pixel-wise (e.g., `OneHotToMaskBatch`): transforms that need the whole image, such as
+        a watershed, would give different results at the borders of the tiles.
+
+    output_dtype: Optional[Union[str, np.dtype]] = None
+        Optional NumPy dtype for the output image. Omit to save the output of inference without casting.
+
+    compression: str = "zlib"
+        Compression of the output TIFF file (see `TIFFPredictionWriter`).
+
+    level: Optional[int] = None
+        Compression level of the output TIFF file.
+
+    precision: Optional[InferencePrecision] = None
+        Precision policy (see `full_inference()`). Omit to run in float32 with
+        `torch.no_grad()`.
+
+    Returns
+    -------
+
+    result: bool
+        True if the inference was successful, False otherwise.
+    """
+    roi_size = tuple(int(r) for r in roi_size)
+    num_spatial_dims = len(roi_size)
+    if tile_size is None:
+        tile_size = (1024, 1024) if num_spatial_dims == 2 else (64, 256, 256)
+    tile_size = tuple(int(t) for t in tile_size)
+    if len(tile_size) != num_spatial_dims:
+        raise ValueError("`tile_size` must have as many dimensions as `roi_size`.")
+
+    # Device and precision policy
+    device, precision = _get_device_and_precision([model], precision)
+
+    # Make sure the model is on the device
+    model.to(device)
+
+    # Switch to evaluation mode
+    model.eval()
+
+    # Use the memory format of the precision policy
+    precision.prepare(model, num_spatial_dims)
+    network = precision.wrap(model, num_spatial_dims)
+
+    with open_region_reader(input_file) as reader:
+        if reader.ndim != num_spatial_dims:
+            raise ValueError(
+                f"The image has {reader.ndim} dimensions, but `roi_size` has {num_spatial_dims}."
+            )
+        shape = reader.shape
+
+        # Statistics for the z-normalization
+        if z_normalize:
+            mean, std = compute_image_statistics(reader, transform=input_transforms)
+            if std == 0.0:
+                std = 1.0
+
+        def read_region(start, stop):
+            """Read and normalize a region; pad outside the image (as SlidingWindowInferer)."""
+            region = np.zeros(
+                tuple(b - a for a, b in zip(start, stop)), dtype=np.float32
+            )
+            inner_start = tuple(max(a, 0) for a in start)
+            inner_stop = tuple(min(b, s) for b, s in zip(stop, shape))
+            data = reader.read(inner_start, inner_stop)
+            if input_transforms is not None:
+                data = input_transforms(data)
+            data = np.asarray(data, dtype=np.float32)
+            if z_normalize:
+                data = (data - mean) / std
+            region[
+                tuple(
+                    slice(a - s, b - s)
+                    for a, b, s in zip(inner_start, inner_stop, start)
+                )
+            ] = data
+            return region
+
+        # Windows (as SlidingWindowInferer on the whole image, which pads images smaller
+        # than the roi symmetrically)
+        image_size = tuple(max(s, r) for s, r in zip(shape, roi_size))
+        pad_before = np.array(
+            [(i - s) // 2 for i, s in zip(image_size, shape)], dtype=int
+        )
+        scan_interval = _get_scan_interval(image_size, roi_size, overlap)
+        window_starts = np.array(
+            [
+                [s.start for s in window]
+                for window in dense_patch_slices(image_size, roi_size, scan_interval)
+            ],
+            dtype=int,
+        )
+        roi = np.array(roi_size, dtype=int)
+        importance_map = compute_importance_map(
+            roi_size, mode=BlendMode.GAUSSIAN, sigma_scale=0.125, device=device
+        )
+
+        writer = None
+        # The output file is closed (and completed) when leaving the stack
+        with ExitStack() as stack, precision.grad_context():
+            for tile_start, tile_stop in iterate_tiles(shape, tile_size):
+                # Tile in the (padded) coordinates of the windows
+                t0 = np.array(tile_start) + pad_before
+                t1 = np.array(tile_stop) + pad_before
+
+                # Windows that overlap the tile, in scan order
+                selected = window_starts[
+                    np.all(window_starts < t1, axis=1)
+                    & np.all(window_starts + roi > t0, axis=1)
+                ]
+
+                # Read the input region under the windows (tile plus halo)
+                r0 = selected.min(axis=0)
+                r1 = selected.max(axis=0) + roi
+                region = torch.from_numpy(
+                    read_region(r0 - pad_before, r1 - pad_before)
+                ).to(device)
+
+                # Blend the predictions of the windows into the tile
+                output, count = None, None
+                for b in range(0, len(selected), batch_size):
+                    starts = selected[b : b + batch_size]
+                    windows = torch.stack(
+                        [
+                            region[
+                                tuple(slice(a, a + r) for a, r in zip(start - r0, roi))
+                            ]
+                            for start in starts
+                        ]
+                    ).unsqueeze(1)
+                    predictions = network(windows) * importance_map
+                    if output is None:
+                        output = torch.zeros(
+                            (predictions.shape[1],) + tuple(t1 - t0),
+                            dtype=predictions.dtype,
+                            device=device,
+                        )
+                        count = torch.zeros(
+                            (1,) + tuple(t1 - t0),
+                            dtype=predictions.dtype,
+                            device=device,
+                        )
+                    for start, prediction in zip(starts, predictions):
+                        a = np.maximum(start, t0)
+                        z = np.minimum(start + roi, t1)
+                        dst = tuple(slice(i, j) for i, j in zip(a - t0, z - t0))
+                        src = tuple(slice(i, j) for i, j in zip(a - start, z - start))
+                        output[(slice(None),) + dst] += prediction[(slice(None),) + src]
+                        count[(slice(None),) + dst] += importance_map[src]
+                output /= count
+
+                # Apply post-transforms?
+                output = output.unsqueeze(0)
+                if post_full_inference_transforms is not None:
+                    output = post_full_inference_transforms(output)
+
+                # Retrieve the tile from the GPU (if needed)
+                tile = output[0].cpu().numpy()
+
+                # Drop the channel singleton dimension and type-cast if needed
+                if tile.shape[0] == 1:
+                    tile = tile.squeeze(0)
+                tile = _cast(tile, output_dtype)
+
+                # Create the output file once the output channels and type are known
+                if writer is None:
+                    writer = stack.enter_context(
+                        open_tile_writer(
+                            output_file,
+                            shape=tile.shape[: tile.ndim - num_spatial_dims] + shape,
+                            dtype=tile.dtype,
+                            tile_size=tile_size,
+                            compression=compression,
+                            level=level,
+                        )
+                    )
+                writer.write(tile_start, tile)
+
+    # Restore the memory format of the model
+    precision.restore(model)
+
+    print(f"Saved {output_file}.")
+
+    # Return success
+    return True
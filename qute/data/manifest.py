@@ -0,0 +1,315 @@
+#  ********************************************************************************
+#  Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+#  All rights reserved. This program and the accompanying materials
+#  are made available under the terms of the Apache License Version 2.0
+#  which accompanies this distribution, and is available at
+#  https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Contributors:
+#    Aaron Ponti - initial API and implementation
+#  ******************************************************************************
+
+import hashlib
+import json
+import os
+from enum import Enum
+from pathlib import Path
+from typing import Any, Optional, Sequence, Union
+
+import numpy as np
+import torch
+
+from qute.hash import calculate_file_hash
+
+__doc__ = (
+    "Content-addressed manifest of predictions, to skip valid outputs and resume runs."
+)
+__all__ = [
+    "PredictionManifest",
+    "describe_parameters",
+    "hash_model",
+]
+
+# Maximum depth of the description of nested objects
+_MAX_DEPTH = 8
+
+
+def describe_parameters(obj: Any, _depth: int = 0, _seen: Optional[set] = None) -> Any:
+    """Return a JSON-serializable description of an object and of its parameters.
+
+    Transforms (and compositions of transforms), writers and other objects are described by
+    their class and (recursively) by their attributes, so that two objects with the same
+    class and parameters have the same description. Arrays and tensors are described by
+    their shape, type and a hash of their content.
+
+    Parameters
+    ----------
+
+    obj: Any
+        Object to describe (e.g., the result of `get_inference_transforms()`).
+
+    Returns
+    -------
+
+    description: Any
+        Description made of dictionaries, lists, strings and numbers.
+    """
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, Enum):
+        return describe_parameters(obj.value, _depth + 1, _seen)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (Path, np.dtype, torch.dtype, torch.device)):
+        return str(obj)
+    if isinstance(obj, (np.ndarray, torch.Tensor)):
+        array = (
+            obj.detach().cpu().contiguous().numpy()
+            if isinstance(obj, torch.Tensor)
+            else np.ascontiguousarray(obj)
+        )
+        return {
+            "shape": list(array.shape),
+            "dtype": str(array.dtype),
+            "sha256": hashlib.sha256(array.tobytes()).hexdigest(),
+        }
+    if isinstance(obj, type) or callable(obj) and not hasattr(obj, "__dict__"):
+        return f"{getattr(obj, '__module__', '')}.{getattr(obj, '__qualname__', type(obj).__qualname__)}"
+    if _depth >= _MAX_DEPTH:
+        return type(obj).__qualname__
+
+    # Containers and objects (avoiding cycles)
+    _seen = set() if _seen is None else _seen
+    if id(obj) in _seen:
+        return type(obj).__qualname__
+    _seen = _seen | {id(obj)}
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        items = sorted(obj, key=repr) if isinstance(obj, (set, frozenset)) else obj
+        return [describe_parameters(item, _depth + 1, _seen) for item in items]
+    if isinstance(obj, dict):
+        return {
+            str(k): describe_parameters(v, _depth + 1, _seen)
+            for k, v in sorted(obj.items(), key=lambda item: str(item[0]))
+        }
+    if hasattr(obj, "__dict__"):
+        return {
+            "class": f"{type(obj).__module__}.{type(obj).__qualname__}",
+            "parameters": {
+                k: describe_parameters(v, _depth + 1, _seen)
+                for k, v in sorted(vars(obj).items())
+                if not k.startswith("__")
+            },
+        }
+    return type(obj).__qualname__
+
+
+def hash_model(model) -> str:
+    """Return a hash of the weights of a model (or of the file of an exported model).
+
+    Parameters
+    ----------
+
+    model: Union[torch.nn.Module, qute.export.InferenceBackend]
+        Model, network or inference backend.
+
+    Returns
+    -------
+
+    hash: str
+        The hexadecimal hash (sha256) of the weights.
+    """
+    if hasattr(model, "file_name"):
+        return calculate_file_hash(model.file_name)
+    if hasattr(model, "module") and not isinstance(model, torch.nn.Module):
+        model = model.module
+    if not isinstance(model, torch.nn.Module):
+        raise ValueError("Cannot hash a model that is neither a module nor a file.")
+    hash_obj = hashlib.sha256()
+    for name, value in sorted(model.state_dict().items()):
+        hash_obj.update(name.encode())
+        if isinstance(value, torch.Tensor):
+            if value.is_quantized:
+                value = value.int_repr()
+            hash_obj.update(value.detach().cpu().contiguous().numpy().tobytes())
+        else:
+            hash_obj.update(repr(value).encode())
+    return hash_obj.hexdigest()
+
+
+class PredictionManifest:
+    """Content-addressed manifest of the predictions written to a folder.
+
+    For each input image, the manifest records the hash of the input, a key computed from
+    the parameters of the prediction (e.g., the hash of the model and the parameters of the
+    inference and post-processing transforms), and the size and hash of each output file.
+    The outputs of an input are valid if the input and the parameters did not change and
+    all outputs still exist with their recorded size and hash: they do not need to be
+    predicted again.
+
+    The manifest is a journal (one JSON record per line) that is appended to as soon as
+    the outputs of an image are written, so that an interrupted run can be resumed. A
+    record that was only partially written is ignored; outputs without a valid record (for
+    instance, files that were being written when the run was interrupted) are detected and
+    predicted again.
+    """
+
+    def __init__(
+        self,
+        target_folder: Union[Path, str],
+        parameters: dict,
+        verify_outputs: bool = True,
+        file_name: str = ".qute_manifest.jsonl",
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        target_folder: Union[Path, str]
+            Folder of the predictions (where the manifest is stored).
+
+        parameters: dict
+            All parameters that affect the predictions (see `describe_parameters()`).
+
+        verify_outputs: bool = True
+            Set to True to compare the hash of the existing outputs with the recorded one;
+            set to False to only compare their size.
+
+        file_name: str = ".qute_manifest.jsonl"
+            Name of the manifest file.
+        """
+        self.target_folder = Path(target_folder)
+        self.target_folder.mkdir(parents=True, exist_ok=True)
+        self.manifest_file = self.target_folder / file_name
+        self.verify_outputs = verify_outputs
+        self.key = hashlib.sha256(
+            json.dumps(describe_parameters(parameters), sort_keys=True).encode()
+        ).hexdigest()
+
+        # Latest record for each input
+        self._records = {}
+        if self.manifest_file.is_file():
+            with open(self.manifest_file, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Partially written record
+                        continue
+                    self._records[record["input"]] = record
+
+    @staticmethod
+    def _input_id(input_file: Union[Path, str]) -> str:
+        return str(Path(input_file).resolve())
+
+    def _output_id(self, output_file: Union[Path, str]) -> str:
+        output_file = Path(output_file).resolve()
+        if output_file.is_relative_to(self.target_folder.resolve()):
+            return output_file.relative_to(self.target_folder.resolve()).as_posix()
+        return str(output_file)
+
+    def _input_hash(self, input_file: Union[Path, str]) -> tuple[str, int, int]:
+        """Return the hash, size and modification time of an input file.
+
+        The hash is only calculated if the size or the modification time of the file
+        changed since it was recorded.
+        """
+        stat = os.stat(input_file)
+        record = self._records.get(self._input_id(input_file), None)
+        if (
+            record is not None
+            and record.get("input_size") == stat.st_size
+            and record.get("input_mtime_ns") == stat.st_mtime_ns
+        ):
+            return record["input_hash"], stat.st_size, stat.st_mtime_ns
+        return calculate_file_hash(input_file), stat.st_size, stat.st_mtime_ns
+
+    def _is_output_valid(self, output_file: Path, recorded: dict) -> bool:
+        if not output_file.is_file():
+            return False
+        if output_file.stat().st_size != recorded["size"]:
+            return False
+        if self.verify_outputs:
+            return calculate_file_hash(output_file) == recorded["hash"]
+        return True
+
+    def is_complete(
+        self, input_file: Union[Path, str], output_files: Sequence[Union[Path, str]]
+    ) -> bool:
+        """Return True if all outputs of the input are valid for the current parameters."""
+        record = self._records.get(self._input_id(input_file), None)
+        if record is None or record["key"] != self.key:
+            return False
+        if record["input_hash"] != self._input_hash(input_file)[0]:
+            return False
+        for output_file in output_files:
+            recorded = record["outputs"].get(self._output_id(output_file), None)
+            if recorded is None or not self._is_output_valid(
+                Path(output_file), recorded
+            ):
+                return False
+        return True
+
+    def pending(
+        self,
+        input_files: Sequence[Union[Path, str]],
+        output_files: Sequence[Sequence[Union[Path, str]]],
+    ) -> list[int]:
+        """Return the indices of the inputs that must be predicted.
+
+        Parameters
+        ----------
+
+        input_files: Sequence[Union[Path, str]]
+            Input images.
+
+        output_files: Sequence[Sequence[Union[Path, str]]]
+            For each input image, the output files that are written for it.
+
+        Returns
+        -------
+
+        indices: list[int]
+            Indices of the inputs whose outputs are missing, outdated or incomplete.
+        """
+        indices, num_partial = [], 0
+        for i, (input_file, outputs) in enumerate(zip(input_files, output_files)):
+            if self.is_complete(input_file, outputs):
+                continue
+            if any(Path(output).exists() for output in outputs):
+                # Outputs from an interrupted run, or from other parameters
+                num_partial += 1
+            indices.append(i)
+        num_valid = len(input_files) - len(indices)
+        if num_valid > 0 or num_partial > 0:
+            print(
+                f"Prediction manifest: {num_valid} valid prediction(s) skipped, "
+                f"{num_partial} outdated or partially written prediction(s) to redo, "
+                f"{len(indices) - num_partial} new prediction(s)."
+            )
+        return indices
+
+    def record(
+        self, input_file: Union[Path, str], output_files: Sequence[Union[Path, str]]
+    ):
+        """Record that all outputs of an input were written (and flush the manifest)."""
+        input_hash, input_size, input_mtime_ns = self._input_hash(input_file)
+        record = {
+            "input": self._input_id(input_file),
+            "input_hash": input_hash,
+            "input_size": input_size,
+            "input_mtime_ns": input_mtime_ns,
+            "key": self.key,
+            "outputs": {
+                self._output_id(output_file): {
+                    "size": Path(output_file).stat().st_size,
+                    "hash": calculate_file_hash(output_file),
+                }
+                for output_file in output_files
+            },
+        }
+        self._records[record["input"]] = record
+        with open(self.manifest_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
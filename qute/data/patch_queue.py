@@ -0,0 +1,222 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import math
+import queue
+import threading
+from copy import deepcopy
+
+import numpy as np
+import torch
+from monai.transforms import Compose
+from torch.utils.data import IterableDataset, get_worker_info
+
+from qute.data.cache import get_deterministic_prefix_length
+
+__doc__ = "Patch-queue training dataset."
+__all__ = [
+    "PatchQueueDataset",
+]
+
+
+class PatchQueueDataset(IterableDataset):
+    """Training dataset that amortizes the loading of the volumes over many patches.
+
+    The deterministic part of the transform pipeline (e.g., reading, resampling and
+    normalization) is run once per volume, and the preprocessed volume is kept in a pool
+    of `pool_size` volumes. Each sample is obtained by running the random tail of the
+    pipeline (e.g., cropping and augmentation) on a volume picked at random from the
+    pool: after `samples_per_volume` samples, a volume is replaced by the next one, that
+    is loaded in a background thread in the meanwhile. The samples are further mixed
+    in a shuffle buffer of `shuffle_buffer_size` samples.
+
+    Each DataLoader worker processes its own share of the volumes, and yields a whole
+    number of batches, so that the length of the DataLoader is exact.
+
+    Call `set_epoch()` at the start of every epoch to shuffle the order of the volumes
+    (e.g., with `qute.callbacks.DatasetEpochCallback`): the epoch is shared with the
+    (persistent or not) DataLoader workers. Set `batch_size` to the batch size of the
+    DataLoader before iterating over it.
+    """
+
+    def __init__(
+        self,
+        data: list,
+        transform: Compose,
+        samples_per_volume: int = 8,
+        pool_size: int = 4,
+        shuffle_buffer_size: int = 16,
+        batch_size: int = 1,
+        seed: int = 42,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        data: list
+            List of data dictionaries (e.g., {"image": path, "label": path}).
+
+        transform: Compose
+            Full transform pipeline.
+
+        samples_per_volume: int = 8
+            Number of samples to draw from each volume before it leaves the pool. Each
+            sample contains as many patches as the cropping transform extracts.
+
+        pool_size: int = 4
+            Number of preprocessed volumes kept in memory (per worker). One more volume is
+            prefetched in the background.
+
+        shuffle_buffer_size: int = 16
+            Number of samples that are mixed before being returned. Set to 1 to disable.
+
+        batch_size: int = 1
+            Size of the batches that will be built by the DataLoader: it is used to split
+            the samples among the workers. Update it if the batch size of the DataLoader
+            changes.
+
+        seed: int = 42
+            Seed for the order in which the volumes are loaded.
+        """
+        super().__init__()
+        if not isinstance(transform, Compose):
+            transform = Compose(transform)
+        if samples_per_volume < 1 or pool_size < 1 or shuffle_buffer_size < 1:
+            raise ValueError(
+                "`samples_per_volume`, `pool_size` and `shuffle_buffer_size` must be at least 1."
+            )
+        self.data = data
+        self.transform = transform
+        self.samples_per_volume = samples_per_volume
+        self.pool_size = pool_size
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.batch_size = batch_size
+        self.seed = seed
+        self.num_preprocessing_transforms = get_deterministic_prefix_length(transform)
+
+        # The epoch is kept in shared memory, to be seen by the DataLoader workers
+        self._epoch = torch.zeros((), dtype=torch.int64).share_memory_()
+
+    def __len__(self) -> int:
+        """Number of samples per epoch."""
+        return len(self.data) * self.samples_per_volume
+
+    def set_epoch(self, epoch: int):
+        """Set the epoch (used to shuffle the order of the volumes)."""
+        self._epoch.fill_(epoch)
+
+    def _get_share(self, worker_id: int, num_workers: int) -> tuple[list, int]:
+        """Return the volumes and the number of samples for the worker."""
+        # All workers use the same permutation for current epoch
+        rng = np.random.default_rng((self.seed, int(self._epoch)))
+        order = rng.permutation(len(self.data))
+
+        # Split the batches (not the samples) among the workers
+        num_samples = len(self)
+        num_batches = math.ceil(num_samples / self.batch_size)
+        first_batch = worker_id * (num_batches // num_workers) + min(
+            worker_id, num_batches % num_workers
+        )
+        worker_batches = num_batches // num_workers + (
+            1 if worker_id < num_batches % num_workers else 0
+        )
+        worker_samples = min(
+            worker_batches * self.batch_size,
+            num_samples - first_batch * self.batch_size,
+        )
+
+        # Split the volumes among the workers
+        volumes = order[worker_id::num_workers]
+        if len(volumes) == 0:
+            volumes = order[worker_id % len(order) :: len(order)]
+        return [self.data[i] for i in volumes], max(0, worker_samples)
+
+    def _load(self, items: list, buffer: queue.Queue, stop: threading.Event):
+        """Preprocess the volumes in a loop and push them to the buffer."""
+        i = 0
+        try:
+            while not stop.is_set():
+                volume = self.transform(
+                    deepcopy(items[i % len(items)]),
+                    end=self.num_preprocessing_transforms,
+                    threading=True,
+                )
+                while not stop.is_set():
+                    try:
+                        buffer.put(volume, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                i += 1
+        except Exception as e:
+            # Hand the exception over to the consumer
+            buffer.put(e)
+
+    def __iter__(self):
+        # Find the share of current worker
+        worker_info = get_worker_info()
+        if worker_info is None:
+            worker_id, num_workers = 0, 1
+        else:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+        items, num_samples = self._get_share(worker_id, num_workers)
+        rng = np.random.default_rng((torch.initial_seed(), int(self._epoch)))
+        if num_samples == 0 or len(items) == 0:
+            return
+
+        # Start loading the volumes in the background
+        buffer = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        loader = threading.Thread(
+            target=self._load, args=(items, buffer, stop), daemon=True
+        )
+        loader.start()
+
+        def next_volume():
+            volume = buffer.get()
+            if isinstance(volume, Exception):
+                raise volume
+            return [volume, self.samples_per_volume]
+
+        try:
+            pool = []
+            shuffle_buffer = []
+            num_loaded = 0
+            for _ in range(num_samples):
+                # Fill the pool (the next volume is prefetched in the background);
+                # do not start a new pass over the volumes before the current one
+                # is exhausted
+                while len(pool) < self.pool_size:
+                    if len(pool) > 0 and num_loaded % len(items) == 0:
+                        break
+                    pool.append(next_volume())
+                    num_loaded += 1
+
+                # Draw a sample from a random volume of the pool
+                index = rng.integers(len(pool))
+                sample = self.transform(
+                    dict(pool[index][0]), start=self.num_preprocessing_transforms
+                )
+                pool[index][1] -= 1
+                if pool[index][1] == 0:
+                    pool.pop(index)
+
+                # Shuffle
+                shuffle_buffer.append(sample)
+                if len(shuffle_buffer) >= self.shuffle_buffer_size:
+                    yield shuffle_buffer.pop(rng.integers(len(shuffle_buffer)))
+
+            # Flush the shuffle buffer
+            while len(shuffle_buffer) > 0:
+                yield shuffle_buffer.pop(rng.integers(len(shuffle_buffer)))
+        finally:
+            stop.set()
@@ -0,0 +1,302 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import time
+from typing import Callable, Optional, Sequence, Tuple
+
+import torch
+from monai.inferers import SlidingWindowInferer
+from monai.transforms import Transform
+from monai.utils import BlendMode
+
+__doc__ = "Reduced-precision and memory-format policies for inference."
+__all__ = [
+    "InferencePrecision",
+    "check_inference_precision",
+]
+
+# Supported precisions and the corresponding autocast types
+_PRECISIONS = {
+    "32": None,
+    "bf16": torch.bfloat16,
+    "16": torch.float16,
+}
+
+
+class InferencePrecision:
+    """Precision policy for inference.
+
+    The policy combines automatic mixed precision (`torch.autocast` to bfloat16 or float16),
+    the `channels_last` (2D) or `channels_last_3d` (3D) memory format for the network and its
+    inputs, and `torch.inference_mode` instead of `torch.no_grad`. The outputs of the network
+    are always returned as float32, so that the sliding window blending and the
+    post-processing are not affected.
+    """
+
+    def __init__(
+        self,
+        precision: str = "32",
+        channels_last: bool = False,
+        inference_mode: bool = True,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        precision: str = "32"
+            One of "32" (float32), "bf16" (bfloat16 autocast, also on CPU) or "16" (float16
+            autocast).
+
+        channels_last: bool = False
+            Set to True to use the channels-last memory format (usually faster for
+            convolutions on recent GPUs and on CPU with oneDNN).
+
+        inference_mode: bool = True
+            Set to True to run in `torch.inference_mode()`, False for `torch.no_grad()`.
+        """
+        precision = str(precision).lower()
+        if precision not in _PRECISIONS:
+            raise ValueError(
+                f"`precision` must be one of {', '.join(_PRECISIONS.keys())}."
+            )
+        self.precision = precision
+        self.channels_last = channels_last
+        self.inference_mode = inference_mode
+
+    def __repr__(self):
+        return (
+            f"InferencePrecision(precision={self.precision}, "
+            f"channels_last={self.channels_last}, inference_mode={self.inference_mode})"
+        )
+
+    @property
+    def dtype(self) -> Optional[torch.dtype]:
+        """Autocast type (None for float32)."""
+        return _PRECISIONS[self.precision]
+
+    def is_supported(self, device: torch.device) -> bool:
+        """Return True if the device supports the autocast type of the policy."""
+        if self.dtype is None:
+            return True
+        device = torch.device(device)
+        if not torch.amp.autocast_mode.is_autocast_available(device.type):
+            return False
+        if device.type == "cuda" and self.dtype == torch.bfloat16:
+            return torch.cuda.is_bf16_supported()
+        try:
+            # Try a small convolution
+            with torch.autocast(device.type, dtype=self.dtype):
+                torch.nn.functional.conv2d(
+                    torch.ones((1, 1, 4, 4), device=device),
+                    torch.ones((1, 1, 3, 3), device=device),
+                )
+        except RuntimeError:
+            return False
+        return True
+
+    def for_device(self, device: torch.device) -> "InferencePrecision":
+        """Return the policy, or its float32 equivalent if the device does not support it."""
+        if self.is_supported(device):
+            return self
+        print(f"{self} is not supported on {device}: falling back to float32.")
+        return InferencePrecision(
+            "32", channels_last=self.channels_last, inference_mode=self.inference_mode
+        )
+
+    def grad_context(self):
+        """Return the context in which to run inference."""
+        return torch.inference_mode() if self.inference_mode else torch.no_grad()
+
+    @staticmethod
+    def _memory_format(spatial_dims: int) -> torch.memory_format:
+        return torch.channels_last if spatial_dims == 2 else torch.channels_last_3d
+
+    def prepare(self, network: torch.nn.Module, spatial_dims: int) -> torch.nn.Module:
+        """Convert the weights of the network to the memory format of the policy (in place)."""
+        if self.channels_last:
+            network.to(memory_format=self._memory_format(spatial_dims))
+        return network
+
+    def restore(self, network: torch.nn.Module) -> torch.nn.Module:
+        """Convert the weights of the network back to the default memory format (in place)."""
+        if self.channels_last:
+            network.to(memory_format=torch.contiguous_format)
+        return network
+
+    def wrap(self, network: Callable, spatial_dims: int) -> Callable:
+        """Return a callable that runs the network with the policy.
+
+        The network itself must have been converted with `prepare()` (if it is a module).
+        """
+        if self.dtype is None and not self.channels_last:
+            return network
+
+        memory_format = self._memory_format(spatial_dims)
+
+        def forward(x: torch.Tensor) -> torch.Tensor:
+            if self.channels_last:
+                x = x.contiguous(memory_format=memory_format)
+            if self.dtype is None:
+                return network(x)
+            with torch.autocast(x.device.type, dtype=self.dtype):
+                output = network(x)
+            return output.float()
+
+        return forward
+
+
+def _agreement(
+    reference: torch.Tensor,
+    output: torch.Tensor,
+    post_transforms: Optional[Transform],
+) -> Tuple[float, float]:
+    """Return the relative L1 error of the outputs and the fraction of differing pixels
+    after post-processing (NaN without post-processing)."""
+    relative_error = (
+        (output - reference).abs().sum() / reference.abs().sum().clamp_min(1e-12)
+    ).item()
+    if post_transforms is None:
+        return relative_error, float("nan")
+    reference = post_transforms(reference)
+    output = post_transforms(output)
+    return relative_error, (reference != output).float().mean().item()
+
+
+def check_inference_precision(
+    network: torch.nn.Module,
+    images: Sequence[torch.Tensor],
+    roi_size: Tuple[int, ...],
+    batch_size: int,
+    precision: InferencePrecision,
+    device: torch.device,
+    post_transforms: Optional[Transform] = None,
+    tolerance: float = 0.01,
+    overlap: float = 0.25,
+    verbose: bool = True,
+) -> dict:
+    """Compare inference with a precision policy against float32 on a few images.
+
+    Parameters
+    ----------
+
+    network: torch.nn.Module
+        Network to test (it is left in float32 and in the default memory format).
+
+    images: Sequence[torch.Tensor]
+        Sample of (batches of) images, with shape (B, C, ...).
+
+    roi_size: Tuple[int, ...]
+        Size of the sliding windows.
+
+    batch_size: int
+        Number of windows to predict in parallel.
+
+    precision: InferencePrecision
+        Policy to test.
+
+    device: torch.device
+        Device to run on.
+
+    post_transforms: Optional[Transform] = None
+        Post full-inference transforms (e.g., the conversion to labels). If given, the
+        policy is accepted if the fraction of post-processed pixels that differ from float32
+        is at most `tolerance`; otherwise, if the relative L1 error of the outputs is.
+
+    tolerance: float = 0.01
+        Maximum fraction of differing pixels (or maximum relative error).
+
+    overlap: float = 0.25
+        Fraction of overlap between the sliding windows.
+
+    verbose: bool = True
+        Set to True to print the result of the check.
+
+    Returns
+    -------
+
+    result: dict
+        "accepted" (bool), "supported" (bool), "relative_error" and "pixel_disagreement"
+        (worst over the images), "reference_time" and "time" (seconds).
+    """
+    spatial_dims = len(roi_size)
+    result = {
+        "accepted": False,
+        "supported": precision.is_supported(device),
+        "relative_error": 0.0,
+        "pixel_disagreement": float("nan"),
+        "reference_time": 0.0,
+        "time": 0.0,
+    }
+    if not result["supported"]:
+        if verbose:
+            print(f"{precision} is not supported on {device}.")
+        return result
+
+    inferer = SlidingWindowInferer(
+        roi_size=roi_size,
+        sw_batch_size=batch_size,
+        overlap=overlap,
+        mode=BlendMode.GAUSSIAN,
+        sigma_scale=0.125,
+        device=device,
+    )
+    network.to(device)
+    network.eval()
+    try:
+        for image in images:
+            image = image.to(device)
+
+            # Reference in float32
+            t0 = time.perf_counter()
+            with torch.no_grad():
+                reference = inferer(inputs=image, network=network)
+            result["reference_time"] += time.perf_counter() - t0
+
+            # Policy
+            precision.prepare(network, spatial_dims)
+            t0 = time.perf_counter()
+            with precision.grad_context():
+                output = inferer(
+                    inputs=image, network=precision.wrap(network, spatial_dims)
+                )
+            result["time"] += time.perf_counter() - t0
+            precision.restore(network)
+
+            with torch.no_grad():
+                relative_error, disagreement = _agreement(
+                    reference, output.clone(), post_transforms
+                )
+            result["relative_error"] = max(result["relative_error"], relative_error)
+            if disagreement == disagreement:
+                previous = result["pixel_disagreement"]
+                result["pixel_disagreement"] = (
+                    disagreement
+                    if previous != previous
+                    else max(previous, disagreement)
+                )
+    finally:
+        precision.restore(network)
+
+    # Decide
+    if post_transforms is not None:
+        result["accepted"] = result["pixel_disagreement"] <= tolerance
+    else:
+        result["accepted"] = result["relative_error"] <= tolerance
+
+    if verbose:
+        print(
+            f"{precision}: relative error {result['relative_error']:.2e}, "
+            f"differing pixels {result['pixel_disagreement']:.2e}, "
+            f"time {result['time']:.2f} s (float32: {result['reference_time']:.2f} s): "
+            f"{'accepted' if result['accepted'] else 'rejected'}."
+        )
+    return result
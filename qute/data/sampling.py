@@ -0,0 +1,189 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from monai.transforms import Compose
+
+from qute.data.cache import (
+    FileContentHasher,
+    get_deterministic_prefix_length,
+    hash_transform_parameters,
+)
+from qute.transforms.geom import IndexedRandCropByPosNegLabeld
+from qute.transforms.util import compute_sampling_index
+
+__doc__ = "Precomputed sampling indices for positive/negative patch cropping."
+__all__ = [
+    "SAMPLING_INDEX_VERSION",
+    "build_sampling_indices",
+    "find_indexed_crop",
+]
+
+# Version of the on-disk sampling index layout
+SAMPLING_INDEX_VERSION = 2
+
+
+def find_indexed_crop(
+    transforms: Compose,
+) -> Union[IndexedRandCropByPosNegLabeld, None]:
+    """Return the first `IndexedRandCropByPosNegLabeld` in the pipeline, or None."""
+    for transform in transforms.flatten().transforms:
+        if isinstance(transform, IndexedRandCropByPosNegLabeld):
+            return transform
+    return None
+
+
+def _build_sampling_index(
+    item: dict,
+    transforms: Compose,
+    end: int,
+    image_key: Optional[str],
+    label_key: str,
+    image_threshold: float,
+    chunk_size: int,
+    index_file: Path,
+):
+    """Run the deterministic transforms on one item and save its sampling index."""
+    data = transforms(deepcopy(item), end=end, threading=True)
+    image = data[image_key] if image_key is not None else None
+    index = compute_sampling_index(
+        data[label_key],
+        image,
+        image_threshold=image_threshold,
+        chunk_size=chunk_size,
+    )
+
+    # Write to a temporary file first, to never leave a partial index behind
+    tmp_file = index_file.with_suffix(f".{os.getpid()}.tmp.npz")
+    np.savez(tmp_file, **index)
+    tmp_file.replace(index_file)
+    return index_file
+
+
+def build_sampling_indices(
+    files: list[dict],
+    transforms: Compose,
+    index_dir: Union[Path, str],
+    chunk_size: int = 32,
+    num_workers: int = 1,
+    hasher: Optional[FileContentHasher] = None,
+) -> Union[list[Path], None]:
+    """Build (or re-use) the sampling indices for the `IndexedRandCropByPosNegLabeld` transform
+    of a pipeline.
+
+    The deterministic transforms preceding the crop (e.g., reading, resampling and
+    normalization) are run once per file, and the positions of the foreground and
+    background voxels, chunk by chunk (see `qute.transforms.util.compute_sampling_index()`),
+    are saved to `index_dir`. The files are named by the content of the input files and the parameters
+    of the preceding transforms, so that they are re-used across runs.
+
+    Parameters
+    ----------
+
+    files: list[dict]
+        List of data dictionaries (e.g., {"image": path, "label": path}).
+
+    transforms: Compose
+        Transform pipeline containing an `IndexedRandCropByPosNegLabeld` transform.
+
+    index_dir: Union[Path, str]
+        Root folder of the indices. The files are stored in the `v{SAMPLING_INDEX_VERSION}`
+        sub-folder.
+
+    chunk_size: int = 32
+        Size of the chunks along each spatial dimension.
+
+    num_workers: int = 1
+        Number of processes to use to build the missing indices.
+
+    hasher: Optional[FileContentHasher] = None
+        Hasher for the data items. If omitted, a new one is created.
+
+    Returns
+    -------
+
+    index_files: Union[list[Path], None]
+        List of paths to the index files, one per data dictionary, or None if the
+        pipeline does not contain an `IndexedRandCropByPosNegLabeld` transform, or
+        if the crop is preceded by random transforms.
+    """
+    if not isinstance(transforms, Compose):
+        transforms = Compose(transforms)
+    if hasher is None:
+        hasher = FileContentHasher()
+
+    # Make sure the crop directly follows the deterministic transforms
+    crop = find_indexed_crop(transforms)
+    if crop is None:
+        return None
+    end = get_deterministic_prefix_length(transforms)
+    if end >= len(transforms.transforms) or transforms.transforms[end] is not crop:
+        return None
+
+    # Everything that defines the index goes into its name
+    image_key = crop.image_key
+    label_key = crop.label_key
+    image_threshold = float(crop.image_threshold)
+    params = (
+        f"{hash_transform_parameters(transforms, end=end)}_{image_key}_"
+        f"{label_key}_{image_threshold}_{chunk_size}"
+    )
+
+    # Make sure the versioned index folder exists
+    index_dir = Path(index_dir) / f"v{SAMPLING_INDEX_VERSION}"
+    index_dir.mkdir(parents=True, exist_ok=True)
+
+    # Find the missing indices
+    index_files = []
+    missing = []
+    for item in files:
+        key = hashlib.sha256(hasher(item) + params.encode("utf-8")).hexdigest()
+        index_file = index_dir / f"{key}.npz"
+        index_files.append(index_file)
+        if not index_file.is_file():
+            missing.append((item, index_file))
+
+    if len(missing) == 0:
+        return index_files
+
+    # Build the missing indices in parallel
+    print(f"Building {len(missing)} sampling indices in {index_dir}.")
+    args = [
+        (
+            item,
+            transforms,
+            end,
+            image_key,
+            label_key,
+            image_threshold,
+            chunk_size,
+            index_file,
+        )
+        for item, index_file in missing
+    ]
+    num_workers = max(1, min(num_workers, len(missing)))
+    if num_workers == 1:
+        for arg in args:
+            _build_sampling_index(*arg)
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            # Propagate any exception raised in the workers
+            for _ in executor.map(_build_sampling_index, *zip(*args)):
+                pass
+
+    return index_files
@@ -0,0 +1,168 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from natsort import natsorted
+from tifffile import imread
+
+__doc__ = "Memory-mapped training store."
+__all__ = [
+    "STORE_METADATA_FILE",
+    "STORE_VERSION",
+    "convert_to_store",
+    "is_store",
+    "read_store_metadata",
+]
+
+# Version of the store layout
+STORE_VERSION = 1
+
+# Name of the metadata file at the root of the store
+STORE_METADATA_FILE = "store.json"
+
+
+def is_store(folder: Union[Path, str]) -> bool:
+    """Return True if the folder is the root of a store created by `convert_to_store()`."""
+    return (Path(folder) / STORE_METADATA_FILE).is_file()
+
+
+def read_store_metadata(folder: Union[Path, str]) -> dict:
+    """Read the metadata of a store created by `convert_to_store()`."""
+    with open(Path(folder) / STORE_METADATA_FILE, "r") as f:
+        metadata = json.load(f)
+    if metadata.get("version") != STORE_VERSION:
+        raise ValueError(
+            f"Unsupported store version {metadata.get('version')} (expected {STORE_VERSION})."
+        )
+    return metadata
+
+
+def _convert_file(
+    in_file: Path, out_file: Path, dtype: Optional[str], overwrite: bool
+) -> dict:
+    """Convert a single TIFF file to an uncompressed .npy file."""
+    if overwrite or not out_file.is_file():
+        image = imread(in_file)
+        if dtype is not None:
+            image = image.astype(dtype, copy=False)
+
+        # Write to a temporary file first, to never leave a partial file behind
+        tmp_file = out_file.with_suffix(f".{os.getpid()}.tmp.npy")
+        np.save(tmp_file, np.ascontiguousarray(image))
+        tmp_file.replace(out_file)
+
+    # Read the metadata from the header only
+    image = np.load(out_file, mmap_mode="r")
+    return {
+        "source": in_file.name,
+        "shape": list(image.shape),
+        "dtype": str(image.dtype),
+    }
+
+
+def convert_to_store(
+    input_dir: Union[Path, str],
+    output_dir: Union[Path, str],
+    sub_folders: tuple[str, ...] = ("images", "labels"),
+    fmt_filter: str = "*.tif",
+    dtype: Optional[str] = "float32",
+    num_workers: int = 1,
+    overwrite: bool = False,
+) -> dict:
+    """Convert a dataset of (compressed) TIFF files into a memory-mapped store.
+
+    Every file is decompressed once and saved as an uncompressed `.npy` file with the
+    same name and in the same sub-folder of `output_dir`. The `.npy` files are
+    memory-mapped by `qute.transforms.io.CustomTIFFReader(d)`: this way, the data is no
+    longer decompressed at every access, and random crops only read the pages of the
+    file they need. A `store.json` file with the shape and data type of all files is
+    written to the root of the store.
+
+    To train from the store, point the `dataset_path` of the configuration file to
+    `output_dir`: the data module will pick up the `.npy` files automatically.
+
+    Parameters
+    ----------
+
+    input_dir: Union[Path, str]
+        Root folder of the dataset.
+
+    output_dir: Union[Path, str]
+        Root folder of the store.
+
+    sub_folders: tuple[str, ...] = ("images", "labels")
+        Sub-folders of `input_dir` to convert.
+
+    fmt_filter: str = "*.tif"
+        Filter for the files to convert.
+
+    dtype: Optional[str] = "float32"
+        Data type of the stored arrays. If it matches the `dtype` of the reader (float32
+        in all campaigns), the reader returns views on the mapped files without copying.
+        Set to None to keep the original data type.
+
+    num_workers: int = 1
+        Number of processes to use for the conversion.
+
+    overwrite: bool = False
+        Set to True to convert again files that are already in the store.
+
+    Returns
+    -------
+
+    metadata: dict
+        Metadata of the store (also saved to `output_dir/store.json`).
+    """
+    input_dir = Path(input_dir).resolve()
+    output_dir = Path(output_dir).resolve()
+    if not input_dir.is_dir():
+        raise ValueError(f"The input folder {input_dir} does not exist.")
+    if input_dir == output_dir:
+        raise ValueError("The input and output folders must be different.")
+
+    # Collect the files to convert
+    jobs = []
+    for sub_folder in sub_folders:
+        in_files = natsorted(
+            file
+            for file in (input_dir / sub_folder).glob(fmt_filter)
+            if not file.name.startswith("._")
+        )
+        if len(in_files) == 0:
+            raise ValueError(f"No files found in {input_dir / sub_folder}.")
+        (output_dir / sub_folder).mkdir(parents=True, exist_ok=True)
+        for in_file in in_files:
+            out_file = output_dir / sub_folder / f"{in_file.stem}.npy"
+            jobs.append((sub_folder, in_file, out_file))
+
+    # Convert the files in parallel
+    args = [(in_file, out_file, dtype, overwrite) for _, in_file, out_file in jobs]
+    num_workers = max(1, min(num_workers, len(jobs)))
+    if num_workers == 1:
+        results = [_convert_file(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(_convert_file, *zip(*args)))
+
+    # Write the metadata
+    metadata = {"version": STORE_VERSION, "files": {}}
+    for (sub_folder, _, out_file), result in zip(jobs, results):
+        metadata["files"][f"{sub_folder}/{out_file.name}"] = result
+    with open(output_dir / STORE_METADATA_FILE, "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    return metadata
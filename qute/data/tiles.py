@@ -0,0 +1,520 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import itertools
+import queue
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import numpy as np
+import tifffile
+from tifffile import TiffFile, TiffWriter
+
+__doc__ = "Region-wise reading and tile-wise writing of images larger than memory."
+__all__ = [
+    "RegionReader",
+    "TileWriter",
+    "compute_image_statistics",
+    "iterate_tiles",
+    "open_region_reader",
+    "open_tile_writer",
+]
+
+
+def _import_zarr():
+    """Import the optional `zarr` package."""
+    try:
+        import zarr
+    except ImportError as e:
+        raise ImportError(
+            "Reading and writing zarr arrays requires the `zarr` package."
+        ) from e
+    return zarr
+
+
+def iterate_tiles(shape: Sequence[int], tile_size: Sequence[int]):
+    """Yield the (start, stop) corners of the tiles covering an image, in raster order.
+
+    The tiles at the far borders of the image are cropped to the image.
+    """
+    if len(shape) != len(tile_size):
+        raise ValueError("The tile size must have as many dimensions as the image.")
+    ranges = [range(0, s, t) for s, t in zip(shape, tile_size)]
+    for start in itertools.product(*ranges):
+        stop = tuple(min(a + t, s) for a, t, s in zip(start, tile_size, shape))
+        yield tuple(start), stop
+
+
+class RegionReader(ABC):
+    """Reads rectangular regions of an image without loading the whole image."""
+
+    shape: tuple[int, ...]
+    dtype: np.dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @abstractmethod
+    def _read(self, region: tuple[slice, ...]) -> np.ndarray:
+        pass
+
+    def read(self, start: Sequence[int], stop: Sequence[int]) -> np.ndarray:
+        """Read the region [start, stop) of the image.
+
+        Parameters
+        ----------
+
+        start: Sequence[int]
+            First pixel of the region (included).
+
+        stop: Sequence[int]
+            Last pixel of the region (excluded).
+
+        Returns
+        -------
+
+        region: np.ndarray
+            Copy of the region of the image.
+        """
+        if len(start) != self.ndim or len(stop) != self.ndim:
+            raise ValueError("The region must have as many dimensions as the image.")
+        if any(a < 0 or a >= b or b > s for a, b, s in zip(start, stop, self.shape)):
+            raise ValueError(f"Region {start} - {stop} is outside of the image.")
+        return self._read(tuple(slice(a, b) for a, b in zip(start, stop)))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class _ArrayRegionReader(RegionReader):
+    """Reads regions of a memory-mapped or chunked (zarr) array."""
+
+    def __init__(self, array):
+        self._array = array
+        self.shape = tuple(array.shape)
+        self.dtype = np.dtype(array.dtype)
+
+    def _read(self, region: tuple[slice, ...]) -> np.ndarray:
+        return np.array(self._array[region])
+
+    def close(self):
+        self._array = None
+
+
+class _TIFFRegionReader(RegionReader):
+    """Reads regions of a (compressed) TIFF file by decoding only the tiles or strips that
+    intersect them.
+
+    Grayscale 2D images, stacks of 2D pages and volumetric (tiled) pages are supported.
+    Recently decoded segments are cached, since neighboring regions usually overlap.
+    """
+
+    def __init__(self, file_name: Union[Path, str], max_cached_bytes: int = 2**26):
+        self._tif = TiffFile(file_name)
+        series = self._tif.series[0]
+        self._keyframe = series.keyframe
+        if self._keyframe.samplesperpixel != 1:
+            self._tif.close()
+            raise ValueError("Only single-channel TIFF files are supported.")
+        page_shape = tuple(self._keyframe.shape)
+        if len(series.pages) > 1:
+            self._pages = series.pages
+            self.shape = (len(series.pages),) + page_shape
+        else:
+            self._pages = None
+            self.shape = page_shape
+        if len(self.shape) not in [2, 3] or int(np.prod(self.shape)) != int(
+            np.prod(series.shape)
+        ):
+            self._tif.close()
+            raise ValueError(f"Unsupported TIFF geometry {tuple(series.shape)}.")
+        self.dtype = np.dtype(series.dtype)
+        self._chunks = tuple(self._keyframe.chunks)
+        self._chunked = tuple(self._keyframe.chunked)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self.max_cached_bytes = max_cached_bytes
+
+    def _segment(self, page_index: int, segment_index: int) -> np.ndarray:
+        """Return a decoded segment (tile or strip) of a page."""
+        key = (page_index, segment_index)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        page = self._keyframe if self._pages is None else self._pages[page_index]
+        offset = page.dataoffsets[segment_index]
+        byte_count = page.databytecounts[segment_index]
+        if byte_count == 0:
+            segment = None
+        else:
+            with self._lock:
+                file_handle = self._tif.filehandle
+                file_handle.seek(offset)
+                data = file_handle.read(byte_count)
+            segment, _, _ = self._keyframe.decode(
+                data, segment_index, jpegtables=self._keyframe.jpegtables
+            )
+        if segment is None:
+            segment = np.zeros(self._chunks, dtype=self.dtype)
+        else:
+            # Drop the samples dimension (and the depth dimension of 2D pages)
+            segment = segment[..., 0]
+            if len(self._chunks) == 2:
+                segment = segment[0]
+
+        # Cache the segment
+        self._cache[key] = segment
+        self._cached_bytes += segment.nbytes
+        while self._cached_bytes > self.max_cached_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted.nbytes
+        return segment
+
+    def _read(self, region: tuple[slice, ...]) -> np.ndarray:
+        out = np.empty(tuple(s.stop - s.start for s in region), dtype=self.dtype)
+        if self._pages is None:
+            page_range, spatial = [0], region
+        else:
+            page_range, spatial = range(region[0].start, region[0].stop), region[1:]
+
+        for p, page_index in enumerate(page_range):
+            target = out if self._pages is None else out[p]
+            grid_ranges = [
+                range(s.start // c, (s.stop - 1) // c + 1)
+                for s, c in zip(spatial, self._chunks)
+            ]
+            for grid_index in itertools.product(*grid_ranges):
+                segment = self._segment(
+                    page_index, int(np.ravel_multi_index(grid_index, self._chunked))
+                )
+
+                # Copy the intersection of the segment and the region
+                src, dst = [], []
+                for g, c, s, n in zip(grid_index, self._chunks, spatial, segment.shape):
+                    a = max(s.start, g * c)
+                    b = min(s.stop, g * c + n)
+                    src.append(slice(a - g * c, b - g * c))
+                    dst.append(slice(a - s.start, b - s.start))
+                target[tuple(dst)] = segment[tuple(src)]
+        return out
+
+    def close(self):
+        self._cache.clear()
+        self._tif.close()
+
+
+def open_region_reader(file_name: Union[Path, str]) -> RegionReader:
+    """Open an image for region-wise reading.
+
+    Uncompressed TIFF files and NumPy (.npy) files are memory-mapped, compressed TIFF
+    files are decoded tile by tile (or strip by strip), and zarr arrays (.zarr, needs
+    the `zarr` package) are read chunk by chunk. In all cases, only the requested regions
+    are loaded into memory.
+
+    Parameters
+    ----------
+
+    file_name: Union[Path, str]
+        Full path of the image: one of .tif, .tiff, .npy or .zarr.
+
+    Returns
+    -------
+
+    reader: RegionReader
+        Reader of the image.
+    """
+    file_name = Path(file_name)
+    suffix = file_name.suffix.lower()
+    if suffix == ".npy":
+        return _ArrayRegionReader(np.load(file_name, mmap_mode="r"))
+    if suffix == ".zarr":
+        zarr = _import_zarr()
+        return _ArrayRegionReader(zarr.open_array(file_name, mode="r"))
+    if suffix in [".tif", ".tiff"]:
+        try:
+            return _ArrayRegionReader(tifffile.memmap(file_name, mode="r"))
+        except ValueError:
+            # Compressed or non-contiguous
+            return _TIFFRegionReader(file_name)
+    raise ValueError(f"Unsupported file format '{suffix}'.")
+
+
+def compute_image_statistics(
+    reader: RegionReader, transform=None, max_block_bytes: int = 2**26
+) -> tuple[float, float]:
+    """Compute the mean and the (unbiased) standard deviation of an image block by block.
+
+    Parameters
+    ----------
+
+    reader: RegionReader
+        Reader of the image.
+
+    transform: Optional[Callable] = None
+        Optional function to apply to each block before computing the statistics.
+
+    max_block_bytes: int = 2**26
+        Approximate maximum size in bytes of the blocks (split along the first axis).
+
+    Returns
+    -------
+
+    mean, std: tuple[float, float]
+        Mean and standard deviation of the image, as torch.std() on the whole image.
+    """
+    row_bytes = int(np.prod(reader.shape[1:])) * 8
+    rows = max(1, max_block_bytes // max(1, row_bytes))
+    n, mean, m2 = 0, 0.0, 0.0
+    for start in range(0, reader.shape[0], rows):
+        stop = min(start + rows, reader.shape[0])
+        block = reader.read(
+            (start,) + (0,) * (reader.ndim - 1), (stop,) + reader.shape[1:]
+        )
+        if transform is not None:
+            block = transform(block)
+        block = np.asarray(block, dtype=np.float64)
+
+        # Combine the statistics of the block with the current ones (Chan et al.)
+        n_b = block.size
+        mean_b = block.mean()
+        m2_b = ((block - mean_b) ** 2).sum()
+        delta = mean_b - mean
+        total = n + n_b
+        mean += delta * n_b / total
+        m2 += m2_b + delta**2 * n * n_b / total
+        n = total
+    std = np.sqrt(m2 / (n - 1)) if n > 1 else 0.0
+    return float(mean), float(std)
+
+
+class TileWriter(ABC):
+    """Writes an image tile by tile."""
+
+    def __init__(self, shape: Sequence[int], dtype, tile_size: Sequence[int]):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.tile_size = tuple(tile_size)
+
+    @abstractmethod
+    def write(self, start: Sequence[int], tile: np.ndarray):
+        """Write a tile with its first pixel at `start`.
+
+        The tile may have leading (channel) dimensions that are written entirely.
+        """
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Do not mask the original error with the one of the incomplete file
+            try:
+                self.close()
+            except Exception:
+                pass
+        return False
+
+
+class _ArrayTileWriter(TileWriter):
+    """Writes tiles into a memory-mapped or chunked (zarr) array."""
+
+    def __init__(self, array, tile_size: Sequence[int]):
+        super().__init__(array.shape, array.dtype, tile_size)
+        self._array = array
+
+    def write(self, start: Sequence[int], tile: np.ndarray):
+        spatial = tile.shape[tile.ndim - len(start) :]
+        region = tuple(slice(a, a + n) for a, n in zip(start, spatial))
+        self._array[(Ellipsis,) + region] = tile
+
+    def close(self):
+        if hasattr(self._array, "flush"):
+            self._array.flush()
+        self._array = None
+
+
+class _TIFFTileWriter(TileWriter):
+    """Writes a tiled TIFF file from tiles received in raster order.
+
+    tifffile consumes the tiles from an iterator in a background thread: at most two tiles
+    are kept in memory. 3D images are written with volumetric tiles.
+    """
+
+    def __init__(
+        self,
+        file_name: Union[Path, str],
+        shape: Sequence[int],
+        dtype,
+        tile_size: Sequence[int],
+        compression: str = "zlib",
+        level: Optional[int] = None,
+    ):
+        super().__init__(shape, dtype, tile_size)
+        if len(self.shape) not in [2, 3]:
+            raise ValueError("Only single-channel 2D and 3D TIFF files are supported.")
+        if any(t % 16 != 0 for t in self.tile_size[-2:]):
+            raise ValueError("The (y, x) tile size must be a multiple of 16 for TIFF.")
+        self._expected = iterate_tiles(self.shape, self.tile_size)
+        self._queue = queue.Queue(maxsize=2)
+        self._error = None
+        kwargs = {}
+        if compression is not None and compression != "none":
+            kwargs["compression"] = compression
+            if level is not None:
+                kwargs["compressionargs"] = {"level": level}
+        self._thread = threading.Thread(
+            target=self._run, args=(file_name, kwargs), daemon=True
+        )
+        self._thread.start()
+
+    def _tiles(self):
+        while True:
+            tile = self._queue.get()
+            if tile is None:
+                return
+            yield tile
+
+    def _run(self, file_name, kwargs):
+        try:
+            with TiffWriter(file_name, bigtiff=True) as tif:
+                tif.write(
+                    self._tiles(),
+                    shape=self.shape,
+                    dtype=self.dtype,
+                    tile=self.tile_size,
+                    photometric="minisblack",
+                    **kwargs,
+                )
+        except Exception as e:
+            self._error = e
+            # Unblock the producer
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _put(self, item):
+        while self._thread.is_alive():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        if self._error is not None:
+            raise self._error
+
+    def write(self, start: Sequence[int], tile: np.ndarray):
+        if self._error is not None:
+            raise self._error
+        expected_start, _ = next(self._expected, (None, None))
+        if tuple(start) != expected_start:
+            raise ValueError(
+                "The tiles of a TIFF file must be written in raster order."
+            )
+
+        # Pad the tiles at the borders of the image to the full tile size
+        if tile.shape != self.tile_size:
+            padded = np.zeros(self.tile_size, dtype=self.dtype)
+            padded[tuple(slice(0, n) for n in tile.shape)] = tile
+            tile = padded
+        self._put(np.ascontiguousarray(tile, dtype=self.dtype))
+
+    def close(self):
+        if self._thread.is_alive():
+            self._put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def open_tile_writer(
+    file_name: Union[Path, str],
+    shape: Sequence[int],
+    dtype,
+    tile_size: Sequence[int],
+    compression: str = "zlib",
+    level: Optional[int] = None,
+) -> TileWriter:
+    """Create an image to be written tile by tile.
+
+    Parameters
+    ----------
+
+    file_name: Union[Path, str]
+        Full path of the image to create. One of:
+            .tif, .tiff: tiled (Big)TIFF file; the tiles must be written in raster order
+                         (see `iterate_tiles()`) and the image must be single-channel. 3D
+                         images are written with volumetric tiles.
+            .npy: memory-mapped NumPy file.
+            .zarr: zarr array chunked by tile (needs the `zarr` package).
+
+    shape: Sequence[int]
+        Shape of the image, including the leading channel dimension if any.
+
+    dtype:
+        Data type of the image.
+
+    tile_size: Sequence[int]
+        Spatial size of the tiles.
+
+    compression: str = "zlib"
+        Compression of the TIFF file (see `TIFFPredictionWriter`).
+
+    level: Optional[int] = None
+        Compression level of the TIFF file.
+
+    Returns
+    -------
+
+    writer: TileWriter
+        Writer of the image.
+    """
+    file_name = Path(file_name)
+    suffix = file_name.suffix.lower()
+    shape = tuple(int(s) for s in shape)
+    tile_size = tuple(int(t) for t in tile_size)
+    if suffix == ".npy":
+        array = np.lib.format.open_memmap(
+            file_name, mode="w+", dtype=dtype, shape=shape
+        )
+        return _ArrayTileWriter(array, tile_size)
+    if suffix == ".zarr":
+        zarr = _import_zarr()
+        chunks = shape[: len(shape) - len(tile_size)] + tile_size
+        array = zarr.open_array(
+            file_name, mode="w", shape=shape, chunks=chunks, dtype=dtype
+        )
+        return _ArrayTileWriter(array, tile_size)
+    if suffix in [".tif", ".tiff"]:
+        return _TIFFTileWriter(
+            file_name, shape, dtype, tile_size, compression=compression, level=level
+        )
+    raise ValueError(f"Unsupported file format '{suffix}'.")
@@ -0,0 +1,256 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import itertools
+import re
+from typing import Callable, Sequence, Union
+
+import torch
+
+__doc__ = "Test-time augmentation with batched flip and rotation variants."
+__all__ = [
+    "TTANetwork",
+    "parse_tta_variants",
+]
+
+# A variant is a tuple (flipped spatial axes, number of 90-degree rotations in the yx plane)
+Variant = tuple[tuple[int, ...], int]
+
+
+def _axis_names(spatial_dims: int) -> dict:
+    return dict(zip(["z", "y", "x"][-spatial_dims:], range(spatial_dims)))
+
+
+def parse_tta_variants(
+    variants: Union[str, Sequence[str]], spatial_dims: int
+) -> list[Variant]:
+    """Parse a specification of test-time augmentation variants.
+
+    Parameters
+    ----------
+
+    variants: Union[str, Sequence[str]]
+        Comma-separated string (or sequence) of variant names or presets:
+            "identity": the original image (always included, and always first).
+            "flip_x", "flip_y", "flip_z": flip along one axis ("flip_z" only for 3D).
+            "flip_xy", "flip_zyx", ...: flip along several axes.
+            "rot90", "rot180", "rot270": rotation in the yx plane.
+            "flips": all combinations of flips (4 variants in 2D, 8 in 3D).
+            "rotations": the four rotations in the yx plane.
+            "all": all combinations of flips and rotations in the yx plane (8 distinct
+                   variants in 2D, 16 in 3D).
+
+    spatial_dims: int
+        Number of spatial dimensions (2 or 3).
+
+    Returns
+    -------
+
+    variants: list[tuple[tuple[int, ...], int]]
+        Unique variants as (flipped spatial axes, number of 90-degree rotations).
+    """
+    if spatial_dims not in [2, 3]:
+        raise ValueError("`spatial_dims` must be 2 or 3.")
+    if isinstance(variants, str):
+        variants = re.sub(r"\s+", "", variants).split(",")
+    axes = _axis_names(spatial_dims)
+    all_flips = [
+        tuple(c)
+        for n in range(spatial_dims + 1)
+        for c in itertools.combinations(range(spatial_dims), n)
+    ]
+
+    parsed = [((), 0)]
+    for name in [v.lower() for v in variants if v != ""]:
+        if name == "identity":
+            new = []
+        elif name == "flips":
+            new = [(f, 0) for f in all_flips]
+        elif name == "rotations":
+            new = [((), k) for k in range(4)]
+        elif name == "all":
+            new = [(f, k) for f in all_flips for k in range(4)]
+        elif name in ["rot90", "rot180", "rot270"]:
+            new = [((), int(name[3:]) // 90)]
+        elif name.startswith("flip_") and all(a in axes for a in name[5:]):
+            new = [(tuple(sorted(axes[a] for a in set(name[5:]))), 0)]
+        else:
+            raise ValueError(f"Unknown test-time augmentation variant '{name}'.")
+        parsed.extend(new)
+
+    # Remove the variants that give the same transformation (in 2D, flipping both
+    # axes is the same as rotating by 180 degrees, and so on)
+    unique, seen = [], set()
+    for variant in parsed:
+        key = _variant_signature(variant, spatial_dims)
+        if key not in seen:
+            seen.add(key)
+            unique.append(variant)
+    return unique
+
+
+def _apply(x: torch.Tensor, variant: Variant) -> torch.Tensor:
+    """Apply a variant to a (B, C, ...) tensor."""
+    flips, k = variant
+    if len(flips) > 0:
+        x = torch.flip(x, dims=[2 + a for a in flips])
+    if k % 4 != 0:
+        x = torch.rot90(x, k, dims=(-2, -1))
+    return x
+
+
+def _invert(x: torch.Tensor, variant: Variant) -> torch.Tensor:
+    """Undo a variant on a (B, C, ...) tensor."""
+    flips, k = variant
+    if k % 4 != 0:
+        x = torch.rot90(x, -k, dims=(-2, -1))
+    if len(flips) > 0:
+        x = torch.flip(x, dims=[2 + a for a in flips])
+    return x
+
+
+def _variant_signature(variant: Variant, spatial_dims: int) -> tuple:
+    """Return where the variant sends the corners of a square (hyper)cube."""
+    x = torch.arange(2**spatial_dims).reshape((1, 1) + (2,) * spatial_dims)
+    return tuple(_apply(x, variant).flatten().tolist())
+
+
+class TTANetwork:
+    """Wraps a network to average its predictions over flipped and rotated inputs.
+
+    All variants of a batch of (sliding) windows are stacked along the batch dimension and
+    predicted in a single forward pass (two if the windows are not square in the yx plane
+    and the variants include 90-degree rotations); the predictions are then transformed back on the
+    device and averaged. Since the merged output has the shape of the output of the
+    network, the wrapper can be passed as network to MONAI's `SlidingWindowInferer`, and
+    the post full-inference transforms are applied to the merged prediction.
+
+    In adaptive mode, the variants are predicted in groups, and no further variants are
+    added once the merged prediction stops changing.
+    """
+
+    def __init__(
+        self,
+        network: Callable,
+        variants: Union[str, Sequence[str], Sequence[Variant]] = "flips",
+        spatial_dims: int = 2,
+        adaptive: bool = False,
+        group_size: int = 2,
+        tolerance: float = 0.001,
+        channel_groups: int = 1,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        network: Callable
+            Network (or ensemble of networks, see `qute.data.ensemble.EnsembleNetwork`).
+
+        variants: Union[str, Sequence[str], Sequence[Variant]] = "flips"
+            Variants to predict (see `parse_tta_variants()`).
+
+        spatial_dims: int = 2
+            Number of spatial dimensions (2 or 3).
+
+        adaptive: bool = False
+            Set to True to predict the variants in groups of `group_size` and stop as soon as
+            the merged prediction agrees with the previous one (see `tolerance`).
+
+        group_size: int = 2
+            Number of variants predicted at once in adaptive mode.
+
+        tolerance: float = 0.001
+            Adaptive mode: maximum fraction of pixels whose class (the argmax over the
+            channels) may change when adding a group of variants. For single-channel outputs,
+            maximum mean absolute change relative to the mean absolute prediction.
+
+        channel_groups: int = 1
+            Number of independent groups of channels in the output (e.g., the number of
+            models of an ensemble) for the computation of the classes in adaptive mode.
+        """
+        if isinstance(variants, str) or all(isinstance(v, str) for v in variants):
+            variants = parse_tta_variants(variants, spatial_dims)
+        self.variants = list(variants)
+        if group_size < 1:
+            raise ValueError("`group_size` must be at least 1.")
+        self.network = network
+        self.spatial_dims = spatial_dims
+        self.adaptive = adaptive
+        self.group_size = group_size
+        self.tolerance = tolerance
+        self.channel_groups = channel_groups
+
+        # Number of variants used per call (for reporting)
+        self.num_calls = 0
+        self.num_predicted_variants = 0
+
+    def _predict(self, x: torch.Tensor, variants: Sequence[Variant]) -> torch.Tensor:
+        """Return the sum of the predictions of the variants, in the original geometry.
+
+        The odd rotations swap y and x: if the windows are not square in the yx plane, they
+        are predicted in a separate forward pass.
+        """
+        if x.shape[-2] == x.shape[-1]:
+            groups = [variants]
+        else:
+            groups = [
+                [v for v in variants if v[1] % 2 == 0],
+                [v for v in variants if v[1] % 2 == 1],
+            ]
+        batch_size = x.shape[0]
+        total = None
+        for group in groups:
+            if len(group) == 0:
+                continue
+            outputs = self.network(torch.cat([_apply(x, v) for v in group]))
+            for i, variant in enumerate(group):
+                output = _invert(
+                    outputs[i * batch_size : (i + 1) * batch_size], variant
+                )
+                total = output if total is None else total + output
+        return total
+
+    def _agree(self, previous: torch.Tensor, current: torch.Tensor) -> bool:
+        """Return True if the merged predictions agree within tolerance."""
+        num_channels = current.shape[1] // self.channel_groups
+        if num_channels > 1:
+            previous = previous.unflatten(1, (self.channel_groups, num_channels))
+            current = current.unflatten(1, (self.channel_groups, num_channels))
+            changed = previous.argmax(dim=2) != current.argmax(dim=2)
+            return changed.float().mean().item() <= self.tolerance
+        change = (current - previous).abs().mean()
+        scale = current.abs().mean().clamp_min(1e-12)
+        return (change / scale).item() <= self.tolerance
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        self.num_calls += 1
+        if not self.adaptive:
+            self.num_predicted_variants += len(self.variants)
+            return self._predict(x, self.variants) / len(self.variants)
+
+        # Add groups of variants until the merged prediction stops changing
+        total, count, merged = None, 0, None
+        for start in range(0, len(self.variants), self.group_size):
+            group = self.variants[start : start + self.group_size]
+            partial = self._predict(x, group)
+            total = partial if total is None else total + partial
+            count += len(group)
+            previous, merged = merged, total / count
+            if previous is not None and self._agree(previous, merged):
+                break
+        self.num_predicted_variants += count
+        return merged
+
+    @property
+    def mean_variants(self) -> float:
+        """Mean number of variants predicted per call."""
+        return self.num_predicted_variants / max(1, self.num_calls)
@@ -0,0 +1,220 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import os
+import time
+from typing import Optional, Sequence
+
+import torch
+
+__doc__ = "DataLoader throughput tuning."
+__all__ = [
+    "get_num_available_cpus",
+    "tune_data_loader",
+]
+
+
+def get_num_available_cpus() -> int:
+    """Return the number of CPUs the current process is allowed to run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def _default_num_workers_candidates(current: int) -> list[int]:
+    """Return 0, 1, 2, 4, ... up to the number of available CPUs, plus the current value."""
+    max_workers = max(0, get_num_available_cpus() - 1)
+    candidates = {0, min(current, max_workers)}
+    n = 1
+    while n <= max_workers:
+        candidates.add(n)
+        n *= 2
+    candidates.add(max_workers)
+    return sorted(candidates)
+
+
+def _to_device(batch, device: torch.device):
+    """Move all tensors of a (nested) batch to the device."""
+    if isinstance(batch, torch.Tensor):
+        return batch.to(device, non_blocking=True)
+    if isinstance(batch, dict):
+        return {key: _to_device(value, device) for key, value in batch.items()}
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_to_device(value, device) for value in batch)
+    return batch
+
+
+def _measure(data_module, num_batches: int, warmup_batches: int) -> float:
+    """Return the throughput (in samples per second) of the training DataLoader."""
+    data_loader = data_module.train_dataloader()
+    device = torch.device("cuda") if torch.cuda.is_available() else None
+    if len(data_loader) == 0:
+        raise ValueError("The training DataLoader is empty.")
+
+    num_samples = 0
+    start = None
+    count = 0
+    try:
+        while count < warmup_batches + num_batches:
+            for batch in data_loader:
+                if device is not None:
+                    batch = _to_device(batch, device)
+                    torch.cuda.synchronize()
+                count += 1
+                if count == warmup_batches:
+                    # Start timing (worker start-up is excluded)
+                    start = time.perf_counter()
+                elif count > warmup_batches:
+                    num_samples += data_module.batch_size
+                if count == warmup_batches + num_batches:
+                    break
+        elapsed = time.perf_counter() - start
+    finally:
+        # Shut down the (persistent) workers
+        del data_loader
+    return num_samples / elapsed if elapsed > 0 else float("inf")
+
+
+def tune_data_loader(
+    data_module,
+    num_workers: Optional[Sequence[int]] = None,
+    prefetch_factors: Sequence[int] = (2, 4, 8),
+    pin_memory: Optional[Sequence[bool]] = None,
+    batch_sizes: Optional[Sequence[int]] = None,
+    num_batches: int = 10,
+    warmup_batches: int = 2,
+    apply: bool = True,
+    verbose: bool = True,
+) -> dict:
+    """Benchmark a few training DataLoader configurations and pick the fastest one.
+
+    The training DataLoader of the data module (that is, the real campaign pipeline) is run
+    for `warmup_batches` + `num_batches` batches per configuration, and the throughput in
+    samples per second is measured over the last `num_batches`. To keep the search short,
+    the parameters are tuned one after the other: first the number of workers, then the
+    prefetch factor (with the best number of workers), then the pinning of the memory (only
+    on CUDA devices), and finally the batch size (only if `batch_sizes` is given).
+
+    Please notice that if the data module caches the preprocessed samples, the first
+    configurations also fill the cache, which favors the later ones.
+
+    Parameters
+    ----------
+
+    data_module: DataModuleLocalFolder
+        Data module, already set up (`data_module.setup("train")`).
+
+    num_workers: Optional[Sequence[int]] = None
+        Numbers of workers to try. If omitted, 0, 1, 2, 4, ... up to the number of
+        available CPUs minus one are tried.
+
+    prefetch_factors: Sequence[int] = (2, 4, 8)
+        Prefetch factors to try (only if the best number of workers is not 0).
+
+    pin_memory: Optional[Sequence[bool]] = None
+        Memory pinning options to try. If omitted, (False, True) are tried on CUDA
+        devices. Pinning is never used without CUDA.
+
+    batch_sizes: Optional[Sequence[int]] = None
+        Batch sizes to try. If omitted, the batch size of the data module is kept, since
+        it also changes the optimization.
+
+    num_batches: int = 10
+        Number of batches to time per configuration.
+
+    warmup_batches: int = 2
+        Number of batches to run before starting the timer.
+
+    apply: bool = True
+        Set to True to set the best configuration into the data module; otherwise, the
+        data module is left unchanged.
+
+    verbose: bool = True
+        Set to True to print the throughput of every configuration.
+
+    Returns
+    -------
+
+    result: dict
+        The best configuration ("num_workers", "prefetch_factor", "pin_memory" and
+        "batch_size"), its throughput ("samples_per_second"), and the throughput of all
+        tried configurations ("results").
+    """
+    if data_module.train_dataset is None:
+        raise ValueError("The data module must be set up before tuning.")
+    if num_batches < 1 or warmup_batches < 1:
+        raise ValueError("`num_batches` and `warmup_batches` must be at least 1.")
+
+    # Original configuration
+    original = {
+        "num_workers": data_module.num_workers,
+        "prefetch_factor": data_module.prefetch_factor,
+        "pin_memory": data_module.pin_memory,
+        "batch_size": data_module.batch_size,
+    }
+
+    # Candidates
+    if num_workers is None:
+        num_workers = _default_num_workers_candidates(data_module.num_workers)
+    if pin_memory is None:
+        pin_memory = [False, True]
+    pin_memory = sorted(set(p and torch.cuda.is_available() for p in pin_memory))
+    if batch_sizes is None:
+        batch_sizes = [data_module.batch_size]
+
+    results = []
+    best = dict(original)
+    best["pin_memory"] = pin_memory[0]
+    best_throughput = -1.0
+
+    def try_candidates(name: str, candidates: Sequence):
+        nonlocal best, best_throughput
+        current = dict(best)
+        for candidate in candidates:
+            config = dict(current)
+            config[name] = candidate
+            if any(config == r["config"] for r in results):
+                continue
+            for key, value in config.items():
+                setattr(data_module, key, value)
+            throughput = _measure(data_module, num_batches, warmup_batches)
+            results.append({"config": config, "samples_per_second": throughput})
+            if verbose:
+                print(
+                    f"DataLoader tuning: {', '.join(f'{k}={v}' for k, v in config.items())}: "
+                    f"{throughput:.2f} samples/s."
+                )
+            if throughput > best_throughput:
+                best, best_throughput = config, throughput
+
+    try:
+        try_candidates("num_workers", num_workers)
+        if best["num_workers"] > 0:
+            try_candidates("prefetch_factor", prefetch_factors)
+        try_candidates("pin_memory", pin_memory)
+        try_candidates("batch_size", batch_sizes)
+    finally:
+        # Set the best (or restore the original) configuration
+        for key, value in (best if apply else original).items():
+            setattr(data_module, key, value)
+
+    if verbose:
+        print(
+            f"DataLoader tuning: best configuration "
+            f"{', '.join(f'{k}={v}' for k, v in best.items())} "
+            f"({best_throughput:.2f} samples/s)."
+        )
+
+    return {
+        **best,
+        "samples_per_second": best_throughput,
+        "results": results,
+    }
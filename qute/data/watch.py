@@ -0,0 +1,310 @@
+#  ********************************************************************************
+#  Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+#  All rights reserved. This program and the accompanying materials
+#  are made available under the terms of the Apache License Version 2.0
+#  which accompanies this distribution, and is available at
+#  https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Contributors:
+#    Aaron Ponti - initial API and implementation
+#  ******************************************************************************
+
+import csv
+import os
+import time
+from pathlib import Path
+from typing import Callable, Optional, Sequence, Union
+
+import numpy as np
+from natsort import natsorted
+
+from qute.data.manifest import PredictionManifest
+
+__doc__ = "Watch a folder and predict new images as they are written (e.g., during acquisition)."
+__all__ = [
+    "FolderWatcher",
+    "LatencyStats",
+    "watch_folder",
+]
+
+
+class FolderWatcher:
+    """Polls a folder for new files, and reports them once they are completely written.
+
+    A file is considered completely written when its size and modification time have not
+    changed for `settle_time` seconds and it can be opened for reading. A file that is
+    modified after it was reported (e.g., overwritten), or that is passed to `retry()`, is
+    reported again.
+    """
+
+    def __init__(
+        self,
+        folder: Union[Path, str],
+        patterns: Sequence[str] = ("*.tif", "*.tiff", "*.nd2"),
+        settle_time: float = 2.0,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        folder: Union[Path, str]
+            Folder to watch.
+
+        patterns: Sequence[str] = ("*.tif", "*.tiff", "*.nd2")
+            Glob patterns of the files to report.
+
+        settle_time: float = 2.0
+            Time (in seconds) the size and modification time of a file must be stable.
+        """
+        self.folder = Path(folder)
+        self.patterns = tuple(patterns)
+        self.settle_time = settle_time
+
+        # Files being written: path -> (size, mtime_ns, first seen, last changed)
+        self._candidates = {}
+
+        # Files already reported: path -> (size, mtime_ns)
+        self._reported = {}
+
+    def _list_files(self) -> list[Path]:
+        files = set()
+        for pattern in self.patterns:
+            files.update(f for f in self.folder.glob(pattern) if f.is_file())
+        return natsorted(files)
+
+    @staticmethod
+    def _can_be_read(file_name: Path) -> bool:
+        try:
+            with open(file_name, "rb"):
+                return True
+        except OSError:
+            return False
+
+    def poll(self) -> list[tuple[Path, float]]:
+        """Return the files that were completely written since the last call.
+
+        Returns
+        -------
+
+        files: list[tuple[Path, float]]
+            Files (in natural order), with the time (`time.time()`) they were first seen.
+        """
+        now = time.time()
+        ready = []
+        for file_name in self._list_files():
+            try:
+                stat = os.stat(file_name)
+            except FileNotFoundError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self._reported.get(file_name, None) == signature:
+                continue
+            candidate = self._candidates.get(file_name, None)
+            if candidate is None:
+                self._candidates[file_name] = (*signature, now, now)
+                continue
+            if candidate[:2] != signature:
+                # Still being written
+                self._candidates[file_name] = (*signature, candidate[2], now)
+                continue
+            if now - candidate[3] >= self.settle_time and self._can_be_read(file_name):
+                ready.append((file_name, candidate[2]))
+                self._reported[file_name] = signature
+                del self._candidates[file_name]
+        return ready
+
+    def retry(self, file_name: Union[Path, str]):
+        """Report a file again once it is completely written (e.g., after a failure)."""
+        self._reported.pop(Path(file_name), None)
+
+
+class LatencyStats:
+    """Per-file latency statistics."""
+
+    def __init__(self):
+        self._values = {}
+
+    def add(self, **values: float):
+        """Add the latencies (in seconds) of a file, by name."""
+        for name, value in values.items():
+            self._values.setdefault(name, []).append(value)
+
+    @property
+    def count(self) -> int:
+        return max((len(v) for v in self._values.values()), default=0)
+
+    def summary(self) -> dict:
+        """Return the mean, median, 95th percentile and maximum of each latency."""
+        summary = {}
+        for name, values in self._values.items():
+            values = np.array(values)
+            summary[name] = {
+                "mean": float(values.mean()),
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+                "max": float(values.max()),
+            }
+        return summary
+
+
+def watch_folder(
+    predict: Callable[[Path, Path], Path],
+    input_folder: Union[Path, str],
+    target_folder: Union[Path, str],
+    manifest: Optional[PredictionManifest] = None,
+    patterns: Sequence[str] = ("*.tif", "*.tiff", "*.nd2"),
+    settle_time: float = 2.0,
+    poll_interval: float = 1.0,
+    idle_timeout: Optional[float] = None,
+    max_retries: int = 3,
+    prefix: str = "",
+    extension: str = ".tif",
+    latency_file: Optional[str] = "watch_latencies.csv",
+) -> dict:
+    """Predict the images written to a folder as they arrive, until interrupted.
+
+    Parameters
+    ----------
+
+    predict: Callable[[Path, Path], Path]
+        Function that predicts an input file and saves the prediction to an output file
+        (e.g., `qute.serve.InferenceServer.predict()`, that keeps the model warm).
+
+    input_folder: Union[Path, str]
+        Folder to watch.
+
+    target_folder: Union[Path, str]
+        Folder where to save the predictions.
+
+    manifest: Optional[PredictionManifest] = None
+        Manifest of the predictions in the target folder, used as checkpoint of the
+        processed files: files with valid predictions (e.g., from before a restart) are
+        skipped. Omit to predict all files found in the folder.
+
+    patterns: Sequence[str] = ("*.tif", "*.tiff", "*.nd2")
+        Glob patterns of the files to predict.
+
+    settle_time: float = 2.0
+        Time (in seconds) the size of a file must be stable before it is predicted.
+
+    poll_interval: float = 1.0
+        Time (in seconds) between two scans of the folder.
+
+    idle_timeout: Optional[float] = None
+        Stop after this many seconds without new files. Omit to watch until interrupted
+        (Ctrl+C).
+
+    max_retries: int = 3
+        Number of times a file whose prediction fails (e.g., because it is still locked by
+        the acquisition software) is tried again, after `settle_time`, before it is skipped.
+        A skipped file is tried again if it is modified.
+
+    prefix: str = ""
+        Prefix to append to the file names of the predictions.
+
+    extension: str = ".tif"
+        Extension of the predictions (e.g., the extension of the prediction writer).
+
+    latency_file: Optional[str] = "watch_latencies.csv"
+        Name of the file in the target folder where the latencies of each file are
+        appended. Set to None to only keep them in memory.
+
+    Returns
+    -------
+
+    summary: dict
+        Statistics (mean, p50, p95, max) of the latencies, in seconds:
+        "settle": time from the first sight of a file to the end of its writing.
+        "inference": time to predict and save a file.
+        "latency": time from the last modification of a file to its saved prediction.
+    """
+    if max_retries < 0:
+        raise ValueError("`max_retries` must be non-negative.")
+    target_folder = Path(target_folder)
+    target_folder.mkdir(parents=True, exist_ok=True)
+    watcher = FolderWatcher(input_folder, patterns=patterns, settle_time=settle_time)
+    stats = LatencyStats()
+    num_skipped, num_failed = 0, 0
+
+    # Number of failed attempts of the files that are retried
+    failures = {}
+
+    print(f"Watching {Path(input_folder).resolve()} (press Ctrl+C to stop).")
+    last_activity = time.time()
+    try:
+        while True:
+            ready = watcher.poll()
+            for input_file, first_seen in ready:
+                output_file = target_folder / f"{prefix}{input_file.stem}{extension}"
+                if manifest is not None and manifest.is_complete(
+                    input_file, [output_file]
+                ):
+                    num_skipped += 1
+                    continue
+
+                # Predict and save (a file that cannot be predicted does not stop the
+                # watch, and is tried again up to `max_retries` times)
+                t0 = time.time()
+                try:
+                    predict(input_file, output_file)
+                except Exception as e:
+                    attempts = failures.pop(input_file, 0) + 1
+                    if attempts <= max_retries:
+                        failures[input_file] = attempts
+                        watcher.retry(input_file)
+                        print(f"Could not predict {input_file} (will retry): {e}")
+                    else:
+                        num_failed += 1
+                        print(f"Could not predict {input_file}: {e}")
+                    continue
+                failures.pop(input_file, None)
+                t1 = time.time()
+                if manifest is not None:
+                    manifest.record(input_file, [output_file])
+
+                latencies = {
+                    "settle": max(t0 - first_seen, 0.0),
+                    "inference": t1 - t0,
+                    "latency": t1 - os.stat(input_file).st_mtime,
+                }
+                stats.add(**latencies)
+                if latency_file is not None:
+                    _append_latencies(
+                        target_folder / latency_file, input_file, latencies
+                    )
+                print(
+                    f"Saved {output_file} ({latencies['latency']:.2f} s after acquisition)."
+                )
+            if len(ready) > 0:
+                last_activity = time.time()
+            elif (
+                idle_timeout is not None and time.time() - last_activity > idle_timeout
+            ):
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+    summary = stats.summary()
+    if num_skipped > 0:
+        print(f"Skipped {num_skipped} file(s) that were already predicted.")
+    if num_failed > 0:
+        print(f"Could not predict {num_failed} file(s).")
+    if stats.count > 0:
+        print(
+            f"Predicted {stats.count} file(s): latency {summary['latency']['mean']:.2f} s "
+            f"on average (p95: {summary['latency']['p95']:.2f} s), inference "
+            f"{summary['inference']['mean']:.2f} s on average."
+        )
+    return summary
+
+
+def _append_latencies(latency_file: Path, input_file: Path, latencies: dict):
+    """Append the latencies of a file to a CSV file (with a header if it is new)."""
+    write_header = not latency_file.is_file()
+    with open(latency_file, "a", newline="") as f:
+        writer = csv.writer(f)
+        if write_header:
+            writer.writerow(["file", *latencies.keys()])
+        writer.writerow([input_file.name, *[f"{v:.4f}" for v in latencies.values()]])
@@ -0,0 +1,211 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+
+import io
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from tifffile import TiffWriter
+
+__doc__ = "Writers for the predictions of full inference."
+__all__ = [
+    "PredictionWriter",
+    "TIFFPredictionWriter",
+    "is_tiff_compression_available",
+    "smallest_integer_dtype",
+]
+
+# Supported TIFF compressions and their default levels
+_TIFF_COMPRESSIONS = {
+    "none": None,
+    "lzw": None,
+    "zlib": 6,
+    "zstd": 3,
+}
+
+
+def smallest_integer_dtype(data: np.ndarray) -> np.dtype:
+    """Return the smallest integer dtype that can represent all values of an integer array.
+
+    Unsigned types are preferred if the array has no negative values. Non-integer arrays
+    are returned with their own dtype.
+    """
+    if not np.issubdtype(data.dtype, np.integer) and data.dtype != bool:
+        return data.dtype
+    if data.size == 0:
+        return np.dtype(np.uint8)
+    min_value, max_value = int(data.min()), int(data.max())
+    candidates = (
+        [np.uint8, np.uint16, np.uint32, np.uint64]
+        if min_value >= 0
+        else [np.int8, np.int16, np.int32, np.int64]
+    )
+    for candidate in candidates:
+        info = np.iinfo(candidate)
+        if info.min <= min_value and max_value <= info.max:
+            return np.dtype(candidate)
+    return data.dtype
+
+
+@lru_cache(maxsize=None)
+def is_tiff_compression_available(compression: str) -> bool:
+    """Return True if tifffile can encode with the given compression in this environment.
+
+    LZW and zstd need the optional `imagecodecs` package.
+    """
+    if compression == "none":
+        return True
+    try:
+        with TiffWriter(io.BytesIO()) as tif:
+            tif.write(np.zeros((8, 8), dtype=np.uint8), compression=compression)
+    except Exception:
+        return False
+    return True
+
+
+class PredictionWriter(ABC):
+    """Abstract base class for the writers of the predictions of full inference."""
+
+    @property
+    @abstractmethod
+    def extension(self) -> str:
+        """File extension (including the leading dot) of the written files."""
+        pass
+
+    @abstractmethod
+    def write(self, pred: np.ndarray, output_name: Union[Path, str]):
+        """Write a prediction to file.
+
+        Parameters
+        ----------
+
+        pred: np.ndarray
+            Prediction to write (already transposed and type-cast).
+
+        output_name: Union[Path, str]
+            Full path of the file to write.
+        """
+        pass
+
+
+class TIFFPredictionWriter(PredictionWriter):
+    """Writes the predictions as (compressed) TIFF files."""
+
+    def __init__(
+        self,
+        compression: str = "zlib",
+        level: Optional[int] = 9,
+        tile: Optional[tuple[int, ...]] = None,
+        rows_per_strip: Optional[int] = None,
+        num_threads: int = 1,
+        label_dtype: Optional[Union[str, np.dtype]] = None,
+    ):
+        """Constructor.
+
+        The default settings (zlib level 9, single-threaded, one strip per plane) reproduce
+        the files written by previous versions of qute.
+
+        Parameters
+        ----------
+
+        compression: str = "zlib"
+            One of "none", "lzw", "zlib" or "zstd". LZW and zstd need the `imagecodecs`
+            package: if it is missing, zlib is used instead (with a warning).
+
+        level: Optional[int] = 9
+            Compression level (only used by "zlib" and "zstd"). Lower levels are much faster
+            to encode and usually compress label images almost as well. Omit to use the
+            default level of the codec.
+
+        tile: Optional[tuple[int, ...]] = None
+            Tile size (y, x) or (z, y, x), with all values multiple of 16. Tiles are encoded in
+            parallel by `num_threads` threads. Omit to write strips.
+
+        rows_per_strip: Optional[int] = None
+            Number of rows per strip (only used if `tile` is None). If omitted, one strip per
+            plane is written with a single thread, and 64 rows per strip with more threads.
+
+        num_threads: int = 1
+            Number of threads used to encode the tiles or strips of each file.
+
+        label_dtype: Optional[Union[str, np.dtype]] = None
+            Integer type to save all integer predictions (e.g., label maps) with, so that all files
+            of a run have the same type (e.g., "uint16" for fewer than 65536 labels). A ValueError
+            is raised if a prediction does not fit. Floating point predictions are never converted.
+            Omit to save the predictions with their own type.
+        """
+        compression = "none" if compression is None else str(compression).lower()
+        if compression not in _TIFF_COMPRESSIONS:
+            raise ValueError(
+                f"`compression` must be one of {', '.join(_TIFF_COMPRESSIONS.keys())}."
+            )
+        if not is_tiff_compression_available(compression):
+            print(
+                f"Compression '{compression}' is not available (is `imagecodecs` installed?): "
+                f"falling back to 'zlib'."
+            )
+            compression = "zlib"
+        if num_threads < 1:
+            raise ValueError("`num_threads` must be at least 1.")
+        if label_dtype is not None:
+            label_dtype = np.dtype(label_dtype)
+            if not np.issubdtype(label_dtype, np.integer):
+                raise ValueError("`label_dtype` must be an integer type.")
+        if tile is not None:
+            tile = tuple(int(t) for t in tile)
+            if any(t % 16 != 0 or t <= 0 for t in tile):
+                raise ValueError("The tile size must be a positive multiple of 16.")
+
+        self.compression = compression
+        self.level = level
+        self.tile = tile
+        self.rows_per_strip = rows_per_strip
+        self.num_threads = num_threads
+        self.label_dtype = label_dtype
+
+    @property
+    def extension(self) -> str:
+        return ".tif"
+
+    def write(self, pred: np.ndarray, output_name: Union[Path, str]):
+        """Write a prediction to a TIFF file."""
+        if self.label_dtype is not None and np.issubdtype(pred.dtype, np.integer):
+            if not np.can_cast(smallest_integer_dtype(pred), self.label_dtype):
+                raise ValueError(
+                    f"The labels of {Path(output_name).name} do not fit in {self.label_dtype}."
+                )
+            pred = pred.astype(self.label_dtype, copy=False)
+
+        # Compression arguments
+        kwargs = {}
+        if self.compression != "none":
+            kwargs["compression"] = self.compression
+            level = self.level
+            if level is None:
+                level = _TIFF_COMPRESSIONS[self.compression]
+            if level is not None:
+                kwargs["compressionargs"] = {"level": level}
+
+        # Layout and parallel encoding
+        if self.tile is not None and pred.ndim >= len(self.tile):
+            kwargs["tile"] = self.tile
+        elif self.rows_per_strip is not None:
+            kwargs["rowsperstrip"] = self.rows_per_strip
+        elif self.num_threads > 1:
+            kwargs["rowsperstrip"] = 64
+        if self.num_threads > 1:
+            kwargs["maxworkers"] = self.num_threads
+
+        with TiffWriter(output_name) as tif:
+            tif.write(pred, **kwargs)
@@ -14,6 +14,7 @@ from ._device import (
     cuda_free_memory,
     cuda_get_gpu_memory_info,
     get_accelerator,
+    get_available_memory,
     get_device,
 )
 
@@ -23,5 +24,6 @@ __all__ = [
     "cuda_free_memory",
     "cuda_get_gpu_memory_info",
     "get_accelerator",
+    "get_available_memory",
     "get_device",
 ]
@@ -9,6 +9,10 @@
 #   Aaron Ponti - initial API and implementation
 # ******************************************************************************
 
+import os
+import sys
+from typing import Optional
+
 import torch
 
 
@@ -88,6 +92,57 @@ def cuda_get_gpu_memory_info() -> tuple[int, int]:
     return total_memory, free_memory
 
 
+def get_available_memory(device: torch.device) -> Optional[int]:
+    """Return the memory currently available on a device.
+
+    Parameters
+    ----------
+
+    device: torch.device
+        CUDA, MPS or CPU device.
+
+    Returns
+    -------
+
+    available_memory: Optional[int]
+        Available memory in bytes: free GPU memory for CUDA devices, memory that can still
+        be allocated (within the recommended maximum) for MPS, and available RAM for the
+        CPU. None if it cannot be determined.
+    """
+    device = torch.device(device)
+    if device.type == "cuda":
+        if not torch.cuda.is_available():
+            return None
+        free_memory, _ = torch.cuda.mem_get_info(device)
+        return free_memory
+
+    if device.type == "mps":
+        if not torch.backends.mps.is_available():
+            return None
+        return max(
+            torch.mps.recommended_max_memory() - torch.mps.driver_allocated_memory(), 0
+        )
+
+    if device.type == "cpu":
+        # Linux: memory available without swapping
+        if sys.platform.startswith("linux"):
+            try:
+                with open("/proc/meminfo", "r") as f:
+                    for line in f:
+                        if line.startswith("MemAvailable:"):
+                            return int(line.split()[1]) * 1024
+            except OSError:
+                pass
+
+        # Other POSIX systems: free physical pages
+        try:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (AttributeError, ValueError, OSError):
+            return None
+
+    return None
+
+
 def cuda_free_memory() -> None:
     """Free unused CUDA memory.
 
@@ -8,6 +8,7 @@
 #  Contributors:
 #    Aaron Ponti - initial API and implementation
 #  ******************************************************************************
+import itertools
 import os
 import re
 from abc import ABC, abstractmethod
@@ -30,8 +31,10 @@ from torch.optim.lr_scheduler import LRScheduler, OneCycleLR
 from torchmetrics import MeanAbsoluteError
 
 from qute import device
+from qute.callbacks import DatasetEpochCallback, TransformProfilingCallback
 from qute.campaigns import (
     CampaignTransforms,
+    InstrumentedCampaignTransforms,
     RestorationCampaignTransforms,
     SegmentationCampaignTransforms2D,
     SegmentationCampaignTransforms3D,
@@ -40,15 +43,34 @@ from qute.campaigns import (
 from qute.config import ConfigFactory
 from qute.data.dataloaders import DataModuleLocalFolder
 from qute.data.demos import CellRestorationDemo, CellSegmentationDemo
-from qute.data.inference import full_inference, full_inference_ensemble
+from qute.data.inference import (
+    full_inference,
+    full_inference_ensemble,
+    full_inference_tiled,
+    get_tiled_input_transforms,
+)
+from qute.data.manifest import PredictionManifest, hash_model
+from qute.data.precision import InferencePrecision, check_inference_precision
+from qute.data.tuning import tune_data_loader
+from qute.data.watch import watch_folder
+from qute.data.writers import TIFFPredictionWriter
+from qute.hash import calculate_file_hash
 from qute.models.attention_unet import AttentionUNet
 from qute.models.base_model import BaseModel
 from qute.models.dynunet import DynUNet
 from qute.models.factory import ModelFactory
+from qute.models.quantization import (
+    compare_quantized_model,
+    get_calibration_batches,
+    is_quantized,
+    quantize_model,
+)
 from qute.models.swinunetr import SwinUNETR
 from qute.models.unet import UNet
 from qute.project import Project
 from qute.random import set_global_rng_seed
+from qute.serve import InferenceServer
+from qute.transforms.objects import ProcessPoolBackend
 
 
 class Director(ABC):
@@ -135,6 +157,8 @@ class Director(ABC):
         self.trainer = None
         self.model = None
         self.steps_per_epoch = 0
+        self.tuned_data_loader_settings = None
+        self.post_processing_backend = None
 
     @abstractmethod
     def _setup_default_campaign_transforms(self):
@@ -156,6 +180,28 @@ class Director(ABC):
         """Set up default metrics."""
         raise NotImplementedError("Reimplement in child class.")
 
+    def _setup_post_processing_backend(self):
+        """Run the object post-processing of the campaign transforms in a pool of processes.
+
+        The pool is only set up if `post_processing_workers` is set in the configuration, and
+        for campaign transforms that support it (e.g., `SegmentationCampaignTransformsIDT2D` and
+        `SegmentationCampaignTransformsIDT3D`) and have no backend yet. It is shut down when
+        `run()` returns.
+        """
+        if self.config.post_processing_workers is None:
+            return
+        if not hasattr(self.campaign_transforms, "post_processing_backend"):
+            return
+        if self.campaign_transforms.post_processing_backend is not None:
+            return
+        if self.post_processing_backend is None:
+            self.post_processing_backend = ProcessPoolBackend(
+                num_workers=self.config.post_processing_workers,
+                block_size=self.config.post_processing_block_size,
+                halo=self.config.post_processing_halo,
+            )
+        self.campaign_transforms.post_processing_backend = self.post_processing_backend
+
     def _set_precision(self):
         """Set the precision for training based on the accelerator.
 
@@ -221,6 +267,237 @@ class Director(ABC):
         # Store the trainer precision
         self.trainer_precision = trainer_precision
 
+    def _run_full_inference(self, target_for_prediction, model_path=None):
+        """Run full inference on all images in the source folder for prediction."""
+        model = self._quantize_models([self.model])[0]
+        model_hash = None
+        if model_path is not None and self.config.resume_prediction:
+            model_hash = self._get_model_hash([model_path], [self.model], [model])
+        if not self.config.tiled_inference:
+            precision = self._setup_inference_precision(
+                model,
+                self.campaign_transforms.get_post_full_inference_transforms(),
+            )
+            full_inference(
+                model,
+                campaign_transforms=self.campaign_transforms,
+                data_loader=self.data_module.inference_dataloader(
+                    input_folder=self.config.source_for_prediction
+                ),
+                target_folder=target_for_prediction,
+                roi_size=self.config.patch_size,
+                batch_size=self.config.inference_window_batch_size,
+                transpose=False,
+                prefix="",
+                output_dtype=self.config.output_dtype,
+                writer=self._setup_prediction_writer(),
+                tta_variants=self.config.tta_variants,
+                tta_adaptive=self.config.tta_adaptive,
+                precision=precision,
+                resume=self.config.resume_prediction,
+                model_hash=model_hash,
+            )
+            return
+
+        # Out-of-core inference, one image (and one output tile) at a time (the images are
+        # too large to compare reduced-precision inference with float32 beforehand)
+        if self.config.inference_window_batch_size == "auto":
+            raise ValueError(
+                "`inference_window_batch_size` cannot be 'auto' with tiled inference."
+            )
+        precision = self._setup_inference_precision(check=False)
+        input_transforms, z_normalize = get_tiled_input_transforms(
+            self.campaign_transforms
+        )
+        Path(target_for_prediction).mkdir(parents=True, exist_ok=True)
+        source_for_prediction = Path(self.config.source_for_prediction)
+        input_files = [
+            *source_for_prediction.glob("*.tif"),
+            *source_for_prediction.glob("*.tiff"),
+        ]
+        for input_file in natsorted(input_files):
+            full_inference_tiled(
+                model,
+                input_file=input_file,
+                output_file=Path(target_for_prediction) / input_file.name,
+                roi_size=self.config.patch_size,
+                tile_size=self.config.inference_tile_size,
+                batch_size=self.config.inference_window_batch_size,
+                input_transforms=input_transforms,
+                z_normalize=z_normalize,
+                post_full_inference_transforms=self.campaign_transforms.get_post_full_inference_transforms(),
+                output_dtype=self.config.output_dtype,
+                compression=self.config.output_compression,
+                level=self.config.output_compression_level,
+                precision=precision,
+            )
+        print("Prediction completed.")
+
+    def _run_watch_inference(self, target_for_prediction, model_path=None):
+        """Predict the images written to the source folder for prediction as they arrive.
+
+        The model is kept warm between files, and the processed files are recorded in the
+        manifest of the target folder.
+        """
+        model = self._quantize_models([self.model])[0]
+        model_hash = (
+            self._get_model_hash([model_path], [self.model], [model])
+            if model_path is not None
+            else hash_model(model)
+        )
+
+        # The images are not there yet to check reduced-precision inference
+        precision = self._setup_inference_precision(check=False)
+        writer = self._setup_prediction_writer()
+        manifest = PredictionManifest(
+            target_for_prediction,
+            parameters={
+                "model": model_hash,
+                "inference_transforms": self.campaign_transforms.get_inference_transforms(),
+                "post_full_inference_transforms": self.campaign_transforms.get_post_full_inference_transforms(),
+                "roi_size": self.config.patch_size,
+                "output_dtype": self.config.output_dtype,
+                "writer": writer,
+                "precision": precision,
+            },
+        )
+        with InferenceServer(
+            {"model": model},
+            roi_size=self.config.patch_size,
+            campaign_transforms=self.campaign_transforms,
+            max_batch_size=self.config.inference_batch_size,
+            output_dtype=self.config.output_dtype,
+            writer=writer,
+            precision=precision,
+            in_channels=self.config.in_channels,
+        ) as server:
+            watch_folder(
+                server.predict,
+                input_folder=self.config.source_for_prediction,
+                target_folder=target_for_prediction,
+                manifest=manifest,
+                settle_time=self.config.watch_settle_time,
+                poll_interval=self.config.watch_poll_interval,
+                idle_timeout=self.config.watch_idle_timeout,
+                max_retries=self.config.watch_max_retries,
+                extension=writer.extension,
+            )
+
+    def _setup_inference_precision(
+        self,
+        network: Optional[Module] = None,
+        post_full_inference_transforms=None,
+        check: bool = True,
+    ):
+        """Set up the precision policy of full inference from the configuration.
+
+        Reduced precisions are compared with float32 on the first images for prediction (if
+        `inference_precision_check` is set), and replaced by float32 if the predictions differ
+        by more than `inference_precision_tolerance`.
+        """
+        precision = InferencePrecision(
+            self.config.inference_precision,
+            channels_last=self.config.inference_channels_last,
+            inference_mode=self.config.inference_mode,
+        )
+        if (
+            precision.dtype is None
+            or not check
+            or network is None
+            or is_quantized(network)
+            or not self.config.inference_precision_check
+        ):
+            return precision
+
+        # Compare with float32 on a sample of the images
+        data_loader = self.data_module.inference_dataloader(
+            input_folder=self.config.source_for_prediction
+        )
+        images = list(
+            itertools.islice(data_loader, self.config.inference_precision_check_images)
+        )
+        result = check_inference_precision(
+            network,
+            images,
+            roi_size=self.config.patch_size,
+            batch_size=self.config.inference_batch_size,
+            precision=precision,
+            device=device.get_device(),
+            post_transforms=post_full_inference_transforms,
+            tolerance=self.config.inference_precision_tolerance,
+        )
+        if result["accepted"]:
+            return precision
+        print("Falling back to float32 inference.")
+        return InferencePrecision(
+            "32",
+            channels_last=self.config.inference_channels_last,
+            inference_mode=self.config.inference_mode,
+        )
+
+    def _quantize_models(self, models: list) -> list:
+        """Quantize the models for CPU inference as configured.
+
+        Each quantized model is compared with its float model on the validation set, and the
+        float model is kept if the metrics drift by more than `quantization_max_metric_drift`.
+        """
+        mode = self.config.inference_quantization
+        if mode is None:
+            return models
+
+        # Calibrate on training patches, and compare on validation patches
+        self.data_module.setup("fit")
+        calibration_batches = None
+        if mode == "static":
+            calibration_batches = get_calibration_batches(
+                self.data_module, self.config.quantization_calibration_batches
+            )
+
+        quantized_models = []
+        for i, model in enumerate(models):
+            quantized_model = quantize_model(model, mode, calibration_batches)
+            print(f"Model {i}:")
+            report = compare_quantized_model(
+                model, quantized_model, self.data_module.val_dataloader()
+            )
+            max_metric_drift = self.config.quantization_max_metric_drift
+            if (
+                max_metric_drift is not None
+                and report["metric_drift"] > max_metric_drift
+            ):
+                print("The metrics drift too much: using the float model.")
+                quantized_model = model
+            quantized_models.append(quantized_model)
+        return quantized_models
+
+    def _get_model_hash(
+        self, model_paths: list, models: list, inference_models: list
+    ) -> str:
+        """Return the hash that identifies the models in the manifest of the predictions.
+
+        The hash combines the hashes of the checkpoint files and the quantization mode of
+        the models that were quantized for inference.
+        """
+        hashes = []
+        for model_path, model, inference_model in zip(
+            model_paths, models, inference_models
+        ):
+            model_hash = calculate_file_hash(model_path)
+            if inference_model is not model:
+                model_hash += f":{self.config.inference_quantization}"
+            hashes.append(model_hash)
+        return ",".join(hashes)
+
+    def _setup_prediction_writer(self):
+        """Set up the writer of the predictions of full inference from the configuration."""
+        return TIFFPredictionWriter(
+            compression=self.config.output_compression,
+            level=self.config.output_compression_level,
+            tile=self.config.output_tile_size,
+            num_threads=self.config.output_writer_threads,
+            label_dtype=self.config.output_label_dtype,
+        )
+
     def run(self):
         """Run the process as configured in the configuration file."""
 
@@ -228,19 +505,25 @@ class Director(ABC):
         set_global_rng_seed(self.config.seed, workers=True)
 
         # Get the mode
-        if self.config.trainer_mode == "train":
-            self._train()
+        try:
+            if self.config.trainer_mode == "train":
+                self._train()
 
-        elif self.config.trainer_mode == "resume":
-            self._resume()
+            elif self.config.trainer_mode == "resume":
+                self._resume()
 
-        elif self.config.trainer_mode == "predict":
-            self._predict()
+            elif self.config.trainer_mode == "predict":
+                self._predict()
 
-        else:
-            raise ValueError(
-                "Trainer mode must be one of 'train', 'resume', or 'predict'."
-            )
+            else:
+                raise ValueError(
+                    "Trainer mode must be one of 'train', 'resume', or 'predict'."
+                )
+        finally:
+            # Shut down the post-processing worker processes
+            if self.post_processing_backend is not None:
+                self.post_processing_backend.close()
+                self.post_processing_backend = None
 
         # Flag the run as successful
         self.project.mark_as_successful()
@@ -310,6 +593,7 @@ class Director(ABC):
         # If no campaign transforms were passed, set up default
         if self.campaign_transforms is None:
             self.campaign_transforms = self._setup_default_campaign_transforms()
+        self._setup_post_processing_backend()
 
         # If not data module was passed, set up default
         if self.data_module is None:
@@ -340,25 +624,25 @@ class Director(ABC):
             print("Target for prediction not specified in configuration.")
             target_for_prediction = self.project.run_dir / "predictions"
             print(f"Defaulting to {target_for_prediction}")
+        elif self.config.resume_prediction or self.config.watch_for_prediction:
+            # Resume (or update) the predictions of earlier runs
+            target_for_prediction = self.config.target_for_prediction
         else:
             # Append the run name
             target_for_prediction = (
                 self.config.target_for_prediction / self.project.run_dir.name
             )
 
+        # Predict the images as they are written to the source folder
+        if self.config.watch_for_prediction:
+            self._run_watch_inference(
+                target_for_prediction, model_path=self.config.source_model_path
+            )
+            return
+
         # Run full inference
-        full_inference(
-            self.model,
-            campaign_transforms=self.campaign_transforms,
-            data_loader=self.data_module.inference_dataloader(
-                input_folder=self.config.source_for_prediction
-            ),
-            target_folder=target_for_prediction,
-            roi_size=self.config.patch_size,
-            batch_size=self.config.inference_batch_size,
-            transpose=False,
-            prefix="",
-            output_dtype=self.config.output_dtype,
+        self._run_full_inference(
+            target_for_prediction, model_path=self.config.source_model_path
         )
 
     def _setup_basis_for_training_and_resume(self):
@@ -370,6 +654,14 @@ class Director(ABC):
         # If no campaign transforms were passed, set up default
         if self.campaign_transforms is None:
             self.campaign_transforms = self._setup_default_campaign_transforms()
+        self._setup_post_processing_backend()
+
+        # Instrument the transform pipelines if requested
+        if self.config.profile_transforms:
+            self.campaign_transforms = InstrumentedCampaignTransforms(
+                self.campaign_transforms,
+                stats_dir=self.project.run_dir / "transform_stats",
+            )
 
         # If not data module was passed, set up default
         if self.data_module is None:
@@ -381,6 +673,11 @@ class Director(ABC):
         # Calculate the number of steps per epoch
         self.data_module.prepare_data()
         self.data_module.setup("train")
+
+        # Tune the data loaders if requested
+        if self.config.tune_data_loader:
+            self.tuned_data_loader_settings = tune_data_loader(self.data_module)
+
         self.steps_per_epoch = len(self.data_module.train_dataloader())
         if self.steps_per_epoch == 0:
             raise ValueError("Number of steps per epoch is zero. Check your data.")
@@ -417,11 +714,20 @@ class Director(ABC):
         # Set up trainer
         self.trainer = self._setup_trainer()
 
+    def _store_run_settings(self):
+        """Copy the configuration file and the tuned data loader settings (if any) to
+        the run folder."""
+        self.project.copy_configuration_file()
+        if self.tuned_data_loader_settings is not None:
+            self.project.store_tuned_data_loader_settings(
+                self.tuned_data_loader_settings
+            )
+
     def _run_common_train_and_resume(self):
         """Run common training and testing operations for 'train' and 'resume' modes."""
 
-        # Copy the configuration file to the run folder
-        self.project.copy_configuration_file()
+        # Copy the configuration file and the tuned settings to the run folder
+        self._store_run_settings()
 
         # Train
         self.trainer.fit(self.model, datamodule=self.data_module)
@@ -464,6 +770,9 @@ class Director(ABC):
             print("Target for prediction not specified in configuration.")
             target_for_prediction = self.project.run_dir / "predictions"
             print(f"Defaulting to {target_for_prediction}")
+        elif self.config.resume_prediction:
+            # Resume (or update) the predictions of earlier runs
+            target_for_prediction = self.config.target_for_prediction
         else:
             # Append the run name
             target_for_prediction = (
@@ -471,18 +780,8 @@ class Director(ABC):
             )
 
         # Run full inference
-        full_inference(
-            self.model,
-            campaign_transforms=self.campaign_transforms,
-            data_loader=self.data_module.inference_dataloader(
-                input_folder=self.config.source_for_prediction
-            ),
-            target_folder=target_for_prediction,
-            roi_size=self.config.patch_size,
-            batch_size=self.config.inference_batch_size,
-            transpose=False,
-            prefix="",
-            output_dtype=self.config.output_dtype,
+        self._run_full_inference(
+            target_for_prediction, model_path=self.project.selected_model_path
         )
 
     def _setup_project(self):
@@ -534,6 +833,13 @@ class Director(ABC):
         )
         lr_monitor = LearningRateMonitor(logging_interval="step")
 
+        # Transform profiling
+        if self.config.profile_transforms:
+            transform_profiling = TransformProfilingCallback(
+                stats_dir=self.project.run_dir / "transform_stats",
+                summary_file=self.project.run_dir / "transform_stats.json",
+            )
+
         # Add them to the training callbacks list
         if self.config.use_early_stopping:
             training_callbacks = [
@@ -546,6 +852,12 @@ class Director(ABC):
                 model_checkpoint,
                 lr_monitor,
             ]
+        if self.config.profile_transforms:
+            training_callbacks.append(transform_profiling)
+
+        # Shuffle the volumes of the patch queue at every epoch
+        if self.config.patch_queue_pool_size is not None:
+            training_callbacks.append(DatasetEpochCallback())
 
         return training_callbacks, early_stopping, model_checkpoint, lr_monitor
 
@@ -610,8 +922,9 @@ class EnsembleDirector(Director):
         self.num_folds = num_folds
         self.current_fold = -1
 
-        # Keep track of the trained models
+        # Keep track of the trained models (and of their checkpoints)
         self._best_models = []
+        self._best_model_paths = []
 
     def _setup_trainer_callbacks(self):
         """Set up trainer callbacks."""
@@ -638,6 +951,19 @@ class EnsembleDirector(Director):
         lr_monitor = LearningRateMonitor(logging_interval="step")
         training_callbacks.append(lr_monitor)
 
+        # Transform profiling (the statistics are cumulated over the folds)
+        if self.config.profile_transforms:
+            training_callbacks.append(
+                TransformProfilingCallback(
+                    stats_dir=self.project.run_dir / "transform_stats",
+                    summary_file=self.project.run_dir / "transform_stats.json",
+                )
+            )
+
+        # Shuffle the volumes of the patch queue at every epoch
+        if self.config.patch_queue_pool_size is not None:
+            training_callbacks.append(DatasetEpochCallback())
+
         return training_callbacks, early_stopping, model_checkpoint, lr_monitor
 
     def _setup_trainer(self):
@@ -664,8 +990,8 @@ class EnsembleDirector(Director):
         # Set up components common to train and resume
         self._setup_basis_for_training_and_resume()
 
-        # Copy the configuration file to the run folder
-        self.project.copy_configuration_file()
+        # Copy the configuration file and the tuned settings to the run folder
+        self._store_run_settings()
 
         # Run training with n-fold cross-validation
         for fold in range(self.num_folds):
@@ -743,6 +1069,7 @@ class EnsembleDirector(Director):
 
             # Append to list of best models for inference
             self._best_models.append(model)
+            self._best_model_paths.append(self.model_checkpoint.best_model_path)
 
             # Test
             self.trainer.test(model, dataloaders=self.data_module.test_dataloader())
@@ -768,22 +1095,45 @@ class EnsembleDirector(Director):
 
     def _run_ensemble_inference(self, target_for_prediction):
         """Run ensemble inference using the trained models."""
+        # Quantized models (if requested)
+        models = self._quantize_models(self._best_models)
+        model_hash = None
+        if self.config.resume_prediction:
+            model_hash = self._get_model_hash(
+                self._best_model_paths, self._best_models, models
+            )
+
+        # Precision policy (checked on the first model of the ensemble)
+        post_full_inference_transforms = (
+            self.campaign_transforms.get_post_inference_transforms()
+        )
+        precision = self._setup_inference_precision(
+            models[0].net, post_full_inference_transforms
+        )
+
         # Run ensemble prediction
         full_inference_ensemble(
-            models=self._best_models,
+            models=models,
             data_loader=self.data_module.inference_dataloader(
                 input_folder=self.config.source_for_prediction,
             ),
             target_folder=target_for_prediction,
-            post_full_inference_transforms=self.campaign_transforms.get_post_inference_transforms(),
+            post_full_inference_transforms=post_full_inference_transforms,
             roi_size=self.config.patch_size,
-            batch_size=self.config.inference_batch_size,
+            batch_size=self.config.inference_window_batch_size,
             transpose=False,
             save_individual_preds=True,
-            voting_mechanism="mode",
+            voting_mechanism=self.config.ensemble_voting_mechanism,
             weights=None,
             prefix="",
             output_dtype=self.config.output_dtype,
+            writer=self._setup_prediction_writer(),
+            vote_chunk_size=self.config.ensemble_vote_chunk_size,
+            tta_variants=self.config.tta_variants,
+            tta_adaptive=self.config.tta_adaptive,
+            precision=precision,
+            resume=self.config.resume_prediction,
+            model_hash=model_hash,
         )
 
     def _predict(self):
@@ -812,6 +1162,7 @@ class EnsembleDirector(Director):
         # If no campaign transforms were passed, set up default
         if self.campaign_transforms is None:
             self.campaign_transforms = self._setup_default_campaign_transforms()
+        self._setup_post_processing_backend()
 
         # If not data module was passed, set up default
         if self.data_module is None:
@@ -833,6 +1184,9 @@ class EnsembleDirector(Director):
             print("Target for prediction not specified in configuration.")
             target_for_prediction = self.project.run_dir / "predictions"
             print(f"Defaulting to {target_for_prediction}")
+        elif self.config.resume_prediction:
+            # Resume (or update) the predictions of earlier runs
+            target_for_prediction = self.config.target_for_prediction
         else:
             # Append the run name
             target_for_prediction = (
@@ -849,6 +1203,7 @@ class EnsembleDirector(Director):
         """
         # Re-load all (best) models
         models = []
+        self._best_model_paths = []
 
         # We consider all subfolders with name strictly matching "fold_#" where # can
         # be any number of digits.
@@ -876,6 +1231,7 @@ class EnsembleDirector(Director):
 
             # Add it to the list
             models.append(model)
+            self._best_model_paths.append(model_path)
 
             # Inform
             print(f"Re-loaded model = {model_path}")
@@ -914,6 +1270,14 @@ class RestorationDirector(Director):
             target_images_label=self.config.target_images_label,
             inference_batch_size=self.config.inference_batch_size,
             num_workers=self.num_workers,
+            prefetch_factor=self.config.prefetch_factor,
+            cache_mode=self.config.cache_mode,
+            cache_dir=self.config.cache_dir,
+            cache_max_bytes=self.config.cache_max_bytes,
+            use_sampling_index=self.config.use_sampling_index,
+            patch_queue_pool_size=self.config.patch_queue_pool_size,
+            patch_queue_samples_per_volume=self.config.patch_queue_samples_per_volume,
+            patch_queue_shuffle_buffer_size=self.config.patch_queue_shuffle_buffer_size,
         )
 
         # Return the data module
@@ -972,6 +1336,14 @@ class SegmentationDirector(Director):
             target_images_label=self.config.target_images_label,
             inference_batch_size=self.config.inference_batch_size,
             num_workers=self.num_workers,
+            prefetch_factor=self.config.prefetch_factor,
+            cache_mode=self.config.cache_mode,
+            cache_dir=self.config.cache_dir,
+            cache_max_bytes=self.config.cache_max_bytes,
+            use_sampling_index=self.config.use_sampling_index,
+            patch_queue_pool_size=self.config.patch_queue_pool_size,
+            patch_queue_samples_per_volume=self.config.patch_queue_samples_per_volume,
+            patch_queue_shuffle_buffer_size=self.config.patch_queue_shuffle_buffer_size,
         )
 
         # Return data module
@@ -988,6 +1360,8 @@ class SegmentationDirector(Director):
             num_classes=self.config.out_channels,
             patch_size=self.config.patch_size,
             num_patches=self.config.num_patches,
+            on_device_augmentation=self.config.on_device_augmentation,
+            use_sampling_index=self.config.use_sampling_index,
         )
 
         # Return the campaign transforms
@@ -1011,6 +1385,8 @@ class SegmentationDirector3D(SegmentationDirector):
             voxel_size=self.config.voxel_size,
             to_isotropic=self.config.to_isotropic,
             upscale_z=self.config.up_scale_z,
+            on_device_augmentation=self.config.on_device_augmentation,
+            use_sampling_index=self.config.use_sampling_index,
         )
 
         # Return the campaign transforms
@@ -1073,6 +1449,14 @@ class EnsembleSegmentationDirector(EnsembleDirector, SegmentationDirector):
             target_images_label=self.config.target_images_label,
             inference_batch_size=self.config.inference_batch_size,
             num_workers=self.num_workers,
+            prefetch_factor=self.config.prefetch_factor,
+            cache_mode=self.config.cache_mode,
+            cache_dir=self.config.cache_dir,
+            cache_max_bytes=self.config.cache_max_bytes,
+            use_sampling_index=self.config.use_sampling_index,
+            patch_queue_pool_size=self.config.patch_queue_pool_size,
+            patch_queue_samples_per_volume=self.config.patch_queue_samples_per_volume,
+            patch_queue_shuffle_buffer_size=self.config.patch_queue_shuffle_buffer_size,
         )
 
         # Return data module
@@ -1107,6 +1491,9 @@ class CellRestorationDemoDirector(RestorationDirector):
             test_fraction=self.config.test_fraction,
             inference_batch_size=self.config.inference_batch_size,
             num_workers=self.num_workers,
+            cache_mode=self.config.cache_mode,
+            cache_dir=self.config.cache_dir,
+            cache_max_bytes=self.config.cache_max_bytes,
         )
 
         # Return data module
@@ -1131,6 +1518,9 @@ class CellSegmentationDemoDirector(SegmentationDirector):
             test_fraction=self.config.test_fraction,
             inference_batch_size=self.config.inference_batch_size,
             num_workers=self.num_workers,
+            cache_mode=self.config.cache_mode,
+            cache_dir=self.config.cache_dir,
+            cache_max_bytes=self.config.cache_max_bytes,
         )
 
         # Return data module
@@ -1156,5 +1546,8 @@ class EnsembleCellSegmentationDemoDirector(EnsembleSegmentationDirector):
             test_fraction=self.config.test_fraction,
             inference_batch_size=self.config.inference_batch_size,
             num_workers=self.num_workers,
+            cache_mode=self.config.cache_mode,
+            cache_dir=self.config.cache_dir,
+            cache_max_bytes=self.config.cache_max_bytes,
         )
         return data_module
@@ -0,0 +1,35 @@
+#  ********************************************************************************
+#  Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+#  All rights reserved. This program and the accompanying materials
+#  are made available under the terms of the Apache License Version 2.0
+#  which accompanies this distribution, and is available at
+#  https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Contributors:
+#    Aaron Ponti - initial API and implementation
+#  ******************************************************************************
+
+from ._export import (
+    EagerBackend,
+    InferenceBackend,
+    ONNXRuntimeBackend,
+    TorchScriptBackend,
+    benchmark_backends,
+    export_checkpoints,
+    export_model,
+    load_backend,
+    read_export_metadata,
+)
+
+__doc__ = "Export of trained models to TorchScript and ONNX, and inference backends."
+__all__ = [
+    "EagerBackend",
+    "InferenceBackend",
+    "ONNXRuntimeBackend",
+    "TorchScriptBackend",
+    "benchmark_backends",
+    "export_checkpoints",
+    "export_model",
+    "load_backend",
+    "read_export_metadata",
+]
@@ -0,0 +1,481 @@
+#  ********************************************************************************
+#  Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+#  All rights reserved. This program and the accompanying materials
+#  are made available under the terms of the Apache License Version 2.0
+#  which accompanies this distribution, and is available at
+#  https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Contributors:
+#    Aaron Ponti - initial API and implementation
+#  ******************************************************************************
+
+import json
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+# Supported export formats and their file extensions
+_FORMATS = {
+    "torchscript": ".pt",
+    "onnx": ".onnx",
+}
+
+
+def _import_onnxruntime():
+    """Import onnxruntime (an optional dependency)."""
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError(
+            "ONNX Runtime is required to run ONNX models: install it with `pip install onnxruntime`."
+        ) from e
+    return onnxruntime
+
+
+def _metadata_file(file_name: Union[Path, str]) -> Path:
+    """Return the name of the metadata file that accompanies an exported model."""
+    file_name = Path(file_name)
+    return file_name.with_name(f"{file_name.name}.json")
+
+
+def read_export_metadata(file_name: Union[Path, str]) -> dict:
+    """Read the metadata of an exported model (empty if the model has none)."""
+    metadata_file = _metadata_file(file_name)
+    if not metadata_file.is_file():
+        return {}
+    with open(metadata_file, "r") as f:
+        return json.load(f)
+
+
+class InferenceBackend(ABC):
+    """Abstract base class for the backends that run a network during inference.
+
+    A backend is called with a batch of windows (B, C, ...) and returns the output of the
+    network as a float32 tensor on the same device, so that it can be passed as network to
+    MONAI's `SlidingWindowInferer` (and hence to `qute.data.inference.full_inference()`)
+    in place of a model.
+    """
+
+    def __init__(self, metadata: Optional[dict] = None):
+        self.metadata = metadata if metadata is not None else {}
+
+    @property
+    def patch_size(self) -> Optional[Tuple[int, ...]]:
+        """Patch size the network was exported with (None if unknown)."""
+        patch_size = self.metadata.get("patch_size", None)
+        return tuple(patch_size) if patch_size is not None else None
+
+    @property
+    def dynamic(self) -> bool:
+        """True if the network accepts windows of any size."""
+        return self.metadata.get("dynamic", True)
+
+    def _check_input(self, x: torch.Tensor):
+        """Make sure that fixed-shape networks are called with windows of the right size."""
+        if not self.dynamic and self.patch_size is not None:
+            if tuple(x.shape[2:]) != self.patch_size:
+                raise ValueError(
+                    f"The model was exported for windows of size {self.patch_size}, "
+                    f"but was called with {tuple(x.shape[2:])}: use the same `roi_size` "
+                    f"or export with dynamic shapes."
+                )
+
+    def to(self, device=None, memory_format=None):
+        """Move the backend to a device (where supported)."""
+        return self
+
+    def eval(self):
+        """Switch to evaluation mode (backends are always in evaluation mode)."""
+        return self
+
+    @abstractmethod
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        pass
+
+
+class EagerBackend(InferenceBackend):
+    """Runs a PyTorch module (e.g., a trained model) as is."""
+
+    def __init__(self, module: torch.nn.Module, metadata: Optional[dict] = None):
+        super().__init__(metadata)
+        self.module = module
+
+    def to(self, device=None, memory_format=None):
+        if device is not None:
+            self.module.to(device)
+        if memory_format is not None:
+            self.module.to(memory_format=memory_format)
+        return self
+
+    def eval(self):
+        self.module.eval()
+        return self
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        return self.module(x)
+
+
+class TorchScriptBackend(InferenceBackend):
+    """Runs a TorchScript model exported with `export_model()`."""
+
+    def __init__(self, file_name: Union[Path, str]):
+        super().__init__(read_export_metadata(file_name))
+        self.file_name = Path(file_name)
+        self.module = torch.jit.load(str(file_name), map_location="cpu")
+        self.module.eval()
+
+    def to(self, device=None, memory_format=None):
+        if device is not None:
+            self.module.to(device)
+        if memory_format is not None:
+            self.module.to(memory_format=memory_format)
+        return self
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        self._check_input(x)
+        return self.module(x)
+
+
+class ONNXRuntimeBackend(InferenceBackend):
+    """Runs an ONNX model exported with `export_model()` with ONNX Runtime on the CPU.
+
+    The windows are copied to the CPU (if needed) and the outputs are returned on the device
+    of the input. Autocast and memory formats do not apply: ONNX Runtime optimizes the graph
+    itself.
+    """
+
+    def __init__(self, file_name: Union[Path, str], num_threads: Optional[int] = None):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        file_name: Union[Path, str]
+            ONNX model.
+
+        num_threads: Optional[int] = None
+            Number of threads used by ONNX Runtime within an operator. Omit to let ONNX
+            Runtime decide.
+        """
+        super().__init__(read_export_metadata(file_name))
+        self.file_name = Path(file_name)
+        onnxruntime = _import_onnxruntime()
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            str(file_name), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        self._check_input(x)
+        inputs = x.detach().cpu().numpy().astype(np.float32, copy=False)
+        (output,) = self.session.run(None, {self.input_name: inputs})
+        return torch.from_numpy(output).to(x.device)
+
+
+def load_backend(file_name: Union[Path, str], **kwargs) -> InferenceBackend:
+    """Load an exported model into the matching backend (by file extension).
+
+    Parameters
+    ----------
+
+    file_name: Union[Path, str]
+        TorchScript (.pt) or ONNX (.onnx) model exported with `export_model()`.
+
+    kwargs:
+        Additional arguments for the backend (e.g., `num_threads` for `ONNXRuntimeBackend`).
+
+    Returns
+    -------
+
+    backend: InferenceBackend
+        Backend that runs the model.
+    """
+    file_name = Path(file_name)
+    if not file_name.is_file():
+        raise IOError(f"The exported model {file_name} does not exist.")
+    if file_name.suffix == _FORMATS["torchscript"]:
+        return TorchScriptBackend(file_name, **kwargs)
+    if file_name.suffix == _FORMATS["onnx"]:
+        return ONNXRuntimeBackend(file_name, **kwargs)
+    raise ValueError(
+        f"Unsupported model file {file_name.name}: expected one of {', '.join(_FORMATS.values())}."
+    )
+
+
+def export_model(
+    network: torch.nn.Module,
+    output_file: Union[Path, str],
+    patch_size: Tuple[int, ...],
+    in_channels: int = 1,
+    export_format: str = "torchscript",
+    dynamic: bool = False,
+    opset_version: int = 17,
+    metadata: Optional[dict] = None,
+) -> Path:
+    """Export a network to TorchScript or ONNX for inference.
+
+    The batch dimension is always dynamic. The spatial dimensions are fixed to `patch_size`
+    unless `dynamic` is set. The export parameters are written next to the exported model
+    (as `<output_file>.json`) and are used by the backends to validate their inputs.
+
+    Parameters
+    ----------
+
+    network: torch.nn.Module
+        Network to export (e.g., the `net` of a trained model). It is moved to the CPU and
+        switched to evaluation mode.
+
+    output_file: Union[Path, str]
+        Exported model. The extension is set to .pt (TorchScript) or .onnx (ONNX).
+
+    patch_size: Tuple[int, ...]
+        Size of the windows (the `patch_size` used for training).
+
+    in_channels: int = 1
+        Number of input channels.
+
+    export_format: str = "torchscript"
+        One of "torchscript" or "onnx". ONNX export requires the `onnx` package.
+
+    dynamic: bool = False
+        Set to True to export a model that accepts windows of any size. Fixed shapes allow
+        for more graph optimizations.
+
+    opset_version: int = 17
+        ONNX opset version.
+
+    metadata: Optional[dict] = None
+        Additional information to store with the exported model (e.g., the source
+        checkpoint).
+
+    Returns
+    -------
+
+    output_file: Path
+        Full path of the exported model.
+    """
+    if export_format not in _FORMATS:
+        raise ValueError(
+            f"`export_format` must be one of {', '.join(_FORMATS.keys())}."
+        )
+    output_file = Path(output_file).with_suffix(_FORMATS[export_format])
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    # Trace on the CPU, in float32 and in the default memory format
+    network = network.to("cpu", memory_format=torch.contiguous_format).eval()
+    patch_size = tuple(int(p) for p in patch_size)
+    example = torch.randn((1, in_channels) + patch_size)
+    with torch.no_grad():
+        reference = network(example)
+
+    if export_format == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(network, example)
+        torch.jit.save(traced, str(output_file))
+    else:
+        try:
+            import onnx  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                "The `onnx` package is required to export to ONNX: install it with `pip install onnx`."
+            ) from e
+        spatial_names = ["z", "y", "x"][-len(patch_size) :]
+        dynamic_axes = {0: "batch"}
+        if dynamic:
+            dynamic_axes.update({2 + i: n for i, n in enumerate(spatial_names)})
+        torch.onnx.export(
+            network,
+            example,
+            str(output_file),
+            input_names=["input"],
+            output_names=["output"],
+            dynamic_axes={"input": dynamic_axes, "output": dynamic_axes},
+            opset_version=opset_version,
+            dynamo=False,
+        )
+
+    # Store the export parameters
+    export_metadata = {
+        "format": export_format,
+        "patch_size": list(patch_size),
+        "in_channels": in_channels,
+        "out_channels": int(reference.shape[1]),
+        "spatial_dims": len(patch_size),
+        "dynamic": dynamic,
+    }
+    if metadata is not None:
+        export_metadata.update(metadata)
+    with open(_metadata_file(output_file), "w") as f:
+        json.dump(export_metadata, f, indent=2)
+
+    print(f"Exported {output_file}.")
+    return output_file
+
+
+def export_checkpoints(
+    config,
+    checkpoint: Optional[Union[Path, str]],
+    output_dir: Union[Path, str],
+    export_format: str = "torchscript",
+    dynamic: bool = False,
+) -> list[Path]:
+    """Export trained models (Lightning checkpoints) to TorchScript or ONNX.
+
+    Only the network of the model is exported: running the exported model does not need
+    Lightning or MONAI.
+
+    Parameters
+    ----------
+
+    config: qute.config.Config
+        Configuration the models were trained with (model class, patch size, channels).
+
+    checkpoint: Optional[Union[Path, str]]
+        Checkpoint (.ckpt) file, or folder to search recursively for checkpoints (e.g., the
+        `models` folder of a run, as listed by `qute.project.Project.models()`). Omit to
+        use the `source_model_path` of the configuration.
+
+    output_dir: Union[Path, str]
+        Folder where to write the exported models (named after the checkpoints).
+
+    export_format: str = "torchscript"
+        One of "torchscript" or "onnx".
+
+    dynamic: bool = False
+        Set to True to export models that accept windows of any size.
+
+    Returns
+    -------
+
+    exported: list[Path]
+        Full paths of the exported models.
+    """
+    from natsort import natsorted
+
+    from qute.models.factory import ModelFactory
+
+    if checkpoint is None or checkpoint == "":
+        checkpoint = config.source_model_path
+    if checkpoint is None or checkpoint == "":
+        raise ValueError("No checkpoint specified.")
+    checkpoint = Path(checkpoint)
+    if checkpoint.is_dir():
+        checkpoints = natsorted(list(checkpoint.rglob("*.ckpt")))
+    elif checkpoint.is_file():
+        checkpoints = [checkpoint]
+    else:
+        raise IOError(f"The checkpoint {checkpoint} does not exist.")
+    if len(checkpoints) == 0:
+        raise IOError(f"No checkpoints found in {checkpoint}.")
+
+    model_class = ModelFactory.get_model_class(config)
+    class_names = config.class_names if hasattr(config, "class_names") else []
+    exported = []
+    for ckpt in checkpoints:
+        model = model_class.load_from_checkpoint(
+            ckpt,
+            map_location="cpu",
+            weights_only=False,
+            criterion=None,
+            metrics=None,
+            class_names=class_names,
+        )
+
+        # Keep the names of the fold sub-folders, if any
+        relative = ckpt.relative_to(checkpoint) if checkpoint.is_dir() else ckpt.name
+        exported.append(
+            export_model(
+                model.net,
+                Path(output_dir) / relative,
+                patch_size=config.patch_size,
+                in_channels=config.in_channels,
+                export_format=export_format,
+                dynamic=dynamic,
+                metadata={
+                    "checkpoint": str(ckpt.resolve()),
+                    "model_class": config.model_class,
+                },
+            )
+        )
+    return exported
+
+
+def benchmark_backends(
+    backends: dict[str, Callable[[], InferenceBackend]],
+    input_shape: Tuple[int, ...],
+    num_iterations: int = 20,
+    device: Union[str, torch.device] = "cpu",
+    verbose: bool = True,
+) -> dict:
+    """Compare the startup time and the steady-state throughput of inference backends.
+
+    Parameters
+    ----------
+
+    backends: dict[str, Callable[[], InferenceBackend]]
+        Functions that load each backend, by name (e.g., {"eager": ..., "onnx": ...}). The
+        time to load the backend is part of its startup time.
+
+    input_shape: Tuple[int, ...]
+        Shape of the batch of windows (B, C, ...) to predict.
+
+    num_iterations: int = 20
+        Number of batches predicted to measure the throughput (after the first one).
+
+    device: Union[str, torch.device] = "cpu"
+        Device to run on.
+
+    verbose: bool = True
+        Set to True to print a report.
+
+    Returns
+    -------
+
+    report: dict
+        For each backend: "startup" (seconds to load the backend and predict the first
+        batch), "latency" (mean seconds per batch afterwards) and "throughput" (windows per
+        second afterwards).
+    """
+    device = torch.device(device)
+    x = torch.randn(input_shape, device=device)
+    report = {}
+    for name, load in backends.items():
+        with torch.inference_mode():
+            t0 = time.perf_counter()
+            backend = load().to(device).eval()
+            backend(x)
+            startup = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            for _ in range(num_iterations):
+                backend(x)
+            latency = (time.perf_counter() - t0) / max(1, num_iterations)
+        report[name] = {
+            "startup": startup,
+            "latency": latency,
+            "throughput": input_shape[0] / latency if latency > 0 else float("inf"),
+        }
+
+    if verbose:
+        reference = report.get("eager", None)
+        print(f"{'Backend':<12} {'Startup (s)':>12} {'Windows/s':>12} {'Speed-up':>9}")
+        for name, values in report.items():
+            speed_up = (
+                f"{values['throughput'] / reference['throughput']:.2f}x"
+                if reference is not None
+                else "-"
+            )
+            print(
+                f"{name:<12} {values['startup']:>12.3f} {values['throughput']:>12.1f} {speed_up:>9}"
+            )
+    return report
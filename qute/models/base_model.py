@@ -93,6 +93,9 @@ class BaseModel(pl.LightningModule):
         # Placeholder for the network, to be defined in subclasses
         self.net = None
 
+        # On-device training augmentations (retrieved from the campaign on first use)
+        self._on_device_train_transforms = None
+
         # Log the hyperparameters
         self.save_hyperparameters(ignore=["criterion", "metrics"])
 
@@ -129,6 +132,21 @@ class BaseModel(pl.LightningModule):
         y_hat = self.net(x)
         return y_hat
 
+    def on_after_batch_transfer(self, batch, dataloader_idx: int):
+        """Apply the on-device augmentations of the campaign to the training batches.
+
+        The augmentations (see `CampaignTransforms.get_on_device_train_transforms()`) run on
+        the whole collated batch, on the device the batch was transferred to.
+        """
+        if self._trainer is not None and self.trainer.training:
+            if self._on_device_train_transforms is None:
+                self._on_device_train_transforms = (
+                    self.campaign_transforms.get_on_device_train_transforms() or False
+                )
+            if self._on_device_train_transforms:
+                batch = self._on_device_train_transforms(batch)
+        return batch
+
     def training_step(self, batch, batch_idx):
         """Perform a training step."""
         x, y = batch
@@ -0,0 +1,323 @@
+#  ********************************************************************************
+#  Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+#  All rights reserved. This program and the accompanying materials
+#  are made available under the terms of the Apache License Version 2.0
+#  which accompanies this distribution, and is available at
+#  https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Contributors:
+#    Aaron Ponti - initial API and implementation
+#  ******************************************************************************
+
+import copy
+import itertools
+import time
+from typing import TYPE_CHECKING, Iterable, Optional
+
+import torch
+from monai.metrics import Metric
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from torch.utils.data import DataLoader
+
+# The models pull in PyTorch Lightning, which is not needed to run quantized networks
+if TYPE_CHECKING:
+    from qute.models.base_model import BaseModel
+
+__doc__ = "Post-training int8 quantization of models for CPU inference."
+__all__ = [
+    "compare_quantized_model",
+    "get_calibration_batches",
+    "is_quantized",
+    "quantize_model",
+]
+
+
+def _get_quantizable_models() -> tuple:
+    """Return the model classes that can be quantized."""
+    from qute.models.attention_unet import AttentionUNet
+    from qute.models.unet import UNet
+
+    return UNet, AttentionUNet
+
+
+class _FloatPReLU(torch.nn.PReLU):
+    """PReLU that is kept in float32 by static quantization.
+
+    The quantized PReLU of PyTorch is not accurate enough, and PReLU cannot be excluded
+    from quantization by type.
+    """
+
+    pass
+
+
+def _keep_prelu_in_float(module: torch.nn.Module) -> torch.nn.Module:
+    """Replace all PReLU modules with `_FloatPReLU` (in place)."""
+    for name, child in module.named_children():
+        if type(child) is torch.nn.PReLU:
+            prelu = _FloatPReLU(num_parameters=child.num_parameters)
+            prelu.weight = child.weight
+            setattr(module, name, prelu)
+        else:
+            _keep_prelu_in_float(child)
+    return module
+
+
+def _get_quantization_engine() -> str:
+    """Return the best quantized engine available on this CPU."""
+    for engine in ["x86", "fbgemm", "qnnpack"]:
+        if engine in torch.backends.quantized.supported_engines:
+            return engine
+    raise RuntimeError("No quantized engine is available on this platform.")
+
+
+def is_quantized(network) -> bool:
+    """Return True if the network (or model) contains quantized modules."""
+    if not isinstance(network, torch.nn.Module):
+        return False
+    return any(
+        type(module).__module__.startswith("torch.ao.nn.quantized")
+        for module in network.modules()
+    )
+
+
+def get_calibration_batches(data_module, num_batches: int = 8) -> list[torch.Tensor]:
+    """Return a sample of image batches from the training set for static quantization.
+
+    Parameters
+    ----------
+
+    data_module: qute.data.dataloaders.DataModuleLocalFolder
+        Data module (already set up) the model was trained with.
+
+    num_batches: int = 8
+        Number of batches of training patches to return.
+
+    Returns
+    -------
+
+    batches: list[torch.Tensor]
+        Batches of images (without labels).
+    """
+    if num_batches < 1:
+        raise ValueError("`num_batches` must be at least 1.")
+    batches = []
+    for x, _ in itertools.islice(data_module.train_dataloader(), num_batches):
+        batches.append(torch.as_tensor(x).float().cpu())
+    if len(batches) == 0:
+        raise ValueError("The training set is empty.")
+    return batches
+
+
+def quantize_model(
+    model: "BaseModel",
+    mode: str = "static",
+    calibration_batches: Optional[Iterable[torch.Tensor]] = None,
+) -> "BaseModel":
+    """Quantize a trained UNet or AttentionUNet to int8 for inference on the CPU.
+
+    The model is copied: the float model is left untouched. The network of the copy is
+    quantized, so that the copy can be passed to `full_inference()` and (with other quantized
+    models) to `full_inference_ensemble()`, which run quantized models on the CPU.
+
+    Parameters
+    ----------
+
+    model: BaseModel
+        Trained model (a `UNet` or an `AttentionUNet`, as built by `ModelFactory`).
+
+    mode: str = "static"
+        "dynamic": int8 weights, with activations quantized on the fly. PyTorch only
+                   quantizes the linear layers dynamically, so a ValueError is raised for
+                   networks without linear layers (e.g., convolutional networks).
+        "static": int8 weights and activations of the convolutions (FX graph mode). The
+                  ranges of the activations are calibrated on `calibration_batches`. PReLU
+                  activations are kept in float32.
+
+    calibration_batches: Optional[Iterable[torch.Tensor]] = None
+        Batches of images representative of the data (see `get_calibration_batches()`).
+        Required for static quantization.
+
+    Returns
+    -------
+
+    quantized_model: BaseModel
+        Copy of the model with a quantized network, in evaluation mode on the CPU.
+    """
+    if not isinstance(model, _get_quantizable_models()):
+        raise ValueError("Only UNet and AttentionUNet models can be quantized.")
+    if mode not in ["dynamic", "static"]:
+        raise ValueError("`mode` must be one of 'dynamic' or 'static'.")
+
+    quantized_model = copy.deepcopy(model).cpu().eval()
+    if mode == "dynamic":
+        quantized_model.net = quantize_dynamic(
+            quantized_model.net, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        if not is_quantized(quantized_model.net):
+            raise ValueError(
+                "The network has no layers that can be quantized dynamically: "
+                "use static quantization for convolutional networks."
+            )
+        return quantized_model
+
+    # Static quantization
+    if calibration_batches is None:
+        raise ValueError("Static quantization requires `calibration_batches`.")
+    calibration_batches = [torch.as_tensor(x).float() for x in calibration_batches]
+    if len(calibration_batches) == 0:
+        raise ValueError("Static quantization requires `calibration_batches`.")
+    engine = _get_quantization_engine()
+    torch.backends.quantized.engine = engine
+    qconfig_mapping = get_default_qconfig_mapping(engine).set_object_type(
+        _FloatPReLU, None
+    )
+    prepared = prepare_fx(
+        _keep_prelu_in_float(quantized_model.net),
+        qconfig_mapping,
+        example_inputs=(calibration_batches[0],),
+    )
+
+    # Calibrate
+    with torch.no_grad():
+        for x in calibration_batches:
+            prepared(x)
+
+    quantized_model.net = convert_fx(prepared)
+    return quantized_model
+
+
+def _as_scores(scores) -> torch.Tensor:
+    """Return the metric scores of a batch as a (B, C) tensor (a scalar becomes (1, 1))."""
+    scores = torch.as_tensor(scores).float().detach().cpu()
+    if scores.ndim == 0:
+        return scores.reshape(1, 1)
+    if scores.ndim == 1:
+        return scores[:, None]
+    return scores.flatten(1)
+
+
+def compare_quantized_model(
+    float_model: "BaseModel",
+    quantized_model: "BaseModel",
+    data_loader: DataLoader,
+    metrics: Optional[Metric] = None,
+    num_batches: Optional[int] = None,
+    verbose: bool = True,
+) -> dict:
+    """Compare the predictions and the metrics of a quantized model with the float model.
+
+    Parameters
+    ----------
+
+    float_model: BaseModel
+        Float model.
+
+    quantized_model: BaseModel
+        Quantized model (see `quantize_model()`).
+
+    data_loader: DataLoader
+        Loader of (image, label) batches, e.g., `DataModuleLocalFolder.val_dataloader()`.
+
+    metrics: Optional[Metric] = None
+        Metric to compare (e.g., `DiceMetric(include_background=False, reduction="none")`)
+        against the labels, after the validation metrics transforms of the campaign. Omit to
+        use the metrics of the float model; if it has none, only the predictions are
+        compared.
+
+    num_batches: Optional[int] = None
+        Number of batches to compare. Omit to use the whole data loader.
+
+    verbose: bool = True
+        Set to True to print the report.
+
+    Returns
+    -------
+
+    report: dict
+        "relative_error": mean absolute difference of the outputs relative to the mean
+                          absolute float output.
+        "agreement": fraction of pixels with the same (transformed) prediction (NaN if the
+                     campaign has no validation metrics transforms).
+        "float_metrics", "quantized_metrics": mean metrics per class (None without metrics).
+        "metric_drift": largest absolute difference of the mean metrics per class (0.0
+                        without metrics).
+        "float_time", "quantized_time": seconds spent in the forward passes.
+    """
+    if metrics is None:
+        metrics = float_model.metrics
+    transforms = float_model.campaign_transforms.get_val_metrics_transforms()
+    float_model = float_model.cpu().eval()
+    quantized_model = quantized_model.cpu().eval()
+
+    absolute_error, absolute_value = 0.0, 0.0
+    agreeing, total = 0, 0
+    float_scores, quantized_scores = [], []
+    float_time, quantized_time = 0.0, 0.0
+    with torch.no_grad():
+        for x, y in itertools.islice(data_loader, num_batches):
+            x = torch.as_tensor(x).float().cpu()
+            y = torch.as_tensor(y).cpu()
+
+            t0 = time.perf_counter()
+            y_float = float_model(x)
+            float_time += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            y_quantized = quantized_model(x)
+            quantized_time += time.perf_counter() - t0
+
+            absolute_error += (y_quantized - y_float).abs().sum().item()
+            absolute_value += y_float.abs().sum().item()
+
+            if transforms is not None:
+                y_float = transforms(y_float)
+                y_quantized = transforms(y_quantized)
+                agreeing += (y_float == y_quantized).sum().item()
+                total += y_float.numel()
+
+            if metrics is not None:
+                float_scores.append(_as_scores(metrics(y_float, y)))
+                quantized_scores.append(_as_scores(metrics(y_quantized, y)))
+
+    # Do not leave the scores of the comparison in the state of the metrics
+    if metrics is not None and hasattr(metrics, "reset"):
+        metrics.reset()
+
+    report = {
+        "relative_error": absolute_error / max(absolute_value, 1e-12),
+        "agreement": agreeing / total if total > 0 else float("nan"),
+        "float_metrics": None,
+        "quantized_metrics": None,
+        "metric_drift": 0.0,
+        "float_time": float_time,
+        "quantized_time": quantized_time,
+    }
+    if len(float_scores) > 0:
+        report["float_metrics"] = torch.cat(float_scores).nanmean(dim=0).tolist()
+        report["quantized_metrics"] = (
+            torch.cat(quantized_scores).nanmean(dim=0).tolist()
+        )
+        report["metric_drift"] = max(
+            abs(q - f)
+            for f, q in zip(report["float_metrics"], report["quantized_metrics"])
+        )
+
+    if verbose:
+        print(
+            f"Quantized model: relative error {report['relative_error']:.2e}, "
+            f"agreement {report['agreement']:.4f}, "
+            f"time {quantized_time:.2f} s (float: {float_time:.2f} s)."
+        )
+        if report["float_metrics"] is not None:
+            # The background may not be part of the metrics
+            num_scores = len(report["float_metrics"])
+            class_names = float_model.class_names
+            if class_names is None or len(class_names) < num_scores:
+                class_names = [f"class_{c}" for c in range(num_scores)]
+            class_names = class_names[len(class_names) - num_scores :]
+            for name, f, q in zip(
+                class_names, report["float_metrics"], report["quantized_metrics"]
+            ):
+                print(f"  {name}: metric {f:.4f} (float) -> {q:.4f} (quantized).")
+            print(f"  Largest metric drift: {report['metric_drift']:.4f}.")
+    return report
@@ -133,6 +133,22 @@ class Project:
         """Copy configuration file to run directory."""
         shutil.copy(self._config.config_file, self._run_dir)
 
+    def store_tuned_data_loader_settings(self, settings: dict):
+        """Append the tuned data loader settings to the configuration file in the run directory.
+
+        The settings are written to a `[tuned_data_loader]` section, so that the run keeps
+        a record of the settings that were actually used.
+        """
+        config_file = self._run_dir / Path(self._config.config_file).name
+        if not config_file.is_file():
+            self.copy_configuration_file()
+        with open(config_file, "a") as file:
+            file.write("\n[tuned_data_loader]\n")
+            for key in ["num_workers", "prefetch_factor", "pin_memory", "batch_size"]:
+                value = settings[key]
+                file.write(f"{key} = {'' if value is None else value}\n")
+            file.write(f"samples_per_second = {settings['samples_per_second']:.2f}\n")
+
     def store_best_score(self, monitor: str, score: float, fold: int = -1):
         """Store the best score to the run directory."""
         if fold >= 0:
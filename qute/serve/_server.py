@@ -0,0 +1,611 @@
+#  ********************************************************************************
+#  Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+#  All rights reserved. This program and the accompanying materials
+#  are made available under the terms of the Apache License Version 2.0
+#  which accompanies this distribution, and is available at
+#  https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Contributors:
+#    Aaron Ponti - initial API and implementation
+#  ******************************************************************************
+
+import json
+import os
+import queue
+import socketserver
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import torch
+from monai.inferers import SlidingWindowInferer
+from monai.transforms import Compose
+from monai.utils import BlendMode
+
+from qute.campaigns import CampaignTransforms
+from qute.data.inference import _get_device_and_precision, _post_process_and_save
+from qute.data.precision import InferencePrecision
+from qute.data.writers import PredictionWriter, TIFFPredictionWriter
+from qute.transforms.io import CustomND2Reader, CustomTIFFReader
+
+
+class _PendingWindows:
+    """Batch of sliding windows of one request, waiting to be predicted."""
+
+    def __init__(self, windows: torch.Tensor):
+        self.windows = windows
+        self.output = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class DynamicBatcher:
+    """Groups the sliding windows of concurrent requests into shared batches.
+
+    The batcher is passed as network to a `SlidingWindowInferer` in each request thread: the
+    windows of all requests are queued, and a single worker thread runs the network on
+    batches of up to `max_batch_size` windows, waiting at most `max_wait` seconds for more
+    windows to fill a batch.
+    """
+
+    def __init__(
+        self,
+        network,
+        device: torch.device,
+        max_batch_size: int = 16,
+        max_wait: float = 0.005,
+        precision: Optional[InferencePrecision] = None,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        network: Callable
+            Network (or `qute.export.InferenceBackend`) in evaluation mode on `device`.
+
+        device: torch.device
+            Device the network runs on.
+
+        max_batch_size: int = 16
+            Maximum number of windows per batch.
+
+        max_wait: float = 0.005
+            Maximum time (in seconds) to wait for more windows before running a batch.
+
+        precision: Optional[InferencePrecision] = None
+            Precision policy of the worker thread. Omit to run in float32 with
+            `torch.no_grad()`.
+        """
+        if max_batch_size < 1:
+            raise ValueError("`max_batch_size` must be at least 1.")
+        self.network = network
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.precision = precision if precision is not None else InferencePrecision()
+        self.num_batches = 0
+        self.num_windows = 0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name="qute_batcher", daemon=True
+        )
+        self._worker.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of window batches waiting to be predicted."""
+        return self._queue.qsize()
+
+    def __call__(self, windows: torch.Tensor) -> torch.Tensor:
+        pending = _PendingWindows(windows)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.output
+
+    def _next_batch(self) -> Optional[list]:
+        """Collect the window batches to predict together (None when closed)."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        num_windows = first.windows.shape[0]
+        deadline = time.perf_counter() + self.max_wait
+        while num_windows < self.max_batch_size:
+            try:
+                pending = self._queue.get(
+                    timeout=max(deadline - time.perf_counter(), 0.0)
+                )
+            except queue.Empty:
+                break
+            if pending is None:
+                # Predict what was collected, then stop
+                self._queue.put(None)
+                break
+            batch.append(pending)
+            num_windows += pending.windows.shape[0]
+        return batch
+
+    def _run(self):
+        with self.precision.grad_context():
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                try:
+                    windows = torch.cat([p.windows.to(self.device) for p in batch])
+                    outputs = self.network(windows)
+                    self.num_batches += 1
+                    self.num_windows += windows.shape[0]
+                    start = 0
+                    for pending in batch:
+                        end = start + pending.windows.shape[0]
+                        pending.output = outputs[start:end]
+                        start = end
+                except Exception as e:
+                    for pending in batch:
+                        pending.error = e
+                for pending in batch:
+                    pending.done.set()
+
+    def close(self):
+        """Stop the worker thread (after the queued windows are predicted)."""
+        self._queue.put(None)
+        self._worker.join()
+
+
+class _ServedModel:
+    """A warm model with its batcher, inferer and transforms."""
+
+    def __init__(self, model, campaign_transforms, batcher, inferer, latency_window):
+        self.model = model
+        self.inference_transforms = campaign_transforms.get_inference_transforms()
+        self.post_full_inference_transforms = (
+            campaign_transforms.get_post_full_inference_transforms()
+        )
+        self.batcher = batcher
+        self.inferer = inferer
+        self.num_requests = 0
+        self.num_errors = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=latency_window)
+
+        # ND2 files are read with the ND2 reader, followed by the same transforms
+        self.nd2_inference_transforms = None
+        transforms = self.inference_transforms
+        if (
+            isinstance(transforms, Compose)
+            and len(transforms.transforms) > 0
+            and isinstance(transforms.transforms[0], CustomTIFFReader)
+        ):
+            self.nd2_inference_transforms = Compose(
+                [
+                    CustomND2Reader(
+                        ensure_channel_first=True,
+                        dtype=transforms.transforms[0].dtype,
+                    ),
+                    *transforms.transforms[1:],
+                ]
+            )
+
+    def get_inference_transforms(self, input_file: Union[Path, str]):
+        """Return the inference transforms for the type of the input file."""
+        if Path(input_file).suffix.lower() != ".nd2":
+            return self.inference_transforms
+        if self.nd2_inference_transforms is None:
+            raise ValueError(
+                "ND2 files can only be predicted with campaigns that read TIFF files."
+            )
+        return self.nd2_inference_transforms
+
+
+class InferenceServer:
+    """Keeps models warm and predicts images on request, over HTTP or a Unix socket.
+
+    The models are loaded once, moved to the device and warmed up. Each request is inferred
+    in its own thread with a sliding window, and the windows of concurrent requests are
+    predicted in shared batches (see `DynamicBatcher`).
+
+    HTTP API:
+
+        POST /predict?model=<name>[&input=<file>][&output=<file>]
+            Predict the image in `input` (a file on the server), or the TIFF image in the
+            request body. The prediction is written to `output` (and a JSON summary is
+            returned), or returned as a TIFF image.
+
+        GET /metrics
+            Number of requests, errors, requests in flight, queue depth, batch sizes and
+            latencies (per model), as JSON.
+
+        GET /health
+            Status and names of the models, as JSON.
+    """
+
+    def __init__(
+        self,
+        models: dict,
+        roi_size: Tuple[int, ...],
+        campaign_transforms: Optional[CampaignTransforms] = None,
+        overlap: float = 0.25,
+        max_batch_size: int = 16,
+        max_wait: float = 0.005,
+        output_dtype: Optional[Union[str, np.dtype]] = None,
+        writer: Optional[PredictionWriter] = None,
+        precision: Optional[InferencePrecision] = None,
+        in_channels: int = 1,
+        latency_window: int = 1000,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        models: dict
+            Models to serve by name: trained models (`BaseModel`) or backends of exported
+            models (see `qute.export.load_backend()`).
+
+        roi_size: Tuple[int, ...]
+            Size of the sliding windows. It must match the patch size during training.
+
+        campaign_transforms: Optional[CampaignTransforms] = None
+            Campaign transforms for the inference and post full-inference transforms. Omit
+            to use the campaign transforms of each model (backends do not have any).
+
+        overlap: float = 0.25
+            Fraction of overlap between the windows.
+
+        max_batch_size: int = 16
+            Maximum number of windows (of one or more requests) predicted together.
+
+        max_wait: float = 0.005
+            Maximum time (in seconds) to wait for the windows of other requests.
+
+        output_dtype: Optional[Union[str, np.dtype]] = None
+            Optional NumPy dtype for the predictions.
+
+        writer: Optional[PredictionWriter] = None
+            Writer used to save the predictions. Omit to save zlib-compressed TIFF files.
+
+        precision: Optional[InferencePrecision] = None
+            Precision policy (see `qute.data.precision.InferencePrecision`).
+
+        in_channels: int = 1
+            Number of input channels (to warm up the models).
+
+        latency_window: int = 1000
+            Number of recent requests the latency statistics are computed on.
+        """
+        if len(models) == 0:
+            raise ValueError("At least one model is required.")
+        self.roi_size = tuple(roi_size)
+        self.output_dtype = output_dtype
+        self.writer = writer if writer is not None else TIFFPredictionWriter()
+        self.device, self.precision = _get_device_and_precision(
+            [getattr(model, "net", model) for model in models.values()], precision
+        )
+        self._lock = threading.Lock()
+        self._http_server = None
+        self._http_thread = None
+        self._socket_path = None
+
+        self._models = {}
+        for name, model in models.items():
+            transforms = campaign_transforms
+            if transforms is None:
+                transforms = getattr(model, "campaign_transforms", None)
+            if transforms is None:
+                raise ValueError(f"No campaign transforms for model '{name}'.")
+
+            # Keep the model on the device, in evaluation mode
+            model.to(self.device)
+            model.eval()
+            self.precision.prepare(model, len(self.roi_size))
+            batcher = DynamicBatcher(
+                self.precision.wrap(model, len(self.roi_size)),
+                device=self.device,
+                max_batch_size=max_batch_size,
+                max_wait=max_wait,
+                precision=self.precision,
+            )
+            inferer = SlidingWindowInferer(
+                roi_size=self.roi_size,
+                sw_batch_size=max_batch_size,
+                overlap=overlap,
+                mode=BlendMode.GAUSSIAN,
+                sigma_scale=0.125,
+                device=self.device,
+                cache_roi_weight_map=True,
+            )
+            self._models[name] = _ServedModel(
+                model, transforms, batcher, inferer, latency_window
+            )
+
+            # Warm up (and do not count the warm-up batch in the metrics)
+            with self.precision.grad_context():
+                batcher(torch.zeros((1, in_channels) + self.roi_size))
+            batcher.num_batches, batcher.num_windows = 0, 0
+
+    @property
+    def model_names(self) -> list[str]:
+        return list(self._models.keys())
+
+    def _get_served_model(self, model_name: Optional[str]) -> _ServedModel:
+        if model_name is None:
+            if len(self._models) > 1:
+                raise ValueError(
+                    f"Please specify one of the models: {', '.join(self._models)}."
+                )
+            model_name = next(iter(self._models))
+        if model_name not in self._models:
+            raise ValueError(f"Unknown model '{model_name}'.")
+        return self._models[model_name]
+
+    def predict(
+        self,
+        input_file: Union[Path, str],
+        output_file: Union[Path, str],
+        model_name: Optional[str] = None,
+    ) -> Path:
+        """Predict an image with a served model and save the prediction.
+
+        Parameters
+        ----------
+
+        input_file: Union[Path, str]
+            Image to predict (a TIFF file, or an ND2 file if the campaign reads TIFF files).
+
+        output_file: Union[Path, str]
+            File where to save the prediction.
+
+        model_name: Optional[str] = None
+            Name of the model. It can be omitted if only one model is served.
+
+        Returns
+        -------
+
+        output_file: Path
+            The saved prediction.
+        """
+        served = self._get_served_model(model_name)
+        output_file = Path(output_file)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            served.num_requests += 1
+            served.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            transforms = served.get_inference_transforms(input_file)
+            image = torch.as_tensor(transforms(str(input_file)))
+            with self.precision.grad_context():
+                outputs = served.inferer(
+                    inputs=image[None].to(self.device), network=served.batcher
+                )
+                _post_process_and_save(
+                    outputs,
+                    served.post_full_inference_transforms,
+                    [output_file],
+                    False,
+                    self.output_dtype,
+                    self.writer,
+                )
+        except Exception:
+            with self._lock:
+                served.num_errors += 1
+            raise
+        finally:
+            with self._lock:
+                served.in_flight -= 1
+        with self._lock:
+            served.latencies.append(time.perf_counter() - t0)
+        return output_file
+
+    def metrics(self) -> dict:
+        """Return the queue-depth, batching and latency metrics of all models."""
+        metrics = {}
+        with self._lock:
+            for name, served in self._models.items():
+                latencies = np.array(served.latencies)
+                batcher = served.batcher
+                metrics[name] = {
+                    "requests": served.num_requests,
+                    "errors": served.num_errors,
+                    "in_flight": served.in_flight,
+                    "queue_depth": batcher.queue_depth,
+                    "batches": batcher.num_batches,
+                    "mean_batch_size": batcher.num_windows
+                    / max(batcher.num_batches, 1),
+                    "latency_mean": (
+                        float(latencies.mean()) if len(latencies) > 0 else None
+                    ),
+                    "latency_p50": (
+                        float(np.percentile(latencies, 50))
+                        if len(latencies) > 0
+                        else None
+                    ),
+                    "latency_p95": (
+                        float(np.percentile(latencies, 95))
+                        if len(latencies) > 0
+                        else None
+                    ),
+                    "latency_max": (
+                        float(latencies.max()) if len(latencies) > 0 else None
+                    ),
+                }
+        return metrics
+
+    def start(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        socket_path: Optional[Union[Path, str]] = None,
+    ):
+        """Start serving in a background thread (see `serve()`).
+
+        Returns
+        -------
+
+        address: Union[Tuple[str, int], str]
+            (host, port) the server listens on (the port is chosen by the system if `port`
+            is 0), or the path of the Unix socket.
+        """
+        if self._http_server is not None:
+            raise RuntimeError("The server is already running.")
+        if socket_path is not None:
+            socket_path = str(socket_path)
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self._http_server = _UnixHTTPServer(socket_path, _RequestHandler)
+            self._socket_path = socket_path
+        else:
+            self._http_server = ThreadingHTTPServer((host, port), _RequestHandler)
+            self._http_server.daemon_threads = True
+        self._http_server.inference_server = self
+        self._http_thread = threading.Thread(
+            target=self._http_server.serve_forever, name="qute_server", daemon=True
+        )
+        self._http_thread.start()
+        return self._http_server.server_address
+
+    def serve(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        socket_path: Optional[Union[Path, str]] = None,
+    ):
+        """Serve requests until interrupted.
+
+        Parameters
+        ----------
+
+        host: str = "127.0.0.1"
+            Address to listen on (ignored if `socket_path` is set).
+
+        port: int = 8000
+            Port to listen on (ignored if `socket_path` is set).
+
+        socket_path: Optional[Union[Path, str]] = None
+            Path of a Unix socket to listen on instead of a TCP port.
+        """
+        address = self.start(host=host, port=port, socket_path=socket_path)
+        print(f"Serving {', '.join(self.model_names)} on {address}.")
+        try:
+            while self._http_thread.is_alive():
+                self._http_thread.join(timeout=1.0)
+        except KeyboardInterrupt:
+            print("Stopping the server.")
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Stop the HTTP server and the batchers."""
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+            if self._socket_path is not None and os.path.exists(self._socket_path):
+                os.remove(self._socket_path)
+            self._socket_path = None
+        for served in self._models.values():
+            served.batcher.close()
+        self._models = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server on a Unix socket."""
+
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Handles the requests to an `InferenceServer`."""
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, content: dict):
+        self._send(status, json.dumps(content).encode(), "application/json")
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        inference_server = self.server.inference_server
+        path = urlparse(self.path).path
+        if path == "/metrics":
+            self._send_json(200, inference_server.metrics())
+        elif path == "/health":
+            self._send_json(
+                200, {"status": "ok", "models": inference_server.model_names}
+            )
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint {path}."})
+
+    def do_POST(self):
+        inference_server = self.server.inference_server
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            self._send_json(404, {"error": f"Unknown endpoint {url.path}."})
+            return
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        with tempfile.TemporaryDirectory(prefix="qute_serve_") as tmp_dir:
+            # Input file on the server, or image in the request body
+            input_file = query.get("input", None)
+            if input_file is None:
+                length = int(self.headers.get("Content-Length", 0))
+                if length == 0:
+                    self._send_json(400, {"error": "No input image."})
+                    return
+                input_file = Path(tmp_dir) / "input.tif"
+                input_file.write_bytes(self.rfile.read(length))
+            output_file = query.get("output", None)
+            if output_file is None:
+                output_file = (
+                    Path(tmp_dir) / f"prediction{inference_server.writer.extension}"
+                )
+
+            t0 = time.perf_counter()
+            try:
+                output_file = inference_server.predict(
+                    input_file, output_file, model_name=query.get("model", None)
+                )
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+
+            if "output" in query:
+                self._send_json(
+                    200,
+                    {
+                        "output": str(output_file),
+                        "latency": time.perf_counter() - t0,
+                    },
+                )
+            else:
+                self._send(200, output_file.read_bytes(), "image/tiff")
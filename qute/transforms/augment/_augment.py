@@ -0,0 +1,303 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+import math
+from typing import Optional, Sequence, Union
+
+import torch
+import torch.nn.functional as F
+from monai.transforms import Transform
+
+Batch = Union[torch.Tensor, tuple, list]
+
+
+def _split_batch(batch: Batch) -> tuple[torch.Tensor, list, bool]:
+    """Split a batch into its image and the other tensors (e.g., the label)."""
+    if isinstance(batch, torch.Tensor):
+        return batch, [], False
+    if len(batch) == 0:
+        raise ValueError("The batch is empty.")
+    return batch[0], list(batch[1:]), True
+
+
+def _merge_batch(image: torch.Tensor, others: list, is_sequence: bool) -> Batch:
+    """Merge the image and the other tensors back into a batch."""
+    if not is_sequence:
+        return image
+    return (image, *others)
+
+
+class RandomizableBatchTransform(Transform):
+    """Base class for the batched random transforms.
+
+    The random parameters are drawn independently for each sample of the batch. By
+    default, they are drawn from the global random number generators of PyTorch (on
+    the device of the batch), so that the transforms are reproducible when the seed is
+    set with `qute.random.set_global_rng_seed()`. Use `set_random_state()` to use a
+    dedicated, seeded generator instead.
+    """
+
+    def __init__(self, prob: float = 0.1):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        prob: float = 0.1
+            Probability to apply the transform to each sample of the batch.
+        """
+        super().__init__()
+        if prob < 0.0 or prob > 1.0:
+            raise ValueError("`prob` must be between 0.0 and 1.0.")
+        self.prob = prob
+        self._seed = None
+        self._generator = None
+
+    def set_random_state(self, seed: Optional[int] = None):
+        """Set the seed of a dedicated random number generator.
+
+        Parameters
+        ----------
+
+        seed: Optional[int] = None
+            Seed for the generator. Set to None to use the global generators of PyTorch.
+        """
+        self._seed = seed
+        self._generator = None
+        return self
+
+    def _get_generator(self, device: torch.device) -> Optional[torch.Generator]:
+        """Return the generator for the device (None for the global generator)."""
+        if self._seed is None:
+            return None
+        if self._generator is None or self._generator.device != device:
+            self._generator = torch.Generator(device=device)
+            self._generator.manual_seed(self._seed)
+        return self._generator
+
+    def _rand(self, n: int, device: torch.device) -> torch.Tensor:
+        """Draw `n` uniform random numbers in [0, 1) on the device."""
+        return torch.rand(n, generator=self._get_generator(device), device=device)
+
+    def _draw_apply(self, n: int, device: torch.device) -> torch.Tensor:
+        """Decide for each of the `n` samples whether to apply the transform."""
+        return self._rand(n, device) < self.prob
+
+
+class RandFlipBatch(RandomizableBatchTransform):
+    """Randomly flips the samples of a batch along a spatial axis.
+
+    The batch is either a tensor of shape (B, C, H, W) or (B, C, D, H, W), or a tuple of
+    such tensors (e.g., (image, label)): all tensors of a sample are flipped together.
+    """
+
+    def __init__(self, prob: float = 0.1, spatial_axis: int = 0):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        prob: float = 0.1
+            Probability to flip each sample of the batch.
+
+        spatial_axis: int = 0
+            Spatial axis to flip (0 is the first axis after the channel).
+        """
+        super().__init__(prob=prob)
+        self.spatial_axis = spatial_axis
+
+    def __call__(self, batch: Batch) -> Batch:
+        image, others, is_sequence = _split_batch(batch)
+        apply = self._draw_apply(image.shape[0], image.device)
+        if not apply.any():
+            return batch
+
+        def flip(data: torch.Tensor) -> torch.Tensor:
+            dim = 2 + self.spatial_axis
+            if dim >= data.ndim:
+                raise ValueError(
+                    f"Spatial axis {self.spatial_axis} is out of range for a tensor of shape {tuple(data.shape)}."
+                )
+            mask = apply.view(-1, *([1] * (data.ndim - 1)))
+            return torch.where(mask, data.flip(dim), data)
+
+        return _merge_batch(flip(image), [flip(o) for o in others], is_sequence)
+
+
+class RandGaussianNoiseBatch(RandomizableBatchTransform):
+    """Randomly adds Gaussian noise to the images of a batch.
+
+    As in `monai.transforms.RandGaussianNoise`, the standard deviation of the noise is
+    drawn uniformly from [0, `std`) for each sample. Only the image (the first tensor of
+    the batch) is modified.
+    """
+
+    def __init__(
+        self,
+        prob: float = 0.1,
+        mean: float = 0.0,
+        std: float = 0.1,
+        sample_std: bool = True,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        prob: float = 0.1
+            Probability to add noise to each sample of the batch.
+
+        mean: float = 0.0
+            Mean of the noise.
+
+        std: float = 0.1
+            (Maximum) standard deviation of the noise.
+
+        sample_std: bool = True
+            If True, draw the standard deviation from [0, `std`) for each sample.
+        """
+        super().__init__(prob=prob)
+        self.mean = mean
+        self.std = std
+        self.sample_std = sample_std
+
+    def __call__(self, batch: Batch) -> Batch:
+        image, others, is_sequence = _split_batch(batch)
+        n, device = image.shape[0], image.device
+        apply = self._draw_apply(n, device)
+        if not apply.any():
+            return batch
+
+        # Per-sample standard deviation (zero for the samples that are left untouched)
+        std = (
+            self._rand(n, device) * self.std
+            if self.sample_std
+            else torch.full((n,), self.std, device=device)
+        )
+        scale = torch.where(apply, std, torch.zeros_like(std))
+        scale = scale.view(-1, *([1] * (image.ndim - 1))).to(image.dtype)
+        noise = torch.randn(
+            image.shape,
+            generator=self._get_generator(device),
+            device=device,
+            dtype=image.dtype,
+        )
+        offset = apply.view_as(scale).to(image.dtype) * self.mean
+        return _merge_batch(image + noise * scale + offset, others, is_sequence)
+
+
+class RandGaussianSmoothBatch(RandomizableBatchTransform):
+    """Randomly smooths the images of a batch with a Gaussian kernel.
+
+    As in `monai.transforms.RandGaussianSmooth`, the sigma along each spatial axis is drawn
+    uniformly from its range for each sample. The (erf-based) kernels are truncated at
+    `truncated` sigmas and the borders are padded by replication. Only the image (the first tensor of
+    the batch) is modified.
+    """
+
+    def __init__(
+        self,
+        prob: float = 0.1,
+        sigma_range: Sequence[tuple[float, float]] = ((0.25, 1.5),),
+        truncated: float = 4.0,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        prob: float = 0.1
+            Probability to smooth each sample of the batch.
+
+        sigma_range: Sequence[tuple[float, float]] = ((0.25, 1.5),)
+            Range of the sigma along each spatial axis. If a single range is given, it is
+            used for all axes.
+
+        truncated: float = 4.0
+            The kernels extend to `truncated` sigmas on each side.
+        """
+        super().__init__(prob=prob)
+        self.sigma_range = tuple(tuple(r) for r in sigma_range)
+        self.truncated = truncated
+
+    def _smooth_along(
+        self, data: torch.Tensor, dim: int, sigma: torch.Tensor
+    ) -> torch.Tensor:
+        """Smooth all samples along one dimension, each with its own sigma."""
+        n, c = data.shape[:2]
+        radius = max(1, int(math.ceil(self.truncated * float(sigma.max()))))
+        x = torch.arange(-radius, radius + 1, device=data.device, dtype=data.dtype)
+        t = math.sqrt(2.0) * sigma[:, None].to(data.dtype)
+        kernels = 0.5 * (torch.erf((x + 0.5) / t) - torch.erf((x - 0.5) / t))
+        kernels = kernels / kernels.sum(dim=1, keepdim=True)
+        weight = kernels.repeat_interleave(c, dim=0).unsqueeze(1)
+
+        # Bring the dimension last and the samples/channels to the channel position
+        moved = data.movedim(dim, -1)
+        shape = moved.shape
+        moved = moved.reshape(n * c, -1, shape[-1]).transpose(0, 1)
+        moved = F.pad(moved, (radius, radius), mode="replicate")
+        out = F.conv1d(moved, weight, groups=n * c)
+        return out.transpose(0, 1).reshape(shape).movedim(-1, dim)
+
+    def __call__(self, batch: Batch) -> Batch:
+        image, others, is_sequence = _split_batch(batch)
+        n, device = image.shape[0], image.device
+        num_spatial = image.ndim - 2
+        apply = self._draw_apply(n, device)
+        if not apply.any():
+            return batch
+
+        if len(self.sigma_range) == 1:
+            sigma_range = self.sigma_range * num_spatial
+        elif len(self.sigma_range) == num_spatial:
+            sigma_range = self.sigma_range
+        else:
+            raise ValueError(
+                f"`sigma_range` must contain 1 or {num_spatial} ranges for this batch."
+            )
+
+        # Smooth the selected samples only
+        selected = image[apply]
+        for axis, (low, high) in enumerate(sigma_range):
+            sigma = low + (high - low) * self._rand(n, device)
+            selected = self._smooth_along(selected, 2 + axis, sigma[apply])
+        image = image.clone()
+        image[apply] = selected
+        return _merge_batch(image, others, is_sequence)
+
+
+class ComposeBatch(Transform):
+    """Applies a sequence of batched transforms."""
+
+    def __init__(self, transforms: Sequence[Transform]):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        transforms: Sequence[Transform]
+            Batched transforms to apply in sequence.
+        """
+        super().__init__()
+        self.transforms = list(transforms)
+
+    def set_random_state(self, seed: Optional[int] = None):
+        """Seed the random transforms (with consecutive seeds), or reset them to the
+        global generators of PyTorch if `seed` is None."""
+        for i, transform in enumerate(self.transforms):
+            if hasattr(transform, "set_random_state"):
+                transform.set_random_state(None if seed is None else seed + i)
+        return self
+
+    def __call__(self, batch: Batch) -> Batch:
+        for transform in self.transforms:
+            batch = transform(batch)
+        return batch
@@ -9,10 +9,11 @@
 #   Aaron Ponti - initial API and implementation
 # ******************************************************************************
 
-from ._geom import CustomResampler, CustomResamplerd
+from ._geom import CustomResampler, CustomResamplerd, IndexedRandCropByPosNegLabeld
 
 __doc__ = "Geometric transforms."
 __all__ = [
     "CustomResampler",
     "CustomResamplerd",
+    "IndexedRandCropByPosNegLabeld",
 ]
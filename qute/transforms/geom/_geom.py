@@ -14,10 +14,10 @@ import monai.data
 import numpy as np
 import torch
 from monai.data import MetaTensor
-from monai.transforms import MapTransform, Transform
+from monai.transforms import MapTransform, RandCropByPosNegLabeld, Transform
 from torch.nn import functional as F
 
-from qute.transforms.util import get_tensor_num_spatial_dims
+from qute.transforms.util import draw_from_sampling_index, get_tensor_num_spatial_dims
 
 
 class CustomResampler(Transform):
@@ -258,3 +258,101 @@ class CustomResamplerd(MapTransform):
             data[key] = interpolator(data[key])
 
         return data
+
+
+class IndexedRandCropByPosNegLabeld(RandCropByPosNegLabeld):
+    """Crop random fixed-size regions with the center being a foreground or background voxel,
+    drawing the centers from a precomputed sampling index.
+
+    If the data dictionary contains the path to a sampling index (as created by
+    `qute.data.sampling.build_sampling_indices()`) under `index_key`, the candidate centers
+    are looked up in the index, without scanning the label image. Many more candidates than
+    samples are drawn from each class, so that the centers that the cropper picks among
+    them are (almost) independent and uniform, as with the whole label image. Otherwise (or
+    if the index does not match the label), the transform behaves exactly like
+    `monai.transforms.RandCropByPosNegLabeld`, and scans the whole label image.
+
+    @see `monai.transforms.RandCropByPosNegLabeld` for the description of all other parameters.
+    """
+
+    def __init__(
+        self,
+        keys,
+        label_key: str,
+        spatial_size,
+        pos: float = 1.0,
+        neg: float = 1.0,
+        num_samples: int = 1,
+        image_key: Optional[str] = None,
+        image_threshold: float = 0.0,
+        index_key: str = "sampling_index",
+        num_candidates: int = 1024,
+        fg_indices_key: str = "fg_indices",
+        bg_indices_key: str = "bg_indices",
+        **kwargs,
+    ):
+        """Constructor
+
+        Parameters
+        ----------
+
+        index_key: str = "sampling_index"
+            Key of the path to the sampling index in the data dictionary.
+
+        num_candidates: int = 1024
+            Number of candidate centers drawn from the index for each class (at least
+            `num_samples`).
+
+        fg_indices_key: str = "fg_indices"
+            Key under which the drawn foreground candidates are passed to the cropper.
+
+        bg_indices_key: str = "bg_indices"
+            Key under which the drawn background candidates are passed to the cropper.
+        """
+        super().__init__(
+            keys=keys,
+            label_key=label_key,
+            spatial_size=spatial_size,
+            pos=pos,
+            neg=neg,
+            num_samples=num_samples,
+            image_key=image_key,
+            image_threshold=image_threshold,
+            fg_indices_key=fg_indices_key,
+            bg_indices_key=bg_indices_key,
+            **kwargs,
+        )
+        self.index_key = index_key
+        self.num_candidates = num_candidates
+        self.image_threshold = image_threshold
+
+    def __call__(self, data, lazy: Optional[bool] = None):
+        d = dict(data)
+        index_file = d.pop(self.index_key, None)
+        if index_file is not None and self.fg_indices_key not in d:
+            label = d[self.label_key]
+            image = d.get(self.image_key) if self.image_key is not None else None
+            with np.load(index_file) as f:
+                index = {key: f[key] for key in f.files}
+            if tuple(index["shape"]) == tuple(label.shape[1:]):
+                try:
+                    # Draw many candidates for the samples from each class
+                    for key, foreground in zip(
+                        (self.fg_indices_key, self.bg_indices_key), (True, False)
+                    ):
+                        d[key] = draw_from_sampling_index(
+                            index,
+                            label,
+                            image,
+                            image_threshold=self.image_threshold,
+                            foreground=foreground,
+                            num_samples=max(
+                                self.num_candidates, self.cropper.num_samples
+                            ),
+                            rand_state=self.R,
+                        )
+                except ValueError:
+                    # Stale index: fall back to scanning the whole label
+                    d.pop(self.fg_indices_key, None)
+                    d.pop(self.bg_indices_key, None)
+        return super().__call__(d, lazy=lazy)
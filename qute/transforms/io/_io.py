@@ -20,6 +20,14 @@ from tifffile import imread
 from tifffile.tifffile import TiffFileError
 
 
+def _torch_dtype(dtype: np.dtype) -> Optional[torch.dtype]:
+    """Return the torch dtype corresponding to a NumPy dtype, or None if not supported."""
+    try:
+        return torch.from_numpy(np.empty(0, dtype=dtype)).dtype
+    except TypeError:
+        return None
+
+
 class CellposeLabelReader(Transform):
     """Loads a Cellpose label file and returns it as a NumPy array."""
 
@@ -389,7 +397,13 @@ class CustomND2Readerd(MapTransform):
 
 
 class CustomTIFFReader(Transform):
-    """Loads a TIFF file using the tifffile library."""
+    """Loads a TIFF file using the tifffile library.
+
+    Files with the `.npy` extension (e.g., from a store created with
+    `qute.data.store.convert_to_store()`) are memory-mapped instead: if the stored
+    data type matches `dtype`, the returned tensor is a view on the mapped file, and
+    only the parts of the file that are accessed are read from disk.
+    """
 
     def __init__(
         self,
@@ -451,9 +465,12 @@ class CustomTIFFReader(Transform):
         # File path
         image_path = str(Path(file_name).resolve())
 
-        # Load the image
+        # Load the image (memory-map it if it comes from a store)
         try:
-            image = imread(image_path)
+            if Path(image_path).suffix == ".npy":
+                image = np.load(image_path, mmap_mode="c")
+            else:
+                image = imread(image_path)
         except (FileNotFoundError, TiffFileError, OSError, KeyError, ValueError) as e:
             print(f"File {image_path} could not be opened: {e}.")
             raise e
@@ -498,8 +515,15 @@ class CustomTIFFReader(Transform):
                 f"Unexpected combination of image dimensions ({image.ndim}) and geometry ({self.geometry})."
             )
 
-        # Load and process image
-        data = torch.Tensor(image.astype(np.float32))
+        # Load and process image (without copying if the type already matches)
+        if (
+            isinstance(image, np.memmap)
+            and self.dtype is not None
+            and _torch_dtype(image.dtype) == self.dtype
+        ):
+            data = torch.from_numpy(image)
+        else:
+            data = torch.Tensor(image.astype(np.float32))
         if self.as_meta_tensor:
             if self.voxel_size is not None:
                 if data.ndim != len(self.voxel_size):
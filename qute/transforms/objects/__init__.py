@@ -21,6 +21,7 @@ from ._objects import (
     WatershedAndLabelTransform,
     WatershedAndLabelTransformd,
 )
+from ._parallel import ProcessPoolBackend
 
 __doc__ = "Object-related transforms."
 __all__ = [
@@ -30,6 +31,7 @@ __all__ = [
     "NormalizedDistanceTransformd",
     "OneHotToMask",
     "OneHotToMaskBatch",
+    "ProcessPoolBackend",
     "TwoClassMaskToLabel",
     "TwoClassMaskToLabeld",
     "WatershedAndLabelTransform",
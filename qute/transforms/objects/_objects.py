@@ -8,7 +8,7 @@
 # Contributors:
 #   Aaron Ponti - initial API and implementation
 # ******************************************************************************
-from typing import Union
+from typing import Optional, Union
 
 import monai.data
 import numpy as np
@@ -21,25 +21,87 @@ from skimage.measure import regionprops
 from skimage.morphology import ball, disk
 from skimage.segmentation import random_walker, watershed
 
+from qute.transforms.objects._parallel import ProcessPoolBackend
 from qute.transforms.util import (
     extract_subvolume,
     get_tensor_num_spatial_dims,
     insert_subvolume,
+    scale_dist_transform_by_region,
 )
 
 
+def _get_footprint(num_spatial_dims: int, radius: int) -> np.ndarray:
+    """Return the disk (2D) or ball (3D) footprint of given radius."""
+    if num_spatial_dims == 2:
+        return disk(radius)
+    return ball(radius)
+
+
+def _inner_label_mask(labels: torch.Tensor, footprint: np.ndarray) -> torch.Tensor:
+    """Return the pixels whose whole footprint neighborhood has their (non-zero) label.
+
+    This is the union of the binary erosions of all labels (with zero padding), obtained
+    by comparing the labels with their shifted copies for all offsets of the footprint.
+    The leading dimensions of `labels` beyond the dimensionality of the footprint are
+    treated as batch dimensions.
+    """
+    num_spatial_dims = footprint.ndim
+    radius = footprint.shape[0] // 2
+    spatial_shape = labels.shape[-num_spatial_dims:]
+    padded = torch.nn.functional.pad(labels, (radius, radius) * num_spatial_dims)
+    inner = labels > 0
+    for offset in np.argwhere(footprint):
+        shifted = padded[
+            (Ellipsis,)
+            + tuple(slice(o, o + size) for o, size in zip(offset, spatial_shape))
+        ]
+        inner &= shifted == labels
+    return inner
+
+
+def _dilate_labels(labels: torch.Tensor, footprint: np.ndarray) -> torch.Tensor:
+    """Expand all labels with the footprint at once.
+
+    Each pixel receives the largest label within its footprint neighborhood (with zero
+    padding): this is the same as dilating the labels one after the other in increasing
+    order. The leading dimensions of `labels` beyond the dimensionality of the footprint
+    are treated as batch dimensions.
+    """
+    num_spatial_dims = footprint.ndim
+    radius = footprint.shape[0] // 2
+    spatial_shape = labels.shape[-num_spatial_dims:]
+    padded = torch.nn.functional.pad(labels, (radius, radius) * num_spatial_dims)
+    dilated = torch.zeros_like(labels)
+    for offset in np.argwhere(footprint):
+        shifted = padded[
+            (Ellipsis,)
+            + tuple(slice(o, o + size) for o, size in zip(offset, spatial_shape))
+        ]
+        dilated = torch.maximum(dilated, shifted)
+    return dilated
+
+
 class LabelToTwoClassMask(Transform):
     """Maps a labels image to a two-class mask: object and border.
 
     Supported and expected are either 2D data of shape (C, H, W) or 3D
-    data of shape (C, D, H, W).
+    data of shape (C, D, H, W), or batches (B, C, H, W) and (B, C, D, H, W)
+    with `with_batch_dim = True`.
 
     The alternative possibility of 2D batch data (B, C, H, W) can't robustly
-    be distinguished from 3D (C, D, H, W) data and will result in unexpected
-    labels.
+    be distinguished from 3D (C, D, H, W) data without `with_batch_dim` and
+    will result in unexpected labels.
+
+    The borders of all objects are found at once, so tensors (e.g., collated
+    batches) are processed on their device.
     """
 
-    def __init__(self, border_thickness: int = 1, drop_eroded: bool = False):
+    def __init__(
+        self,
+        border_thickness: int = 1,
+        drop_eroded: bool = False,
+        with_batch_dim: bool = False,
+    ):
         """Constructor.
 
         Parameters
@@ -55,6 +117,10 @@ class LabelToTwoClassMask(Transform):
              in z direction) will have only border. Set `drop_eroded = True` to remove also the
              border.
 
+        with_batch_dim: bool (Optional, default is False)
+            Whether the input tensor has a batch dimension or not. This is to distinguish between the
+            2D case (B, C, H, W) and the 3D case (C, D, H, W). All other supported cases are clear.
+
         Please notice that if the input tensor is black-and-white, connected component analysis will be applied by
         the transform before creating the two classes. This may cause objects to fuse.
         """
@@ -63,6 +129,7 @@ class LabelToTwoClassMask(Transform):
             raise ValueError("The border thickness cannot be zero!")
         self.border_thickness = border_thickness
         self.drop_eroded = drop_eroded
+        self.with_batch_dim = with_batch_dim
 
     def __call__(
         self, data: Union[torch.tensor, monai.data.MetaTensor, np.ndarray]
@@ -80,86 +147,75 @@ class LabelToTwoClassMask(Transform):
         -------
 
         tensor: torch.Tensor | monai.MetaTensor
-            Tensor as with two-class mask.
+            Tensor as with two-class mask (on the device of the input tensor).
         """
 
         if type(data) not in [torch.Tensor, monai.data.MetaTensor, np.ndarray]:
             raise TypeError(f"Unsupported input type {type(data)}.")
 
         # Keep track of whether we are working with MONAI MetaTensor
-        is_meta_tensor = type(data) is monai.data.MetaTensor
+        meta = None
+        if type(data) is monai.data.MetaTensor:
+            meta = data.meta.copy()
+            data = data.as_tensor()
 
         # Get the number of spatial dimensions
-        num_spatial_dims = get_tensor_num_spatial_dims(data, with_batch_dim=False)
+        num_spatial_dims = get_tensor_num_spatial_dims(
+            data, with_batch_dim=self.with_batch_dim
+        )
 
         # Make sure the channel dimension has only one element
-        if data.shape[0] != 1:
+        if data.shape[1 if self.with_batch_dim else 0] != 1:
             raise ValueError("The input tensor must have only one channel!")
 
-        # Footprint (structuring element) for erosion
-        if num_spatial_dims == 2:
-            footprint = torch.tensor(disk(self.border_thickness), dtype=torch.int32)
-        else:
-            footprint = torch.tensor(ball(self.border_thickness), dtype=torch.int32)
-
-        # Original size
-        original_size = data.shape
-
-        # Make sure to work with int32 tensors
+        # Make sure to work with int32 tensors with a batch dimension
         if type(data) is np.ndarray:
-            data = torch.tensor(data)
-        data.to(torch.int32)
-
-        # Remove singleton dimensions (in a copy)
-        data = data.squeeze()
-
-        # Allocate output (with the original shape)
-        out = torch.zeros(original_size, dtype=torch.int32)
+            labels = torch.from_numpy(data.astype(np.int32))
+        else:
+            labels = data.to(torch.int32)
+        if not self.with_batch_dim:
+            labels = labels.unsqueeze(0)
 
         # Make sure we have labels
-        unique_labels = torch.unique(data)
-        if len(unique_labels) == 2 and torch.all(unique_labels == torch.tensor([0, 1])):
-            data_np = data.cpu().detach().numpy()
-            labels_np = ndi.label(data_np)[0].astype(np.int32)
-            data = torch.from_numpy(labels_np)
-
-        # Calculate bounding boxes
-        regions = regionprops(data.numpy())
-
-        # Process all labels serially
-        for region in regions:
-            if region.label == 0:
-                continue
-
-            # Extract the subvolume
-            cropped_masks = extract_subvolume(data, region.bbox)
-
-            # Select object
-            mask = (cropped_masks == region.label).to(torch.int32)
-
-            # Perform erosion
-            eroded_mask = ndi.binary_erosion(mask, footprint)
-
-            # Crete object and border
-            border = mask - eroded_mask
-            bw_tc = mask + border  # Count border pixels twice
-
-            # Drop objects that have been eroded away?
-            if (bw_tc == 1).sum() == 0 and self.drop_eroded:
-                continue
+        relabeled = False
+        for b in range(labels.shape[0]):
+            unique_labels = torch.unique(labels[b])
+            if len(unique_labels) == 2 and torch.all(
+                unique_labels.cpu() == torch.tensor([0, 1])
+            ):
+                if not relabeled:
+                    labels = labels.clone()
+                    relabeled = True
+                labels_np = ndi.label(labels[b, 0].cpu().numpy())[0].astype(np.int32)
+                labels[b, 0] = torch.from_numpy(labels_np).to(labels.device)
+
+        # Find the pixels that survive the erosion of their object with the footprint
+        footprint = _get_footprint(num_spatial_dims, self.border_thickness)
+        inner = _inner_label_mask(labels, footprint)
+
+        # Objects have class 1 and their borders class 2
+        objects = labels > 0
+        out = objects.to(torch.int32) * 2 - inner.to(torch.int32)
+
+        # Drop objects that have been eroded away?
+        if self.drop_eroded:
+            # Count the inner pixels of each label (per image of the batch)
+            num_labels = int(labels.max()) + 1
+            keys = labels + num_labels * torch.arange(
+                labels.shape[0], device=labels.device
+            ).reshape((-1,) + (1,) * (labels.ndim - 1))
+            num_inner = torch.bincount(
+                keys[inner], minlength=num_labels * labels.shape[0]
+            )
+            out[objects & (num_inner[keys] == 0)] = 0
 
-            # Insert it into dt_out
-            bbox = region.bbox
-            while bw_tc.ndim < out.ndim:
-                bw_tc = bw_tc[np.newaxis, :]
-                m = len(bbox) // 2
-                bbox = tuple([0] + list(bbox[:m]) + [1] + list(bbox[m:]))
-            out = insert_subvolume(out, bw_tc, bbox, masked=True)
+        if not self.with_batch_dim:
+            out = out.squeeze(0)
 
         # If needed, pack the result into a MetaTensor and
         # transfer the metadata dictionary.
-        if is_meta_tensor:
-            out = MetaTensor(out, meta=data.meta.copy())
+        if meta is not None:
+            out = MetaTensor(out, meta=meta)
 
         return out
 
@@ -168,11 +224,12 @@ class LabelToTwoClassMaskd(MapTransform):
     """Maps labels images to two-class masks.
 
     Supported and expected are either 2D data of shape (C, H, W) or 3D
-    data of shape (C, D, H, W).
+    data of shape (C, D, H, W), or batches (B, C, H, W) and (B, C, D, H, W)
+    with `with_batch_dim = True`.
 
     The alternative possibility of 2D batch data (B, C, H, W) can't robustly
-    be distinguished from 3D (C, D, H, W) data and will result in unexpected
-    labels.
+    be distinguished from 3D (C, D, H, W) data without `with_batch_dim` and
+    will result in unexpected labels.
     """
 
     def __init__(
@@ -180,6 +237,7 @@ class LabelToTwoClassMaskd(MapTransform):
         keys: tuple[str] = ("image", "label"),
         border_thickness: int = 1,
         drop_eroded: bool = False,
+        with_batch_dim: bool = False,
     ) -> None:
         """Constructor
 
@@ -198,11 +256,16 @@ class LabelToTwoClassMaskd(MapTransform):
             Objects that are eroded away because smaller than the structuring element (e.g., flat
              in z direction) will have only border. Set `drop_eroded = True` to remove also the
              border.
+
+        with_batch_dim: bool (Optional, default is False)
+            Whether the input tensor has a batch dimension or not. This is to distinguish between the
+            2D case (B, C, H, W) and the 3D case (C, D, H, W). All other supported cases are clear.
         """
         super().__init__(keys=keys)
         self.keys = keys
         self.border_thickness = border_thickness
         self.drop_eroded = drop_eroded
+        self.with_batch_dim = with_batch_dim
 
     def __call__(self, data: dict) -> dict:
         """
@@ -221,7 +284,9 @@ class LabelToTwoClassMaskd(MapTransform):
         # Process the images
         for key in self.keys:
             transform = LabelToTwoClassMask(
-                border_thickness=self.border_thickness, drop_eroded=self.drop_eroded
+                border_thickness=self.border_thickness,
+                drop_eroded=self.drop_eroded,
+                with_batch_dim=self.with_batch_dim,
             )
             d[key] = transform(d[key])
         return d
@@ -231,16 +296,20 @@ class TwoClassMaskToLabel(Transform):
     """Maps a two-class (object and border) mask to labels image.
 
     Supported and expected are either 2D data of shape (C, H, W) or 3D
-    data of shape (C, D, H, W).
+    data of shape (C, D, H, W), or batches (B, C, H, W) and (B, C, D, H, W)
+    with `with_batch_dim = True`.
 
     The alternative possibility of 2D batch data (B, C, H, W) can't robustly
-    be distinguished from 3D (C, D, H, W) data and will result in unexpected
-    labels.
-
-    @TODO: Add with_batch_dim support.
+    be distinguished from 3D (C, D, H, W) data without `with_batch_dim` and
+    will result in unexpected labels.
     """
 
-    def __init__(self, object_class: int = 1, border_thickness: int = 1):
+    def __init__(
+        self,
+        object_class: int = 1,
+        border_thickness: int = 1,
+        with_batch_dim: bool = False,
+    ):
         """Constructor.
 
         Parameters
@@ -252,10 +321,15 @@ class TwoClassMaskToLabel(Transform):
         border_thickness: Optional[int] = None
             Thickness of the border to be added. If set, it should be the same as the one used in
             LabelToTwoClassMask(d), but it is optional (and disabled by default).
+
+        with_batch_dim: bool (Optional, default is False)
+            Whether the input tensor has a batch dimension or not. This is to distinguish between the
+            2D case (B, C, H, W) and the 3D case (C, D, H, W). All other supported cases are clear.
         """
         super().__init__()
         self.object_class = object_class
         self.border_thickness = border_thickness
+        self.with_batch_dim = with_batch_dim
 
     def __call__(
         self, data: Union[torch.tensor, monai.data.MetaTensor, np.ndarray]
@@ -273,95 +347,55 @@ class TwoClassMaskToLabel(Transform):
         -------
 
         tensor: torch.Tensor | monai.MetaTensor
-            Tensor as with label image.
+            Tensor as with label image (on the device of the input tensor).
         """
 
         if type(data) not in [torch.Tensor, monai.data.MetaTensor, np.ndarray]:
             raise TypeError(f"Unsupported input type {type(data)}.")
 
         # Keep track of whether we are working with MONAI MetaTensor
-        is_meta_tensor = type(data) is monai.data.MetaTensor
+        meta = None
+        if type(data) is monai.data.MetaTensor:
+            meta = data.meta.copy()
+            data = data.as_tensor()
 
         # Get the number of spatial dimensions
-        num_spatial_dims = get_tensor_num_spatial_dims(data, with_batch_dim=False)
+        num_spatial_dims = get_tensor_num_spatial_dims(
+            data, with_batch_dim=self.with_batch_dim
+        )
 
         # Make sure the channel dimension has only one element
-        if data.shape[0] != 1:
+        if data.shape[1 if self.with_batch_dim else 0] != 1:
             raise ValueError("The input tensor must have only one channel!")
 
-        # Original shape
-        original_shape = data.shape
-
-        # Make sure to work with int32 tensors
+        # Connected-component analysis works on NumPy arrays (with a batch dimension)
+        device = torch.device("cpu")
         if type(data) is np.ndarray:
-            data = torch.tensor(data)
-        data.to(torch.int32)
-
-        # Remove singleton dimensions (in a copy)
-        data = data.squeeze()
-
-        # Extract the pixels with selected class
-        data_mask = data == self.object_class
-
-        # Run a connected-component analysis on the mask
-        labels = torch.tensor(ndi.label(data_mask)[0], dtype=torch.int32)
-
-        # Do we need to dilate?
+            data_np = data
+        else:
+            device = data.device
+            data_np = data.detach().cpu().numpy()
+        if not self.with_batch_dim:
+            data_np = data_np[np.newaxis]
+
+        # Run a connected-component analysis on the mask of each image
+        labels = np.zeros(data_np.shape, dtype=np.int32)
+        for b in range(data_np.shape[0]):
+            labels[b, 0] = ndi.label(data_np[b, 0] == self.object_class)[0]
+        labels = torch.from_numpy(labels).to(device)
+
+        # Do we need to dilate? All labels are expanded at once.
         if self.border_thickness is not None and self.border_thickness > 0:
-            # Allocate result
-            labels_dilated = torch.zeros(data.shape, dtype=torch.int32)
-
-            # Footprint (structuring element) for dilation
-            if num_spatial_dims == 2:
-                footprint = torch.tensor(disk(self.border_thickness), dtype=torch.int32)
-            else:
-                footprint = torch.tensor(ball(self.border_thickness), dtype=torch.int32)
-
-            # Process all labels serially
-            for lbl in torch.unique(labels):
-                if lbl == 0:
-                    continue
-
-                # Select object
-                mask = (labels == lbl).to(torch.int32)
-
-                # Find the indices of the non-zero elements
-                positions = np.where(mask > 0)
-                if not positions[0].size:
-                    raise ValueError("No connected components found.")
-
-                # Determine bounds and apply borders for each dimension
-                bounds = []
-                for dim in range(num_spatial_dims):
-                    min_bound = positions[dim].min() - self.border_thickness
-                    max_bound = positions[dim].max() + self.border_thickness + 1
-                    bounds.append((max(min_bound, 0), min(max_bound, mask.shape[dim])))
-
-                # Unpack bounds to slicing format
-                slices = tuple(
-                    slice(min_bound, max_bound) for min_bound, max_bound in bounds
-                )
-
-                # Crop the (extended) mask
-                cropped_mask = mask[slices]
+            footprint = _get_footprint(num_spatial_dims, self.border_thickness)
+            labels = _dilate_labels(labels, footprint)
 
-                # Perform dilation
-                dilated_mask = ndi.binary_dilation(cropped_mask, footprint)
-
-                # Store in the output
-                labels_dilated[slices][dilated_mask > 0] = lbl
-
-            # Set labels to the dilated version
-            labels = labels_dilated
-
-        # Restore original shape
-        while len(labels.shape) < len(original_shape):
-            labels = labels.unsqueeze(0)
+        if not self.with_batch_dim:
+            labels = labels.squeeze(0)
 
         # If needed, pack the result into a MetaTensor and
         # transfer the metadata dictionary.
-        if is_meta_tensor:
-            labels = MetaTensor(labels, meta=data.meta.copy())
+        if meta is not None:
+            labels = MetaTensor(labels, meta=meta)
 
         return labels
 
@@ -370,11 +404,12 @@ class TwoClassMaskToLabeld(MapTransform):
     """Maps a two-class (object and border) mask to labels image.
 
     Supported and expected are either 2D data of shape (C, H, W) or 3D
-    data of shape (C, D, H, W).
+    data of shape (C, D, H, W), or batches (B, C, H, W) and (B, C, D, H, W)
+    with `with_batch_dim = True`.
 
     The alternative possibility of 2D batch data (B, C, H, W) can't robustly
-    be distinguished from 3D (C, D, H, W) data and will result in unexpected
-    labels.
+    be distinguished from 3D (C, D, H, W) data without `with_batch_dim` and
+    will result in unexpected labels.
     """
 
     def __init__(
@@ -382,6 +417,7 @@ class TwoClassMaskToLabeld(MapTransform):
         keys: tuple[str] = ("image", "label"),
         object_class: int = 1,
         border_thickness: int = 1,
+        with_batch_dim: bool = False,
     ) -> None:
         """Constructor
 
@@ -397,11 +433,16 @@ class TwoClassMaskToLabeld(MapTransform):
         border_thickness: Optional[int] = None
             Thickness of the border to be added. If set, it should be the same as the one used in
             LabelToTwoClassMask(d), but it is optional (and disabled by default).
+
+        with_batch_dim: bool (Optional, default is False)
+            Whether the input tensor has a batch dimension or not. This is to distinguish between the
+            2D case (B, C, H, W) and the 3D case (C, D, H, W). All other supported cases are clear.
         """
         super().__init__(keys=keys)
         self.keys = keys
         self.object_class = object_class
         self.border_thickness = border_thickness
+        self.with_batch_dim = with_batch_dim
 
     def __call__(self, data: dict) -> dict:
         """
@@ -420,7 +461,9 @@ class TwoClassMaskToLabeld(MapTransform):
         # Process the images
         for key in self.keys:
             transform = TwoClassMaskToLabel(
-                object_class=self.object_class, border_thickness=self.border_thickness
+                object_class=self.object_class,
+                border_thickness=self.border_thickness,
+                with_batch_dim=self.with_batch_dim,
             )
             d[key] = transform(d[key])
         return d
@@ -501,6 +544,7 @@ class NormalizedDistanceTransformd(MapTransform):
         add_seed_channel: bool = False,
         seed_radius: int = 1,
         with_batch_dim: bool = False,
+        whole_image: bool = False,
     ) -> None:
         """Constructor
 
@@ -529,6 +573,15 @@ class NormalizedDistanceTransformd(MapTransform):
         with_batch_dim: bool (Optional, default is False)
             Whether the input tensor has a batch dimension or not. This is to distinguish between the
             2D case (B, C, H, W) and the 3D case (C, D, H, W). All other supported cases are clear.
+
+        whole_image: bool (Optional, default is False)
+            Set to True to calculate one distance transform of all objects over the whole image, and to
+            normalize it and place the seeds for all labels at once, instead of processing the bounding
+            box of each label in turn. This is faster for (2D) images with many objects. The results are
+            the same for objects surrounded by background within their bounding box (e.g., round objects);
+            otherwise (e.g., objects with flat sides), the distances are not limited to the bounding box of
+            each object, and touching objects are separated by setting the pixels on their common border
+            to background.
         """
         super().__init__(keys=keys)
         self.keys = keys
@@ -538,6 +591,7 @@ class NormalizedDistanceTransformd(MapTransform):
             add_seed_channel=add_seed_channel,
             seed_radius=seed_radius,
             with_batch_dim=with_batch_dim,
+            whole_image=whole_image,
         )
 
     def __call__(self, data: dict) -> dict:
@@ -573,6 +627,7 @@ class NormalizedDistanceTransform(Transform):
         add_seed_channel: bool = False,
         seed_radius: int = 1,
         with_batch_dim: bool = False,
+        whole_image: bool = False,
     ) -> None:
         """Constructor
 
@@ -601,6 +656,15 @@ class NormalizedDistanceTransform(Transform):
         with_batch_dim: bool (Optional, default is False)
             Whether the input tensor has a batch dimension or not. This is to distinguish between the
             2D case (B, C, H, W) and the 3D case (C, D, H, W). All other supported cases are clear.
+
+        whole_image: bool (Optional, default is False)
+            Set to True to calculate one distance transform of all objects over the whole image, and to
+            normalize it and place the seeds for all labels at once, instead of processing the bounding
+            box of each label in turn. This is faster for (2D) images with many objects. The results are
+            the same for objects surrounded by background within their bounding box (e.g., round objects);
+            otherwise (e.g., objects with flat sides), the distances are not limited to the bounding box of
+            each object, and touching objects are separated by setting the pixels on their common border
+            to background.
         """
         super().__init__()
         self.reverse = reverse
@@ -609,6 +673,7 @@ class NormalizedDistanceTransform(Transform):
         self.add_seed_channel = add_seed_channel
         self.seed_radius = seed_radius
         self.with_batch_dim = with_batch_dim
+        self.whole_image = whole_image
 
     def _process_single(self, data_label):
         """Process a single image (of a potential batch)."""
@@ -699,6 +764,87 @@ class NormalizedDistanceTransform(Transform):
         else:
             return dt_out
 
+    def _process_whole_image(self, data_label):
+        """Process a single image (of a potential batch) with one distance transform."""
+        # Original shape
+        original_shape = data_label.shape
+
+        # Remove singleton dimensions
+        data_label = data_label.squeeze()
+
+        # Make sure that the input is of integer type
+        if not data_label.dtype.kind == "i":
+            data_label = data_label.astype(np.int32)
+
+        # Set the pixels on the border between touching labels to background
+        mask = data_label > 0
+        inner = mask.copy()
+        for axis in range(data_label.ndim):
+            first = [slice(None)] * data_label.ndim
+            second = [slice(None)] * data_label.ndim
+            first[axis] = slice(None, -1)
+            second[axis] = slice(1, None)
+            first, second = tuple(first), tuple(second)
+            border = (
+                (data_label[first] != data_label[second]) & mask[first] & mask[second]
+            )
+            inner[first] &= ~border
+            inner[second] &= ~border
+
+        # Calculate the distance transform of all objects at once (in the bounding box
+        # of all objects, with one pixel of background around it)
+        dt = np.zeros(mask.shape, dtype=np.float64)
+        bbox = ndi.find_objects(mask.astype(np.uint8))
+        if len(bbox) > 0:
+            bbox = tuple(
+                slice(max(s.start - 1, 0), min(s.stop + 1, n))
+                for s, n in zip(bbox[0], mask.shape)
+            )
+            dt[bbox] = ndi.distance_transform_edt(inner[bbox], return_distances=True)
+
+        # Normalize the distance transform of each label by its own range (on the pixels
+        # with a positive distance only)
+        inside = dt > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = scale_dist_transform_by_region(
+                dt[inside],
+                data_label[inside],
+                reverse=self.reverse,
+                do_not_zero=self.do_not_zero,
+                in_place=True,
+            )
+        dt_out = np.zeros(data_label.shape, dtype=np.float32)
+        dt_out[inside] = values
+        dt_out = dt_out.reshape(original_shape)
+
+        if not self.add_seed_channel:
+            return dt_out
+
+        # Calculate the centers of mass of all labels in one pass (rounded as offsets
+        # from the corner of their bounding boxes)
+        labels = data_label[mask]
+        objects = ndi.find_objects(data_label)
+        counts = np.bincount(labels)
+        present = np.flatnonzero(counts)
+        centers_of_mass = []
+        for d, coords in enumerate(np.nonzero(mask)):
+            corners = np.zeros(len(counts), dtype=int)
+            corners[present] = [objects[label - 1][d].start for label in present]
+            offsets = coords - corners[labels]
+            means = np.bincount(labels, weights=offsets)[present] / counts[present]
+            centers_of_mass.append(np.round(means).astype(int) + corners[present])
+
+        # Add the seeds: add the offsets of the footprint to all centers at once
+        footprint = _get_footprint(data_label.ndim, self.seed_radius)
+        offsets = np.argwhere(footprint) - self.seed_radius
+        points = np.stack(centers_of_mass, axis=1)[:, np.newaxis] + offsets
+        points = points.reshape(-1, data_label.ndim)
+        valid = np.all((points >= 0) & (points < data_label.shape), axis=1)
+        dt_seeds = np.zeros(data_label.shape, dtype=np.float32)
+        dt_seeds[tuple(points[valid].T)] = 1.0
+        dt_seeds = dt_seeds.reshape(original_shape)
+        return np.concatenate((dt_out, dt_seeds), axis=0)
+
     def __call__(
         self, data: Union[torch.Tensor, monai.data.MetaTensor, np.ndarray]
     ) -> torch.Tensor:
@@ -739,14 +885,20 @@ class NormalizedDistanceTransform(Transform):
         else:
             data_label = data
 
+        # Process the bounding box of each label in turn, or the whole image at once
+        if self.whole_image:
+            process = self._process_whole_image
+        else:
+            process = self._process_single
+
         if self.with_batch_dim:
             out_shape = list(data_label.shape)
             out_shape[1] = 2
             dt_final = np.zeros(tuple(out_shape), dtype=np.float32)
             for b in range(data_label.shape[0]):
-                dt_final[b] = self._process_single(data_label[b])
+                dt_final[b] = process(data_label[b])
         else:
-            dt_final = self._process_single(data_label)
+            dt_final = process(data_label)
 
         # Cast to a tensor
         dt = torch.from_numpy(dt_final)
@@ -770,6 +922,7 @@ class WatershedAndLabelTransformd(MapTransform):
         use_seed_channel: bool = True,
         use_random_walker: bool = False,
         with_batch_dim: bool = False,
+        backend: Optional[ProcessPoolBackend] = None,
     ) -> None:
         """Constructor
 
@@ -790,6 +943,10 @@ class WatershedAndLabelTransformd(MapTransform):
         with_batch_dim: bool (Optional, default is False)
             Whether the input tensor has a batch dimension or not. This is to distinguish between the
             2D case (B, C, H, W) and the 3D case (C, D, H, W). All other supported cases are clear.
+
+        backend: Optional[ProcessPoolBackend] = None
+            Backend that processes the items (or blocks of large volumes) of the input in a pool
+            of processes. Omit to process them serially in the current process.
         """
         super().__init__(keys=keys)
         self.keys = keys
@@ -797,6 +954,7 @@ class WatershedAndLabelTransformd(MapTransform):
             use_seed_channel=use_seed_channel,
             use_random_walker=use_random_walker,
             with_batch_dim=with_batch_dim,
+            backend=backend,
         )
 
     def __call__(self, data: dict) -> dict:
@@ -835,6 +993,7 @@ class WatershedAndLabelTransform(Transform):
         dt_threshold: float = 0.02,
         use_random_walker: bool = False,
         with_batch_dim: bool = False,
+        backend: Optional[ProcessPoolBackend] = None,
     ) -> None:
         """Constructor
 
@@ -858,6 +1017,10 @@ class WatershedAndLabelTransform(Transform):
         with_batch_dim: bool (Optional, default is False)
             Whether the input tensor has a batch dimension or not. This is to distinguish between the
             2D case (B, C, H, W) and the 3D case (C, D, H, W). All other supported cases are clear.
+
+        backend: Optional[ProcessPoolBackend] = None
+            Backend that processes the items (or blocks of large volumes) of the input in a pool
+            of processes. Omit to process them serially in the current process.
         """
         super().__init__()
         self.is_idt = is_idt
@@ -865,6 +1028,7 @@ class WatershedAndLabelTransform(Transform):
         self.dt_threshold = dt_threshold
         self.use_random_walker = use_random_walker
         self.with_batch_dim = with_batch_dim
+        self.backend = backend
 
     def _process_single(self, data_label):
         """Process a single image (of a potential batch)."""
@@ -950,7 +1114,15 @@ class WatershedAndLabelTransform(Transform):
         else:
             data_label = data
 
-        if self.with_batch_dim:
+        if self.backend is not None:
+            # Fan the items (or blocks) out to the worker processes
+            if self.with_batch_dim:
+                labels = self.backend.map(self._process_single, data_label)
+                dt_final = labels.astype(np.float32)
+            else:
+                labels = self.backend.map(self._process_single, data_label[None])
+                dt_final = labels[0, 0]
+        elif self.with_batch_dim:
             # Output is with one channel only
             input_shape = list(data_label.shape)
             input_shape[1] = 1
@@ -0,0 +1,322 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+import itertools
+import sys
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, resource_tracker, shared_memory
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+# Process pools of the backends. They are kept out of the attributes of the backends, so
+# that the description of the transforms (e.g., in the prediction manifests) does not
+# depend on the state of the pool.
+_executors = weakref.WeakKeyDictionary()
+
+
+def _init_worker():
+    """Do not track the shared memory segments attached by the workers.
+
+    The segments are owned (and unlinked) by the calling process. Before Python 3.13, the
+    workers would otherwise register and unregister them with the resource tracker they
+    share with the calling process.
+    """
+    if sys.version_info < (3, 13):
+        resource_tracker.register = lambda name, rtype: None
+        resource_tracker.unregister = lambda name, rtype: None
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def _process_task(
+    process_fn: Callable,
+    input_name: str,
+    input_shape: tuple,
+    input_dtype: str,
+    output_name: str,
+    output_shape: tuple,
+    b: int,
+    read: tuple,
+    core: tuple,
+    halo_planes: Sequence[int],
+) -> tuple[int, list]:
+    """Process an item (or a block of an item) of a batch in shared memory.
+
+    The labels of the core of the block are relabeled consecutively and written to the
+    output. Returns the number of labels, and the labels (with the same ids) that the
+    block sees on the first plane of the next block along each of `halo_planes`.
+    """
+    input_shm = _attach_shared_memory(input_name)
+    output_shm = _attach_shared_memory(output_name)
+    try:
+        data = np.ndarray(input_shape, dtype=input_dtype, buffer=input_shm.buf)
+        output = np.ndarray(output_shape, dtype=np.int32, buffer=output_shm.buf)
+
+        # Process the block with its halo
+        labels = process_fn(np.array(data[(b, slice(None), *read)]))
+
+        # Relabel the core consecutively
+        core_in_read = tuple(
+            slice(c.start - r.start, c.stop - r.start) for c, r in zip(core, read)
+        )
+        ids, inverse = np.unique(labels[core_in_read], return_inverse=True)
+        if ids[0] != 0:
+            inverse += 1
+        output[(b, 0, *core)] = inverse.reshape(labels[core_in_read].shape)
+        num_labels = len(ids) - 1 if ids[0] == 0 else len(ids)
+
+        # Labels of the core objects on the first plane of the next blocks (in the halo)
+        planes = []
+        for d in halo_planes:
+            index = list(core_in_read)
+            index[d] = core[d].stop - read[d].start
+            plane = labels[tuple(index)]
+            position = np.clip(np.searchsorted(ids, plane), 0, len(ids) - 1)
+            found = (ids[position] == plane) & (plane != 0)
+            planes.append(
+                np.where(found, position + (0 if ids[0] == 0 else 1), 0).astype(
+                    np.int32
+                )
+            )
+    finally:
+        input_shm.close()
+        output_shm.close()
+    return num_labels, planes
+
+
+class ProcessPoolBackend:
+    """Execution backend that fans the object post-processing out to a pool of processes.
+
+    The items of a batch are processed in parallel. If `block_size` is set, each item is
+    further split into blocks that are processed (with a halo of context) in parallel, and
+    the objects that cross the borders of the blocks are stitched back together. The
+    volumes are shared with the workers in shared memory, and the label ids are unique
+    within each item.
+
+    Processing an item at once gives the same result as processing it serially. When
+    split into blocks, the result may differ close to the borders of the blocks: the
+    halo should be larger than the largest expected objects.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 4,
+        block_size: Optional[Sequence[int]] = None,
+        halo: int = 16,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        num_workers: int = 4
+            Number of worker processes.
+
+        block_size: Optional[Sequence[int]] = None
+            Spatial size of the blocks each item is split into (e.g., (64, 256, 256) for a
+            3D volume). Omit to process each item at once.
+
+        halo: int = 16
+            Number of pixels of context added on each side of the blocks (only used if
+            `block_size` is set).
+        """
+        if num_workers < 1:
+            raise ValueError("`num_workers` must be at least 1.")
+        if block_size is not None and any(s < 1 for s in block_size):
+            raise ValueError("`block_size` must be positive.")
+        if block_size is not None and halo < 1:
+            raise ValueError("`halo` must be at least 1 to stitch the blocks.")
+        self.num_workers = num_workers
+        self.block_size = None if block_size is None else tuple(block_size)
+        self.halo = halo
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        executor = _executors.get(self, None)
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+            )
+            _executors[self] = executor
+        return executor
+
+    def _get_blocks(self, spatial_shape: tuple) -> list[tuple[tuple, tuple]]:
+        """Return the (read, core) slices of the blocks of an item."""
+        if self.block_size is None:
+            full = tuple(slice(0, s) for s in spatial_shape)
+            return [(full, full)]
+        if len(self.block_size) != len(spatial_shape):
+            raise ValueError(
+                f"`block_size` must have {len(spatial_shape)} dimensions to split "
+                f"volumes of shape {spatial_shape}."
+            )
+        starts = [range(0, s, b) for s, b in zip(spatial_shape, self.block_size)]
+        blocks = []
+        for start in itertools.product(*starts):
+            core = tuple(
+                slice(s, min(s + b, n))
+                for s, b, n in zip(start, self.block_size, spatial_shape)
+            )
+            read = tuple(
+                slice(max(c.start - self.halo, 0), min(c.stop + self.halo, n))
+                for c, n in zip(core, spatial_shape)
+            )
+            blocks.append((read, core))
+        return blocks
+
+    def map(self, process_fn: Callable, data: np.ndarray) -> np.ndarray:
+        """Apply a function to all items (or blocks) of a batch in the worker processes.
+
+        Parameters
+        ----------
+
+        process_fn: Callable
+            Function that maps an item (C, *spatial) to a label image (*spatial). It must
+            be picklable (e.g., the method of a transform).
+
+        data: np.ndarray
+            Batch (B, C, *spatial).
+
+        Returns
+        -------
+
+        labels: np.ndarray
+            Label images (B, 1, *spatial) as int32.
+        """
+        data = np.ascontiguousarray(data)
+        output_shape = (data.shape[0], 1, *data.shape[2:])
+        blocks = self._get_blocks(data.shape[2:])
+
+        # A single task is processed in the current process
+        if data.shape[0] == 1 and len(blocks) == 1:
+            labels = np.zeros(output_shape, dtype=np.int32)
+            labels[0, 0] = process_fn(data[0])
+            return labels
+
+        # Share the input and the output with the workers
+        input_shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        output_shm = shared_memory.SharedMemory(
+            create=True, size=max(int(np.prod(output_shape)) * 4, 1)
+        )
+        try:
+            shared = np.ndarray(data.shape, dtype=data.dtype, buffer=input_shm.buf)
+            shared[:] = data
+            del shared
+
+            # Process all blocks of all items
+            tasks = []
+            for b in range(data.shape[0]):
+                for read, core in blocks:
+                    halo_planes = [
+                        d for d in range(len(core)) if core[d].stop < data.shape[2 + d]
+                    ]
+                    tasks.append((b, read, core, halo_planes))
+            executor = self._get_executor()
+            futures = [
+                executor.submit(
+                    _process_task,
+                    process_fn,
+                    input_shm.name,
+                    data.shape,
+                    data.dtype.str,
+                    output_shm.name,
+                    output_shape,
+                    *task,
+                )
+                for task in tasks
+            ]
+            results = [future.result() for future in futures]
+            labels = np.ndarray(
+                output_shape, dtype=np.int32, buffer=output_shm.buf
+            ).copy()
+        finally:
+            for shm in (input_shm, output_shm):
+                shm.close()
+                shm.unlink()
+
+        if len(blocks) > 1:
+            for b in range(data.shape[0]):
+                n = len(blocks)
+                self._stitch(
+                    labels[b, 0],
+                    tasks[b * n : (b + 1) * n],
+                    results[b * n : (b + 1) * n],
+                )
+        return labels
+
+    @staticmethod
+    def _stitch(labels: np.ndarray, tasks: list, results: list):
+        """Make the labels of the blocks of an item unique, and merge the objects that
+        cross the borders of the blocks (in place)."""
+
+        # Offset the labels of each block
+        offsets = np.cumsum([0] + [num_labels for num_labels, _ in results])
+        for (_, _, core, _), offset in zip(tasks, offsets[:-1]):
+            block = labels[core]
+            block[block > 0] += offset
+
+        # Objects are merged with the object of the next block they overlap most with
+        # on its first plane, if that is also their best match
+        parent = np.arange(offsets[-1] + 1)
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for (_, _, core, halo_planes), offset, (_, planes) in zip(
+            tasks, offsets[:-1], results
+        ):
+            for d, plane in zip(halo_planes, planes):
+                index = list(core)
+                index[d] = core[d].stop
+                neighbour = labels[tuple(index)]
+                valid = (plane > 0) & (neighbour > 0)
+                if not np.any(valid):
+                    continue
+                pairs, counts = np.unique(
+                    np.stack([plane[valid] + offset, neighbour[valid]]),
+                    axis=1,
+                    return_counts=True,
+                )
+                order = np.argsort(-counts, kind="stable")
+                pairs = pairs[:, order]
+                _, best_a = np.unique(pairs[0], return_index=True)
+                _, best_b = np.unique(pairs[1], return_index=True)
+                for a, c in pairs[:, np.intersect1d(best_a, best_b)].T:
+                    root_a, root_c = find(a), find(c)
+                    if root_a != root_c:
+                        parent[max(root_a, root_c)] = min(root_a, root_c)
+
+        # Relabel consecutively
+        roots = np.array([find(i) for i in range(len(parent))])
+        _, lut = np.unique(roots, return_inverse=True)
+        labels[:] = lut[labels]
+
+    def close(self):
+        """Shut down the worker processes (they are started again if needed)."""
+        executor = _executors.pop(self, None)
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
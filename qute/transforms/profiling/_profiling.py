@@ -0,0 +1,241 @@
+# ******************************************************************************
+# Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the Apache License Version 2.0
+# which accompanies this distribution, and is available at
+# https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+# Contributors:
+#   Aaron Ponti - initial API and implementation
+# ******************************************************************************
+import json
+import os
+import time
+import uuid
+from copy import deepcopy
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import torch
+from monai.transforms import Compose
+from monai.transforms.compose import apply_pending_transforms
+from monai.transforms.transform import ThreadUnsafe, apply_transform
+
+# Recorders of the current process, by stats folder
+_recorders = {}
+
+
+def _nbytes(data) -> int:
+    """Return the total size in bytes of the tensors and arrays in (nested) data."""
+    if isinstance(data, torch.Tensor):
+        return data.element_size() * data.nelement()
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    if isinstance(data, dict):
+        return sum(_nbytes(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return sum(_nbytes(value) for value in data)
+    return 0
+
+
+class _TransformStatsRecorder:
+    """Accumulates the transform statistics of one process and saves them to a JSON file."""
+
+    def __init__(self, stats_dir: Path, flush_interval: float):
+        self.pid = os.getpid()
+        self.stats_dir = stats_dir
+        self.flush_interval = flush_interval
+        self.stats = {}
+        self.file_name = stats_dir / f"stats_{self.pid}_{uuid.uuid4().hex[:8]}.json"
+        self._last_flush = 0.0
+        # Flush the last statistics when the process (e.g., a DataLoader worker) exits
+        self._finalizer = Finalize(self, self.flush, exitpriority=10)
+
+    def record(self, pipeline: str, transform: str, seconds: float, nbytes: int):
+        entry = self.stats.setdefault(pipeline, {}).setdefault(
+            transform,
+            {"calls": 0, "total_time": 0.0, "max_time": 0.0, "total_bytes": 0},
+        )
+        entry["calls"] += 1
+        entry["total_time"] += seconds
+        entry["max_time"] = max(entry["max_time"], seconds)
+        entry["total_bytes"] += nbytes
+
+    def maybe_flush(self):
+        if time.perf_counter() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the statistics to the JSON file of the process."""
+        self._last_flush = time.perf_counter()
+        if len(self.stats) == 0:
+            return
+        self.stats_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.file_name.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump({"pid": self.pid, "stats": self.stats}, f)
+        tmp_file.replace(self.file_name)
+
+
+def _get_recorder(stats_dir: Path, flush_interval: float) -> _TransformStatsRecorder:
+    """Return the recorder of the current process for the stats folder."""
+    recorder = _recorders.get(stats_dir)
+    if recorder is None or recorder.pid != os.getpid():
+        # A forked process must not reuse the statistics of its parent
+        recorder = _TransformStatsRecorder(stats_dir, flush_interval)
+        _recorders[stats_dir] = recorder
+    return recorder
+
+
+def flush_transform_stats(stats_dir: Union[Path, str, None] = None):
+    """Write the transform statistics of the current process to disk.
+
+    Parameters
+    ----------
+
+    stats_dir: Union[Path, str, None] = None
+        Folder of the statistics to flush. If omitted, all statistics are flushed.
+    """
+    for key, recorder in _recorders.items():
+        if recorder.pid != os.getpid():
+            continue
+        if stats_dir is None or key == Path(stats_dir).resolve():
+            recorder.flush()
+
+
+def aggregate_transform_stats(stats_dir: Union[Path, str]) -> dict:
+    """Aggregate the transform statistics written by all processes.
+
+    Parameters
+    ----------
+
+    stats_dir: Union[Path, str]
+        Folder of the statistics (see `InstrumentedCompose`).
+
+    Returns
+    -------
+
+    stats: dict
+        Dictionary {pipeline: {transform: stats}}, where the statistics are the number
+        of "calls", the "total_time", "mean_time" and "max_time" in seconds, the
+        "total_bytes" and "mean_bytes" of the outputs, and the number of "processes".
+    """
+    stats = {}
+    for file_name in sorted(Path(stats_dir).glob("stats_*.json")):
+        try:
+            with open(file_name, "r") as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            # The file is being replaced
+            continue
+        for pipeline, transforms in content["stats"].items():
+            for transform, entry in transforms.items():
+                out = stats.setdefault(pipeline, {}).setdefault(
+                    transform,
+                    {
+                        "calls": 0,
+                        "total_time": 0.0,
+                        "max_time": 0.0,
+                        "total_bytes": 0,
+                        "processes": 0,
+                    },
+                )
+                out["calls"] += entry["calls"]
+                out["total_time"] += entry["total_time"]
+                out["max_time"] = max(out["max_time"], entry["max_time"])
+                out["total_bytes"] += entry["total_bytes"]
+                out["processes"] += 1
+
+    # Add the means
+    for transforms in stats.values():
+        for entry in transforms.values():
+            calls = max(1, entry["calls"])
+            entry["mean_time"] = entry["total_time"] / calls
+            entry["mean_bytes"] = entry["total_bytes"] / calls
+    return stats
+
+
+class InstrumentedCompose(Compose):
+    """Compose that records the wall time, the output size and the number of calls of each of
+    its transforms.
+
+    Each process (e.g., each DataLoader worker) accumulates its own statistics and
+    periodically writes them to a JSON file in `stats_dir`; use
+    `aggregate_transform_stats()` to combine them.
+    """
+
+    def __init__(
+        self,
+        transforms: Compose,
+        stats_dir: Union[Path, str],
+        name: str = "pipeline",
+        flush_interval: float = 2.0,
+    ):
+        """Constructor.
+
+        Parameters
+        ----------
+
+        transforms: Compose
+            Pipeline to instrument.
+
+        stats_dir: Union[Path, str]
+            Folder where the statistics are saved.
+
+        name: str = "pipeline"
+            Name of the pipeline in the statistics (e.g., "train").
+
+        flush_interval: float = 2.0
+            Minimum interval in seconds between two writes of the statistics of a process.
+        """
+        if not isinstance(transforms, Compose):
+            transforms = Compose(transforms)
+        super().__init__(
+            transforms.transforms,
+            map_items=transforms.map_items,
+            unpack_items=transforms.unpack_items,
+            lazy=transforms.lazy,
+            overrides=transforms.overrides,
+            log_stats=transforms.log_stats,
+        )
+        self.stats_dir = Path(stats_dir).resolve()
+        self.name = name
+        self.flush_interval = flush_interval
+        self.transform_names = [
+            f"{i:02d}_{type(t).__name__}" for i, t in enumerate(self.transforms)
+        ]
+
+    def __call__(self, input_, start=0, end=None, threading=False, lazy=None):
+        recorder = _get_recorder(self.stats_dir, self.flush_interval)
+        _lazy = self._lazy if lazy is None else lazy
+        end = len(self.transforms) if end is None else end
+
+        # Same as monai.transforms.compose.execute_compose(), one transform at a time
+        data = input_
+        for i in range(start, end):
+            transform = self.transforms[i]
+            if threading and isinstance(transform, ThreadUnsafe):
+                transform = deepcopy(transform)
+            t0 = time.perf_counter()
+            data = apply_transform(
+                transform,
+                data,
+                self.map_items,
+                self.unpack_items,
+                lazy=_lazy,
+                overrides=self.overrides,
+                log_stats=self.log_stats,
+            )
+            recorder.record(
+                self.name,
+                self.transform_names[i],
+                time.perf_counter() - t0,
+                _nbytes(data),
+            )
+        data = apply_pending_transforms(
+            data, None, self.overrides, logger_name=self.log_stats
+        )
+        recorder.maybe_flush()
+        return data
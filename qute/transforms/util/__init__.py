@@ -14,6 +14,8 @@ from ._util import (
     compute_2d_flows,
     compute_3d_flow_magnitude_and_angle,
     compute_3d_flows,
+    compute_sampling_index,
+    draw_from_sampling_index,
     extract_subvolume,
     get_tensor_num_spatial_dims,
     insert_subvolume,
@@ -27,6 +29,8 @@ __all__ = [
     "compute_2d_flows",
     "compute_3d_flow_magnitude_and_angle",
     "compute_3d_flows",
+    "compute_sampling_index",
+    "draw_from_sampling_index",
     "extract_subvolume",
     "get_tensor_num_spatial_dims",
     "insert_subvolume",
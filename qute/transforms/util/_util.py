@@ -18,20 +18,24 @@ from scipy.ndimage import distance_transform_edt
 
 
 def scale_dist_transform_by_region(
-    dt: np.ndarray,
-    regions: np.ndarray,
+    dt: Union[np.ndarray, torch.Tensor],
+    regions: Union[np.ndarray, torch.Tensor],
     reverse: bool = False,
     do_not_zero: bool = False,
     in_place: bool = False,
 ):
     """Scales the distance transform values by region.
 
+    All regions are scaled in one pass: the minimum and maximum of each region are
+    collected in lookup tables indexed by the region label, and gathered back for each
+    pixel.
+
     Parameters
     ----------
-    dt: np.ndarray
-        The distance transform array.
+    dt: Union[np.ndarray, torch.Tensor]
+        The distance transform array (or tensor, on any device).
 
-    regions: np.ndarray
+    regions: Union[np.ndarray, torch.Tensor]
         The region array.
 
     in_place: bool (Optional)
@@ -50,42 +54,65 @@ def scale_dist_transform_by_region(
     The updated distance transform array.
     """
 
-    # Get all regions
-    ids = np.unique(regions)
+    is_tensor = isinstance(dt, torch.Tensor)
 
     # Should the process happen in place?
     if in_place:
         work_dt = dt
     else:
-        work_dt = dt.copy()
-
-    # Process all regions
-    for i in ids:
-        # Skip background
-        if i == 0:
-            continue
-
-        # Extract the distance transform for current region and scale it
-        indices = regions == i
-        values = work_dt[indices]
-        if reverse:
-            # Reverse the direction of the distance transform: make sure to stretch
-            # the maximum to 1.0; we can keep a minimum larger than 0.0 in the center.
-            if do_not_zero:
-                # Do not set the distance at the center to 0.0; the gradient is
-                # slightly lower, depending on the original range.
-                tmp = work_dt[indices]
-                tmp = (tmp.max() + 1) - tmp
-                work_dt[indices] = tmp / tmp.max()
-            else:
-                # Plain linear inverse
-                min_value = work_dt[indices].min()
-                max_value = work_dt[indices].max()
-                work_dt[indices] = (work_dt[indices] - max_value) / (
-                    min_value - max_value
-                )
+        work_dt = dt.clone() if is_tensor else dt.copy()
+
+    # Label of each pixel in a region (skip background)
+    if is_tensor:
+        regions = torch.as_tensor(regions, device=dt.device)
+        mask = regions != 0
+        labels = regions[mask].to(torch.int64)
+    else:
+        regions = _as_numpy(regions)
+        mask = regions != 0
+        labels = regions[mask].astype(np.int64)
+    if len(labels) == 0:
+        return work_dt
+
+    # Map negative labels to non-negative indices for the lookup tables
+    if labels.min() < 0:
+        labels = labels - labels.min()
+    num_labels = int(labels.max()) + 1
+
+    # Minimum and maximum of the distance transform in each region
+    values = work_dt[mask]
+    if is_tensor:
+        max_values = torch.zeros(num_labels, dtype=values.dtype, device=values.device)
+        max_values = max_values.scatter_reduce(
+            0, labels, values, "amax", include_self=False
+        )
+        min_values = torch.zeros(num_labels, dtype=values.dtype, device=values.device)
+        min_values = min_values.scatter_reduce(
+            0, labels, values, "amin", include_self=False
+        )
+    else:
+        max_values = np.full(num_labels, values.min(), dtype=values.dtype)
+        np.maximum.at(max_values, labels, values)
+        min_values = np.full(num_labels, values.max(), dtype=values.dtype)
+        np.minimum.at(min_values, labels, values)
+    max_values = max_values[labels]
+    min_values = min_values[labels]
+
+    # Scale the distance transform of all regions
+    if reverse:
+        # Reverse the direction of the distance transform: make sure to stretch
+        # the maximum to 1.0; we can keep a minimum larger than 0.0 in the center.
+        if do_not_zero:
+            # Do not set the distance at the center to 0.0; the gradient is
+            # slightly lower, depending on the original range.
+            work_dt[mask] = ((max_values + 1) - values) / (
+                (max_values + 1) - min_values
+            )
         else:
-            work_dt[indices] = work_dt[indices] / values.max()
+            # Plain linear inverse
+            work_dt[mask] = (values - max_values) / (min_values - max_values)
+    else:
+        work_dt[mask] = values / max_values
 
     # Return updated dt
     return work_dt
@@ -342,3 +369,177 @@ def insert_subvolume(image, subvolume, bbox, masked: bool = False):
     else:
         image[slices] = subvolume
     return image
+
+
+def _as_numpy(data) -> np.ndarray:
+    """Return a NumPy view (or copy, for device tensors) of the passed array."""
+    if isinstance(data, torch.Tensor):
+        return data.detach().cpu().numpy()
+    return np.asarray(data)
+
+
+def _pos_neg_masks(
+    label: np.ndarray,
+    image: Union[np.ndarray, None] = None,
+    image_threshold: float = 0.0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Return the foreground and background masks as defined by `monai.transforms.utils.map_binary_to_indices`.
+
+    Both `label` and `image` are expected to be channel-first.
+    """
+    label_mask = np.any(label, axis=0)
+    if image is None:
+        return label_mask, ~label_mask
+    image_mask = np.any(image > image_threshold, axis=0)
+    return label_mask & image_mask, ~label_mask & image_mask
+
+
+def compute_sampling_index(
+    label: Union[np.ndarray, torch.Tensor],
+    image: Union[np.ndarray, torch.Tensor, None] = None,
+    image_threshold: float = 0.0,
+    chunk_size: int = 32,
+) -> dict:
+    """Compute an index of the foreground and background voxels of a label image for
+    positive/negative patch sampling.
+
+    The spatial domain is split into chunks of `chunk_size` voxels per side, and the
+    positions of the foreground and background voxels are stored chunk by chunk, as
+    offsets within their chunk (so that they fit in 16 bits for the default chunk size).
+    Foreground and background are defined as in `monai.transforms.RandCropByPosNegLabeld`:
+    a voxel is foreground if the label is non-zero, and background otherwise; if the
+    `image` is passed, only voxels with intensity larger than `image_threshold` are
+    considered.
+
+    Parameters
+    ----------
+
+    label: Union[np.ndarray, torch.Tensor]
+        Channel-first label image (C, [D], H, W).
+
+    image: Union[np.ndarray, torch.Tensor, None] = None
+        Optional channel-first intensity image (C, [D], H, W).
+
+    image_threshold: float = 0.0
+        Intensity threshold for the `image`.
+
+    chunk_size: int = 32
+        Size of the chunks along each spatial dimension.
+
+    Returns
+    -------
+
+    index: dict
+        Dictionary with keys "shape" (spatial shape of the label), "chunk_size",
+        "fg_counts" and "bg_counts" (number of foreground and background voxels per
+        chunk, with one entry per chunk along each spatial dimension), and "fg_offsets"
+        and "bg_offsets" (positions of the voxels within their chunk, chunk by chunk).
+    """
+    label = _as_numpy(label)
+    image = _as_numpy(image) if image is not None else None
+    fg_mask, bg_mask = _pos_neg_masks(label, image, image_threshold)
+
+    # Pad the masks to a multiple of the chunk size and lay out the chunks one after the
+    # other (chunk, voxel in chunk)
+    shape = fg_mask.shape
+    ndim = len(shape)
+    grid = tuple(int(np.ceil(s / chunk_size)) for s in shape)
+    padding = tuple((0, g * chunk_size - s) for g, s in zip(grid, shape))
+    blocked_shape = tuple(v for g in grid for v in (g, chunk_size))
+    order = tuple(range(0, 2 * ndim, 2)) + tuple(range(1, 2 * ndim, 2))
+    chunk_volume = chunk_size**ndim
+    offset_dtype = np.uint16 if chunk_volume <= 2**16 else np.uint32
+    index = {
+        "shape": np.array(shape, dtype=np.int64),
+        "chunk_size": np.array(chunk_size, dtype=np.int64),
+    }
+    for name, mask in (("fg", fg_mask), ("bg", bg_mask)):
+        mask = np.pad(mask, padding).reshape(blocked_shape).transpose(order)
+        chunks, offsets = np.nonzero(mask.reshape(-1, chunk_volume))
+        counts = np.bincount(chunks, minlength=int(np.prod(grid)))
+        index[f"{name}_counts"] = counts.reshape(grid).astype(np.uint32)
+        index[f"{name}_offsets"] = offsets.astype(offset_dtype)
+
+    return index
+
+
+def draw_from_sampling_index(
+    index: dict,
+    label: Union[np.ndarray, torch.Tensor, None] = None,
+    image: Union[np.ndarray, torch.Tensor, None] = None,
+    image_threshold: float = 0.0,
+    foreground: bool = True,
+    num_samples: int = 1,
+    rand_state: Union[np.random.RandomState, None] = None,
+) -> np.ndarray:
+    """Draw random foreground (or background) voxels using an index from `compute_sampling_index()`.
+
+    Each voxel is drawn with uniform probability among all foreground (or background)
+    voxels, as `monai.transforms.RandCropByPosNegLabeld` would do, by looking up its
+    position in the index: the label image is not scanned.
+
+    Parameters
+    ----------
+
+    index: dict
+        Sampling index as returned by `compute_sampling_index()`.
+
+    label: Union[np.ndarray, torch.Tensor, None] = None
+        Optional channel-first label image (C, [D], H, W) that the index was computed from.
+        If passed, the class of the drawn voxels is checked against it.
+
+    image: Union[np.ndarray, torch.Tensor, None] = None
+        Optional channel-first intensity image (C, [D], H, W) that the index was computed
+        from (only used if `label` is passed).
+
+    image_threshold: float = 0.0
+        Intensity threshold for the `image`.
+
+    foreground: bool = True
+        Whether to draw foreground (True) or background (False) voxels.
+
+    num_samples: int = 1
+        Number of voxels to draw.
+
+    rand_state: Union[np.random.RandomState, None] = None
+        Random state to use. If omitted, a new (randomly seeded) one is created.
+
+    Returns
+    -------
+
+    indices: np.ndarray
+        Raveled indices of the drawn voxels in the spatial domain of `label`. The array is
+        empty if there are no voxels of the requested class.
+    """
+    if rand_state is None:
+        rand_state = np.random.RandomState()
+    name = "fg" if foreground else "bg"
+    shape = tuple(int(s) for s in index["shape"])
+    chunk_size = int(index["chunk_size"])
+    counts = index[f"{name}_counts"]
+    offsets = index[f"{name}_offsets"]
+    if len(offsets) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # Draw the rank of the voxels among all voxels of the class, and find their chunks
+    ranks = rand_state.randint(len(offsets), size=num_samples)
+    chunks = np.searchsorted(np.cumsum(counts.ravel(), dtype=np.int64), ranks, "right")
+
+    # Position of the voxels: corner of the chunk plus offset within the chunk
+    corners = np.unravel_index(chunks, counts.shape)
+    local = np.unravel_index(offsets[ranks], (chunk_size,) * len(shape))
+    coords = tuple(c * chunk_size + o for c, o in zip(corners, local))
+    if any(np.any(c >= s) for c, s in zip(coords, shape)):
+        raise ValueError("The sampling index does not match the label image.")
+    indices = np.ravel_multi_index(coords, shape)
+
+    # Check the class of the drawn voxels
+    if label is not None:
+        label = _as_numpy(label.reshape(label.shape[0], -1)[:, indices])
+        if image is not None:
+            image = _as_numpy(image.reshape(image.shape[0], -1)[:, indices])
+        masks = _pos_neg_masks(label, image, image_threshold)
+        if not np.all(masks[0] if foreground else masks[1]):
+            raise ValueError("The sampling index does not match the label image.")
+
+    return indices
@@ -65,6 +65,25 @@ def test_reading_classification_conf():
     assert config.use_v2 is False, "Wrong use_v2."
 
 
+def test_dynamic_quantization_is_rejected(tmp_path):
+    sample = (
+        Path(__file__).parent.parent
+        / "config_samples"
+        / "classification_project.ini_sample"
+    )
+    text = sample.read_text()
+    assert "inference_quantization = none" in text
+    for mode, expected in [("static", True), ("dynamic", False)]:
+        config_file = tmp_path / f"{mode}.ini"
+        config_file.write_text(
+            text.replace(
+                "inference_quantization = none", f"inference_quantization = {mode}"
+            )
+        )
+        config = ConfigFactory.get_config(config_file)
+        assert config.parse() is expected, f"Wrong validation of '{mode}'."
+
+
 def test_reading_regression_conf():
     config = Config(
         Path(__file__).parent.parent
@@ -178,3 +197,36 @@ def test_process_path():
     with pytest.raises(ValueError):
         path = "${HOME}/Documents/${" + generate_random_alphanumeric_string() + "}"
         _ = Config.process_path(path)
+
+
+def test_post_processing_pool_settings(tmp_path):
+    sample = (
+        Path(__file__).parent.parent
+        / "config_samples"
+        / "regression_project.ini_sample"
+    )
+    text = sample.read_text()
+    config = ConfigFactory.get_config(sample)
+    assert config.parse() is True, "Could not parse configuration file."
+    assert config.post_processing_workers is None, "Wrong number of workers."
+    assert config.post_processing_block_size is None, "Wrong block size."
+    assert config.post_processing_halo == 16, "Wrong halo."
+
+    config_file = tmp_path / "pool.ini"
+    config_file.write_text(
+        text.replace(
+            "post_processing_workers =", "post_processing_workers = 4"
+        ).replace(
+            "post_processing_block_size =", "post_processing_block_size = 64, 256, 256"
+        )
+    )
+    config = ConfigFactory.get_config(config_file)
+    assert config.parse() is True, "Could not parse configuration file."
+    assert config.post_processing_workers == 4, "Wrong number of workers."
+    assert config.post_processing_block_size == (64, 256, 256), "Wrong block size."
+
+    config_file.write_text(
+        text.replace("post_processing_workers =", "post_processing_workers = 0")
+    )
+    config = ConfigFactory.get_config(config_file)
+    assert config.parse() is False, "Invalid number of workers accepted."
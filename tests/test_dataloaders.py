@@ -9,10 +9,67 @@
 #   Aaron Ponti - initial API and implementation
 # ******************************************************************************
 
-import pytest
+from types import SimpleNamespace
 
-from qute.campaigns import SegmentationCampaignTransforms2D
+import numpy as np
+import pytest
+import torch
+from monai.data import DataLoader, Dataset
+from monai.transforms import Compose, RandFlipd, RandSpatialCropd
+from tifffile import imwrite
+
+from qute.callbacks import DatasetEpochCallback
+from qute.campaigns import (
+    InstrumentedCampaignTransforms,
+    SegmentationCampaignTransforms2D,
+)
+from qute.data.cache import (
+    DiskCacheDataset,
+    SharedMemoryCache,
+    SharedMemoryCacheDataset,
+    get_deterministic_prefix_length,
+    hash_transform_parameters,
+)
+from qute.data.dataloaders import DataModuleLocalFolder
 from qute.data.demos import CellSegmentationDemo
+from qute.data.patch_queue import PatchQueueDataset
+from qute.data.store import convert_to_store, is_store, read_store_metadata
+from qute.data.tuning import tune_data_loader
+from qute.transforms.io import CustomTIFFReaderd
+from qute.transforms.norm import ZNormalized
+from qute.transforms.profiling import (
+    InstrumentedCompose,
+    aggregate_transform_stats,
+    flush_transform_stats,
+)
+
+
+@pytest.fixture
+def make_image_label_pairs(tmp_path):
+    """Return a function that writes random image/label pairs and returns their file names.
+
+    The pairs are written to `tmp_path` as image_{i}.tif and label_{i}.tif, or to
+    `images_dir` and `labels_dir` (both as image_{i}.tif) if they are passed.
+    """
+
+    def _make(num_pairs, images_dir=None, labels_dir=None):
+        rng = np.random.default_rng(2022)
+        files = []
+        for i in range(num_pairs):
+            image = rng.integers(0, 1000, size=(32, 48)).astype(np.uint16)
+            label = (image > 500).astype(np.int32)
+            if images_dir is None:
+                image_file = tmp_path / f"image_{i}.tif"
+                label_file = tmp_path / f"label_{i}.tif"
+            else:
+                image_file = images_dir / f"image_{i}.tif"
+                label_file = labels_dir / f"image_{i}.tif"
+            imwrite(image_file, image)
+            imwrite(label_file, label)
+            files.append({"image": image_file, "label": label_file})
+        return files
+
+    return _make
 
 
 def test_k_folds():
@@ -422,3 +479,322 @@ def test_setup():
     # Check that 5 is not an acceptable fold number
     with pytest.raises(ValueError):
         data_module.set_fold(5)
+
+
+def test_disk_cache(tmp_path, make_image_label_pairs):
+    # Create a few image/label pairs
+    files = make_image_label_pairs(3)
+
+    # Deterministic prefix followed by a random tail (that never flips)
+    transforms = Compose(
+        [
+            CustomTIFFReaderd(keys=("image", "label")),
+            ZNormalized(keys=("image",)),
+            RandFlipd(keys=("image", "label"), prob=0.0, spatial_axis=0),
+        ]
+    )
+    assert get_deterministic_prefix_length(transforms) == 2, "Wrong prefix length."
+
+    # The parameters hash depends on the prefix only
+    other_transforms = Compose(
+        [
+            CustomTIFFReaderd(keys=("image", "label")),
+            ZNormalized(keys=("image",)),
+            RandFlipd(keys=("image", "label"), prob=0.5, spatial_axis=1),
+        ]
+    )
+    assert hash_transform_parameters(transforms, end=2) == hash_transform_parameters(
+        other_transforms, end=2
+    ), "Unexpected hash."
+    assert hash_transform_parameters(transforms) != hash_transform_parameters(
+        other_transforms
+    ), "Unexpected hash."
+
+    # Compare the cached and the uncached datasets
+    dataset = Dataset(data=files, transform=transforms)
+    cached_dataset = DiskCacheDataset(
+        data=files, transform=transforms, cache_dir=tmp_path / "cache"
+    )
+    for _ in range(2):
+        for i in range(len(files)):
+            expected = dataset[i]
+            cached = cached_dataset[i]
+            assert np.allclose(
+                np.asarray(expected["image"]), np.asarray(cached["image"])
+            ), "Cached image does not match."
+            assert np.all(
+                np.asarray(expected["label"]) == np.asarray(cached["label"])
+            ), "Cached label does not match."
+
+    # One cache entry per file, in the versioned folder
+    assert (
+        len(list((tmp_path / "cache").rglob("*.pt"))) == 3
+    ), "Wrong number of entries."
+
+    # Changing the content of a file invalidates its entry
+    imwrite(tmp_path / "image_0.tif", np.zeros((32, 48), dtype=np.uint16))
+    cached_dataset = DiskCacheDataset(
+        data=files, transform=transforms, cache_dir=tmp_path / "cache"
+    )
+    _ = cached_dataset[0]
+    assert (
+        len(list((tmp_path / "cache").rglob("*.pt"))) == 4
+    ), "Wrong number of entries."
+
+
+def test_shared_memory_cache(tmp_path, make_image_label_pairs):
+    # Create a cache that can only hold two samples
+    cache = SharedMemoryCache(max_bytes=2 * 4096 + 3000)
+    for i in range(3):
+        assert cache.put(f"{i}", torch.full((1024,), float(i))), "Could not cache."
+        assert cache.get(f"{i}")[0] == float(i), "Unexpected cached value."
+
+    # The first entry was evicted
+    assert len(cache) == 2, "Unexpected number of cached samples."
+    assert cache.get("0") is None, "Least recently used sample was not evicted."
+
+    # Access "1" to make "2" the least recently used
+    _ = cache.get("1")
+    cache.put("3", torch.zeros(1024))
+    assert "1" in cache and "2" not in cache, "Wrong sample evicted."
+    assert cache.stats()["evictions"] == 2, "Unexpected number of evictions."
+    cache.close()
+
+    # Create a few image/label pairs
+    files = make_image_label_pairs(4)
+    transforms = Compose(
+        [
+            CustomTIFFReaderd(keys=("image", "label")),
+            ZNormalized(keys=("image",)),
+            RandFlipd(keys=("image", "label"), prob=0.0, spatial_axis=0),
+        ]
+    )
+
+    # Two datasets sharing the cache, read by multiple workers
+    cache = SharedMemoryCache(max_bytes=1024**3)
+    dataset = Dataset(data=files, transform=transforms)
+    train_dataset = SharedMemoryCacheDataset(
+        data=files[:2], transform=transforms, cache=cache
+    )
+    val_dataset = SharedMemoryCacheDataset(
+        data=files, transform=transforms, cache=cache
+    )
+    for _ in DataLoader(train_dataset, batch_size=1, num_workers=2):
+        pass
+    assert len(cache) == 2, "Samples were not cached."
+    for i, sample in enumerate(DataLoader(val_dataset, batch_size=1, num_workers=2)):
+        assert torch.allclose(
+            torch.as_tensor(dataset[i]["image"]), torch.as_tensor(sample["image"][0])
+        ), "Cached image does not match."
+    assert len(cache) == 4, "Samples were not cached."
+    assert cache.stats()["hits"] == 2, "Cache was not shared across datasets."
+    cache.close()
+
+
+def test_default_cache_size_without_sysconf(tmp_path, monkeypatch):
+    # Platforms without `os.sysconf` (e.g., Windows)
+    monkeypatch.delattr("os.sysconf", raising=False)
+    campaign_transforms = SegmentationCampaignTransforms2D(
+        num_classes=3, patch_size=(32, 32)
+    )
+    data_module = DataModuleLocalFolder(
+        campaign_transforms=campaign_transforms, data_dir=tmp_path
+    )
+    assert data_module.cache_max_bytes is None, "Unexpected cache size."
+    data_module = DataModuleLocalFolder(
+        campaign_transforms=campaign_transforms, data_dir=tmp_path, cache_mode="shared"
+    )
+    assert data_module.cache_max_bytes == 4 * 1024**3, "Unexpected default cache size."
+
+
+def test_patch_queue(tmp_path):
+    # Create a few image/label pairs: the image intensity encodes the file index
+    files = []
+    for i in range(5):
+        image = np.full((32, 48), i, dtype=np.uint16)
+        label = np.full((32, 48), i, dtype=np.int32)
+        imwrite(tmp_path / f"image_{i}.tif", image)
+        imwrite(tmp_path / f"label_{i}.tif", label)
+        files.append(
+            {"image": tmp_path / f"image_{i}.tif", "label": tmp_path / f"label_{i}.tif"}
+        )
+    transforms = Compose(
+        [
+            CustomTIFFReaderd(keys=("image", "label")),
+            RandSpatialCropd(keys=("image", "label"), roi_size=(16, 16)),
+        ]
+    )
+
+    # Check the number of samples and batches with multiple workers
+    dataset = PatchQueueDataset(
+        data=files,
+        transform=transforms,
+        samples_per_volume=3,
+        pool_size=2,
+        shuffle_buffer_size=4,
+        batch_size=4,
+    )
+    assert len(dataset) == 15, "Unexpected number of samples."
+    for num_workers in [2, 0]:
+        data_loader = DataLoader(
+            dataset, batch_size=4, num_workers=num_workers, persistent_workers=False
+        )
+        num_batches = 0
+        counts = np.zeros(5, dtype=int)
+        for batch in data_loader:
+            num_batches += 1
+            assert batch["image"].shape[1:] == (1, 16, 16), "Unexpected patch size."
+            for value in batch["image"][:, 0, 0, 0]:
+                counts[int(value)] += 1
+        assert num_batches == len(data_loader), "Unexpected number of batches."
+        assert counts.sum() == 15, "Unexpected number of samples."
+
+    # Without workers, all volumes are sampled equally
+    assert np.all(counts == 3), "Volumes were not sampled equally."
+
+    # The order is reproducible
+    orders = []
+    for _ in range(2):
+        torch.manual_seed(2022)
+        dataset.set_epoch(0)
+        orders.append([int(s["image"][0, 0, 0]) for s in dataset])
+    assert orders[0] == orders[1], "Order of the samples is not reproducible."
+
+    # The epoch is passed to the persistent workers
+    data_loader = DataLoader(
+        dataset, batch_size=4, num_workers=2, persistent_workers=True
+    )
+    orders = {}
+    for epoch in [0, 1, 0]:
+        DatasetEpochCallback().on_train_epoch_start(
+            SimpleNamespace(train_dataloader=data_loader, current_epoch=epoch), None
+        )
+        order = [int(v) for batch in data_loader for v in batch["image"][:, 0, 0, 0]]
+        assert orders.setdefault(epoch, order) == order, "Epoch was not applied."
+    assert orders[0] != orders[1], "The order does not change with the epoch."
+    del data_loader
+
+
+def test_store(tmp_path, make_image_label_pairs):
+    # Create a small dataset
+    for sub_folder in ["images", "labels"]:
+        (tmp_path / "data" / sub_folder).mkdir(parents=True)
+    make_image_label_pairs(
+        3, tmp_path / "data" / "images", tmp_path / "data" / "labels"
+    )
+
+    # Convert it
+    metadata = convert_to_store(tmp_path / "data", tmp_path / "store")
+    assert is_store(tmp_path / "store"), "Store not recognized."
+    assert not is_store(tmp_path / "data"), "Unexpected store."
+    assert read_store_metadata(tmp_path / "store") == metadata, "Wrong metadata."
+    assert len(metadata["files"]) == 6, "Wrong number of files."
+    assert metadata["files"]["images/image_0.npy"] == {
+        "source": "image_0.tif",
+        "shape": [32, 48],
+        "dtype": "float32",
+    }, "Wrong file metadata."
+
+    # The reader returns the same data from the store
+    reader = CustomTIFFReaderd(keys=("image", "label"))
+    for i in range(3):
+        expected = reader(
+            {
+                "image": tmp_path / "data" / "images" / f"image_{i}.tif",
+                "label": tmp_path / "data" / "labels" / f"image_{i}.tif",
+            }
+        )
+        stored = reader(
+            {
+                "image": tmp_path / "store" / "images" / f"image_{i}.npy",
+                "label": tmp_path / "store" / "labels" / f"image_{i}.npy",
+            }
+        )
+        for key in ["image", "label"]:
+            assert stored[key].shape == expected[key].shape, "Wrong shape."
+            assert stored[key].dtype == expected[key].dtype, "Wrong dtype."
+            assert torch.equal(stored[key], expected[key]), "Wrong data."
+
+
+def test_tune_data_loader(tmp_path):
+    # Create a small dataset
+    rng = np.random.default_rng(2022)
+    for sub_folder in ["images", "labels"]:
+        (tmp_path / sub_folder).mkdir()
+    for i in range(10):
+        label = np.zeros((64, 64), dtype=np.int32)
+        label[16:48, 16:48] = 1
+        image = (rng.normal(size=(64, 64)) * 100 + 1000 * label).astype(np.uint16)
+        imwrite(tmp_path / "images" / f"image_{i}.tif", image)
+        imwrite(tmp_path / "labels" / f"image_{i}.tif", label)
+
+    data_module = DataModuleLocalFolder(
+        campaign_transforms=SegmentationCampaignTransforms2D(
+            num_classes=3, patch_size=(32, 32)
+        ),
+        data_dir=tmp_path,
+        batch_size=2,
+        patch_size=(32, 32),
+        num_workers=0,
+        num_inference_workers=0,
+        pin_memory=True,
+    )
+    data_module.setup("train")
+
+    # Memory is never pinned without CUDA
+    assert data_module.pin_memory == torch.cuda.is_available(), "Wrong pin_memory."
+
+    # Tune
+    result = tune_data_loader(
+        data_module,
+        num_workers=[0, 1],
+        prefetch_factors=[2, 4],
+        batch_sizes=[2, 4],
+        num_batches=2,
+        warmup_batches=1,
+        verbose=False,
+    )
+    for key in ["num_workers", "prefetch_factor", "pin_memory", "batch_size"]:
+        assert getattr(data_module, key) == result[key], f"{key} was not applied."
+    assert result["samples_per_second"] == max(
+        r["samples_per_second"] for r in result["results"]
+    ), "The best configuration was not selected."
+    assert len(result["results"]) >= 3, "Too few configurations were tried."
+    assert len(data_module.train_dataloader()) > 0, "Unexpected DataLoader."
+
+
+def test_transform_profiling(tmp_path, make_image_label_pairs):
+    # Create a few image/label pairs
+    files = make_image_label_pairs(4)
+
+    # Instrument a campaign
+    campaign_transforms = InstrumentedCampaignTransforms(
+        SegmentationCampaignTransforms2D(num_classes=2, patch_size=(16, 16)),
+        stats_dir=tmp_path / "stats",
+    )
+    assert campaign_transforms.num_classes == 2, "Attribute was not forwarded."
+    transforms = campaign_transforms.get_valid_transforms()
+    assert isinstance(transforms, InstrumentedCompose), "Pipeline not instrumented."
+
+    # Run the pipeline in the main process and in a worker
+    for num_workers in [0, 1]:
+        data_loader = DataLoader(
+            Dataset(data=files, transform=transforms),
+            batch_size=2,
+            num_workers=num_workers,
+        )
+        for _ in data_loader:
+            pass
+        del data_loader
+    flush_transform_stats()
+
+    # Both processes contributed to the statistics
+    stats = aggregate_transform_stats(tmp_path / "stats")
+    assert list(stats.keys()) == ["valid"], "Unexpected pipelines."
+    assert len(stats["valid"]) == len(transforms.transforms), "Missing transforms."
+    for name, entry in stats["valid"].items():
+        assert entry["calls"] == 8, f"Wrong number of calls for {name}."
+        assert entry["processes"] == 2, f"Wrong number of processes for {name}."
+        assert entry["total_time"] > 0.0, f"Wrong time for {name}."
+    reader = stats["valid"]["00_CustomTIFFReaderd"]
+    assert reader["mean_bytes"] == 2 * 32 * 48 * 4, "Wrong output size."
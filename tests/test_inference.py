@@ -0,0 +1,750 @@
+#  ********************************************************************************
+#  Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+#  All rights reserved. This program and the accompanying materials
+#  are made available under the terms of the Apache License Version 2.0
+#  which accompanies this distribution, and is available at
+#  https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Contributors:
+#    Aaron Ponti - initial API and implementation
+#  ******************************************************************************
+
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import torch
+from monai.inferers import SlidingWindowInferer
+from monai.losses import DiceCELoss
+from monai.metrics import DiceMetric
+from monai.utils import BlendMode
+from tifffile import imread, imwrite
+
+from qute.campaigns import SegmentationCampaignTransforms2D
+from qute.data import inference
+from qute.data.dataloaders import DataModuleLocalFolder
+from qute.data.ensemble import EnsembleNetwork, vote
+from qute.data.inference import (
+    _SlidingWindowPlanner,
+    full_inference,
+    full_inference_ensemble,
+    full_inference_tiled,
+)
+from qute.data.manifest import PredictionManifest, describe_parameters
+from qute.data.precision import InferencePrecision, check_inference_precision
+from qute.data.tiles import iterate_tiles, open_region_reader, open_tile_writer
+from qute.data.tta import TTANetwork, parse_tta_variants
+from qute.data.writers import (
+    TIFFPredictionWriter,
+    is_tiff_compression_available,
+    smallest_integer_dtype,
+)
+from qute.export import (
+    EagerBackend,
+    benchmark_backends,
+    export_model,
+    load_backend,
+    read_export_metadata,
+)
+from qute.models.quantization import (
+    compare_quantized_model,
+    get_calibration_batches,
+    is_quantized,
+    quantize_model,
+)
+from qute.models.unet import UNet
+from qute.transforms.objects import OneHotToMaskBatch
+
+
+@pytest.fixture
+def inference_setup(tmp_path):
+    # Create a few images of different sizes (the last batch is incomplete)
+    rng = np.random.default_rng(2022)
+    (tmp_path / "inputs").mkdir()
+    for i in range(5):
+        image = rng.integers(0, 1000, size=(48 + 8 * i, 40)).astype(np.uint16)
+        imwrite(tmp_path / "inputs" / f"image_{i}.tif", image)
+
+    # Small untrained model
+    torch.manual_seed(2022)
+    campaign_transforms = SegmentationCampaignTransforms2D(
+        num_classes=3, patch_size=(32, 32)
+    )
+    model = UNet(
+        campaign_transforms=campaign_transforms,
+        spatial_dims=2,
+        in_channels=1,
+        out_channels=3,
+        criterion=DiceCELoss(),
+        metrics=None,
+        lr_scheduler_class=None,
+        channels=(4, 8),
+        strides=(2,),
+    )
+    data_module = DataModuleLocalFolder(
+        campaign_transforms=campaign_transforms,
+        data_dir=tmp_path,
+        inference_batch_size=1,
+        num_workers=0,
+        num_inference_workers=0,
+    )
+    return tmp_path, model, campaign_transforms, data_module
+
+
+def test_pipelined_full_inference(inference_setup):
+    tmp_path, model, campaign_transforms, data_module = inference_setup
+
+    # Run with and without overlapping the inference and the writing
+    for name, num_writers, max_pending in [("serial", 1, 1), ("pipelined", 3, 2)]:
+        result = full_inference(
+            model,
+            campaign_transforms=campaign_transforms,
+            data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+            target_folder=tmp_path / name,
+            roi_size=(32, 32),
+            batch_size=2,
+            transpose=False,
+            output_dtype="uint8",
+            num_writers=num_writers,
+            max_pending=max_pending,
+        )
+        assert result, "Inference failed."
+
+    # Each prediction is saved under the name of its input, and both runs agree
+    for i in range(5):
+        serial = imread(tmp_path / "serial" / f"pred_image_{i}.tif")
+        pipelined = imread(tmp_path / "pipelined" / f"pred_image_{i}.tif")
+        assert serial.shape == (48 + 8 * i, 40), "Prediction mapped to wrong file."
+        assert serial.dtype == np.uint8, "Wrong data type."
+        assert np.array_equal(serial, pipelined), "Predictions do not match."
+
+    # Errors in the writers are propagated
+    with pytest.raises(TypeError):
+        full_inference(
+            model,
+            campaign_transforms=campaign_transforms,
+            data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+            target_folder=tmp_path / "error",
+            roi_size=(32, 32),
+            batch_size=2,
+            output_dtype="not_a_dtype",
+        )
+
+
+def test_prediction_writers(tmp_path):
+    # Smallest safe integer type
+    assert smallest_integer_dtype(np.array([0, 255], dtype=np.int32)) == np.uint8
+    assert smallest_integer_dtype(np.array([0, 256], dtype=np.int32)) == np.uint16
+    assert smallest_integer_dtype(np.array([-1, 127], dtype=np.int64)) == np.int8
+    assert smallest_integer_dtype(np.array([0.5], dtype=np.float32)) == np.float32
+
+    # Label image with few labels
+    rng = np.random.default_rng(2022)
+    labels = rng.integers(0, 200, size=(8, 100, 90)).astype(np.int32)
+
+    for name, writer in [
+        ("default", TIFFPredictionWriter()),
+        ("none", TIFFPredictionWriter(compression="none")),
+        ("strips", TIFFPredictionWriter(level=1, num_threads=2)),
+        ("tiles", TIFFPredictionWriter(tile=(32, 32), num_threads=2)),
+        ("tiles_3d", TIFFPredictionWriter(tile=(16, 32, 32))),
+        ("labels", TIFFPredictionWriter(label_dtype="uint8")),
+    ]:
+        output_name = tmp_path / f"{name}{writer.extension}"
+        writer.write(labels, output_name)
+        written = imread(output_name)
+        assert np.array_equal(written, labels), f"Wrong content for '{name}'."
+        expected_dtype = np.uint8 if name == "labels" else np.int32
+        assert written.dtype == expected_dtype, f"Wrong data type for '{name}'."
+
+    # Codecs that are not available fall back to zlib
+    writer = TIFFPredictionWriter(compression="zstd")
+    expected = "zstd" if is_tiff_compression_available("zstd") else "zlib"
+    assert writer.compression == expected, "Unexpected compression."
+
+    # Invalid settings
+    with pytest.raises(ValueError):
+        TIFFPredictionWriter(compression="jpeg")
+    with pytest.raises(ValueError):
+        TIFFPredictionWriter(tile=(30, 30))
+    with pytest.raises(ValueError):
+        TIFFPredictionWriter(label_dtype="float32")
+
+    # Labels that do not fit in the requested type are not silently truncated
+    with pytest.raises(ValueError):
+        TIFFPredictionWriter(label_dtype="uint8").write(
+            labels + 200, tmp_path / "overflow.tif"
+        )
+
+
+def test_region_readers_and_tile_writers(tmp_path):
+    rng = np.random.default_rng(2022)
+    volume = rng.integers(0, 1000, size=(5, 70, 90)).astype(np.uint16)
+
+    # Memory-mapped, tiled, stripped and volumetric files
+    imwrite(tmp_path / "plain.tif", volume, photometric="minisblack")
+    imwrite(
+        tmp_path / "tiled.tif",
+        volume,
+        tile=(32, 32),
+        compression="zlib",
+        photometric="minisblack",
+    )
+    imwrite(
+        tmp_path / "strips.tif",
+        volume,
+        rowsperstrip=16,
+        compression="zlib",
+        photometric="minisblack",
+    )
+    imwrite(tmp_path / "image.tif", volume[2], tile=(16, 32), compression="zlib")
+    np.save(tmp_path / "volume.npy", volume)
+    with open_tile_writer(
+        tmp_path / "volumetric.tif", volume.shape, volume.dtype, tile_size=(4, 32, 48)
+    ) as writer:
+        for start, stop in iterate_tiles(volume.shape, (4, 32, 48)):
+            writer.write(start, volume[tuple(slice(a, b) for a, b in zip(start, stop))])
+    assert np.array_equal(imread(tmp_path / "volumetric.tif"), volume), "Bad tiles."
+
+    for name in [
+        "plain.tif",
+        "tiled.tif",
+        "strips.tif",
+        "volume.npy",
+        "volumetric.tif",
+    ]:
+        with open_region_reader(tmp_path / name) as reader:
+            assert reader.shape == volume.shape, f"Wrong shape for {name}."
+            region = reader.read((1, 10, 25), (4, 55, 90))
+            assert np.array_equal(region, volume[1:4, 10:55, 25:90]), f"Bad {name}."
+    with open_region_reader(tmp_path / "image.tif") as reader:
+        assert np.array_equal(reader.read((5, 7), (70, 41)), volume[2, 5:70, 7:41])
+        with pytest.raises(ValueError):
+            reader.read((0, 0), (71, 10))
+
+    # TIFF tiles must be written in raster order
+    with pytest.raises(ValueError):
+        with open_tile_writer(
+            tmp_path / "wrong.tif", (64, 64), np.uint8, tile_size=(32, 32)
+        ) as writer:
+            writer.write((0, 32), np.zeros((32, 32), dtype=np.uint8))
+
+
+def test_tiled_full_inference(inference_setup):
+    tmp_path, model, campaign_transforms, data_module = inference_setup
+
+    # Compressed input larger than a few tiles
+    rng = np.random.default_rng(2022)
+    image = rng.integers(0, 1000, size=(150, 130)).astype(np.uint16)
+    imwrite(tmp_path / "large.tif", image, tile=(32, 32), compression="zlib")
+
+    # Reference: sliding window inference on the whole (z-normalized) image
+    model.eval()
+    data = torch.from_numpy(image.astype(np.float32))
+    data = (data - data.mean()) / data.std()
+    with torch.no_grad():
+        expected = SlidingWindowInferer(
+            roi_size=(32, 32),
+            sw_batch_size=2,
+            overlap=0.25,
+            mode=BlendMode.GAUSSIAN,
+            sigma_scale=0.125,
+        )(data[None, None], model)[0].numpy()
+
+    # Blended output (as NumPy file)
+    full_inference_tiled(
+        model,
+        input_file=tmp_path / "large.tif",
+        output_file=tmp_path / "large_pred.npy",
+        roi_size=(32, 32),
+        tile_size=(48, 64),
+        batch_size=3,
+    )
+    output = np.load(tmp_path / "large_pred.npy")
+    assert output.shape == expected.shape, "Wrong output shape."
+    assert np.allclose(output, expected, atol=1e-5), "Tiles do not match."
+
+    # Label image (as tiled TIFF file)
+    full_inference_tiled(
+        model,
+        input_file=tmp_path / "large.tif",
+        output_file=tmp_path / "large_pred.tif",
+        roi_size=(32, 32),
+        tile_size=(48, 64),
+        batch_size=3,
+        post_full_inference_transforms=OneHotToMaskBatch(),
+        output_dtype="uint8",
+    )
+    labels = imread(tmp_path / "large_pred.tif")
+    assert labels.dtype == np.uint8, "Wrong data type."
+    assert np.array_equal(labels, expected.argmax(axis=0)), "Labels do not match."
+
+
+def test_ensemble_voting():
+    # Three 3D label predictions
+    rng = np.random.default_rng(2022)
+    preds = torch.from_numpy(rng.integers(0, 3, size=(3, 2, 1, 6, 7, 8)))
+
+    # Mode (the smallest label wins ties), also chunk by chunk
+    expected, _ = torch.mode(preds, dim=0)
+    voted = vote(preds, mechanism="mode")
+    assert voted.dtype == torch.uint8, "Labels were not compacted."
+    assert torch.equal(voted.long(), expected), "Wrong mode."
+    assert torch.equal(vote(preds, mechanism="mode", chunk_size=50), voted)
+
+    # Weighted mode: the first model has the majority
+    weighted = vote(preds, mechanism="mode", weights=[0.6, 0.2, 0.2])
+    assert torch.equal(weighted.long(), preds[0]), "Wrong weighted mode."
+
+    # Weighted mean
+    weights = [0.5, 0.25, 0.25]
+    expected = torch.round(
+        sum(w * preds[m].float() for m, w in enumerate(weights))
+    ).long()
+    voted = vote(preds, mechanism="mean", weights=weights, chunk_size=77)
+    assert torch.equal(voted.long(), expected), "Wrong mean."
+
+    # Many labels: torch.mode on the device and a larger type
+    preds = torch.from_numpy(rng.integers(0, 1000, size=(3, 10, 10)))
+    expected, _ = torch.mode(preds, dim=0)
+    voted = vote(preds, mechanism="mode")
+    assert voted.dtype == torch.int16, "Wrong compact type."
+    assert torch.equal(voted.long(), expected), "Wrong mode."
+
+
+def test_ensemble_full_inference(inference_setup):
+    tmp_path, model, campaign_transforms, data_module = inference_setup
+
+    # Ensemble of three models with the same architecture
+    models = [model]
+    for seed in [1, 2]:
+        torch.manual_seed(seed)
+        models.append(
+            UNet(
+                campaign_transforms=campaign_transforms,
+                spatial_dims=2,
+                in_channels=1,
+                out_channels=3,
+                criterion=DiceCELoss(),
+                metrics=None,
+                lr_scheduler_class=None,
+                channels=(4, 8),
+                strides=(2,),
+            )
+        )
+
+    # The stacked and the sequential evaluations agree
+    x = torch.randn(2, 1, 32, 32)
+    with torch.no_grad():
+        stacked = EnsembleNetwork([m.net for m in models])
+        sequential = EnsembleNetwork([m.net for m in models], stack=False)
+        assert stacked.stacked and not sequential.stacked
+        assert torch.allclose(stacked(x), sequential(x), atol=1e-5)
+        expected = torch.stack([m.net(x) for m in models], dim=1)
+        assert torch.allclose(stacked.split(stacked(x)), expected, atol=1e-5)
+
+    for voting_mechanism in ["mode", "soft"]:
+        target = tmp_path / f"ensemble_{voting_mechanism}"
+        result = full_inference_ensemble(
+            models,
+            data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+            target_folder=target,
+            post_full_inference_transforms=OneHotToMaskBatch(),
+            roi_size=(32, 32),
+            batch_size=2,
+            voting_mechanism=voting_mechanism,
+            transpose=False,
+            save_individual_preds=True,
+        )
+        assert result, "Ensemble inference failed."
+
+        for i in range(5):
+            ensemble = imread(target / f"ensemble_image_{i}.tif")
+            assert ensemble.shape == (48 + 8 * i, 40), "Wrong shape."
+            assert ensemble.dtype == np.int32, "Unexpected data type."
+            folds = np.stack(
+                [imread(target / f"fold_{p}" / f"pred_image_{i}.tif") for p in range(3)]
+            )
+            if voting_mechanism == "mode":
+                expected, _ = torch.mode(torch.from_numpy(folds).long(), dim=0)
+                assert np.array_equal(ensemble, expected.numpy()), "Wrong vote."
+
+
+def test_test_time_augmentation(inference_setup):
+    tmp_path, model, campaign_transforms, data_module = inference_setup
+
+    # Variants (duplicated transformations are removed)
+    assert len(parse_tta_variants("flips", 2)) == 4
+    assert len(parse_tta_variants("all", 2)) == 8
+    assert len(parse_tta_variants("all", 3)) == 16
+    assert len(parse_tta_variants("flip_xy, rot180", 2)) == 2
+    with pytest.raises(ValueError):
+        parse_tta_variants("flip_z", 2)
+
+    # The variants are undone: a symmetric filter gives the same result for all of them
+    for spatial_dims in [2, 3]:
+        conv = (torch.nn.Conv2d if spatial_dims == 2 else torch.nn.Conv3d)(
+            1, 1, 3, padding=1, bias=False
+        )
+        with torch.no_grad():
+            conv.weight.fill_(1.0)
+            x = torch.randn((2, 1) + (16,) * spatial_dims)
+            tta = TTANetwork(conv, "all", spatial_dims=spatial_dims)
+            assert torch.allclose(tta(x), conv(x), atol=1e-5), "Variants not undone."
+
+            # Adaptive mode stops after the second group of variants
+            tta = TTANetwork(conv, "all", spatial_dims=spatial_dims, adaptive=True)
+            assert torch.allclose(tta(x), conv(x), atol=1e-5)
+            assert tta.mean_variants == 4, "Adaptive mode did not stop."
+
+        # Windows that are not square in the yx plane
+        with torch.no_grad():
+            x = torch.randn((2, 1) + (8,) * (spatial_dims - 2) + (32, 64))
+            tta = TTANetwork(conv, "all", spatial_dims=spatial_dims)
+            assert torch.allclose(tta(x), conv(x), atol=1e-5), "Variants not undone."
+
+    # Full inference with test-time augmentation
+    result = full_inference(
+        model,
+        campaign_transforms=campaign_transforms,
+        data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+        target_folder=tmp_path / "tta",
+        roi_size=(32, 32),
+        batch_size=2,
+        transpose=False,
+        output_dtype="uint8",
+        tta_variants="flips",
+    )
+    assert result, "Inference failed."
+    for i in range(5):
+        pred = imread(tmp_path / "tta" / f"pred_image_{i}.tif")
+        assert pred.shape == (48 + 8 * i, 40), "Wrong shape."
+
+
+def test_inference_precision(inference_setup):
+    tmp_path, model, campaign_transforms, data_module = inference_setup
+    post_transforms = campaign_transforms.get_post_full_inference_transforms()
+    images = list(data_module.inference_dataloader(tmp_path / "inputs"))[:2]
+
+    with pytest.raises(ValueError):
+        InferencePrecision("64")
+
+    # bfloat16 autocast and channels-last are supported on the CPU and agree with float32
+    precision = InferencePrecision("bf16", channels_last=True)
+    assert precision.is_supported(torch.device("cpu"))
+    result = check_inference_precision(
+        model.net,
+        images,
+        roi_size=(32, 32),
+        batch_size=2,
+        precision=precision,
+        device=torch.device("cpu"),
+        post_transforms=post_transforms,
+        tolerance=0.1,
+    )
+    assert result["accepted"], "bfloat16 inference rejected."
+    assert result["relative_error"] > 0.0, "Inference did not run in bfloat16."
+    assert next(model.net.parameters()).is_contiguous(), "Memory format not restored."
+
+    # A tolerance of 0 rejects the reduced precision
+    result = check_inference_precision(
+        model.net,
+        images,
+        roi_size=(32, 32),
+        batch_size=2,
+        precision=precision,
+        device=torch.device("cpu"),
+        tolerance=0.0,
+    )
+    assert not result["accepted"], "Reduced precision accepted with zero tolerance."
+
+    # Full inference with the policy; channels-last and inference mode alone do not
+    # change the predictions
+    for name, policy in [
+        ("reference", None),
+        ("channels_last", InferencePrecision(channels_last=True)),
+        ("bf16", precision),
+    ]:
+        result = full_inference(
+            model,
+            campaign_transforms=campaign_transforms,
+            data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+            target_folder=tmp_path / name,
+            roi_size=(32, 32),
+            batch_size=2,
+            transpose=False,
+            output_dtype="uint8",
+            precision=policy,
+        )
+        assert result, "Inference failed."
+    for i in range(5):
+        reference = imread(tmp_path / "reference" / f"pred_image_{i}.tif")
+        channels_last = imread(tmp_path / "channels_last" / f"pred_image_{i}.tif")
+        bf16 = imread(tmp_path / "bf16" / f"pred_image_{i}.tif")
+        assert np.array_equal(reference, channels_last), "Predictions do not match."
+        assert bf16.shape == reference.shape, "Wrong shape."
+        assert np.mean(bf16 != reference) <= 0.1, "bfloat16 predictions differ."
+
+
+def test_exported_inference_backends(inference_setup):
+    tmp_path, model, campaign_transforms, data_module = inference_setup
+
+    # Export with fixed and dynamic window sizes
+    fixed = export_model(model.net, tmp_path / "fixed", patch_size=(32, 32))
+    dynamic = export_model(
+        model.net, tmp_path / "dynamic", patch_size=(32, 32), dynamic=True
+    )
+    assert fixed.suffix == ".pt", "Wrong extension."
+    metadata = read_export_metadata(fixed)
+    assert metadata["patch_size"] == [32, 32] and metadata["out_channels"] == 3
+    with pytest.raises(ValueError):
+        export_model(model.net, tmp_path / "bad", (32, 32), export_format="bad")
+
+    # Fixed-size models reject windows of other sizes
+    x = torch.randn((2, 1, 48, 48))
+    with pytest.raises(ValueError):
+        load_backend(fixed)(x)
+    with torch.no_grad():
+        assert torch.allclose(load_backend(dynamic)(x), model.net(x), atol=1e-5)
+
+    # Full inference with the exported model gives the same predictions as the model
+    for name, backend in [("eager", model), ("torchscript", load_backend(fixed))]:
+        result = full_inference(
+            backend,
+            campaign_transforms=campaign_transforms,
+            data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+            target_folder=tmp_path / name,
+            roi_size=(32, 32),
+            batch_size=2,
+            transpose=False,
+            output_dtype="uint8",
+        )
+        assert result, "Inference failed."
+    for i in range(5):
+        eager = imread(tmp_path / "eager" / f"pred_image_{i}.tif")
+        exported = imread(tmp_path / "torchscript" / f"pred_image_{i}.tif")
+        assert np.array_equal(eager, exported), "Predictions do not match."
+
+    # Startup and throughput report
+    report = benchmark_backends(
+        {
+            "eager": lambda: EagerBackend(model.net),
+            "torchscript": lambda: load_backend(fixed),
+        },
+        input_shape=(2, 1, 32, 32),
+        num_iterations=2,
+    )
+    assert set(report.keys()) == {"eager", "torchscript"}
+    assert all(r["throughput"] > 0 for r in report.values())
+
+    # Running exported models does not need PyTorch Lightning
+    code = (
+        "import sys; import qute.data.inference; import qute.export; "
+        "assert 'pytorch_lightning' not in sys.modules; "
+        "assert 'lightning' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_quantized_inference(inference_setup):
+    tmp_path, model, campaign_transforms, data_module = inference_setup
+
+    # Small labelled data set for calibration and comparison
+    rng = np.random.default_rng(2022)
+    for folder in ["images", "labels"]:
+        (tmp_path / "training" / folder).mkdir(parents=True)
+    for i in range(10):
+        image = rng.integers(0, 1000, size=(64, 64)).astype(np.uint16)
+        imwrite(tmp_path / "training" / "images" / f"image_{i}.tif", image)
+        imwrite(
+            tmp_path / "training" / "labels" / f"image_{i}.tif",
+            (image // 334).astype(np.int32),
+        )
+    training_data_module = DataModuleLocalFolder(
+        campaign_transforms=campaign_transforms,
+        data_dir=tmp_path / "training",
+        batch_size=2,
+        patch_size=(32, 32),
+        num_workers=0,
+        num_inference_workers=0,
+        pin_memory=False,
+    )
+    training_data_module.setup("fit")
+    calibration_batches = get_calibration_batches(training_data_module, 2)
+    assert len(calibration_batches) == 2
+    assert calibration_batches[0].shape[1:] == (1, 32, 32), "Wrong batches."
+
+    # Dynamic quantization cannot change a convolutional network; static can
+    model.eval()
+    with pytest.raises(ValueError):
+        quantize_model(model, "dynamic")
+    with pytest.raises(ValueError):
+        quantize_model(model, "static")
+    quantized_model = quantize_model(model, "static", calibration_batches)
+    assert is_quantized(quantized_model), "Model not quantized."
+    assert not is_quantized(model), "The float model was modified."
+
+    # Drift report against the float model
+    report = compare_quantized_model(
+        model,
+        quantized_model,
+        training_data_module.val_dataloader(),
+        metrics=DiceMetric(include_background=False, reduction="none"),
+    )
+    assert 0.0 <= report["agreement"] <= 1.0
+    assert len(report["float_metrics"]) == 2, "Wrong number of classes."
+    assert report["metric_drift"] >= 0.0
+
+    # The quantized model plugs into full and ensemble inference
+    result = full_inference(
+        quantized_model,
+        campaign_transforms=campaign_transforms,
+        data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+        target_folder=tmp_path / "quantized",
+        roi_size=(32, 32),
+        batch_size=2,
+        transpose=False,
+        output_dtype="uint8",
+    )
+    assert result, "Inference failed."
+    result = full_inference_ensemble(
+        [quantized_model, quantize_model(model, "static", calibration_batches)],
+        data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+        target_folder=tmp_path / "quantized_ensemble",
+        post_full_inference_transforms=campaign_transforms.get_post_full_inference_transforms(),
+        roi_size=(32, 32),
+        batch_size=2,
+        transpose=False,
+    )
+    assert result, "Ensemble inference failed."
+    for i in range(5):
+        pred = imread(tmp_path / "quantized" / f"pred_image_{i}.tif")
+        ensemble = imread(tmp_path / "quantized_ensemble" / f"ensemble_image_{i}.tif")
+        assert pred.shape == ensemble.shape == (48 + 8 * i, 40), "Wrong shape."
+        assert np.array_equal(pred, ensemble), "Identical models do not agree."
+
+
+def test_resumable_full_inference(inference_setup, capsys):
+    tmp_path, model, campaign_transforms, data_module = inference_setup
+    target = tmp_path / "resumable"
+
+    def predict(**kwargs):
+        return full_inference(
+            model,
+            campaign_transforms=campaign_transforms,
+            data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+            target_folder=target,
+            roi_size=(32, 32),
+            batch_size=2,
+            transpose=False,
+            output_dtype="uint8",
+            resume=True,
+            **kwargs,
+        )
+
+    def saved():
+        return sorted(
+            line.split(" ")[1].rstrip(".\n")
+            for line in capsys.readouterr().out.splitlines(keepends=True)
+            if line.startswith("Saved ")
+        )
+
+    # The descriptions of the parameters are deterministic
+    assert describe_parameters(campaign_transforms.get_inference_transforms()) == (
+        describe_parameters(campaign_transforms.get_inference_transforms())
+    )
+
+    # First run: all images are predicted and recorded
+    assert predict(), "Inference failed."
+    assert len(saved()) == 5
+    expected = [imread(target / f"pred_image_{i}.tif") for i in range(5)]
+
+    # Second run: all predictions are still valid
+    assert predict(), "Inference failed."
+    assert len(saved()) == 0, "Valid predictions were redone."
+
+    # Missing, partially written (truncated) and unrecorded outputs are redone
+    (target / "pred_image_1.tif").unlink()
+    with open(target / "pred_image_3.tif", "r+b") as f:
+        f.truncate(100)
+    manifest_file = target / ".qute_manifest.jsonl"
+    lines = manifest_file.read_text().splitlines(keepends=True)
+    last = [line for line in lines if "image_4.tif" in line][-1]
+    manifest_file.write_text(
+        "".join(line for line in lines if line is not last) + last[: len(last) // 2]
+    )
+    assert predict(), "Inference failed."
+    assert saved() == [
+        str(target / f"pred_image_{i}.tif") for i in [1, 3, 4]
+    ], "Wrong predictions were redone."
+    for i in range(5):
+        assert np.array_equal(imread(target / f"pred_image_{i}.tif"), expected[i])
+
+    # A changed input, model or parameter invalidates the predictions
+    image = imread(tmp_path / "inputs" / "image_2.tif")
+    imwrite(tmp_path / "inputs" / "image_2.tif", image[::-1])
+    assert predict(), "Inference failed."
+    assert saved() == [str(target / "pred_image_2.tif")], "Changed input not redone."
+    assert predict(model_hash="another model"), "Inference failed."
+    assert len(saved()) == 5, "Changed model not redone."
+    assert predict(model_hash="another model", overlap=0.5), "Inference failed."
+    assert len(saved()) == 5, "Changed parameters not redone."
+
+    # The manifest keeps the latest record of each input
+    manifest = PredictionManifest(target, parameters={})
+    assert not manifest.is_complete(
+        tmp_path / "inputs" / "image_0.tif", [target / "pred_image_0.tif"]
+    ), "Records with other parameters must not be valid."
+
+
+def test_auto_sliding_window_batch_size(inference_setup, monkeypatch):
+    tmp_path, model, campaign_transforms, data_module = inference_setup
+
+    # The automatic batch size does not change the predictions
+    for name, batch_size in [("fixed", 2), ("auto", "auto")]:
+        assert full_inference(
+            model,
+            campaign_transforms=campaign_transforms,
+            data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+            target_folder=tmp_path / name,
+            roi_size=(32, 32),
+            batch_size=batch_size,
+            transpose=False,
+            output_dtype="uint8",
+        ), "Inference failed."
+    for i in range(5):
+        assert np.array_equal(
+            imread(tmp_path / "fixed" / f"pred_image_{i}.tif"),
+            imread(tmp_path / "auto" / f"pred_image_{i}.tif"),
+        ), "Predictions do not match."
+    with pytest.raises(ValueError):
+        full_inference(
+            model,
+            campaign_transforms=campaign_transforms,
+            data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+            target_folder=tmp_path / "error",
+            roi_size=(32, 32),
+            batch_size="max",
+        )
+
+    # The plan follows the available memory (a 96x80 image is covered by 4x3 windows)
+    model.eval()
+    images = torch.zeros((1, 1, 96, 80))
+    planner = _SlidingWindowPlanner(model, [model], (32, 32), 0.25, "cpu")
+    with torch.no_grad():
+        planner.plan(images)
+    assert planner.out_channels == 3 and planner.window_bytes > 0
+    monkeypatch.setattr(inference, "get_available_memory", lambda device: 2**40)
+    assert planner.plan(images) == (12, torch.device("cpu"))
+    monkeypatch.setattr(
+        inference, "get_available_memory", lambda device: 3 * planner.window_bytes
+    )
+    assert planner.plan(images)[0] < 12
+
+    # On accelerators, the stitching moves to the host when the output does not fit
+    planner.device = torch.device("cuda")
+    monkeypatch.setattr(inference, "get_available_memory", lambda device: 2**40)
+    assert planner.plan(images) == (12, torch.device("cuda"))
+    monkeypatch.setattr(inference, "get_available_memory", lambda device: 2**16)
+    assert planner.plan(images) == (1, torch.device("cpu"))
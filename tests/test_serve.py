@@ -0,0 +1,287 @@
+#  ********************************************************************************
+#  Copyright © 2022 - 2025, ETH Zurich, D-BSSE, Aaron Ponti
+#  All rights reserved. This program and the accompanying materials
+#  are made available under the terms of the Apache License Version 2.0
+#  which accompanies this distribution, and is available at
+#  https://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Contributors:
+#    Aaron Ponti - initial API and implementation
+#  ******************************************************************************
+
+import http.client
+import io
+import json
+import shutil
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+import torch
+from monai.losses import DiceCELoss
+from tifffile import imread, imwrite
+
+from qute.campaigns import SegmentationCampaignTransforms2D
+from qute.data.dataloaders import DataModuleLocalFolder
+from qute.data.inference import full_inference
+from qute.data.manifest import PredictionManifest
+from qute.data.watch import FolderWatcher, watch_folder
+from qute.models.unet import UNet
+from qute.serve import DynamicBatcher, InferenceServer
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path):
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+@pytest.fixture
+def served_model(tmp_path):
+    rng = np.random.default_rng(2022)
+    (tmp_path / "inputs").mkdir()
+    for i in range(4):
+        image = rng.integers(0, 1000, size=(48 + 8 * i, 40)).astype(np.uint16)
+        imwrite(tmp_path / "inputs" / f"image_{i}.tif", image)
+
+    torch.manual_seed(2022)
+    campaign_transforms = SegmentationCampaignTransforms2D(
+        num_classes=3, patch_size=(32, 32)
+    )
+    model = UNet(
+        campaign_transforms=campaign_transforms,
+        spatial_dims=2,
+        in_channels=1,
+        out_channels=3,
+        criterion=DiceCELoss(),
+        metrics=None,
+        lr_scheduler_class=None,
+        channels=(4, 8),
+        strides=(2,),
+    )
+
+    # Reference predictions
+    data_module = DataModuleLocalFolder(
+        campaign_transforms=campaign_transforms,
+        data_dir=tmp_path,
+        inference_batch_size=1,
+        num_workers=0,
+        num_inference_workers=0,
+    )
+    full_inference(
+        model,
+        campaign_transforms=campaign_transforms,
+        data_loader=data_module.inference_dataloader(tmp_path / "inputs"),
+        target_folder=tmp_path / "reference",
+        roi_size=(32, 32),
+        batch_size=2,
+        transpose=False,
+        output_dtype="uint8",
+    )
+    return tmp_path, model
+
+
+def test_dynamic_batcher():
+    network = torch.nn.Conv2d(1, 2, 3, padding=1).eval()
+    batcher = DynamicBatcher(
+        network, torch.device("cpu"), max_batch_size=8, max_wait=0.2
+    )
+    inputs = [torch.randn((2, 1, 16, 16)) for _ in range(3)]
+    outputs = {}
+
+    def call(i):
+        outputs[i] = batcher(inputs[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    # The windows of concurrent calls are predicted together, and returned to their caller
+    assert batcher.num_windows == 6 and batcher.num_batches < 3, "Not batched."
+    with torch.no_grad():
+        for i in range(3):
+            assert torch.allclose(outputs[i], network(inputs[i]), atol=1e-6)
+
+
+def test_inference_server(served_model):
+    tmp_path, model = served_model
+
+    with InferenceServer(
+        {"unet": model}, roi_size=(32, 32), max_batch_size=8, output_dtype="uint8"
+    ) as server:
+        host, port = server.start(port=0)
+
+        # Concurrent requests (returning the predictions) agree with full inference
+        responses = {}
+
+        def request(i):
+            connection = http.client.HTTPConnection(host, port)
+            connection.request(
+                "POST", f"/predict?input={tmp_path / 'inputs' / f'image_{i}.tif'}"
+            )
+            response = connection.getresponse()
+            responses[i] = (response.status, response.read())
+
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(4):
+            status, body = responses[i]
+            assert status == 200, "Request failed."
+            expected = imread(tmp_path / "reference" / f"pred_image_{i}.tif")
+            assert np.array_equal(imread(io.BytesIO(body)), expected)
+
+        # Image in the request body, prediction streamed to disk
+        connection = http.client.HTTPConnection(host, port)
+        connection.request(
+            "POST",
+            f"/predict?model=unet&output={tmp_path / 'served' / 'pred.tif'}",
+            body=(tmp_path / "inputs" / "image_0.tif").read_bytes(),
+        )
+        response = connection.getresponse()
+        assert response.status == 200
+        assert json.loads(response.read())["latency"] > 0
+        assert np.array_equal(
+            imread(tmp_path / "served" / "pred.tif"),
+            imread(tmp_path / "reference" / "pred_image_0.tif"),
+        )
+
+        # Unknown model
+        connection = http.client.HTTPConnection(host, port)
+        connection.request("POST", "/predict?model=other&input=image.tif")
+        assert connection.getresponse().status == 400
+
+        # Metrics
+        connection = http.client.HTTPConnection(host, port)
+        connection.request("GET", "/metrics")
+        metrics = json.loads(connection.getresponse().read())["unet"]
+        assert metrics["requests"] == 5 and metrics["errors"] == 0
+        assert metrics["in_flight"] == 0 and metrics["queue_depth"] == 0
+        assert metrics["latency_p95"] >= metrics["latency_p50"] > 0
+
+    # Unix socket
+    socket_path = str(tmp_path / "qute.sock")
+    with InferenceServer({"unet": model}, roi_size=(32, 32)) as server:
+        server.start(socket_path=socket_path)
+        connection = _UnixHTTPConnection(socket_path)
+        connection.request("GET", "/health")
+        assert json.loads(connection.getresponse().read())["models"] == ["unet"]
+
+
+def test_folder_watcher(tmp_path):
+    watcher = FolderWatcher(tmp_path, settle_time=0.2)
+
+    # A file that is still being written is not reported
+    with open(tmp_path / "image_0.tif", "wb") as f:
+        f.write(b"0" * 100)
+        f.flush()
+        assert watcher.poll() == []
+        time.sleep(0.3)
+        f.write(b"0" * 100)
+        f.flush()
+        assert watcher.poll() == []
+    assert watcher.poll() == []
+    time.sleep(0.3)
+    ready = watcher.poll()
+    assert [f.name for f, _ in ready] == ["image_0.tif"], "File not reported."
+
+    # Files are reported once, unless they are modified
+    (tmp_path / "other.txt").write_text("Not an image.")
+    time.sleep(0.3)
+    assert watcher.poll() == []
+    (tmp_path / "image_0.tif").write_bytes(b"1" * 300)
+    watcher.poll()
+    time.sleep(0.3)
+    assert len(watcher.poll()) == 1, "Modified file not reported."
+
+
+def test_watch_folder(served_model):
+    tmp_path, model = served_model
+    source = tmp_path / "acquisition"
+    target = tmp_path / "watched"
+    source.mkdir()
+
+    # Simulate an acquisition: copy the images while the folder is watched
+    def acquire():
+        for i in range(4):
+            time.sleep(0.2)
+            shutil.copy(tmp_path / "inputs" / f"image_{i}.tif", source)
+
+    with InferenceServer(
+        {"unet": model}, roi_size=(32, 32), output_dtype="uint8"
+    ) as server:
+        manifest = PredictionManifest(target, parameters={"model": "unet"})
+        acquisition = threading.Thread(target=acquire)
+        acquisition.start()
+        summary = watch_folder(
+            server.predict,
+            source,
+            target,
+            manifest=manifest,
+            settle_time=0.1,
+            poll_interval=0.05,
+            idle_timeout=1.0,
+        )
+        acquisition.join()
+        for i in range(4):
+            assert np.array_equal(
+                imread(target / f"image_{i}.tif"),
+                imread(tmp_path / "reference" / f"pred_image_{i}.tif"),
+            ), "Wrong prediction."
+        assert summary["latency"]["max"] >= summary["inference"]["max"] > 0
+        assert len((target / "watch_latencies.csv").read_text().splitlines()) == 5
+
+        # A restarted watch skips the files that were already processed
+        summary = watch_folder(
+            server.predict,
+            source,
+            target,
+            manifest=PredictionManifest(target, parameters={"model": "unet"}),
+            settle_time=0.0,
+            poll_interval=0.05,
+            idle_timeout=0.2,
+        )
+        assert summary == {}, "Processed files were predicted again."
+
+
+def test_watch_folder_retries_failed_files(tmp_path):
+    source = tmp_path / "acquisition"
+    target = tmp_path / "watched"
+    source.mkdir()
+    (source / "locked.tif").write_bytes(b"0" * 100)
+    (source / "broken.tif").write_bytes(b"0" * 100)
+
+    # The first attempts fail (e.g., the file is still locked)
+    attempts = {}
+
+    def predict(input_file, output_file):
+        attempts[input_file.name] = attempts.get(input_file.name, 0) + 1
+        if input_file.name == "broken.tif" or attempts[input_file.name] <= 2:
+            raise OSError("File locked.")
+        output_file.write_bytes(input_file.read_bytes())
+
+    summary = watch_folder(
+        predict,
+        source,
+        target,
+        settle_time=0.0,
+        poll_interval=0.01,
+        idle_timeout=0.2,
+        max_retries=2,
+        latency_file=None,
+    )
+    assert attempts == {"locked.tif": 3, "broken.tif": 3}, "Wrong number of attempts."
+    assert (target / "locked.tif").is_file(), "Failed file not retried."
+    assert not (target / "broken.tif").is_file()
+    assert summary["inference"]["max"] >= 0
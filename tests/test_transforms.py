@@ -17,9 +17,17 @@ import pytest
 import scipy.ndimage as ndi
 import torch
 from monai.data import MetaTensor
-from monai.transforms import Spacing
+from monai.transforms import GaussianSmooth, Spacing
+from skimage.morphology import ball, disk
 from skimage.segmentation import watershed
 
+from qute.transforms.augment import (
+    ComposeBatch,
+    RandFlipBatch,
+    RandGaussianNoiseBatch,
+    RandGaussianSmoothBatch,
+)
+from qute.transforms.geom import IndexedRandCropByPosNegLabeld
 from qute.transforms.io import CellposeLabelReader, CustomTIFFReader
 from qute.transforms.norm import CustomMinMaxNormalize, CustomMinMaxNormalized
 from qute.transforms.objects import (
@@ -29,11 +37,17 @@ from qute.transforms.objects import (
     NormalizedDistanceTransformd,
     OneHotToMask,
     OneHotToMaskBatch,
+    ProcessPoolBackend,
     TwoClassMaskToLabel,
     TwoClassMaskToLabeld,
     WatershedAndLabelTransform,
     WatershedAndLabelTransformd,
 )
+from qute.transforms.util import (
+    compute_sampling_index,
+    draw_from_sampling_index,
+    scale_dist_transform_by_region,
+)
 
 
 @pytest.fixture(autouse=False)
@@ -170,6 +184,43 @@ def test_label_to_two_class_mask(extract_test_transforms_data):
         _ = tr(data)
 
 
+def test_label_to_two_class_mask_batch(extract_test_transforms_data):
+    # Load 3D labels dataset (many objects)
+    reader = CustomTIFFReader(dtype=torch.int32, geometry="zyx")
+    labels = reader(Path(__file__).parent / "data" / "labels.tif")
+
+    # Reference: erosion of each object with the footprint
+    def reference(label_image, border_thickness, drop_eroded):
+        footprint = ball(border_thickness)
+        expected = torch.zeros(label_image.shape, dtype=torch.int32)
+        for lbl in np.unique(label_image):
+            if lbl == 0:
+                continue
+            mask = label_image[0] == lbl
+            eroded = ndi.binary_erosion(mask, footprint)
+            if drop_eroded and not eroded.any():
+                continue
+            expected[0][mask] = 2
+            expected[0][eroded] = 1
+        return expected
+
+    for border_thickness in [1, 2]:
+        for drop_eroded in [False, True]:
+            mask = LabelToTwoClassMask(border_thickness, drop_eroded)(labels)
+            expected = reference(labels.numpy(), border_thickness, drop_eroded)
+            assert torch.equal(mask, expected), "Unexpected two-class mask."
+
+    # Batches (with a black-and-white item) give the same result as single images
+    batch = torch.stack([labels, (labels > 0).to(torch.int32)], dim=0)
+    masks = LabelToTwoClassMaskd(
+        keys=("label",), drop_eroded=True, with_batch_dim=True
+    )({"label": batch})["label"]
+    assert masks.shape == (2, 1, 26, 300, 300), "Unexpected output shape."
+    for b in range(2):
+        expected = LabelToTwoClassMask(drop_eroded=True)(batch[b])
+        assert torch.equal(masks[b], expected), "Unexpected batch result."
+
+
 def test_two_class_mask_to_labels_2d(extract_test_transforms_data):
     #
     # 2D
@@ -383,6 +434,40 @@ def test_two_class_mask_to_labels_3d(extract_test_transforms_data):
     ), "Unexpected number of reconstructed labels."
 
 
+def test_two_class_mask_to_labels_batch(extract_test_transforms_data):
+    # Load 3D labels image and create a 2-class mask
+    reader = CustomTIFFReader(dtype=torch.int32, geometry="zyx")
+    labels = reader(Path(__file__).parent / "data" / "labels.tif")
+    two_class = LabelToTwoClassMask(border_thickness=1)(labels)
+
+    # Reference: dilate each label in turn (later labels overwrite earlier ones)
+    def reference(mask, border_thickness):
+        label_image = ndi.label(mask[0] == 1)[0]
+        expected = np.zeros(mask.shape, dtype=np.int32)
+        for lbl in range(1, label_image.max() + 1):
+            dilated = ndi.binary_dilation(label_image == lbl, ball(border_thickness))
+            expected[0][dilated] = lbl
+        return torch.from_numpy(expected)
+
+    for border_thickness in [1, 2]:
+        reconstructed_label = TwoClassMaskToLabel(border_thickness=border_thickness)(
+            two_class
+        )
+        expected = reference(two_class.numpy(), border_thickness)
+        assert torch.equal(reconstructed_label, expected), "Unexpected labels."
+
+    # Batches give the same result as single images
+    batch = torch.stack([two_class, two_class.flip(-1)], dim=0)
+    batch_labels = TwoClassMaskToLabeld(keys=("label",), with_batch_dim=True)(
+        {"label": MetaTensor(batch)}
+    )["label"]
+    assert type(batch_labels) is MetaTensor, "Metadata lost."
+    assert batch_labels.shape == (2, 1, 26, 300, 300), "Unexpected output shape."
+    for b in range(2):
+        expected = TwoClassMaskToLabel()(batch[b])
+        assert torch.equal(batch_labels[b].as_tensor(), expected), "Unexpected result."
+
+
 def test_custom_tiff_reader(extract_test_transforms_data):
     # Load TIFF file with default arguments
     reader = CustomTIFFReader(geometry="zyx")
@@ -702,6 +787,100 @@ def test_normalized_distance_transform_with_seeds(extract_test_transforms_data):
     assert torch.all(data_out["label"] == label_out), "Unexpected result."
 
 
+def test_whole_image_normalized_distance_transform():
+    # Separated round objects of different sizes, in 2D and 3D
+    labels_2d = np.zeros((1, 120, 120), dtype=np.int32)
+    labels_3d = np.zeros((1, 30, 80, 80), dtype=np.int32)
+    for i, radius in enumerate([3, 5, 7, 9]):
+        footprint = disk(radius) > 0
+        center = (15 + 30 * i, 20 + 25 * i)
+        labels_2d[0][
+            tuple(slice(c - radius, c + radius + 1) for c in center)
+        ] += footprint * (i + 1)
+        footprint = ball(radius) > 0
+        center = (15, 10 + 18 * i, 70 - 18 * i)
+        labels_3d[0][
+            tuple(slice(c - radius, c + radius + 1) for c in center)
+        ] += footprint * (i + 1)
+
+    # The whole-image distance transform matches the per-region one
+    for labels in [labels_2d, labels_3d]:
+        for reverse, do_not_zero in [(False, False), (True, False), (True, True)]:
+            kwargs = dict(
+                reverse=reverse, do_not_zero=do_not_zero, add_seed_channel=True
+            )
+            expected = NormalizedDistanceTransform(**kwargs)(labels)
+            dt = NormalizedDistanceTransform(whole_image=True, **kwargs)(labels)
+            assert dt.shape == (2,) + labels.shape[1:], "Unexpected shape."
+            assert torch.equal(dt, expected), "Unexpected distance transform."
+
+    # Touching objects are separated at their common border
+    labels = np.zeros((1, 20, 30), dtype=np.int32)
+    labels[0, 5:15, 5:15] = 1
+    labels[0, 5:15, 15:25] = 2
+    dt = NormalizedDistanceTransform(whole_image=True)(labels)
+    assert torch.all(dt[0, :, 14:16] == 0.0), "Touching objects not separated."
+    assert torch.equal(dt[0, :, 5:15], dt[0, :, 15:25].flip(-1)), "Not symmetric."
+    assert torch.max(dt[0, :, 5:15]) == 1.0, "Unexpected maximum pixel value."
+
+    # Batches
+    batch = np.stack([labels_2d, labels_2d[:, ::-1, :]], axis=0)
+    dt = NormalizedDistanceTransformd(
+        keys=("label",),
+        add_seed_channel=True,
+        with_batch_dim=True,
+        whole_image=True,
+    )({"label": MetaTensor(torch.from_numpy(batch.copy()))})["label"]
+    assert type(dt) is MetaTensor, "Metadata lost."
+    assert dt.shape == (2, 2, 120, 120), "Unexpected shape."
+    for b in range(2):
+        expected = NormalizedDistanceTransform(add_seed_channel=True)(batch[b])
+        assert torch.equal(dt[b].as_tensor(), expected), "Unexpected batch result."
+
+
+def test_scale_dist_transform_by_region():
+    rng = np.random.default_rng(2022)
+    regions = rng.integers(0, 20, size=(40, 50))
+    dt = rng.uniform(0.0, 10.0, size=(40, 50)).astype(np.float32)
+
+    # Reference: scale each region in turn
+    def reference(reverse, do_not_zero):
+        expected = dt.copy()
+        for i in np.unique(regions):
+            if i == 0:
+                continue
+            values = dt[regions == i]
+            if reverse and do_not_zero:
+                values = (values.max() + 1) - values
+                expected[regions == i] = values / values.max()
+            elif reverse:
+                expected[regions == i] = (values - values.max()) / (
+                    values.min() - values.max()
+                )
+            else:
+                expected[regions == i] = values / values.max()
+        return expected
+
+    for reverse, do_not_zero in [(False, False), (True, False), (True, True)]:
+        expected = reference(reverse, do_not_zero)
+
+        # NumPy arrays
+        dt_copy = dt.copy()
+        scaled = scale_dist_transform_by_region(
+            dt, regions, reverse, do_not_zero, in_place=False
+        )
+        assert np.array_equal(scaled, expected), "Unexpected scaling."
+        assert np.array_equal(dt, dt_copy), "Input modified."
+
+        # Tensors (also in place)
+        dt_tensor = torch.from_numpy(dt.copy())
+        scaled = scale_dist_transform_by_region(
+            dt_tensor, torch.from_numpy(regions), reverse, do_not_zero, in_place=True
+        )
+        assert scaled is dt_tensor, "Not scaled in place."
+        assert np.array_equal(scaled.numpy(), expected), "Unexpected scaling."
+
+
 def test_to_label(tmpdir):
     # Create 2D label ground truth (classes 0, 1, 2)
     gt_2d = torch.zeros((1, 60, 60), dtype=torch.int32)
@@ -1260,3 +1439,160 @@ def test_watershed_and_label_dict_2d(extract_test_transforms_data):
     assert (
         i_ns_ws_num_labels_after == ns_ws_num_labels_after
     ), "The number of labels from IDT and DT should match!"
+
+
+def test_watershed_and_label_process_pool(extract_test_transforms_data):
+    # Load TIFF file with (dtype=torch.int32)
+    reader = CustomTIFFReader(dtype=torch.int32, geometry="yx", as_meta_tensor=True)
+    label_image = reader(Path(__file__).parent / "data" / "labels_2d.tif")
+    dt = NormalizedDistanceTransform(
+        reverse=True, do_not_zero=True, add_seed_channel=True
+    )(label_image)
+    batch = MetaTensor(torch.stack([dt, dt.flip(-1), dt.flip(-2)], dim=0))
+    expected = WatershedAndLabelTransform(with_batch_dim=True)(batch)
+
+    with ProcessPoolBackend(num_workers=2) as backend:
+        # Batch items are processed in parallel, with the same result
+        labels = WatershedAndLabelTransformd(
+            keys=("label",), with_batch_dim=True, backend=backend
+        )({"label": batch})["label"]
+        assert type(labels) is MetaTensor, "Metadata lost."
+        assert labels.shape == (3, 1, 100, 100), "Unexpected image shape."
+        assert labels.dtype == torch.float32, "Unexpected data type."
+        assert torch.equal(labels.as_tensor(), expected.as_tensor())
+
+        # Single image
+        labels = WatershedAndLabelTransform(with_batch_dim=False, backend=backend)(dt)
+        assert labels.shape == (100, 100), "Unexpected image shape."
+        assert labels.dtype == torch.int32, "Unexpected data type."
+        assert torch.equal(labels.as_tensor(), expected[0, 0].int().as_tensor())
+
+    # Blocks of a single image are stitched into one object per label
+    with ProcessPoolBackend(num_workers=2, block_size=(40, 40), halo=16) as backend:
+        labels = WatershedAndLabelTransform(with_batch_dim=False, backend=backend)(dt)
+    labels = labels.numpy()
+    reference = expected[0, 0].numpy()
+    assert len(np.unique(labels)) == len(np.unique(reference)) == 15
+    assert np.array_equal(labels > 0, reference > 0), "Unexpected foreground."
+    for label in np.unique(reference)[1:]:
+        assert len(np.unique(labels[reference == label])) == 1, "Object split."
+
+
+def test_sampling_index(extract_test_transforms_data, tmpdir):
+    # Load a 3D label image and create an image with some voxels below threshold
+    reader = CustomTIFFReader(dtype=torch.int32, geometry="zyx")
+    label = reader(Path(__file__).parent / "data" / "labels.tif")
+    rng = np.random.default_rng(2022)
+    image = torch.tensor(rng.normal(size=label.shape), dtype=torch.float32)
+
+    # Compute the index with a chunk size that does not divide the image size
+    index = compute_sampling_index(label, image, image_threshold=0.0, chunk_size=17)
+    fg_mask = (label[0] > 0) & (image[0] > 0.0)
+    bg_mask = (label[0] == 0) & (image[0] > 0.0)
+    assert index["fg_counts"].sum() == fg_mask.sum(), "Wrong number of fg voxels."
+    assert index["bg_counts"].sum() == bg_mask.sum(), "Wrong number of bg voxels."
+
+    # All drawn voxels must belong to the requested class
+    rand_state = np.random.RandomState(2022)
+    fg = draw_from_sampling_index(
+        index, label, image, foreground=True, num_samples=500, rand_state=rand_state
+    )
+    bg = draw_from_sampling_index(
+        index, label, image, foreground=False, num_samples=500, rand_state=rand_state
+    )
+    assert fg_mask.numpy().ravel()[fg].all(), "Drawn voxels are not foreground."
+    assert bg_mask.numpy().ravel()[bg].all(), "Drawn voxels are not background."
+
+    # All voxels of a class can be drawn
+    small = (rng.uniform(size=(1, 40, 50)) > 0.9).astype(np.int32)
+    small_index = compute_sampling_index(small, chunk_size=16)
+    drawn = draw_from_sampling_index(
+        small_index, small, num_samples=20000, rand_state=rand_state
+    )
+    assert np.array_equal(
+        np.unique(drawn), np.flatnonzero(small[0])
+    ), "Not all foreground voxels can be drawn."
+
+    # The crop draws the patch centers from the index
+    index_file = Path(tmpdir) / "index.npz"
+    np.savez(index_file, **index)
+    crop = IndexedRandCropByPosNegLabeld(
+        keys=("image", "label"),
+        label_key="label",
+        spatial_size=(8, 32, 32),
+        pos=1.0,
+        neg=0.0,
+        num_samples=4,
+        image_key="image",
+        image_threshold=0.0,
+    )
+    crop.set_random_state(seed=2022)
+    patches = crop({"image": image, "label": label, "sampling_index": index_file})
+    assert len(patches) == 4, "Unexpected number of patches."
+    for patch in patches:
+        assert patch["label"].shape == (1, 8, 32, 32), "Unexpected patch size."
+        assert "sampling_index" not in patch, "Index path was not consumed."
+        assert (patch["label"] > 0).any(), "Patch is not centered on foreground."
+
+    # A mismatching index is detected, and the crop falls back to scanning the label
+    index = compute_sampling_index(
+        label.flip(-1), image.flip(-1), image_threshold=0.0, chunk_size=17
+    )
+    with pytest.raises(ValueError):
+        draw_from_sampling_index(index, label, image, num_samples=500)
+    np.savez(index_file, **index)
+    patches = crop({"image": image, "label": label, "sampling_index": index_file})
+    assert len(patches) == 4, "Unexpected number of patches."
+    for patch in patches:
+        assert (patch["label"] > 0).any(), "Patch is not centered on foreground."
+
+
+def test_batch_augmentations():
+    # Batch of 3D images and labels
+    rng = np.random.default_rng(2022)
+    image = torch.tensor(rng.normal(size=(16, 1, 12, 20, 24)), dtype=torch.float32)
+    label = (image > 0.5).to(torch.float32)
+
+    # The flips are decided per sample, and images and labels are flipped together
+    flip = RandFlipBatch(prob=0.5, spatial_axis=2).set_random_state(2022)
+    out_image, out_label = flip((image, label))
+    flipped = [
+        bool(torch.equal(out_image[i], image[i].flip(3))) for i in range(len(image))
+    ]
+    untouched = [bool(torch.equal(out_image[i], image[i])) for i in range(len(image))]
+    assert all(f != u for f, u in zip(flipped, untouched)), "Unexpected flip."
+    assert 0 < sum(flipped) < len(image), "Flips are not decided per sample."
+    assert torch.equal(out_label, (out_image > 0.5).to(torch.float32)), "Wrong label."
+
+    # Noise is only added to the image, with a standard deviation per sample
+    noise = RandGaussianNoiseBatch(prob=1.0, std=0.5).set_random_state(2022)
+    out_image, out_label = noise((image, label))
+    assert torch.equal(out_label, label), "The label must not change."
+    std = (out_image - image).flatten(1).std(dim=1)
+    assert torch.all(std < 0.5) and std.max() - std.min() > 0.1, "Wrong noise."
+
+    # Smoothing with a fixed sigma matches the MONAI transform (away from the borders)
+    smooth = RandGaussianSmoothBatch(prob=1.0, sigma_range=((1.0, 1.0),))
+    out_image = smooth(image)
+    expected = GaussianSmooth(sigma=1.0)(image[3])
+    assert torch.allclose(
+        out_image[3, :, 5:-5, 5:-5, 5:-5], expected[:, 5:-5, 5:-5, 5:-5], atol=1e-4
+    ), "Wrong smoothing."
+
+    # The pipeline is reproducible, with a dedicated or the global generator
+    transforms = ComposeBatch(
+        [
+            RandFlipBatch(prob=0.5, spatial_axis=0),
+            RandFlipBatch(prob=0.5, spatial_axis=1),
+            RandGaussianNoiseBatch(prob=0.2),
+            RandGaussianSmoothBatch(prob=0.2),
+        ]
+    )
+    for seed in [2022, None]:
+        outputs = []
+        for _ in range(2):
+            torch.manual_seed(42)
+            transforms.set_random_state(seed)
+            outputs.append(transforms((image, label)))
+        assert torch.equal(outputs[0][0], outputs[1][0]), "Image is not reproducible."
+        assert torch.equal(outputs[0][1], outputs[1][1]), "Label is not reproducible."